@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 """ Backend device of quantum computing """
 
+import os
 import datetime
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import numpy as np
 
 from qlazy.util import read_config_ini
 from qlazy.gpu import is_gpu_available, is_gpu_supported_lib, gpu_preparation
 from qlazy.QCirc import QCirc
+from qlazy.QPlan import QPlan
 from qlazy.Observable import Observable
+from qlazy.NoiseModel import NoiseModel
 
 BACKEND_DEVICES = {'qlazy': ['qstate_simulator',
                              'stabilizer_simulator',
@@ -47,6 +53,11 @@ class Backend:
     config_braket : dict
         config for amazon braket backend
         {'backet_name': str, 'poll_timeout_seconds': int}
+    noise_model : instance of NoiseModel
+        noise model of the circuit execution
+        (only for qlazy's qstate simulator with CPU, see NoiseModel)
+    pool : str
+        pool of the workers for the submitted jobs ('thread' or 'process', see set_pool)
 
     Notes
     -----
@@ -72,7 +83,7 @@ class Backend:
     poll_timeout_seconds = 86400  # set 1-day (default: 5-days)
 
     """
-    def __init__(self, product=None, device=None):
+    def __init__(self, product=None, device=None, noise_model=None):
 
         #
         # set attributes (product, device)
@@ -94,6 +105,16 @@ class Backend:
 
         self.config_braket = None
 
+        if noise_model is not None and not isinstance(noise_model, NoiseModel):
+            raise TypeError("noise_model must be NoiseModel.")
+        if noise_model is not None and (self.product != 'qlazy' or self.device != 'qstate_simulator'):
+            raise ValueError("noise model is supported only by qlazy's qstate_simulator.")
+        self.noise_model = noise_model
+
+        self.pool = 'thread'
+        self.max_workers = None
+        self.__executor = None
+
         #
         # set method (__run)
         #
@@ -233,14 +254,21 @@ class Backend:
         backend_dict = {'product': self.product, 'device': self.device}
         return str(backend_dict)
 
+    def __getstate__(self):
+        # the executor of the pool is not pickled (see Result.save, set_pool)
+        state = self.__dict__.copy()
+        state['_Backend__executor'] = None
+        return state
+
     def run(self, qcirc=None, shots=1, cid=None, out_state=False, init=None, **kwargs):
         """
         run the quantum circuit.
 
         Parameters
         ----------
-        qcirc : instance of QCirc
-            quantum circuit.
+        qcirc : instance of QCirc or QPlan
+            quantum circuit (or its compiled plan, only for qlazy's qstate simulator with CPU,
+            see QCirc.compile).
         shots : int, default 1
             number of measurements.
         cid : list, default None
@@ -250,6 +278,25 @@ class Backend:
             (only for qlazy's qstate and stabilizer simulator)
         init : instance of QState, Stabilizer, MPState
             initial quantum state
+        fusion_qubit_num : int, default 3
+            max qubit number of the block which the consecutive gates are fused into
+            (only for qlazy's qstate simulator, 0: no fusion, max: 5)
+        precision : str, default 'double'
+            precision of the quantum state vector, 'double' (complex128) or 'single' (complex64)
+            (only for qlazy's qstate simulator with CPU, the precision of 'init' is used if it is set)
+        cache_qubit_num : int, default 16
+            number of the low-order qubits of a cache block, the runs of the fused gates
+            acting on them are operated block by block of 2^cache_qubit_num amplitudes
+            (only for qlazy's qstate simulator with CPU and fusion, 0: no cache blocking, min: 5)
+        relabel : bool, default True
+            relabel the qubits of a run to the low-order qubits for cache blocking
+            (only for qlazy's qstate simulator with CPU)
+        seed : int, default None
+            seed for random generation for measurement, the result is reproducible
+            for the seed (only for qlazy's qstate simulator with CPU, set randomly if None)
+        stream : int, default 0
+            stream id of the random numbers of the seed (see QState.set_seed),
+            the results of the different streams of the same seed are independent.
 
         Returns
         -------
@@ -277,6 +324,9 @@ class Backend:
         Counter({'00': 100})
 
         """
+        if isinstance(qcirc, QPlan):
+            return self.__run_qplan(qplan=qcirc, shots=shots, cid=cid, out_state=out_state,
+                                    init=init, **kwargs)
         if not isinstance(qcirc, QCirc):
             raise TypeError("qcirc must be QCirc or ParamtricQCirc.")
         if not isinstance(shots, int):
@@ -290,6 +340,13 @@ class Backend:
         if not isinstance(out_state, bool):
             raise TypeError("out_state must be bool.")
         
+        # multi-qubit gates (mcx, qft, iqft) are operated natively only by qlazy's qstate simulator
+        if self.product != 'qlazy' or self.device != 'qstate_simulator':
+            qcirc = qcirc.expand_multi_qubit_gates()
+
+        if self.noise_model is not None:
+            kwargs['noise_model'] = self.noise_model
+
         start_time = datetime.datetime.now()
         result = self.__run(qcirc=qcirc, shots=shots, cid=cid, backend=self,
                             out_state=out_state, init=init, **kwargs)
@@ -301,6 +358,329 @@ class Backend:
 
         return result
 
+    def __run_qplan(self, qplan=None, shots=1, cid=None, out_state=False, init=None, **kwargs):
+        """ run the compiled plan of the quantum circuit """
+
+        if self.product != 'qlazy' or self.device != 'qstate_simulator':
+            raise ValueError("compiled plan is supported only by qlazy's qstate_simulator.")
+        if self.noise_model is not None:
+            raise ValueError("compiled plan is not supported with the noise model.")
+        for key in ('fusion_qubit_num', 'precision'):
+            if key in kwargs:
+                raise ValueError("{} of the compiled plan is set by QCirc.compile.".format(key))
+
+        from qlazy.backend.qlazy_qstate_simulator import run_qplan_cpu
+
+        start_time = datetime.datetime.now()
+        result = run_qplan_cpu(qplan=qplan, shots=shots, cid=cid, backend=self,
+                               out_state=out_state, init=init, **kwargs)
+        end_time = datetime.datetime.now()
+
+        result.start_time = start_time
+        result.end_time = end_time
+        result.elapsed_time = (end_time - start_time).total_seconds()
+
+        return result
+
+    def set_pool(self, pool='thread', max_workers=None):
+        """
+        set the pool of the workers for the submitted jobs (see submit, run_async).
+
+        Parameters
+        ----------
+        pool : str, default 'thread'
+            'thread' (ThreadPoolExecutor) or 'process' (ProcessPoolExecutor).
+        max_workers : int, default None
+            maximum number of the workers (None: default of the executor).
+
+        Returns
+        -------
+        self : instance of Backend
+
+        Notes
+        -----
+        The calls of the C library of qlazy release the GIL, so the jobs of
+        qlazy's simulators run in parallel in the thread pool. In the process
+        pool, the circuit is sent to the worker as the list of gates (see
+        QCirc.get_gates) and run by the backend of the same product, device
+        and noise model, where out_state and init are not supported.
+
+        """
+        if pool not in ('thread', 'process'):
+            raise ValueError("pool must be 'thread' or 'process'.")
+
+        self.shutdown()
+        self.pool = pool
+        self.max_workers = max_workers
+
+        return self
+
+    def shutdown(self, wait=True):
+        """
+        shutdown the pool of the workers (started again by the next submitted job).
+
+        Parameters
+        ----------
+        wait : bool, default True
+            wait for the pending jobs or not.
+
+        Returns
+        -------
+        None
+
+        """
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=wait)
+            self.__executor = None
+
+    def submit(self, qcirc=None, shots=1, cid=None, out_state=False, init=None, **kwargs):
+        """
+        submit the quantum circuit to the pool of the workers (see set_pool).
+
+        Parameters
+        ----------
+        qcirc : instance of QCirc
+            quantum circuit.
+        shots, cid, out_state, init, **kwargs
+            same as the run method.
+
+        Returns
+        -------
+        future : instance of concurrent.futures.Future
+            future of the job, whose result is the instance of Result
+            (start_time, end_time and elapsed_time are those of the job).
+
+        Examples
+        --------
+        >>> from qlazy import QCirc, Backend
+        >>> bk = Backend(product='qlazy', device='qstate_simulator')
+        >>> qc = QCirc().h(0).cx(0,1).measure(qid=[0,1], cid=[0,1])
+        >>> futures = [bk.submit(qcirc=qc, shots=100) for _ in range(10)]
+        >>> results = [f.result() for f in futures]
+
+        """
+        if not isinstance(qcirc, QCirc):
+            raise TypeError("qcirc must be QCirc or ParamtricQCirc.")
+
+        if self.__executor is None:
+            if self.pool == 'process':
+                self.__executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self.__executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        if self.pool == 'process':
+            if out_state is True or init is not None:
+                raise ValueError("out_state and init are not supported with the process pool.")
+            return self.__executor.submit(_run_gates, self.product, self.device, self.noise_model,
+                                          qcirc.get_gates(), shots, cid, kwargs)
+
+        return self.__executor.submit(self.run, qcirc=qcirc, shots=shots, cid=cid,
+                                      out_state=out_state, init=init, **kwargs)
+
+    async def run_async(self, qcirc=None, shots=1, cid=None, out_state=False, init=None, **kwargs):
+        """
+        run the quantum circuit asynchronously in the pool of the workers (see submit).
+
+        Parameters
+        ----------
+        qcirc, shots, cid, out_state, init, **kwargs
+            same as the run method.
+
+        Returns
+        -------
+        result : instance of Result
+            measurement result.
+
+        Examples
+        --------
+        >>> import asyncio
+        >>> from qlazy import QCirc, Backend
+        >>> bk = Backend(product='qlazy', device='qstate_simulator')
+        >>> qc = QCirc().h(0).cx(0,1).measure(qid=[0,1], cid=[0,1])
+        >>> async def main():
+        ...     return await asyncio.gather(*[bk.run_async(qcirc=qc, shots=100) for _ in range(10)])
+        >>> results = asyncio.run(main())
+
+        """
+        future = self.submit(qcirc=qcirc, shots=shots, cid=cid, out_state=out_state, init=init,
+                             **kwargs)
+        return await asyncio.wrap_future(future)
+
+    def run_many(self, circuits=None, shots=1, cid=None, workers=None, chunk_size=None, **kwargs):
+        """
+        run many quantum circuits in the worker processes.
+
+        Parameters
+        ----------
+        circuits : list of QCirc
+            quantum circuits.
+        shots : int, default 1
+            number of measurements.
+        cid : list, default None
+            classical register id list to count frequency.
+        workers : int, default None
+            number of the worker processes (None: number of the cpus).
+        chunk_size : int, default None
+            number of the circuits sent to a worker at once
+            (None: set so that each worker gets about 4 chunks).
+        **kwargs
+            options of the run method (fusion_qubit_num, precision, seed, ..),
+            the circuit of the index i is run with the stream i of the seed.
+
+        Returns
+        -------
+        results : generator
+            generator of the tuples (index, result), where index is the index of the
+            circuit in 'circuits' and result is the instance of Result of the circuit.
+
+        Notes
+        -----
+        The results are yielded in the order of completion (not of 'circuits').
+        Each worker process loads the C library and initializes the backend of the
+        same product, device and noise model once, and the circuits are sent to it as
+        the lists of gates (see QCirc.get_gates), so out_state and init are not supported.
+
+        Examples
+        --------
+        >>> from qlazy import QCirc, Backend
+        >>> bk = Backend(product='qlazy', device='qstate_simulator')
+        >>> circuits = [QCirc().rx(0, phase=0.01*i).measure(qid=[0], cid=[0]) for i in range(1000)]
+        >>> freqs = [None] * len(circuits)
+        >>> for i, result in bk.run_many(circuits=circuits, shots=100, workers=4):
+        ...     freqs[i] = result.frequency
+
+        """
+        if not isinstance(circuits, list):
+            raise TypeError("circuits must be list of QCirc.")
+        for qc in circuits:
+            if not isinstance(qc, QCirc):
+                raise TypeError("circuits must be list of QCirc.")
+        for key in ('out_state', 'init', 'stream'):
+            if kwargs.get(key) not in (None, False):
+                raise ValueError("{} is not supported by run_many.".format(key))
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if chunk_size is None:
+            chunk_size = max(1, len(circuits) // (workers * 4))
+
+        return self.__run_many(circuits, shots, cid, workers, chunk_size, kwargs)
+
+    def __run_many(self, circuits, shots, cid, workers, chunk_size, kwargs):
+        """ generator of the results of run_many (the arguments are checked in run_many) """
+
+        if len(circuits) == 0:
+            return
+
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(self.product, self.device, self.noise_model))
+
+        try:
+            futures = []
+            for start in range(0, len(circuits), chunk_size):
+                gates_list = [qc.get_gates() for qc in circuits[start:start+chunk_size]]
+                futures.append(executor.submit(_run_gates_chunk, start, gates_list, shots, cid,
+                                               kwargs))
+            for future in as_completed(futures):
+                for index, result in future.result():
+                    result.backend = self
+                    yield index, result
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def run_batch(self, qcirc=None, params=None, shots=1, cid=None, out_state=False, init=None,
+                  observable=None, **kwargs):
+        """
+        run the parametric quantum circuit for each parameter set.
+
+        Parameters
+        ----------
+        qcirc : instance of QCirc
+            parametric quantum circuit (with tags).
+        params : list of dict
+            tag and phase dictionaries (same as QCirc.set_params)
+            ex) [{'tag1': phase1, 'tag2': phase2, ...}, {'tag1': ...}, ...]
+        shots : int, default 1
+            number of measurements.
+        cid : list, default None
+            classical register id list to count frequency.
+        out_state : bool, default False
+            output classical and quantum information after execting circuit.
+        init : instance of QState
+            initial quantum state
+        observable : instance of Observable, default None
+            obserbable to get the expectation values (the circuit must be unitary).
+        **kwargs
+            options of the run method (fusion_qubit_num, precision, seed, ..),
+            the member of the index i is measured with the stream 'stream' + i of the seed
+            (only for qlazy's qstate simulator with CPU).
+
+        Returns
+        -------
+        result : list of Result or numpy.ndarray
+            measurement results for each parameter set,
+            or the expectation values (complex) if observable is set.
+
+        Notes
+        -----
+        qlazy's qstate simulator (CPU) keeps the quantum states of all the parameter sets
+        in one array and operates each gate without the tags on all of them at once,
+        and the tagged gates with the phases of each parameter set. The circuit is walked
+        only once for the batch. Other backends run the circuit for each parameter set.
+
+        Examples
+        --------
+        >>> from qlazy import QCirc, Backend
+        >>> from qlazy.Observable import Z
+        >>> bk = Backend(product='qlazy', device='qstate_simulator')
+        >>> qc = QCirc().h(0).rz(0, tag='foo').h(0)
+        >>> params = [{'foo': 0.0}, {'foo': 0.5}, {'foo': 1.0}]
+        >>> expvals = bk.run_batch(qcirc=qc, params=params, observable=Z(0))
+        >>> print(expvals.real)
+        [ 1.  0. -1.]
+
+        """
+        if not isinstance(qcirc, QCirc):
+            raise TypeError("qcirc must be QCirc or ParamtricQCirc.")
+        if not isinstance(params, list):
+            raise TypeError("params must be list of dict.")
+        for p in params:
+            if not isinstance(p, dict):
+                raise TypeError("params must be list of dict.")
+        if observable is not None and not isinstance(observable, Observable):
+            raise TypeError("observable must be Observable.")
+        if self.noise_model is not None:
+            raise ValueError("run_batch is not supported with the noise model.")
+
+        if self.product == 'qlazy' and self.device == 'qstate_simulator':
+            from qlazy.backend.qlazy_qstate_simulator import run_batch_cpu
+
+            start_time = datetime.datetime.now()
+            results = run_batch_cpu(qcirc=qcirc, params=params, shots=shots, cid=cid, backend=self,
+                                    out_state=out_state, init=init, observable=observable, **kwargs)
+            end_time = datetime.datetime.now()
+
+            if observable is None:
+                for result in results:
+                    result.start_time = start_time
+                    result.end_time = end_time
+                    result.elapsed_time = (end_time - start_time).total_seconds()
+            return results
+
+        results = []
+        for p in params:
+            qc = qcirc.clone()
+            qc.set_params(p)
+            if observable is not None:
+                results.append(self.expect(qcirc=qc, observable=observable, precise=True, init=init))
+            else:
+                results.append(self.run(qcirc=qc, shots=shots, cid=cid, out_state=out_state,
+                                        init=init, **kwargs))
+
+        if observable is not None:
+            return np.array(results)
+        return results
+
     def _get_expectation_value_by_calculation(self, qcirc, observable, state='qstate', init=None):
         """ estimate expectation value by calcu """
 
@@ -338,12 +718,12 @@ class Backend:
             fac = wpp['weight'] * wpp['pp'].factor  # complex (imaginary is zero, maybe)
 
             result = self.run(qcirc=qc, shots=shots, cid=cid, init=init)
-            freq = result.frequency
+            counts = result.counts
             
             n_even = 0
             n_odd = 0
-            for m, f in freq.items():
-                if sum(list(map(int, list(m)))) % 2 == 0:
+            for m, f in counts.items():
+                if bin(m).count('1') % 2 == 0:
                     n_even += f
                 else:
                     n_odd += f
@@ -358,8 +738,9 @@ class Backend:
 
         Parameters
         ----------
-        qcirc : instance of QCirc
-            quantum circuit.
+        qcirc : instance of QCirc or QPlan
+            quantum circuit (or its compiled plan, only with precise=True for
+            qlazy's qstate simulator, see QCirc.compile).
         observable : instance of Observable
             obserbable considerd.
         shots : int, default - None
@@ -387,7 +768,7 @@ class Backend:
         >>> 0.0074
 
         """
-        if not isinstance(qcirc, QCirc):
+        if not isinstance(qcirc, (QCirc, QPlan)):
             raise TypeError("qcirc must be QCirc or ParamtricQCirc.")
         if not isinstance(observable, Observable):
             raise TypeError("observable must be Observable.")
@@ -395,6 +776,11 @@ class Backend:
             raise ValueError("the observable must be a hermitian.")
         if qcirc.qubit_num < observable.qubit_num:
             raise ValueError("total qubit number of the observable must be less than qcirc's.")
+        if isinstance(qcirc, QPlan) and precise is not True:
+            raise ValueError("expectation value of the compiled plan is supported only with precise=True.")
+
+        if precise is True and self.noise_model is not None:
+            raise ValueError("precise expectation value is not supported with the noise model.")
 
         if precise is True:
             if self.product == 'qlazy':
@@ -419,3 +805,89 @@ class Backend:
                 raise ValueError("shots must be set as int.")
 
         return expval
+
+    def gradient(self, qcirc=None, observable=None, init=None, **kwargs):
+        """
+        get the gradient of the expectation value by the phases of the tags.
+
+        Parameters
+        ----------
+        qcirc : instance of QCirc
+            parametric quantum circuit (with tags), which must be unitary.
+        observable : instance of Observable
+            obserbable considerd.
+        init : instance of QState
+            initial quantum state
+        **kwargs
+            options of the run method (fusion_qubit_num, precision, ..)
+
+        Returns
+        -------
+        grad : dict
+            tag and derivative dictionary, {'tag1': d<O>/d(phase1), ...}
+
+        Notes
+        -----
+        This method is supported only by qlazy's qstate simulator (CPU).
+        The gradient is computed with the adjoint method: the quantum state after
+        the forward pass and the observable applied to it are walked back through
+        the gates, so the circuit is operated about three times for all the tags
+        (instead of twice for each tag with the parameter shift rule).
+        If a tag is set to several gates, the derivatives of the gates are summed.
+
+        Examples
+        --------
+        >>> from qlazy import QCirc, Backend
+        >>> from qlazy.Observable import Z
+        >>> bk = Backend(product='qlazy', device='qstate_simulator')
+        >>> qc = QCirc().h(0).rz(0, tag='foo').h(0)
+        >>> qc.set_params({'foo': 0.5})
+        >>> grad = bk.gradient(qcirc=qc, observable=Z(0))
+        >>> print(grad)
+        {'foo': -3.141592653589793}
+
+        """
+        if not isinstance(qcirc, QCirc):
+            raise TypeError("qcirc must be QCirc or ParamtricQCirc.")
+        if not isinstance(observable, Observable):
+            raise TypeError("observable must be Observable.")
+        if not observable.is_hermitian():
+            raise ValueError("the observable must be a hermitian.")
+        if qcirc.qubit_num < observable.qubit_num:
+            raise ValueError("total qubit number of the observable must be less than qcirc's.")
+
+        if self.product != 'qlazy' or self.device != 'qstate_simulator':
+            raise ValueError("gradient is supported only by qlazy's qstate_simulator.")
+        if self.noise_model is not None:
+            raise ValueError("gradient is not supported with the noise model.")
+
+        from qlazy.backend.qlazy_qstate_simulator import gradient_cpu
+        return gradient_cpu(qcirc=qcirc, observable=observable, init=init, **kwargs)
+
+def _run_gates(product, device, noise_model, gates, shots, cid, kwargs):
+    """ run the quantum circuit of the gates in the worker process (see Backend.submit) """
+
+    backend = Backend(product=product, device=device, noise_model=noise_model)
+    return backend.run(qcirc=QCirc().add_gates(gates), shots=shots, cid=cid, **kwargs)
+
+# backend of the worker process (see Backend.run_many)
+_WORKER_BACKEND = None
+
+def _init_worker(product, device, noise_model):
+    """ initialize the backend of the worker process """
+
+    global _WORKER_BACKEND
+    _WORKER_BACKEND = Backend(product=product, device=device, noise_model=noise_model)
+
+def _run_gates_chunk(start, gates_list, shots, cid, kwargs):
+    """ run the quantum circuits of the gate lists by the backend of the worker process """
+
+    results = []
+    for i, gates in enumerate(gates_list):
+        if kwargs.get('seed') is not None: # independent stream of the seed for each circuit
+            kwargs = dict(kwargs, stream=start + i)
+        result = _WORKER_BACKEND.run(qcirc=QCirc().add_gates(gates), shots=shots, cid=cid, **kwargs)
+        result.backend = None
+        results.append((start + i, result))
+
+    return results
@@ -1171,11 +1171,10 @@ class DensOp(ctypes.Structure, QObject):
         if self.qubit_num < qcirc.qubit_num:
             raise ValueError("qubit number of quantum state must be equal or larger than the quantum circuit size.")
 
-        if qctrl is None:
-            densop_operate_qcirc(self, qcirc=qcirc)
-        else:
-            qc_qctrl = qcirc.add_control(qctrl=qctrl)
-            densop_operate_qcirc(self, qcirc=qc_qctrl)
+        if qctrl is not None:
+            qcirc = qcirc.add_control(qctrl=qctrl)
+        qcirc = qcirc.expand_multi_qubit_gates()
+        densop_operate_qcirc(self, qcirc=qcirc)
 
         return self
 
@@ -982,10 +982,9 @@ class MPState(FiniteMPS, QObject):
         if self.qubit_num < qcirc.qubit_num:
             raise ValueError("qubit number of quantum state must be equal or larger than the quantum circuit size.")
 
-        if qctrl is None:
-            mps_operate_qcirc(self, cmem=None, qcirc=qcirc, shots=1, cid=None)
-        else:
-            qc_qctrl = qcirc.add_control(qctrl=qctrl)
-            mps_operate_qcirc(self, cmem=None, qcirc=qc_qctrl, shots=1, cid=None)
+        if qctrl is not None:
+            qcirc = qcirc.add_control(qctrl=qctrl)
+        qcirc = qcirc.expand_multi_qubit_gates()
+        mps_operate_qcirc(self, cmem=None, qcirc=qcirc, shots=1, cid=None)
 
         return self
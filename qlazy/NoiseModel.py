@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+""" Noise model of quantum circuit execution """
+import math
+import numpy as np
+
+import qlazy.config as cfg
+
+NOISE_CHANNELS = ('bit_flip', 'phase_flip', 'bit_phase_flip', 'depolarize',
+                  'amp_dump', 'phase_dump', 'pauli')
+
+# gates of QCirc (the other gates are decomposed into them when added to QCirc)
+NOISE_GATES = ('x', 'z', 'h', 's', 's_dg', 't', 't_dg', 'rx', 'rz', 'cx', 'cz', 'ch', 'crz',
+               'mcx', 'qft', 'iqft', 'mrz', 'reset')
+
+def kraus_operators(channel, prob):
+    """ 2x2 kraus operators of the quantum channel (same as the channels of DensOp) """
+
+    I = np.eye(2)
+    X = np.array([[0, 1], [1, 0]])
+    Y = np.array([[0, -1j], [1j, 0]])
+    Z = np.array([[1, 0], [0, -1]])
+
+    if channel == 'pauli':
+        if len(prob) != 3:
+            raise ValueError("prob of pauli channel must be [px, py, pz].")
+        return [math.sqrt(1.0 - sum(prob)) * I, math.sqrt(prob[0]) * X,
+                math.sqrt(prob[1]) * Y, math.sqrt(prob[2]) * Z]
+    if channel == 'bit_flip':
+        return [math.sqrt(1.0 - prob) * I, math.sqrt(prob) * X]
+    if channel == 'phase_flip':
+        return [math.sqrt(1.0 - prob) * I, math.sqrt(prob) * Z]
+    if channel == 'bit_phase_flip':
+        return [math.sqrt(1.0 - prob) * I, math.sqrt(prob) * Y]
+    if channel == 'depolarize':
+        return [math.sqrt(1.0 - 0.75 * prob) * I, math.sqrt(0.25 * prob) * X,
+                math.sqrt(0.25 * prob) * Y, math.sqrt(0.25 * prob) * Z]
+    if channel == 'amp_dump':
+        return [np.array([[1, 0], [0, math.sqrt(1.0 - prob)]]),
+                np.array([[0, math.sqrt(prob)], [0, 0]])]
+    if channel == 'phase_dump':
+        return [np.array([[1, 0], [0, math.sqrt(1.0 - prob)]]),
+                np.array([[0, 0], [0, math.sqrt(prob)]])]
+    raise ValueError("channel:{} is unknown.".format(channel))
+
+class NoiseModel:
+    """ Noise model of quantum circuit execution
+    (quantum-trajectory simulation of qlazy's qstate simulator)
+
+    Attributes
+    ----------
+    channels : list of tuple
+        gate name (None: all the gates) and 2x2 kraus operators of each channel.
+    readout : tuple of float
+        probabilities of the readout error, reading 1 for 0 and reading 0 for 1.
+
+    Notes
+    -----
+    Each channel acts on each qubit of the gate after the gate. The state
+    vector of each shot is operated by one kraus operator of the channel
+    sampled with its probability (quantum trajectory), so the memory is
+    2^n (not 4^n of DensOp) and the shots of the noisy circuit are the
+    samples of the density operator of the noisy channels.
+
+    Examples
+    --------
+    >>> from qlazy import QCirc, Backend, NoiseModel
+    >>> nm = NoiseModel().add_channel('depolarize', prob=0.01, gates=['cx'])
+    >>> nm.set_readout_error(prob_0to1=0.02, prob_1to0=0.05)
+    >>> bk = Backend(product='qlazy', device='qstate_simulator', noise_model=nm)
+    >>> qc = QCirc().h(0).cx(0,1).measure(qid=[0,1], cid=[0,1])
+    >>> result = bk.run(qcirc=qc, shots=1000)
+    >>> print(result.frequency)
+    Counter({'00': 475, '11': 456, '01': 39, '10': 30})
+
+    """
+    def __init__(self):
+
+        self.channels = []
+        self.readout = (0.0, 0.0)
+
+    def add_channel(self, channel=None, prob=0.0, kraus=None, gates=None):
+        """
+        add the noise channel.
+
+        Parameters
+        ----------
+        channel : str
+            'bit_flip', 'phase_flip', 'bit_phase_flip', 'depolarize',
+            'amp_dump', 'phase_dump' (same as the methods of DensOp) or 'pauli'.
+        prob : float or list of float
+            probability of the channel ([px, py, pz] for 'pauli').
+        kraus : list of numpy.ndarray
+            2x2 kraus operators (if channel is not set).
+        gates : list of str, default None
+            gate names after which the channel acts (ex: ['cx', 'h'], None: all the gates),
+            which must be in NOISE_GATES (the other gates such as 'ry' are decomposed
+            into them in QCirc, and the channel acts after each of the decomposed gates).
+
+        Returns
+        -------
+        self : instance of NoiseModel
+
+        """
+        if channel is not None:
+            kraus = kraus_operators(channel, prob)
+        elif kraus is None:
+            raise ValueError("channel or kraus must be set.")
+
+        kraus = [np.array(K, dtype=np.complex128) for K in kraus]
+        for K in kraus:
+            if K.shape != (2, 2):
+                raise ValueError("kraus operators must be 2x2 matrices.")
+        if not np.allclose(sum(K.conj().T @ K for K in kraus), np.eye(2), atol=cfg.EPS):
+            raise ValueError("kraus operators must satisfy the completeness relation.")
+
+        if gates is None:
+            self.channels.append((None, kraus))
+            return self
+
+        for g in gates:
+            if g not in NOISE_GATES:
+                raise ValueError("gate:{} is not a gate of QCirc (see NOISE_GATES).".format(g))
+            self.channels.append((g, kraus))
+
+        return self
+
+    def set_readout_error(self, prob_0to1=0.0, prob_1to0=0.0):
+        """
+        set the readout error of the measurement.
+
+        Parameters
+        ----------
+        prob_0to1 : float
+            probability of reading 1 for 0.
+        prob_1to0 : float
+            probability of reading 0 for 1.
+
+        Returns
+        -------
+        self : instance of NoiseModel
+
+        """
+        for p in (prob_0to1, prob_1to0):
+            if p < 0.0 or p > 1.0:
+                raise ValueError("probability of the readout error must be 0.0-1.0.")
+        self.readout = (prob_0to1, prob_1to0)
+
+        return self
+
+    def kraus_arrays(self):
+        """
+        arrays of the channels for the quantum-trajectory simulation.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        chan_kind : numpy.ndarray (int32)
+            gate kind of each channel (-1: all the gates).
+        kraus_num : numpy.ndarray (int32)
+            number of kraus operators of each channel.
+        kraus : numpy.ndarray (float64)
+            real and imaginary parts of the kraus operators.
+        prob : numpy.ndarray (float64)
+            probability of each kraus operator
+            (-1.0 if the channel is not a mixture of unitaries).
+
+        Notes
+        -----
+        The operators of a mixture of unitaries (K^dag K = p I) are normalized to
+        the unitaries and the operators of zero probability are removed,
+        which are sampled without the quantum state.
+
+        """
+        chan_kind, kraus_num, kraus, prob = [], [], [], []
+        for gate, ops in self.channels:
+            gram = [K.conj().T @ K for K in ops]
+            mixture = all(abs(M[0, 1]) < cfg.EPS and abs(M[0, 0] - M[1, 1]) < cfg.EPS
+                          for M in gram)
+            if mixture is True:
+                pairs = [(K / math.sqrt(M[0, 0].real), M[0, 0].real)
+                         for K, M in zip(ops, gram) if M[0, 0].real > cfg.EPS]
+            else:
+                pairs = [(K, -1.0) for K in ops]
+            chan_kind.append(-1 if gate is None else cfg.GATE_KIND[gate])
+            kraus_num.append(len(pairs))
+            for K, p in pairs:
+                kraus.append(np.stack([K.real, K.imag], axis=-1).ravel())
+                prob.append(p)
+
+        return (np.array(chan_kind, dtype=np.int32), np.array(kraus_num, dtype=np.int32),
+                np.concatenate(kraus) if kraus else np.zeros(0),
+                np.array(prob, dtype=np.float64))
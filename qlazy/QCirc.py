@@ -191,6 +191,9 @@ class QCirc(ctypes.Structure, QObject):
             term_num = get_qgate_qubit_num(kind)
             if kind in (cfg.MEASURE, cfg.RESET):
                 term_num = 1
+            elif kind in (cfg.MULTI_CONTROLLED_X, cfg.QFT_GATE, cfg.IQFT_GATE,
+                          cfg.MULTI_ROTATION_Z):
+                term_num = len(qid)
             para_num = get_qgate_param_num(kind)
 
             gate_str = cfg.GATE_STRING[kind]
@@ -424,8 +427,12 @@ class QCirc(ctypes.Structure, QObject):
         -------
         qcirc_str : str
 
+        Notes
+        -----
+        Multi-qubit gates (mcx, qft, iqft, mrz) are expanded to the gates supported in OpenQASM 2.0.
+
         """
-        qc = self.clone()
+        qc = self.expand_multi_qubit_gates()
 
         # header and include file
         qcirc_str = """OPENQASM 2.0;\n"""
@@ -528,7 +535,7 @@ class QCirc(ctypes.Structure, QObject):
         None
 
         """
-        qc = self.clone()
+        qc = self.expand_multi_qubit_gates()
 
         qubit_num = self.qubit_num
         cmem_num = self.cmem_num
@@ -1222,7 +1229,12 @@ class QCirc(ctypes.Structure, QObject):
             raise TypeError("ctrl must be int.")
 
         # qcirc_append_gate(self, kind, qid, para, c, ctrl)
-        qcirc_append_gate(self, kind, qid, para, c, ctrl, tag)
+        if kind in (cfg.MULTI_CONTROLLED_X, cfg.QFT_GATE, cfg.IQFT_GATE, cfg.MULTI_ROTATION_Z):
+            if c is not None:
+                raise ValueError("c must be None for multi-qubit gate.")
+            qcirc_append_mqgate(self, kind, qid, para, ctrl, tag)
+        else:
+            qcirc_append_gate(self, kind, qid, para, c, ctrl, tag)
 
     def split_unitary_non_unitary(self):
         """
@@ -1512,6 +1524,51 @@ class QCirc(ctypes.Structure, QObject):
 
         return params
 
+    def compile(self, fusion_qubit_num=cfg.DEF_FUSION_QUBIT_NUM, precision='double'):
+        """
+        compile the unitary quantum circuit into the plan for qlazy's qstate simulator
+
+        Parameters
+        ----------
+        fusion_qubit_num : int, default 3
+            max qubit number of the block which the consecutive gates are fused into
+            (0: no fusion, max: 5)
+        precision : str, default 'double'
+            precision of the quantum state vector operated by the plan,
+            'double' (complex128) or 'single' (complex64)
+
+        Returns
+        -------
+        qplan : instance of QPlan
+            compiled plan of the quantum circuit
+
+        Notes
+        -----
+        The plan is a flat array of the fused blocks with the matrices computed once
+        (and the multi-qubit gates), which is operated by QState.operate_qcirc or
+        qlazy's Backend.run, expect (qstate_simulator) without decomposing the circuit
+        and building the matrices every time. The plan is independent of the circuit
+        after compiled, and QPlan.set_params only updates the matrices of the blocks
+        including the tagged gates. The quantum circuit must be unitary.
+
+        Examples
+        --------
+        >>> from qlazy import QCirc, QState
+        >>> qc = QCirc().h(0).rz(0, tag='foo').h(0)
+        >>> qplan = qc.compile()
+        >>> for phase in [0.0, 0.5, 1.0]:
+        >>>     qplan.set_params({'foo': phase})
+        >>>     qs = QState(qubit_num=1).operate_qcirc(qplan)
+        >>>     ...
+
+        """
+        from qlazy.QPlan import QPlan
+
+        if self.is_unitary() is False:
+            raise ValueError("qcirc must be unitary quantum circuit.")
+
+        return QPlan(qcirc=self, fusion_qubit_num=fusion_qubit_num, precision=precision)
+
     def add_control(self, qctrl=None):
         """
         add control qubit to quantum circuit
@@ -1589,6 +1646,19 @@ class QCirc(ctypes.Structure, QObject):
             qc.crz(qctrl, qid[1], phase=para[0], ctrl=ctrl, tag=tag, fac=-0.5*para[2])
             qc.ccx(qctrl, qid[0], qid[1], ctrl=ctrl)
     
+        # multi-controlled gate
+        elif kind == cfg.MULTI_CONTROLLED_X:
+            qc.mcx(qid=[qctrl] + qid, ctrl=ctrl)
+        elif kind in (cfg.QFT_GATE, cfg.IQFT_GATE, cfg.MULTI_ROTATION_Z):
+            qc_ft = QCirc()
+            qc_ft.append_gate(kind, qid, para, c, ctrl, tag)
+            qc.merge_mutable(qc_ft.expand_multi_qubit_gates().add_control(qctrl=qctrl))
+            if kind in (cfg.QFT_GATE, cfg.IQFT_GATE):
+                # the expanded sequence is the native qft (iqft) times the global phase
+                # exp(-+i*PI*S/4), where S = n-2+2^(1-n) is the sum of the phases of 'cp'
+                phase = (len(qid) - 2 + 2.0**(1 - len(qid))) / 4.0
+                qc.p(qctrl, phase=phase if kind == cfg.QFT_GATE else -phase, ctrl=ctrl)
+
         # non-unitary gate
         elif kind == cfg.MEASURE:
             qc.measure(qid=[qid[0]], cid=[c])
@@ -1597,6 +1667,169 @@ class QCirc(ctypes.Structure, QObject):
         else:
             raise ValueError("not supported quantum gate.")
     
+    def mcx(self, qid=None, ctrl=None):
+        """
+        operate MCX gate (multi-controlled X gate).
+
+        Parameters
+        ----------
+        qid : list of int
+            qubit id list [control, control, ... , control, target]
+        ctrl : int, default None
+            classical register id to controll the gate
+
+        Returns
+        -------
+        self : instance of QCirc
+
+        Notes
+        -----
+        The gate is stored as a native multi-controlled X gate, which qlazy's
+        qstate simulator operates in a single sweep of the amplitudes.
+        It is expanded to the gray-code sequence of 'cp' and 'cx' gates
+        for the other backends (see 'expand_multi_qubit_gates' method).
+
+        """
+        if qid is None:
+            raise ValueError("qid must be set.")
+        if len(qid) < 2:
+            raise ValueError("qid must include control and target qubits.")
+
+        self.append_gate(kind=cfg.MULTI_CONTROLLED_X, qid=list(qid), ctrl=ctrl)
+        return self
+
+    def qft(self, qid):
+        """
+        Quantum Fourier Transform
+
+        Parameters
+        ----------
+        qid : list of int
+            qubit id list
+
+        Returns
+        -------
+        self : instance of QCirc
+
+        Notes
+        -----
+        The transform is stored as a native QFT gate, which qlazy's qstate simulator
+        operates as a FFT over the amplitudes of the qubits in O(2^n * len(qid)).
+        It is expanded to the sequence of 'h' and 'cp' gates for the other backends
+        (see 'expand_multi_qubit_gates' method).
+
+        """
+        self.append_gate(kind=cfg.QFT_GATE, qid=self.__ft_qid(qid))
+        return self
+
+    def iqft(self, qid):
+        """
+        Inverse Quantum Fourier Transform
+
+        Parameters
+        ----------
+        qid : list of int
+            qubit id list
+
+        Returns
+        -------
+        self : instance of QCirc
+
+        Notes
+        -----
+        The transform is stored as a native IQFT gate (see 'qft' method).
+
+        """
+        self.append_gate(kind=cfg.IQFT_GATE, qid=self.__ft_qid(qid))
+        return self
+
+    def mrz(self, qid, phase=0.0, gphase=0.0, fac=1.0, tag=None, ctrl=None):
+        """
+        operate multi-qubit Rz gate, exp(-i * (phase * PI / 2) * Z...Z).
+
+        Parameters
+        ----------
+        qid : list of int
+            qubit id list
+        phase : float
+            rotation angle (unit of angle is PI radian).
+        tag : str, default None
+            tag of the phase (for parametric quantum circuit)
+        ctrl : int, default None
+            classical register id to controll the gate
+
+        Returns
+        -------
+        self : instance of QCirc
+
+        Notes
+        -----
+        The gate is stored as a native multi-qubit Rz gate, which qlazy's qstate
+        simulator operates in a single sweep of the amplitudes. It is expanded to
+        the ladder of 'cx' gates and a 'rz' gate for the other backends
+        (see 'expand_multi_qubit_gates' method). Rotation of any pauli product
+        ('rpp' method) is operated as this gate between the basis changes.
+
+        """
+        para = [float(phase), float(gphase), float(fac)]
+        self.append_gate(kind=cfg.MULTI_ROTATION_Z, qid=self.__ft_qid(qid), para=para,
+                         ctrl=ctrl, tag=tag)
+        return self
+
+    def __ft_qid(self, qid):
+
+        if qid is None or len(qid) < 1:
+            raise ValueError("qid must be set.")
+        if len(set(qid)) != len(qid):
+            raise ValueError("qid must not include the same qubit id.")
+        return list(qid)
+
+    def expand_multi_qubit_gates(self):
+        """
+        expand the multi-qubit gates (mcx, qft, iqft, mrz) to the sequence of 1 and 2-qubit gates.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        qc_out : instance of QCirc
+            quantum circuit without multi-qubit gate
+
+        Notes
+        -----
+        Multi-controlled X gates are expanded to the gray-code sequence of 'cp' and 'cx'
+        gates, QFT (IQFT) gates to the sequence of 'h' and 'cp' gates, and multi-qubit
+        Rz gates to the ladder of 'cx' gates and a 'rz' gate.
+
+        """
+        kinds = (cfg.MULTI_CONTROLLED_X, cfg.QFT_GATE, cfg.IQFT_GATE, cfg.MULTI_ROTATION_Z)
+        if not any(kind in kinds for kind in self.kind_list()):
+            return self.clone()
+
+        qc = self.clone()
+        qc_out = self.__class__()
+        while True:
+            kind = qc.kind_first()
+            if kind is None:
+                break
+
+            (kind, qid, para, c, ctrl, tag) = qc.pop_gate()
+            if kind == cfg.MULTI_CONTROLLED_X:
+                QObject.mcx(qc_out, qid=qid, ctrl=ctrl)
+            elif kind == cfg.QFT_GATE:
+                QObject.qft(qc_out, qid)
+            elif kind == cfg.IQFT_GATE:
+                QObject.iqft(qc_out, qid)
+            elif kind == cfg.MULTI_ROTATION_Z:
+                QObject.mrz(qc_out, qid, phase=para[0], gphase=para[1], fac=para[2], tag=tag,
+                            ctrl=ctrl)
+            else:
+                qc_out.append_gate(kind, qid, para, c, ctrl, tag)
+
+        return qc_out
+
     # operate gate
 
     def operate_gate(self, kind=None, qid=None, cid=None,
@@ -1824,7 +2057,7 @@ class QCirc(ctypes.Structure, QObject):
 # c-library for qstate
 from qlazy.lib.qcirc_c import (qcirc_init, qcirc_copy, qcirc_merge,
                                qcirc_merge_mutable, qcirc_is_equal,
-                               qcirc_append_gate, qcirc_kind_first,
+                               qcirc_append_gate, qcirc_append_mqgate, qcirc_kind_first,
                                qcirc_pop_gate, qcirc_set_params,
                                qcirc_get_tag_phase, qcirc_get_tag_list,
                                qcirc_free)
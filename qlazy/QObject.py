@@ -762,6 +762,33 @@ class QObject:
 
         return self
 
+    def mrz(self, qid, phase=0.0, gphase=0.0, fac=1.0, tag=None, ctrl=None):
+        """
+        operate multi-qubit Rz gate, exp(-i * (phase * PI / 2) * Z...Z).
+
+        Parameters
+        ----------
+        qid : list of int
+            qubit id list
+        phase : float
+            rotation angle (unit of angle is PI radian).
+
+        Returns
+        -------
+        self : instance of QObject
+
+        """
+        if qid is None or len(qid) < 1:
+            raise ValueError("qid must be set.")
+
+        for i in range(len(qid) - 1):
+            self.cx(qid[i], qid[i+1], ctrl=ctrl)
+        self.rz(qid[-1], phase=phase, gphase=gphase, fac=fac, tag=tag, ctrl=ctrl)
+        for i in reversed(range(len(qid) - 1)):
+            self.cx(qid[i], qid[i+1], ctrl=ctrl)
+
+        return self
+
     # operate pauli product
 
     def operate_pp(self, pp=None, ctrl=None, qctrl=None):
@@ -824,6 +851,54 @@ class QObject:
 
         return self
 
+    def rpp(self, pp=None, phase=0.0, fac=1.0, tag=None, ctrl=None):
+        """
+        operate rotation gate of pauli product, exp(-i * (phase * PI / 2) * pp).
+
+        Parameters
+        ----------
+        pp : instance of PauliProduct
+            pauli product (factor must be +1 or -1)
+        phase : float
+            rotation angle (unit of angle is PI radian).
+
+        Returns
+        -------
+        self : instance of QObject
+
+        Notes
+        -----
+        The pauli product is rotated to the Z-basis by 'h' (X) or 'rx' (Y) gates
+        and operated as the multi-qubit Rz gate (see 'mrz' method).
+
+        """
+        if pp is None:
+            raise ValueError("pp must be set.")
+        if pp.factor == 1.+0.j:
+            sign = 1.0
+        elif pp.factor == -1.+0.j:
+            sign = -1.0
+        else:
+            raise ValueError("factor of pauli product must be +1 or -1.")
+
+        qid = [q for q, pauli in zip(pp.qid, pp.pauli_list) if pauli in ('X', 'Y', 'Z')]
+        if len(qid) == 0:
+            raise ValueError("pauli product must include X, Y or Z.")
+
+        for q, pauli in zip(pp.qid, pp.pauli_list):
+            if pauli == 'X':
+                self.h(q, ctrl=ctrl)
+            elif pauli == 'Y':
+                self.rx(q, phase=0.5, ctrl=ctrl)
+        self.mrz(qid, phase=phase, fac=sign*fac, tag=tag, ctrl=ctrl)
+        for q, pauli in zip(pp.qid, pp.pauli_list):
+            if pauli == 'X':
+                self.h(q, ctrl=ctrl)
+            elif pauli == 'Y':
+                self.rx(q, phase=-0.5, ctrl=ctrl)
+
+        return self
+
     def operate(self, pp=None, ctrl=None, qctrl=None):
         """ operate pauli product. """
 
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+""" Compiled plan of Quantum Circuit """
+import ctypes
+
+class QPlan(ctypes.Structure):
+    """ Compiled plan of Quantum Circuit (see QCirc.compile)
+
+    Attributes
+    ----------
+    qubit_num : int
+        qubit number of the quantum circuit.
+    step_num : int
+        number of steps (fused blocks and multi-qubit gates).
+    slot_num : int
+        number of slots (steps including the tagged gates).
+    tag_num : int
+        number of tags.
+    use_single : bool
+        single precision (complex64) plan or not.
+
+    """
+    _fields_ = [
+        ('qubit_num', ctypes.c_int),
+        ('step_num', ctypes.c_int),
+        ('step', ctypes.c_void_p),
+        ('slot_num', ctypes.c_int),
+        ('slot', ctypes.c_void_p),
+        ('param_num', ctypes.c_int),
+        ('param_gate', ctypes.c_void_p),
+        ('param_tag', ctypes.c_void_p),
+        ('param_slot', ctypes.c_void_p),
+        ('tag_num', ctypes.c_int),
+        ('phase', ctypes.POINTER(ctypes.c_double)),
+        ('qcirc', ctypes.c_void_p),
+        ('gbank', ctypes.c_void_p),
+        ('use_single', ctypes.c_bool),
+    ]
+
+    def __new__(cls, qcirc=None, fusion_qubit_num=None, precision='double', **kwargs):
+        """
+        Parameters
+        ----------
+        qcirc : instance of QCirc
+            unitary quantum circuit (with tags or not).
+        fusion_qubit_num : int, default 3
+            max qubit number of the block which the consecutive gates are fused into
+            (0: no fusion, max: 5)
+        precision : str, default 'double'
+            precision of the quantum state vector operated by the plan,
+            'double' (complex128) or 'single' (complex64)
+
+        Returns
+        -------
+        qplan : instance (QPlan)
+
+        """
+        tags = list(qcirc.get_params() or {})
+        obj = qplan_init(qcirc, fusion_qubit_num=fusion_qubit_num, tags=tags, precision=precision)
+        qplan = ctypes.cast(obj.value, ctypes.POINTER(cls)).contents
+        qplan.tags = tags
+        return qplan
+
+    def __init__(self, qcirc=None, fusion_qubit_num=None, precision='double', **kwargs):
+        # the arguments are used in __new__ (not to be set to the fields by ctypes.Structure)
+        super().__init__()
+
+    @property
+    def precision(self):
+        """ precision of the quantum state vector operated by the plan """
+        return 'single' if self.use_single is True else 'double'
+
+    def set_params(self, params):
+        """
+        set parameters for each tag (only the matrices of the slots including
+        the gates with the changed parameters are updated)
+
+        Parameters
+        ----------
+        params : dict
+            tag and phase dictionary
+            ex) {'tag1': phase1, 'tag2': phase2, ...}
+
+        Returns
+        -------
+        None
+
+        """
+        if not isinstance(params, dict):
+            raise TypeError("params must be dict.")
+        for tag in params:
+            if tag not in self.tags:
+                raise ValueError("can't set tag:{}, phase:{}.".format(tag, params[tag]))
+
+        phase = [params.get(tag, self.phase[t]) for t, tag in enumerate(self.tags)]
+        qplan_set_params(self, phase)
+
+    def get_params(self):
+        """
+        get parameters for each tag
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        params : dict
+            tag and phase dictionary
+            ex) {'tag1': phase1, 'tag2': phase2, ...}
+
+        """
+        if len(self.tags) == 0:
+            return None
+        return {tag: self.phase[t] for t, tag in enumerate(self.tags)}
+
+    def __del__(self):
+
+        qplan_free(self)
+
+# c-library for qplan
+from qlazy.lib.qplan_c import qplan_init, qplan_set_params, qplan_free
@@ -20,13 +20,19 @@ class QState(ctypes.Structure, QObject):
         dimension of the quantum state vector (= 2**qubit_num).
     amp : list of complex
         elements of the quantum state vector.
+    precision : str
+        precision of the elements ('double': complex128, 'single': complex64).
+    mapped : bool
+        elements are kept in the memory-mapped file ('backing') or not.
+    adopted : bool
+        elements are kept in the numpy array adopted by 'from_numpy' or not.
 
     """
 
     if is_gpu_supported_lib() is True:
         _fields_ = [
             ('qubit_num', ctypes.c_int),
-            ('state_num', ctypes.c_int),
+            ('state_num', ctypes.c_longlong),
             ('buf_id', ctypes.c_int),
             ('camp', ctypes.c_void_p),
             ('buffer_0', ctypes.c_void_p),
@@ -40,12 +46,16 @@ class QState(ctypes.Structure, QObject):
             ('d_prob_array', ctypes.c_void_p),
             ('d_prob_updated', ctypes.c_bool),
             ('gbank', ctypes.c_void_p),
+            ('rng', ctypes.c_void_p),
             ('use_gpu', ctypes.c_bool),
+            ('use_single', ctypes.c_bool),
+            ('mapped', ctypes.c_bool),
+            ('adopted', ctypes.c_bool),
         ]
     else:
         _fields_ = [
             ('qubit_num', ctypes.c_int),
-            ('state_num', ctypes.c_int),
+            ('state_num', ctypes.c_longlong),
             ('buf_id', ctypes.c_int),
             ('camp', ctypes.c_void_p),
             ('buffer_0', ctypes.c_void_p),
@@ -53,10 +63,15 @@ class QState(ctypes.Structure, QObject):
             ('prob_array', ctypes.c_void_p),
             ('prob_updated', ctypes.c_bool),
             ('gbank', ctypes.c_void_p),
+            ('rng', ctypes.c_void_p),
             ('use_gpu', ctypes.c_bool),
+            ('use_single', ctypes.c_bool),
+            ('mapped', ctypes.c_bool),
+            ('adopted', ctypes.c_bool),
         ]
 
-    def __new__(cls, qubit_num=0, vector=None, seed=None, use_gpu=False, **kwargs):
+    def __new__(cls, qubit_num=0, vector=None, seed=None, use_gpu=False, precision='double',
+                backing=None, **kwargs):
         """
         Parameters
         ----------
@@ -68,28 +83,63 @@ class QState(ctypes.Structure, QObject):
             seed for random generation for meaurement.
         use_gpu : bool
             calcurate with GPU(cuda) or not.
+        precision : str, default - 'double'
+            precision of the elements of the quantum state vector.
+            'double' (complex128) or 'single' (complex64).
+        backing : str, default - None
+            file name to keep the elements of the quantum state vector
+            as a memory-mapped file instead of the memory.
 
         Notes
         -----
         You must specify either 'qubit_num' or 'vector', not both.
+        The single precision state halves the memory and bandwidth
+        (the fidelity is about 1e-6 after many gates). It is not
+        supported with GPU.
+
+        With 'backing', the state is created as |00..0> in the file
+        if 'qubit_num' is specified, otherwise the existing file is
+        loaded as it is (the qubit number is deduced from the file size).
+        The file is the raw array of the elements (numpy.complex128, or
+        numpy.complex64 for single precision), so that the state larger
+        than the memory can be kept on the storage, resumed later, and
+        read by the other processes (ex: numpy.memmap). The gates and
+        'operate_qcirc' method operate on the file in place. Call 'sync'
+        method to write the elements back to the file at any time.
 
         """
         if seed is None:
             seed = random.randint(0, 1000000)
 
+        if backing is not None:
+            if use_gpu is True:
+                raise ValueError("backing file is not supported with GPU.")
+            if vector is not None:
+                raise ValueError("backing file can not be initialized with vector.")
+            if qubit_num > cfg.MAX_QUBIT_NUM:
+                raise ValueError("qubit number must be {0:d} or less.".format(cfg.MAX_QUBIT_NUM))
+            obj = qstate_init_with_file(qubit_num, str(backing), seed, precision)
         # if qubit_num is not None:
-        if qubit_num > 0:
+        elif qubit_num > 0:
             if qubit_num > cfg.MAX_QUBIT_NUM:
                 raise ValueError("qubit number must be {0:d} or less.".format(cfg.MAX_QUBIT_NUM))
-            obj = qstate_init(qubit_num, seed, use_gpu)
+            if use_gpu is True and qubit_num > cfg.MAX_GPU_QUBIT_NUM:
+                raise ValueError("qubit number must be {0:d} or less with GPU."
+                                 .format(cfg.MAX_GPU_QUBIT_NUM))
+            obj = qstate_init(qubit_num, seed, use_gpu, precision)
         elif qubit_num == 0:
-            obj = qstate_init_with_vector(vector, seed, use_gpu)
+            obj = qstate_init_with_vector(vector, seed, use_gpu, precision)
         else:
             raise ValueError("qubit number must be positive.")
 
         self = ctypes.cast(obj.value, ctypes.POINTER(cls)).contents
         return self
 
+    def __init__(self, qubit_num=0, vector=None, seed=None, use_gpu=False, precision='double',
+                 backing=None, **kwargs):
+        # the arguments are used in __new__ (not to be set to the fields by ctypes.Structure)
+        super().__init__()
+
     def __str__(self):
 
         return str(self.get_amp())
@@ -204,6 +254,68 @@ class QState(ctypes.Structure, QObject):
                 idx += 1
         return idx
 
+    @classmethod
+    def from_numpy(cls, array, copy=True, seed=None):
+        """
+        initialize the quantum state with the numpy array.
+
+        Parameters
+        ----------
+        array : numpy.ndarray
+            elements of the quantum state vector (the size must be 2**n).
+        copy : bool, default - True
+            the array is copied at once (True) or adopted as the elements
+            of the quantum state without copying (False).
+        seed : int, default - set randomly
+            seed for random generation for meaurement.
+
+        Returns
+        -------
+        qstate : instance of QState
+
+        Notes
+        -----
+        The precision of the quantum state is 'single' if the dtype of the
+        array is complex64, otherwise 'double' (complex128).
+        If 'copy' is False, the array must be a C-contiguous and writable
+        complex128 or complex64 array, and the gates of the quantum state
+        operate on the array in place (the array is kept by the quantum
+        state while it is alive). It is not supported with GPU.
+
+        Examples
+        --------
+        >>> vec = np.array([1.0, 0.0, 0.0, 1.0], dtype=np.complex128) / np.sqrt(2.0)
+        >>> qs = QState.from_numpy(vec, copy=False)
+        >>> qs.h(0)
+        >>> print(vec)
+        [ 0.5+0.j  0.5+0.j  0.5+0.j -0.5+0.j]
+
+        """
+        if not isinstance(array, np.ndarray):
+            raise TypeError("array must be numpy.ndarray.")
+        if array.size < 2 or array.size & (array.size - 1) != 0:
+            raise ValueError("size of the array must be a power of 2.")
+        if array.size > (1 << cfg.MAX_QUBIT_NUM):
+            raise ValueError("qubit number must be {0:d} or less.".format(cfg.MAX_QUBIT_NUM))
+
+        precision = 'single' if array.dtype == np.complex64 else 'double'
+        dtype = np.complex64 if precision == 'single' else np.complex128
+        if copy is True:
+            array = np.ascontiguousarray(array, dtype=dtype).ravel()
+        elif (array.dtype != dtype or not array.flags.c_contiguous
+              or not array.flags.writeable or not array.flags.aligned):
+            raise ValueError("array must be C-contiguous and writable complex128 or complex64 "
+                             "to be adopted (copy=False).")
+
+        if seed is None:
+            seed = random.randint(0, 1000000)
+
+        obj = qstate_init_with_buffer(array, adopt=not copy, seed=seed, precision=precision)
+        qs = ctypes.cast(obj.value, ctypes.POINTER(cls)).contents
+        if copy is False:
+            qs.buffer = array  # owned by the numpy array
+        return qs
+
     @classmethod
     def del_all(cls, *qstates):
         """
@@ -232,7 +344,12 @@ class QState(ctypes.Structure, QObject):
         """ elements of quantum state vector. """
         return self.get_amp()
 
-    def get_amp(self, qid=None):
+    @property
+    def precision(self):
+        """ precision of the elements of quantum state vector ('double' or 'single'). """
+        return 'single' if self.use_single is True else 'double'
+
+    def get_amp(self, qid=None, view=False, writable=False):
         """
         get the elements of quantum state vector.
 
@@ -240,6 +357,10 @@ class QState(ctypes.Structure, QObject):
         ----------
         qid : list of int, default - list of all of the qubit id
             qubit id's list.
+        view : bool, default - False
+            get the view of the elements (not copied) or not.
+        writable : bool, default - False
+            the view is writable or read-only.
 
         Returns
         -------
@@ -254,7 +375,19 @@ class QState(ctypes.Structure, QObject):
         probabilistic. If no qubits are specified, you get all
         elements of the quantum state.
 
+        If 'view' is True, the numpy array (complex128, or complex64 for
+        single precision) aliases the elements kept in the quantum state,
+        so that it follows the gates operated after that. The elements
+        are the raw ones (not normalized if the state is initialized with
+        the unnormalized vector). 'qid' can not be set with the view, and
+        the view is not supported with GPU. If 'writable' is True, the
+        elements can be written through the view.
+
         """
+        if view is True:
+            if qid is not None and list(qid) != list(range(self.qubit_num)):
+                raise ValueError("qid can not be set with the view.")
+            return qstate_amp_view(self, writable=writable)
         ret = qstate_get_camp(self, qid)
         return ret
 
@@ -275,15 +408,79 @@ class QState(ctypes.Structure, QObject):
             ex) {'00': 0.52, '11': 0.48}
 
         """
-        amp = qstate_get_camp(self, qid)
-        if qid is None:
-            digits = self.qubit_num
+        if qid is None or list(qid) == list(range(self.qubit_num)):
+            prob_array = qstate_marginal_prob(self)
         else:
-            digits = len(qid)
-        prob = {"{:0{digits}b}".format(i, digits=digits): abs(c) * abs(c)
-                for i, c in enumerate(amp) if abs(c) > cfg.EPS}
+            prob_array = np.abs(qstate_get_camp(self, qid))**2
+        digits = int(prob_array.size).bit_length() - 1
+        prob = {"{:0{digits}b}".format(i, digits=digits): float(prob_array[i])
+                for i in np.flatnonzero(prob_array > cfg.EPS**2)}
         return prob
 
+    def marginal_prob(self, qid=None):
+        """
+        get the marginal probabilities of the qubits.
+
+        Parameters
+        ----------
+        qid : list of int, default - list of all of the qubit id
+            qubit id's list.
+
+        Returns
+        -------
+        prob : numpy.ndarray (float)
+            marginal probabilities (the length is 2**len(qid)),
+            prob[x] is the probability of the measured value x
+            (qid[0] is the most significant bit of x).
+
+        Notes
+        -----
+        The remaining qubits are traced out (not measured), and the
+        quantum state is not changed. The probabilities are reduced
+        in C, so that the elements of the quantum state vector are
+        not transferred.
+
+        Examples
+        --------
+        >>> qs = QState(qubit_num=3).h(0).cx(0,1)
+        >>> print(qs.marginal_prob(qid=[1,2]))
+        [0.5 0.  0.5 0. ]
+
+        """
+        return qstate_marginal_prob(self, qid)
+
+    def sample(self, qid=None, shots=cfg.DEF_SHOTS):
+        """
+        sample the measured values of the qubits.
+
+        Parameters
+        ----------
+        qid : list of int, default - list of all of the qubit id
+            qubit id's list.
+        shots : int, default - 1
+            number of shots.
+
+        Returns
+        -------
+        mval : numpy.ndarray (int)
+            measured values of each shot (the length is shots),
+            (qid[0] is the most significant bit of the value).
+
+        Notes
+        -----
+        Unlike the 'm' method, the quantum state is not changed
+        (not collapsed by the measurement). The values of all of the
+        shots are sampled at once in C.
+
+        Examples
+        --------
+        >>> qs = QState(qubit_num=2).h(0).cx(0,1)
+        >>> print(qs.sample(qid=[0,1], shots=10))
+        [3 0 0 3 3 0 3 0 0 3]
+
+        """
+        return qstate_sample(self, qid, shots)
+
     def partial(self, qid=None):
         """
         get the partial quantum state.
@@ -309,7 +506,7 @@ class QState(ctypes.Structure, QObject):
 
         """
         vec = self.get_amp(qid)
-        qs = self.__class__(vector=vec)
+        qs = self.__class__(vector=vec, precision=self.precision)
         return qs
 
     def show(self, qid=None, nonzero=False, preal=0):
@@ -405,6 +602,55 @@ class QState(ctypes.Structure, QObject):
         qs = ctypes.cast(obj.value, ctypes.POINTER(self.__class__)).contents
         return qs
 
+    def set_seed(self, seed, stream=0):
+        """
+        set the seed of the random number generator for the measurements.
+
+        Parameters
+        ----------
+        seed : int
+            seed for random generation for meaurement.
+        stream : int, default - 0
+            stream id of the random numbers (ex: id of the process).
+
+        Returns
+        -------
+        self : instance of QState
+
+        Notes
+        -----
+        Each quantum state has its own counter-based generator, so that
+        the measured values are reproducible for the seed and the stream
+        regardless of the other quantum states. The streams of the same
+        seed are independent. The clone of the quantum state has the
+        generator split from the original one deterministically.
+
+        """
+        if not isinstance(seed, int) or not isinstance(stream, int) or seed < 0 or stream < 0:
+            raise ValueError("seed and stream must be non-negative integer.")
+        qstate_set_seed(self, seed, stream)
+        return self
+
+    def sync(self):
+        """
+        write the elements of the quantum state vector back to the backing file.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        self : instance of QState
+
+        Notes
+        -----
+        Nothing is done if the quantum state has no backing file.
+
+        """
+        qstate_sync(self)
+        return self
+
     def bloch(self, q=0):
         """
         get bloch angles.
@@ -574,6 +820,9 @@ class QState(ctypes.Structure, QObject):
         -----
         The 'iter' value should be sufficiently larger than the
         'time' value. This method change the original state.
+        Each term c * P of the Hamiltonian is operated as the
+        rotation exp(i * PI * c * P * time / iter) in a single
+        sweep of the amplitudes.
 
         See Also
         --------
@@ -893,6 +1142,100 @@ class QState(ctypes.Structure, QObject):
             raise ValueError("gate: {} is not supported.".format(cfg.GATE_STRING[kind]))
         return self
 
+    def mcx(self, qid=None, ctrl=None):
+        """
+        operate MCX gate (multi-controlled X gate).
+
+        Parameters
+        ----------
+        qid : list of int
+            qubit id list [control, control, ... , control, target]
+
+        Returns
+        -------
+        self : instance of QState
+
+        Notes
+        -----
+        The gate is operated natively (in a single sweep of the amplitudes) with CPU,
+        and expanded to the gray-code sequence of 'cp' and 'cx' gates with GPU.
+
+        """
+        if self.use_gpu is True:
+            return super().mcx(qid=qid, ctrl=ctrl)
+        return self.operate_qcirc(QCirc().mcx(qid=qid))
+
+    def qft(self, qid):
+        """
+        Quantum Fourier Transform
+
+        Parameters
+        ----------
+        qid : list of int
+            qubit id list
+
+        Returns
+        -------
+        self : instance of QState
+
+        Notes
+        -----
+        The transform is operated natively (as a FFT over the amplitudes of the qubits)
+        with CPU, and expanded to the sequence of 'h' and 'cp' gates with GPU.
+
+        """
+        if self.use_gpu is True:
+            return super().qft(qid)
+        return self.operate_qcirc(QCirc().qft(qid))
+
+    def iqft(self, qid):
+        """
+        Inverse Quantum Fourier Transform
+
+        Parameters
+        ----------
+        qid : list of int
+            qubit id list
+
+        Returns
+        -------
+        self : instance of QState
+
+        Notes
+        -----
+        The transform is operated natively (as a FFT over the amplitudes of the qubits)
+        with CPU, and expanded to the sequence of 'h' and 'cp' gates with GPU.
+
+        """
+        if self.use_gpu is True:
+            return super().iqft(qid)
+        return self.operate_qcirc(QCirc().iqft(qid))
+
+    def mrz(self, qid, phase=0.0, gphase=0.0, fac=1.0, tag=None, ctrl=None):
+        """
+        operate multi-qubit Rz gate, exp(-i * (phase * PI / 2) * Z...Z).
+
+        Parameters
+        ----------
+        qid : list of int
+            qubit id list
+        phase : float
+            rotation angle (unit of angle is PI radian).
+
+        Returns
+        -------
+        self : instance of QState
+
+        Notes
+        -----
+        The gate is operated natively (in a single sweep of the amplitudes) with CPU,
+        and expanded to the ladder of 'cx' gates and a 'rz' gate with GPU.
+
+        """
+        if self.use_gpu is True:
+            return super().mrz(qid, phase=phase, gphase=gphase, fac=fac, ctrl=ctrl)
+        return self.operate_qcirc(QCirc().mrz(qid, phase=phase, gphase=gphase, fac=fac))
+
     # operate quantum circuit
 
     def operate_qcirc(self, qcirc, qctrl=None):
@@ -901,8 +1244,8 @@ class QState(ctypes.Structure, QObject):
 
         Parameters
         ----------
-        qcirc : instance of QCirc
-            quantum circuit
+        qcirc : instance of QCirc or QPlan
+            quantum circuit (or its compiled plan, see QCirc.compile)
         qctrl : int
             control qubit id
 
@@ -914,18 +1257,30 @@ class QState(ctypes.Structure, QObject):
         Notes
         -----
         The quantum circut must be unintary.
+        The plan is operated only on the quantum state with CPU and the same precision,
+        and qctrl is not supported for the plan.
 
         """
+        if isinstance(qcirc, QPlan):
+            if qctrl is not None:
+                raise ValueError("qctrl is not supported for the compiled plan.")
+            if self.qubit_num < qcirc.qubit_num:
+                raise ValueError("qubit number of quantum state must be equal or larger than the quantum circuit size.")
+            if self.use_gpu is True:
+                raise ValueError("the compiled plan is not supported with GPU.")
+            qstate_operate_qplan(self, qcirc)
+            return self
+
         if qcirc.is_unitary() is False:
             raise ValueError("qcirc must be unitary quantum circuit.")
         if self.qubit_num < qcirc.qubit_num:
             raise ValueError("qubit number of quantum state must be equal or larger than the quantum circuit size.")
 
-        if qctrl is None:
-            qstate_operate_qcirc(self, cmem=None, qcirc=qcirc, shots=1, cid=None, out_state=True)
-        else:
-            qc_qctrl = qcirc.add_control(qctrl=qctrl)
-            qstate_operate_qcirc(self, cmem=None, qcirc=qc_qctrl, shots=1, cid=None, out_state=True)
+        if qctrl is not None:
+            qcirc = qcirc.add_control(qctrl=qctrl)
+        if self.use_gpu is True:
+            qcirc = qcirc.expand_multi_qubit_gates()
+        qstate_operate_qcirc(self, cmem=None, qcirc=qcirc, shots=1, cid=None, out_state=True)
 
         return self
 
@@ -934,10 +1289,15 @@ class QState(ctypes.Structure, QObject):
         qstate_free(self)
 
 # c-library for qstate
-from qlazy.lib.qstate_c import (qstate_init, qstate_init_with_vector, qstate_reset,
+from qlazy.lib.qstate_c import (qstate_init, qstate_init_with_vector, qstate_init_with_file,
+                                qstate_init_with_buffer, qstate_amp_view, qstate_set_seed,
+                                qstate_sync, qstate_reset,
                                 qstate_print, qstate_copy, qstate_bloch,
                                 qstate_inner_product, qstate_get_camp,
+                                qstate_marginal_prob, qstate_sample,
                                 qstate_tensor_product, qstate_evolve, qstate_expect_value,
                                 qstate_apply_matrix, qstate_operate_qgate, qstate_measure,
                                 qstate_measure_stats, qstate_measure_bell_stats, qstate_operate_qcirc,
-                                qstate_free)
+                                qstate_operate_qplan, qstate_free)
+from qlazy.QCirc import QCirc
+from qlazy.QPlan import QPlan
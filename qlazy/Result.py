@@ -28,7 +28,10 @@ class Result:
     shots : int
         number of measurements
     freqency : instance of Counter
-        frequencies of measured value.
+        frequencies of measured value (bit string of cid).
+    counts : dict
+        frequencies of measured value (integer, cid[0] is the most
+        significant bit).
     start_time : instance of datetime
         start time to ececute the quantum circuit.
     end_time : instance of datetime
@@ -50,7 +53,6 @@ class Result:
     cmem_num: int          = field(default=None, init=False)
     cid: list              = field(default=None, init=False)
     shots: int             = field(default=None, init=False)
-    frequency: Counter     = field(default=None, init=False)
     start_time: datetime   = field(default=None, init=False)
     end_time: datetime     = field(default=None, init=False)
     elapsed_time: float    = field(default=None, init=False)
@@ -58,6 +60,34 @@ class Result:
     stabilizer: Stabilizer = field(default=None, init=False)
     cmem: CMem             = field(default=None, init=False)
     info: dict             = field(default=None, init=False)
+    _frequency: Counter    = field(default=None, init=False, repr=False)
+    _counts: dict          = field(default=None, init=False, repr=False)
+
+    @property
+    def frequency(self):
+        """ frequencies of measured value (built from the counts when it is accessed). """
+        if self._frequency is None and self._counts is not None:
+            digits = len(self.cid) if self.cid is not None else 0
+            self._frequency = Counter({('{:0{digits}b}'.format(k, digits=digits) if digits > 0 else ''): v
+                                       for k, v in self._counts.items()})
+        return self._frequency
+
+    @frequency.setter
+    def frequency(self, frequency):
+        self._frequency = frequency
+        self._counts = None
+
+    @property
+    def counts(self):
+        """ frequencies of measured value (integer keys). """
+        if self._counts is None and self._frequency is not None:
+            self._counts = {(int(k, 2) if k != '' else 0): v for k, v in self._frequency.items()}
+        return self._counts
+
+    @counts.setter
+    def counts(self, counts):
+        self._counts = counts
+        self._frequency = None
 
     def __str__(self):
 
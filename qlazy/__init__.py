@@ -7,6 +7,8 @@ from .Stabilizer import Stabilizer
 from .MPState import MPState
 from .Backend import Backend
 from .QCirc import QCirc
+from .QPlan import QPlan
+from .NoiseModel import NoiseModel
 from .CMem import CMem
 from .PauliProduct import PauliProduct
 from .Result import Result
@@ -16,4 +18,4 @@ from . import util
 from . import gpu
 
 __all__ = ["QState", "ObservableBase", "Observable", "DensOp", "Stabilizer", "MPState",
-           "Backend", "QCirc", "CMem", "PauliProduct", "Result", "config", "error", "util", "gpu"]
+           "Backend", "QCirc", "QPlan", "NoiseModel", "CMem", "PauliProduct", "Result", "config", "error", "util", "gpu"]
@@ -39,14 +39,14 @@ def run(qcirc=None, shots=1, cid=None, backend=None, out_state=False, max_trunca
     if cmem_num < len(cid):
         raise ValueError("length of cid must be less than classical resister size of qcirc")
 
-    frequency = mps_operate_qcirc(mps, cmem, qcirc, shots, cid)
+    counts = mps_operate_qcirc(mps, cmem, qcirc, shots, cid)
 
     result = Result()
     result.qubit_num = qubit_num
     result.cmem_num = cmem_num
     result.cid = cid
     result.shots = shots
-    result.frequency = frequency
+    result.counts = counts
     result.backend = backend
     if out_state is True:
         result.mpstate = mps
@@ -1,26 +1,151 @@
 # -*- coding: utf-8 -*-
 """ run function for qlazy's qstate simulator """
 
+import numpy as np
+
+import qlazy.config as cfg
 from qlazy.QState import QState
 from qlazy.QCirc import QCirc
 from qlazy.CMem import CMem
 from qlazy.Result import Result
-from qlazy.lib.qstate_c import qstate_operate_qcirc
+from qlazy.lib.qstate_c import (qstate_operate_qcirc, qstate_operate_qcirc_batch, qstate_operate_qplan,
+                                qstate_gradient, qstate_operate_qcirc_noise)
 
-def run_cpu(qcirc=None, shots=1, cid=None, backend=None, out_state=False, init=None):
+def run_cpu(qcirc=None, shots=1, cid=None, backend=None, out_state=False, init=None,
+            fusion_qubit_num=cfg.DEF_FUSION_QUBIT_NUM, precision='double',
+            cache_qubit_num=cfg.DEF_CACHE_QUBIT_NUM, relabel=True, seed=None, stream=0,
+            noise_model=None):
     """ run the quantum circuit (with CPU) """
 
     return __run_all(qcirc=qcirc, shots=shots, cid=cid, backend=backend, use_gpu=False,
-                     out_state=out_state, init=init)
+                     out_state=out_state, init=init, fusion_qubit_num=fusion_qubit_num,
+                     precision=precision, cache_qubit_num=cache_qubit_num, relabel=relabel,
+                     seed=seed, stream=stream, noise_model=noise_model)
 
-def run_gpu(qcirc=None, shots=1, cid=None, backend=None, out_state=False, init=None):
+def run_gpu(qcirc=None, shots=1, cid=None, backend=None, out_state=False, init=None,
+            fusion_qubit_num=cfg.DEF_FUSION_QUBIT_NUM):
     """ run the quantum circuit (with GPU) """
 
     return __run_all(qcirc=qcirc, shots=shots, cid=cid, backend=backend, use_gpu=True,
-                     out_state=out_state, init=init)
+                     out_state=out_state, init=init, fusion_qubit_num=fusion_qubit_num)
+
+def run_qplan_cpu(qplan=None, shots=1, cid=None, backend=None, out_state=False, init=None,
+                  cache_qubit_num=cfg.DEF_CACHE_QUBIT_NUM, relabel=True):
+    """ run the compiled plan of the unitary quantum circuit (with CPU) """
+
+    if qplan is None:
+        raise ValueError("compiled plan must be specified.")
+
+    if init is None:
+        qstate = QState(qubit_num=qplan.qubit_num, precision=qplan.precision)
+    else:
+        if init.qubit_num < qplan.qubit_num:
+            raise ValueError("qubit number of the quantum state must be equal or larger than the quantum circuit size.")
+        qstate = init.clone()
+
+    qstate_operate_qplan(qstate, qplan, cache_qubit_num=cache_qubit_num, relabel=relabel)
+
+    result = Result()
+    result.backend = backend
+    result.qubit_num = qplan.qubit_num
+    result.cmem_num = 0
+    result.cid = cid if cid is not None else []
+    result.shots = shots
+    result.frequency = None
+    result.qstate = qstate if out_state is True else None
+    result.cmem = None
+    result.info = None
+
+    return result
+
+def run_batch_cpu(qcirc=None, params=None, shots=1, cid=None, backend=None, out_state=False,
+                  init=None, observable=None, fusion_qubit_num=cfg.DEF_FUSION_QUBIT_NUM,
+                  precision='double', cache_qubit_num=cfg.DEF_CACHE_QUBIT_NUM, relabel=True,
+                  seed=None, stream=0):
+    """ run the quantum circuit for each parameter set in a batch (with CPU) """
+
+    if qcirc is None:
+        raise ValueError("quantum circuit must be specified.")
+
+    # unitary part is operated on the batch, and the rest (measurement or reset first) member by member
+    qc_unitary, qc_rest = qcirc.split_unitary_non_unitary()
+    if observable is not None and qc_rest.kind_first() is not None:
+        raise ValueError("quantum circuit must be unitary to get the expectation values.")
+
+    if init is None:
+        init = QState(qubit_num=qcirc.qubit_num, precision=precision)
+    elif init.qubit_num < qcirc.qubit_num:
+        raise ValueError("qubit number of the quantum state must be equal or larger than the quantum circuit size.")
+
+    # phase of each tag for each member (current phase of the circuit if not specified)
+    params_current = qc_unitary.get_params() or {}
+    tags = list(params_current)
+    phase = np.array([[p.get(tag, params_current[tag]) for tag in tags] for p in params],
+                     dtype=np.float64).reshape(len(params), len(tags))
+
+    qstates = qstate_operate_qcirc_batch(init, qc_unitary, tags, phase,
+                                         fusion_qubit_num=fusion_qubit_num,
+                                         cache_qubit_num=cache_qubit_num, relabel=relabel)
+
+    if observable is not None:
+        return np.array([qs.expect(observable=observable) for qs in qstates])
+
+    results = []
+    for b, (p, qs) in enumerate(zip(params, qstates)):
+        if qc_rest.kind_first() is not None:
+            qc = qc_rest.clone()
+            params_rest = qc.get_params()
+            if params_rest is not None:
+                qc.set_params({tag: phase for tag, phase in p.items() if tag in params_rest})
+            result = __run_all(qcirc=qc, shots=shots, cid=cid, backend=backend, use_gpu=False,
+                               out_state=out_state, init=qs, fusion_qubit_num=fusion_qubit_num,
+                               cache_qubit_num=cache_qubit_num, relabel=relabel, seed=seed,
+                               stream=stream + b)
+            result.qubit_num = qcirc.qubit_num
+        else:
+            result = Result()
+            result.backend = backend
+            result.qubit_num = qcirc.qubit_num
+            result.cmem_num = qcirc.cmem_num
+            result.cid = cid if cid is not None else list(range(qcirc.cmem_num))
+            result.shots = shots
+            result.frequency = None
+            result.qstate = qs if out_state is True else None
+            result.cmem = CMem(qcirc.cmem_num) if out_state is True and qcirc.cmem_num > 0 else None
+            result.info = None
+        results.append(result)
+
+    return results
+
+def gradient_cpu(qcirc=None, observable=None, init=None, fusion_qubit_num=cfg.DEF_FUSION_QUBIT_NUM,
+                 precision='double', cache_qubit_num=cfg.DEF_CACHE_QUBIT_NUM, relabel=True):
+    """ gradient of the expectation value by the phases of the tags (with CPU) """
+
+    if qcirc is None:
+        raise ValueError("quantum circuit must be specified.")
+
+    if qcirc.is_unitary() is False:
+        raise ValueError("quantum circuit must be unitary to get the gradient.")
+
+    if init is None:
+        init = QState(qubit_num=qcirc.qubit_num, precision=precision)
+    elif init.qubit_num < qcirc.qubit_num:
+        raise ValueError("qubit number of the quantum state must be equal or larger than the quantum circuit size.")
+
+    ob = observable.clone()
+    if ob.recalc_weight() is False:
+        raise ValueError("Observable is not hermitian.")
+
+    tags = list(qcirc.get_params() or {})
+    grad = qstate_gradient(init, qcirc, ob.base, tags, fusion_qubit_num=fusion_qubit_num,
+                           cache_qubit_num=cache_qubit_num, relabel=relabel)
+
+    return {tag: float(g) for tag, g in zip(tags, grad)}
 
 def __run_all(qcirc=None, shots=1, cid=None, backend=None, use_gpu=False, out_state=False,
-              init=None):
+              init=None, fusion_qubit_num=cfg.DEF_FUSION_QUBIT_NUM, precision='double',
+              cache_qubit_num=cfg.DEF_CACHE_QUBIT_NUM, relabel=True, seed=None, stream=0,
+              noise_model=None):
     """ run the quantum circuit """
 
     if qcirc is None:
@@ -41,13 +166,20 @@ def __run_all(qcirc=None, shots=1, cid=None, backend=None, use_gpu=False, out_st
         raise ValueError("length of cid must be less than classical resister size of qcirc")
 
     if init is None:
-        qstate = QState(qubit_num=qubit_num, use_gpu=use_gpu)
+        qstate = QState(qubit_num=qubit_num, use_gpu=use_gpu, precision=precision)
     else:
         if init.qubit_num < qcirc.qubit_num:
             raise ValueError("qubit number of the quantum state must be equal or larger than the quantum circuit size.")
         qstate = init.clone()
+    if seed is not None:
+        qstate.set_seed(seed, stream=stream)
 
-    frequency = qstate_operate_qcirc(qstate, cmem, qcirc, shots, cid, out_state)
+    if noise_model is not None: # quantum trajectories (the gates are not fused)
+        counts = qstate_operate_qcirc_noise(qstate, cmem, qcirc, shots, cid, noise_model)
+    else:
+        counts = qstate_operate_qcirc(qstate, cmem, qcirc, shots, cid, out_state,
+                                      fusion_qubit_num=fusion_qubit_num,
+                                      cache_qubit_num=cache_qubit_num, relabel=relabel)
 
     result = Result()
     result.backend = backend
@@ -55,7 +187,7 @@ def __run_all(qcirc=None, shots=1, cid=None, backend=None, use_gpu=False, out_st
     result.cmem_num = cmem_num
     result.cid = cid
     result.shots = shots
-    result.frequency = frequency
+    result.counts = counts
     if out_state is True:
         result.qstate = qstate
         result.cmem = cmem
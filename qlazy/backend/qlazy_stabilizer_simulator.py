@@ -37,15 +37,15 @@ def run(qcirc=None, shots=1, cid=None, backend=None, out_state=False, init=None)
 
     qcirc_unitary, qcirc_non_unitary = qcirc.split_unitary_non_unitary()
 
-    frequency = stabilizer_operate_qcirc(stab, cmem, qcirc_unitary, 1, cid)
-    frequency = stabilizer_operate_qcirc(stab, cmem, qcirc_non_unitary, shots, cid)
+    counts = stabilizer_operate_qcirc(stab, cmem, qcirc_unitary, 1, cid)
+    counts = stabilizer_operate_qcirc(stab, cmem, qcirc_non_unitary, shots, cid)
 
     result = Result()
     result.qubit_num = qubit_num
     result.cmem_num = cmem_num
     result.cid = cid
     result.shots = shots
-    result.frequency = frequency
+    result.counts = counts
     result.backend = backend
     if out_state is True:
         result.stabilizer = stab
@@ -8,7 +8,14 @@ FALSE = 0
 EPS = 1e-6
 INF = 1e+6
 
-MAX_QUBIT_NUM = 30
+MAX_QUBIT_NUM = 40
+MAX_GPU_QUBIT_NUM = 30
+MEMCHECK_QUBIT_NUM = 24
+
+DEF_FUSION_QUBIT_NUM = 3
+MAX_FUSION_QUBIT_NUM = 5
+DEF_CACHE_QUBIT_NUM = 16
+MAX_QEXT_NUM = 39
 
 DEF_SHOTS = 1
 
@@ -73,6 +80,10 @@ ROTATION_XX    = 180
 ROTATION_YY    = 181
 ROTATION_ZZ    = 182
 SWAP_QUBITS    = 190
+MULTI_CONTROLLED_X = 195
+QFT_GATE       = 196
+IQFT_GATE      = 197
+MULTI_ROTATION_Z = 198
 MEASURE        = 200
 MEASURE_X      = 201
 MEASURE_Y      = 202
@@ -118,6 +129,10 @@ GATE_KIND = {
     'cu2': CONTROLLED_U2,
     'cu3': CONTROLLED_U3,
     'sw': SWAP_QUBITS,
+    'mcx': MULTI_CONTROLLED_X,
+    'qft': QFT_GATE,
+    'iqft': IQFT_GATE,
+    'mrz': MULTI_ROTATION_Z,
     'rxx': ROTATION_XX,
     'ryy': ROTATION_XX,
     'rzz': ROTATION_ZZ,
@@ -165,6 +180,10 @@ GATE_STRING = {
     CONTROLLED_U2:'cu2',
     CONTROLLED_U3:'cu3',
     SWAP_QUBITS:'sw',
+    MULTI_CONTROLLED_X:'mcx',
+    QFT_GATE:'qft',
+    IQFT_GATE:'iqft',
+    MULTI_ROTATION_Z:'mrz',
     ROTATION_XX:'rxx',
     ROTATION_YY:'ryy',
     ROTATION_ZZ:'rzz',
@@ -213,6 +232,10 @@ GATE_LABEL = {
     CONTROLLED_U2:'U2',
     CONTROLLED_U3:'U3',
     SWAP_QUBITS:'SW',
+    MULTI_CONTROLLED_X:'X',
+    QFT_GATE:'QFT',
+    IQFT_GATE:'IQFT',
+    MULTI_ROTATION_Z:'MRZ',
     MEASURE:'M',
     MEASURE_X:'MX',
     MEASURE_Y:'MY',
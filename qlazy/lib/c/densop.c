@@ -443,7 +443,7 @@ static bool _densop_rapply_matrix(DensOp* densop, int qnum_part, int* qid,
   densop' = densop * matrix
 */
 {
-  int*		index	   = NULL;
+  INDEX*	index	   = NULL;
   int*		inv_index  = NULL;
   COMPLEX	coef	   = 0.0 + 0.0 * COMP_I;
   int		qnum	   = 0;
@@ -514,7 +514,7 @@ static bool _densop_lapply_matrix(DensOp* densop, int qnum_part, int* qid,
   densop' = matrix * densop
 */
 {
-  int*		index	   = NULL;
+  INDEX*	index	   = NULL;
   int*		inv_index  = NULL;
   COMPLEX	coef	   = 0.0 + 0.0 * COMP_I;
   int		qnum	   = 0;
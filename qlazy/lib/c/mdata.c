@@ -8,8 +8,8 @@ bool mdata_init(int qubit_num, int shot_num,
 		double angle, double phase, int* qubit_id, void** mdata_out)
 {
   MData*	mdata = NULL;
-  int		state_num;
-  int		i;
+  INDEX		state_num;
+  INDEX		i;
 
   if (!(mdata = (MData*)malloc(sizeof(MData))))
     ERR_RETURN(ERROR_CANT_ALLOC_MEMORY,false);
@@ -21,7 +21,7 @@ bool mdata_init(int qubit_num, int shot_num,
     ERR_RETURN(ERROR_CANT_ALLOC_MEMORY,false);
   memcpy(mdata->qubit_id, qubit_id, sizeof(int) * qubit_num);
 
-  state_num = (int)pow(2.0, (double)qubit_num);
+  state_num = (INDEX)1 << qubit_num;
   if (!(mdata->freq = (int*)malloc(sizeof(int)*state_num)))
     ERR_RETURN(ERROR_CANT_ALLOC_MEMORY,false);
   for (i=0; i<state_num; i++) mdata->freq[i] = 0;
@@ -36,8 +36,8 @@ bool mdata_print(MData* mdata)
   char	state[MAX_QUBIT_NUM+1];
   char	last_state[MAX_QUBIT_NUM+1];
   int   zflag = ON;
-  int   state_num;
-  int   i;
+  INDEX state_num;
+  INDEX i;
 
   if (mdata == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
 
@@ -58,7 +58,7 @@ bool mdata_print(MData* mdata)
 	   mdata->angle, mdata->phase);
   }
 
-  state_num = (int)pow(2.0, (double)(mdata->qubit_num));
+  state_num = (INDEX)1 << mdata->qubit_num;
 
   for (i=0; i<state_num; i++) {
     if (!(binstr_from_decimal(state, mdata->qubit_num, i, zflag)))
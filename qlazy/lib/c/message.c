@@ -234,6 +234,13 @@ void error_msg(ErrCode err)
     fprintf(stderr, "ERROR: qcirc decompose failure !\n");
     break;
 
+  case ERROR_QPLAN_INIT:
+    fprintf(stderr, "ERROR: qplan init failure !\n");
+    break;
+  case ERROR_QPLAN_SET_PARAMS:
+    fprintf(stderr, "ERROR: qplan set params failure !\n");
+    break;
+
   case ERROR_TAGTABLE_INIT:
     fprintf(stderr, "ERROR: tagtable init failure !\n");
     break;
@@ -292,6 +299,9 @@ void error_msg(ErrCode err)
   case ERROR_CANT_RESET:
     fprintf(stderr, "ERROR: can't reset qubits !\n");
     break;
+  case ERROR_NOT_ENOUGH_MEMORY:
+    fprintf(stderr, "ERROR: not enough memory for the quantum state !\n");
+    break;
     
   default:
     fprintf(stderr, "ERROR:unidentified error occur (unknown error code) !\n");
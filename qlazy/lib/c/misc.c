@@ -166,7 +166,7 @@ bool is_decimal(char* str)
   return true;
 }
 
-bool binstr_from_decimal(char* binstr, int qubit_num, int decimal, int zflag)
+bool binstr_from_decimal(char* binstr, int qubit_num, INDEX decimal, int zflag)
 {
   /*
     [description]
@@ -176,8 +176,8 @@ bool binstr_from_decimal(char* binstr, int qubit_num, int decimal, int zflag)
     - zflag:     ON -> character of the state is '0'/'1'
                  OFF->character of the state is 'u'/'d'
    */
-  int	d	    = decimal;
-  int	max_decimal = (1<<MAX_QUBIT_NUM) - 1;
+  INDEX	d	    = decimal;
+  INDEX	max_decimal = ((INDEX)1<<MAX_QUBIT_NUM) - 1;
   int	pos	    = 0;
   char	up,dn;
   int   i;
@@ -206,7 +206,7 @@ bool binstr_from_decimal(char* binstr, int qubit_num, int decimal, int zflag)
   return true;
 }
 
-int bit_permutation(int bits_in, int qnum, int qnum_part, int* qid)
+INDEX bit_permutation(INDEX bits_in, int qnum, int qnum_part, int* qid)
 /*
   [example]
   bits_in: abcdef (<-- binary array)
@@ -215,8 +215,8 @@ int bit_permutation(int bits_in, int qnum, int qnum_part, int* qid)
   --> bits_out: eacbdf
 */
 {
-  int	bits_out = 0;
-  int	bit	 = 0;
+  INDEX	bits_out = 0;
+  INDEX	bit	 = 0;
   int	now	 = 0;
   bool	flg[MAX_QUBIT_NUM];
   int   i;
@@ -241,12 +241,12 @@ int bit_permutation(int bits_in, int qnum, int qnum_part, int* qid)
   return bits_out;
 }
 
-int* bit_permutation_array(int length, int qnum, int qnum_part, int* qid)
+INDEX* bit_permutation_array(INDEX length, int qnum, int qnum_part, int* qid)
 {
-  int* index = NULL;
-  int  i;
+  INDEX* index = NULL;
+  INDEX  i;
 
-  if (!(index = (int*)malloc(sizeof(int)*length))) {
+  if (!(index = (INDEX*)malloc(sizeof(INDEX)*length))) {
     printf("Error: can't alloc memory\n");
     exit(1);
   }  
@@ -258,7 +258,7 @@ int* bit_permutation_array(int length, int qnum, int qnum_part, int* qid)
   return index;
 }
 
-bool select_bits(int* bits_out, int bits_in, int digits_out, int digits_in, int* digit_array)
+bool select_bits(INDEX* bits_out, INDEX bits_in, int digits_out, int digits_in, int* digit_array)
 {
   /*
     [description]
@@ -274,7 +274,7 @@ bool select_bits(int* bits_out, int bits_in, int digits_out, int digits_in, int*
       (digits_out < 1) || (digits_out > MAX_QUBIT_NUM) || (bits_in < 0))
     ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
 
-  int bits = 0;
+  INDEX bits = 0;
   int count = 0;
   for (i=digits_out-1; i>=0; i--) {
     if (digit_array[i] >= digits_in) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
@@ -287,15 +287,35 @@ bool select_bits(int* bits_out, int bits_in, int digits_out, int digits_in, int*
   SUC_RETURN(true);
 }
 
-bool is_power_of_2(int n)
+bool is_power_of_2(INDEX n)
 {
-  int log2_n;
-  double diff;
-  
-  log2_n = (int)log2((double)n);
-  diff = log2((double)n) - (double)log2_n;
-  if (fabs(diff) < MIN_DOUBLE) return true;
-  else return false;
+  return ((n > 0) && ((n & (n - 1)) == 0));
+}
+
+size_t get_available_memory(void)
+/* available physical memory in bytes (MemAvailable of /proc/meminfo,
+   or physical memory size if it is not supported), 0 if unknown */
+{
+  FILE*		fp;
+  char		line[LINE_STRLEN];
+  long long	kb  = -1;
+  long		pages, page_size;
+
+  if ((fp = fopen("/proc/meminfo", "r")) != NULL) {
+    while (fgets(line, LINE_STRLEN, fp) != NULL) {
+      if (sscanf(line, "MemAvailable: %lld kB", &kb) == 1) break;
+    }
+    fclose(fp);
+    if (kb >= 0) return (size_t)kb * 1024;
+  }
+
+#if defined(_SC_PHYS_PAGES) && defined(_SC_PAGESIZE)
+  pages = sysconf(_SC_PHYS_PAGES);
+  page_size = sysconf(_SC_PAGESIZE);
+  if ((pages > 0) && (page_size > 0)) return (size_t)pages * (size_t)page_size;
+#endif
+
+  return 0;
 }
 
 int kind_get_qid_size(Kind kind)
@@ -325,6 +345,10 @@ int kind_get_qid_size(Kind kind)
   case MEASURE_Y:
   case MEASURE_Z:
   case RESET:
+  case MULTI_CONTROLLED_X:  /* qid[0] only (extra qubits are set separately) */
+  case QFT_GATE:
+  case IQFT_GATE:
+  case MULTI_ROTATION_Z:
     qid_size = 1;
     break;
   case CONTROLLED_X:
@@ -388,6 +412,9 @@ int kind_get_para_size(Kind kind)
   case CONTROLLED_T:
   case CONTROLLED_T_:
   case SWAP_QUBITS:
+  case MULTI_CONTROLLED_X:
+  case QFT_GATE:
+  case IQFT_GATE:
   case MEASURE_BELL:
   case IDENTITY:
     para_size = 0;
@@ -402,6 +429,7 @@ int kind_get_para_size(Kind kind)
   case CONTROLLED_RY:
   case CONTROLLED_RZ:
   case CONTROLLED_U1:
+  case MULTI_ROTATION_Z:
     para_size = 1;
     break;
   case ROTATION_U2:
@@ -497,6 +525,10 @@ bool kind_is_unitary(Kind kind)
   case CONTROLLED_U2:
   case ROTATION_U3:
   case CONTROLLED_U3:
+  case MULTI_CONTROLLED_X:
+  case QFT_GATE:
+  case IQFT_GATE:
+  case MULTI_ROTATION_Z:
     is_unitary = true;
     break;
   default:
@@ -539,6 +571,25 @@ bool kind_is_controlled(Kind kind)
   return is_controlled;
 }
 
+bool kind_is_multi_qubit(Kind kind)
+{
+  bool is_multi_qubit;
+  
+  switch (kind) {
+  case MULTI_CONTROLLED_X:
+  case QFT_GATE:
+  case IQFT_GATE:
+  case MULTI_ROTATION_Z:
+    is_multi_qubit = true;
+    break;
+  default:
+    is_multi_qubit = false;
+    break;
+  }
+  
+  return is_multi_qubit;
+}
+
 bool is_gpu_supported_lib(void)
 {
 #ifdef USE_GPU
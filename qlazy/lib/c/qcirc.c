@@ -4,6 +4,107 @@
 
 #include "qlazy.h"
 
+static bool _qcirc_append(QCirc* qcirc, Kind kind, int* qid, int qext_num, int* qext,
+			  double* para, int c, int ctrl, char* tag)
+{
+  QGate* qgate = NULL;
+  int qid_size = 0;
+  int para_size = 0;
+  int i, j;
+  
+  if (qcirc == NULL ||
+      (kind_is_measurement(kind) == false &&
+       kind_is_reset(kind) == false && kind_is_unitary(kind) == false)) {
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
+  /* bell measurement is not supported */
+  if (kind == MEASURE_BELL) {
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
+
+  /* set qgate */
+  qid_size = kind_get_qid_size(kind);
+  para_size = kind_get_para_size(kind);
+  if (qid_size < 0) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  if (qid_size == 2 && qid[0] == qid[1]) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  if (para_size < 0) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  /* extra qubits of multi-qubit gate (distinct from each other and qid[0]) */
+  if (kind_is_multi_qubit(kind) == true) {
+    if ((qext_num < 0) || (qext_num > MAX_QEXT_NUM)) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    if ((kind == MULTI_CONTROLLED_X) && (qext_num < 1)) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    for (i=0; i<qext_num; i++) {
+      if ((qext[i] < 0) || (qext[i] == qid[0])) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+      for (j=0; j<i; j++) {
+	if (qext[i] == qext[j]) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+      }
+    }
+  }
+  else if (qext_num != 0) {
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
+
+  if (!(qgate = (QGate*)malloc(sizeof(QGate))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  qgate->kind = kind;
+  for (i=0; i<qid_size; i++) qgate->qid[i] = qid[i];
+  for (i=qid_size; i<2; i++) qgate->qid[i] = -1;
+  qgate->qext_num = qext_num;
+  qgate->qext = NULL; /* allocated only for the multi-qubit gate */
+  if (qext_num > 0) {
+    if (!(qgate->qext = (int*)malloc(sizeof(int) * qext_num)))
+      ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+    for (i=0; i<qext_num; i++) qgate->qext[i] = qext[i];
+  }
+  for (i=0; i<3; i++) qgate->para[i] = para[i];
+  qgate->c = c;
+  qgate->ctrl = ctrl;
+
+  if (tag == NULL) {
+    strcpy(qgate->tag, "");
+  }
+  else if (strlen(tag) > TAG_STRLEN) {
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
+  else {
+    strcpy(qgate->tag, tag);
+  }
+
+  /* set tag table */
+  if (strlen(qgate->tag) > 0) {
+    if (!(tagtable_set_phase(qcirc->tag_table, qgate->tag, para[0])))
+      ERR_RETURN(ERROR_TAGTABLE_SET_PHASE, false);
+  }
+
+  /* update qubit_num, cmem_num, gate_num */
+  for (i=0; i<qid_size; i++) qcirc->qubit_num = MAX(qcirc->qubit_num, qgate->qid[i] + 1);
+  for (i=0; i<qext_num; i++) qcirc->qubit_num = MAX(qcirc->qubit_num, qgate->qext[i] + 1);
+  if (qgate->c != -1) qcirc->cmem_num = MAX(qcirc->cmem_num, qgate->c + 1);
+  if (qgate->ctrl != -1) qcirc->cmem_num = MAX(qcirc->cmem_num, qgate->ctrl + 1);
+  qcirc->gate_num += 1;
+
+  /* append qgate */
+  if (qcirc->first == NULL) {
+    qcirc->first = qcirc->last = qgate;
+    qgate->prev = NULL;
+    qgate->next = NULL;
+  }
+  else {
+    qcirc->last->next = qgate;
+    qgate->prev = qcirc->last;
+    qgate->next = NULL;
+    qcirc->last = qgate;
+  }
+  
+  SUC_RETURN(true);
+}
+
+static bool _qcirc_append_qgate(QCirc* qcirc, QGate* qgate)
+{
+  return _qcirc_append(qcirc, qgate->kind, qgate->qid, qgate->qext_num, qgate->qext,
+		       qgate->para, qgate->c, qgate->ctrl, qgate->tag);
+}
+
 bool qcirc_init(void** qcirc_out)
 {
   QCirc* qcirc = NULL;
@@ -37,7 +138,7 @@ bool qcirc_copy(QCirc* qcirc_in, void** qcirc_out)
   /* copy gates */
   gate = qcirc_in->first;
   while (gate != NULL) {
-    if (!(qcirc_append_gate(qcirc, gate->kind, gate->qid, gate->para, gate->c, gate->ctrl, gate->tag)))
+    if (!(_qcirc_append_qgate(qcirc, gate)))
       ERR_RETURN(ERROR_QCIRC_APPEND_GATE, false);
     gate = gate->next;
   }
@@ -71,7 +172,7 @@ bool qcirc_merge(QCirc* qcirc_L, QCirc* qcirc_R, void** qcirc_out)
   /* append left */
   gate = qcirc_L->first;
   while (gate != NULL) {
-    if (!(qcirc_append_gate(qcirc, gate->kind, gate->qid, gate->para, gate->c, gate->ctrl, gate->tag)))
+    if (!(_qcirc_append_qgate(qcirc, gate)))
       ERR_RETURN(ERROR_QCIRC_APPEND_GATE, NULL);
     gate = gate->next;
   }
@@ -82,7 +183,7 @@ bool qcirc_merge(QCirc* qcirc_L, QCirc* qcirc_R, void** qcirc_out)
   /* append right */
   gate = qcirc_R->first;
   while (gate != NULL) {
-    if (!(qcirc_append_gate(qcirc, gate->kind, gate->qid, gate->para, gate->c, gate->ctrl, gate->tag)))
+    if (!(_qcirc_append_qgate(qcirc, gate)))
       ERR_RETURN(ERROR_QCIRC_APPEND_GATE, NULL);
     gate = gate->next;
   }
@@ -107,7 +208,7 @@ bool qcirc_merge_mutable(QCirc* qcirc_mut, QCirc* qcirc)
   /* append gate */
   gate = qcirc->first;
   while (gate != NULL) {
-    if (!(qcirc_append_gate(qcirc_mut, gate->kind, gate->qid, gate->para, gate->c, gate->ctrl, gate->tag)))
+    if (!(_qcirc_append_qgate(qcirc_mut, gate)))
       ERR_RETURN(ERROR_QCIRC_APPEND_GATE, NULL);
     gate = gate->next;
   }
@@ -145,7 +246,10 @@ bool qcirc_is_equal(QCirc* qcirc_L, QCirc* qcirc_R, bool* ans)
 	(gate_L->para[1] != gate_R->para[1]) ||
 	(gate_L->para[2] != gate_R->para[2]) ||
 	(gate_L->c != gate_R->c) ||
-	(gate_L->ctrl != gate_R->ctrl)) {
+	(gate_L->ctrl != gate_R->ctrl) ||
+	(gate_L->qext_num != gate_R->qext_num) ||
+	((gate_L->qext_num > 0) &&
+	 (memcmp(gate_L->qext, gate_R->qext, sizeof(int) * gate_L->qext_num) != 0))) {
       *ans = false;
       SUC_RETURN(true);
     }
@@ -199,73 +303,16 @@ bool qcirc_is_measurement_only(QCirc* qcirc, bool* ans)
 
 bool qcirc_append_gate(QCirc* qcirc, Kind kind, int* qid, double* para, int c, int ctrl, char* tag)
 {
-  QGate* qgate = NULL;
-  int qid_size = 0;
-  int para_size = 0;
-  int i;
-  
-  if (qcirc == NULL ||
-      (kind_is_measurement(kind) == false &&
-       kind_is_reset(kind) == false && kind_is_unitary(kind) == false)) {
-    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
-  }
-  /* bell measurement is not supported */
-  if (kind == MEASURE_BELL) {
-    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
-  }
-
-  /* set qgate */
-  qid_size = kind_get_qid_size(kind);
-  para_size = kind_get_para_size(kind);
-  if (qid_size < 0) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
-  if (qid_size == 2 && qid[0] == qid[1]) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
-  if (para_size < 0) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
-
-  if (!(qgate = (QGate*)malloc(sizeof(QGate))))
-    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
-  qgate->kind = kind;
-  for (i=0; i<qid_size; i++) qgate->qid[i] = qid[i];
-  for (i=qid_size; i<2; i++) qgate->qid[i] = -1;
-  for (i=0; i<3; i++) qgate->para[i] = para[i];
-  qgate->c = c;
-  qgate->ctrl = ctrl;
-
-  if (tag == NULL) {
-    strcpy(qgate->tag, "");
-  }
-  else if (strlen(tag) > TAG_STRLEN) {
-    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
-  }
-  else {
-    strcpy(qgate->tag, tag);
-  }
-
-  /* set tag table */
-  if (strlen(qgate->tag) > 0) {
-    if (!(tagtable_set_phase(qcirc->tag_table, qgate->tag, para[0])))
-      ERR_RETURN(ERROR_TAGTABLE_SET_PHASE, false);
-  }
-
-  /* update qubit_num, cmem_num, gate_num */
-  for (i=0; i<qid_size; i++) qcirc->qubit_num = MAX(qcirc->qubit_num, qgate->qid[i] + 1);
-  if (qgate->c != -1) qcirc->cmem_num = MAX(qcirc->cmem_num, qgate->c + 1);
-  if (qgate->ctrl != -1) qcirc->cmem_num = MAX(qcirc->cmem_num, qgate->ctrl + 1);
-  qcirc->gate_num += 1;
+  if (kind_is_multi_qubit(kind) == true) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  return _qcirc_append(qcirc, kind, qid, 0, NULL, para, c, ctrl, tag);
+}
 
-  /* append qgate */
-  if (qcirc->first == NULL) {
-    qcirc->first = qcirc->last = qgate;
-    qgate->prev = NULL;
-    qgate->next = NULL;
-  }
-  else {
-    qcirc->last->next = qgate;
-    qgate->prev = qcirc->last;
-    qgate->next = NULL;
-    qcirc->last = qgate;
-  }
-  
-  SUC_RETURN(true);
+bool qcirc_append_mqgate(QCirc* qcirc, Kind kind, int* qid, int qext_num, int* qext,
+			 double* para, int ctrl, char* tag)
+/* append the multi-qubit gate (qubits: qext[0], ... , qext[qext_num-1], qid[0]) */
+{
+  if (kind_is_multi_qubit(kind) == false) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  return _qcirc_append(qcirc, kind, qid, qext_num, qext, para, -1, ctrl, tag);
 }
 
 bool qcirc_kind_first(QCirc* qcirc, Kind* kind)
@@ -292,6 +339,7 @@ static void _qcirc_update(QCirc* qcirc)
   qgate = qcirc->first;
   while (qgate != NULL) {
     for (i=0; i<2; i++) qubit_num = MAX(qubit_num, qgate->qid[i] + 1);
+    for (i=0; i<qgate->qext_num; i++) qubit_num = MAX(qubit_num, qgate->qext[i] + 1);
     cmem_num = MAX(cmem_num, qgate->c + 1);
     cmem_num = MAX(cmem_num, qgate->ctrl + 1);
     gate_num += 1;
@@ -303,8 +351,8 @@ static void _qcirc_update(QCirc* qcirc)
   qcirc->gate_num = gate_num;
 }
 
-bool qcirc_pop_gate(QCirc* qcirc, Kind* kind, int* qid, double* para, int* c, int* ctrl,
-		    char* tag, int* taglen)
+bool qcirc_pop_gate(QCirc* qcirc, Kind* kind, int* qid, int* qext_num, int* qext,
+		    double* para, int* c, int* ctrl, char* tag, int* taglen)
 {
   QGate*	ori_first;
   int		q_max = -1;
@@ -316,6 +364,8 @@ bool qcirc_pop_gate(QCirc* qcirc, Kind* kind, int* qid, double* para, int* c, in
   /* get first gate */
   *kind = qcirc->first->kind;
   memcpy(qid, qcirc->first->qid, sizeof(int) * 2);
+  *qext_num = qcirc->first->qext_num;
+  if (*qext_num > 0) memcpy(qext, qcirc->first->qext, sizeof(int) * (*qext_num));
   memcpy(para, qcirc->first->para, sizeof(double) * 3);
   *c = qcirc->first->c;
   *ctrl = qcirc->first->ctrl;
@@ -325,10 +375,11 @@ bool qcirc_pop_gate(QCirc* qcirc, Kind* kind, int* qid, double* para, int* c, in
   /* free first gate (original) */
   ori_first = qcirc->first;
   qcirc->first = qcirc->first->next;
-  free(ori_first); ori_first = NULL;
+  qgate_free(ori_first); ori_first = NULL;
 
   /* update qubit_num, cmem_num, gate_num */
   for (i=0; i<2; i++) q_max = MAX(q_max, qid[i] + 1);
+  for (i=0; i<*qext_num; i++) q_max = MAX(q_max, qext[i] + 1);
   c_max = MAX(c_max, *c);
   c_max = MAX(c_max, *ctrl);
   if ((q_max >= qcirc->qubit_num) || (c_max >= qcirc->cmem_num)) _qcirc_update(qcirc);
@@ -358,7 +409,7 @@ bool qcirc_decompose(QCirc* qcirc_in, void** qcirc_uonly_out, void** qcirc_mixed
   while (qgate != NULL) {
     if (kind_is_unitary(qgate->kind) == true) {
       uonly_flg = true;
-      if (!(qcirc_append_gate(qcirc_uonly, qgate->kind, qgate->qid, qgate->para, qgate->c, qgate->ctrl, qgate->tag)))
+      if (!(_qcirc_append_qgate(qcirc_uonly, qgate)))
 	ERR_RETURN(ERROR_QCIRC_APPEND_GATE, false);
       *qcirc_uonly_out = qcirc_uonly;
     }
@@ -388,7 +439,7 @@ bool qcirc_decompose(QCirc* qcirc_in, void** qcirc_uonly_out, void** qcirc_mixed
   monly_flg = true;
   while (qgate != NULL) {
     if (kind_is_measurement(qgate->kind) == false) monly_flg = false;
-    if (!(qcirc_append_gate(qcirc_monly, qgate->kind, qgate->qid, qgate->para, qgate->c, qgate->ctrl, qgate->tag)))
+    if (!(_qcirc_append_qgate(qcirc_monly, qgate)))
       ERR_RETURN(ERROR_QCIRC_APPEND_GATE, false);
     qgate = qgate->next;
   }
@@ -512,12 +563,12 @@ void qcirc_free(QCirc* qcirc)
   
   while (qgate != NULL) {
     if (qgate->next == NULL) {
-      free(qgate); qgate = NULL;
+      qgate_free(qgate); qgate = NULL;
     }
     else {
       qgate = qgate->next;
       if (qgate->prev != NULL) {
-	free(qgate->prev);
+	qgate_free(qgate->prev);
 	qgate->prev = NULL;
       }
     }
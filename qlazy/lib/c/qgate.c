@@ -286,7 +286,8 @@ bool qgate_get_next_unitary(void** qgate_inout, GBank* gbank, int* dim, int* q0,
   free(U_tmp); U_tmp = NULL;
 
   *compo = false;
-  while ((qgate->next != NULL) && (kind_is_unitary(qgate->next->kind) == true)) {
+  while ((qgate->next != NULL) && (kind_is_unitary(qgate->next->kind) == true) &&
+	 (kind_is_multi_qubit(qgate->next->kind) == false)) {
 
     if (!(_composite_or_not(*dim, *q0, *q1, qgate->next, &ans)))
       ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
@@ -314,6 +315,239 @@ bool qgate_get_next_unitary(void** qgate_inout, GBank* gbank, int* dim, int* q0,
   SUC_RETURN(true);
 }
 
+static void _block_operate_unitary(COMPLEX* T, int knum, COMPLEX* U, int dim, int j0, int j1)
+/*
+ * operate the 1 or 2-qubit unitary U on the local qubits j0 (,j1) of each
+ * row of T (2^knum rows x 2^knum columns, each row is a column of the block matrix)
+ */
+{
+  int		size = 1 << knum;
+  int		b0   = knum - j0 - 1;
+  int		b1   = knum - j1 - 1;
+  int		idx[4];
+  COMPLEX	a[4];
+  COMPLEX*	v    = NULL;
+  int		r, i, k, l;
+
+  for (r=0; r<size; r++) {
+    v = &T[r * size];
+    for (i=0; i<size; i++) {
+      if (dim == 2) {
+	if ((i >> b0) % 2 == 1) continue;
+	idx[0] = i;
+	idx[1] = i | (1 << b0);
+      }
+      else {
+	if (((i >> b0) % 2 == 1) || ((i >> b1) % 2 == 1)) continue;
+	idx[0] = i;
+	idx[1] = i | (1 << b1);
+	idx[2] = i | (1 << b0);
+	idx[3] = i | (1 << b0) | (1 << b1);
+      }
+      for (k=0; k<dim; k++) a[k] = v[idx[k]];
+      for (k=0; k<dim; k++) {
+	v[idx[k]] = 0.0;
+	for (l=0; l<dim; l++) v[idx[k]] += U[k * dim + l] * a[l];
+      }
+    }
+  }
+}
+
+#define FUSION_LOOKAHEAD 64 /* max number of the remained gates to look ahead for fusion */
+
+bool qblock_set_matrix(QBlock* qblock, GBank* gbank)
+/* set the block matrix of the fused gates qblock->fused[0,1,...,gate_num-1] */
+{
+  QGate**	qgate_fused = qblock->fused;
+  COMPLEX*	T     = NULL; /* transpose of the block matrix */
+  COMPLEX*	U_tmp = NULL;
+  int		knum  = qblock->knum;
+  int		size  = 1 << knum;
+  int		dim   = 0;
+  int		i, k, r, j0, j1;
+
+  if (!(T = (COMPLEX*)malloc(sizeof(COMPLEX) * size * size)))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  for (i=0; i<size*size; i++) T[i] = 0.0;
+  for (i=0; i<size; i++) T[i * size + i] = 1.0;
+
+  /* operate the gates to the identity matrix */
+  for (k=0; k<qblock->gate_num; k++) {
+    if (!(gbank_get_unitary(gbank, qgate_fused[k]->kind, qgate_fused[k]->para[0],
+			    qgate_fused[k]->para[1], qgate_fused[k]->para[2], &dim, (void**)&U_tmp)))
+      ERR_RETURN(ERROR_GBANK_GET_UNITARY, false);
+    for (j0=0; qblock->qid[j0] != qgate_fused[k]->qid[0]; j0++);
+    j1 = j0;
+    if (dim == 4) for (j1=0; qblock->qid[j1] != qgate_fused[k]->qid[1]; j1++);
+    _block_operate_unitary(T, knum, U_tmp, dim, j0, j1);
+    free(U_tmp); U_tmp = NULL;
+  }
+
+  /* transpose */
+  if (!(qblock->U = (COMPLEX*)malloc(sizeof(COMPLEX) * size * size)))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  for (r=0; r<size; r++) {
+    for (i=0; i<size; i++) qblock->U[i * size + r] = T[r * size + i];
+  }
+  free(T); T = NULL;
+
+  SUC_RETURN(true);
+}
+
+bool qgate_get_next_fused_blocks(void** qgate_inout, GBank* gbank, int fuse_num,
+				 int* block_num_out, void** qblock_out)
+/*
+ * fuse the consecutive unitary gates (with the same control) from '*qgate_inout'
+ * into the blocks acting on 'fuse_num' qubits or less.
+ * a gate can be fused into a block ahead of the gates which are not fused, only if
+ * it acts on the qubits different from theirs (so the gates commute each other).
+ * '*qgate_inout' is updated to the last gate of the consecutive unitary gates.
+ */
+{
+  QGate*	qgate_first = (QGate*)(*qgate_inout);
+  QGate*	qgate	    = NULL;
+  QGate**	qgate_seg   = NULL; /* consecutive unitary gates (segment) */
+  QGate**	qgate_fused = NULL;
+  QBlock*	qblock	    = NULL;
+  int*		next	    = NULL; /* linked list of the remained gates */
+  char*		used	    = NULL; /* qubit is used by the block or not */
+  char*		blocked	    = NULL; /* qubit is used by the gates not fused or not */
+  int		seg_num	    = 0;
+  int		block_num   = 0;
+  int		qid_max	    = 0;
+  int		head, prev, cur, scan, add, qnum, knum, gate_num, q, i, j;
+
+  if ((qgate_first == NULL) || (fuse_num < 2) || (fuse_num > MAX_FUSION_QUBIT_NUM))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  /* segment of the consecutive unitary gates */
+  for (qgate = qgate_first; qgate != NULL; qgate = qgate->next) {
+    if ((kind_is_unitary(qgate->kind) == false) || (qgate->ctrl != qgate_first->ctrl) ||
+	(kind_is_multi_qubit(qgate->kind) == true)) break;
+    for (i=0; i<kind_get_qid_size(qgate->kind); i++) qid_max = MAX(qid_max, qgate->qid[i]);
+    seg_num++;
+  }
+  if (seg_num == 0) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  if (!(qgate_seg = (QGate**)malloc(sizeof(QGate*) * seg_num)))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(qgate_fused = (QGate**)malloc(sizeof(QGate*) * seg_num)))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(qblock = (QBlock*)malloc(sizeof(QBlock) * seg_num)))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(next = (int*)malloc(sizeof(int) * seg_num)))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(used = (char*)malloc(sizeof(char) * (qid_max + 1))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(blocked = (char*)malloc(sizeof(char) * (qid_max + 1))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+
+  qgate = qgate_first;
+  for (i=0; i<seg_num; i++) {
+    qgate_seg[i] = qgate;
+    next[i] = i + 1;
+    qgate = qgate->next;
+  }
+  next[seg_num - 1] = -1;
+
+  /* fusion */
+  head = 0;
+  while (head != -1) {
+
+    for (q=0; q<=qid_max; q++) { used[q] = 0; blocked[q] = 0; }
+    knum = 0;
+    gate_num = 0;
+
+    prev = -1;
+    cur = head;
+    scan = 0;
+    while ((cur != -1) && (scan < FUSION_LOOKAHEAD)) {
+      qgate = qgate_seg[cur];
+      qnum = kind_get_qid_size(qgate->kind);
+
+      /* can be fused or not */
+      add = 0;
+      for (i=0; i<qnum; i++) {
+	if (blocked[qgate->qid[i]] == 1) { add = fuse_num + 1; break; }
+	if (used[qgate->qid[i]] == 0) add++;
+      }
+
+      if (knum + add <= fuse_num) { /* fuse and remove from the list */
+	for (i=0; i<qnum; i++) {
+	  if (used[qgate->qid[i]] == 0) { used[qgate->qid[i]] = 1; knum++; }
+	}
+	qgate_fused[gate_num++] = qgate;
+	if (prev == -1) head = next[cur];
+	else next[prev] = next[cur];
+      }
+      else {
+	for (i=0; i<qnum; i++) blocked[qgate->qid[i]] = 1;
+	prev = cur;
+	scan++;
+      }
+      cur = next[cur];
+    }
+
+    /* set the block */
+    qblock[block_num].knum = knum;
+    for (q=0, j=0; q<=qid_max; q++) {
+      if (used[q] == 1) qblock[block_num].qid[j++] = q;
+    }
+    qblock[block_num].gate_num = gate_num;
+    qblock[block_num].U = NULL;
+    qblock[block_num].qgate = NULL;
+    if (!(qblock[block_num].fused = (QGate**)malloc(sizeof(QGate*) * gate_num)))
+      ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+    memcpy(qblock[block_num].fused, qgate_fused, sizeof(QGate*) * gate_num);
+    if (gate_num == 1) {
+      qblock[block_num].qgate = qgate_fused[0];
+    }
+    else if (!(qblock_set_matrix(&qblock[block_num], gbank))) {
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    }
+    block_num++;
+  }
+
+  *qgate_inout = qgate_seg[seg_num - 1];
+  *block_num_out = block_num;
+  *qblock_out = qblock;
+
+  free(qgate_seg); qgate_seg = NULL;
+  free(qgate_fused); qgate_fused = NULL;
+  free(next); next = NULL;
+  free(used); used = NULL;
+  free(blocked); blocked = NULL;
+
+  SUC_RETURN(true);
+}
+
+void qblock_free(QBlock* qblock, int block_num)
+{
+  int i;
+
+  if (qblock == NULL) return;
+
+  for (i=0; i<block_num; i++) {
+    if (qblock[i].U != NULL) {
+      free(qblock[i].U); qblock[i].U = NULL;
+    }
+    if (qblock[i].fused != NULL) {
+      free(qblock[i].fused); qblock[i].fused = NULL;
+    }
+  }
+  free(qblock);
+}
+
+void qgate_free(QGate* qgate)
+{
+  if (qgate == NULL) return;
+
+  if (qgate->qext != NULL) {
+    free(qgate->qext); qgate->qext = NULL;
+  }
+  free(qgate);
+}
+
 bool qgate_get_measurement_attributes(void** qgate_inout, GBank* gbank,
 				      int* mnum_out, int* qid_out, int* cid_out, bool* last_out)
 {
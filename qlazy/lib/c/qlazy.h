@@ -11,6 +11,10 @@
 #include <math.h>
 #include <time.h>
 #include <string.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <sys/stat.h>
+#include <sys/mman.h>
 #include <complex.h>
 
 #ifdef USE_LIBREADLINE
@@ -51,8 +55,21 @@
 #define DEF_QUBIT_NUM		5
 #define DEF_QC_STEPS		100
 #define DEF_QCIRC_DEPTH		100
-#define MAX_QUBIT_NUM		30	        /* max qubit number for state vector simulation */
+#define MAX_QUBIT_NUM		40	        /* max qubit number for state vector simulation (limited by memory) */
+#define MAX_GPU_QUBIT_NUM	30	        /* max qubit number for state vector simulation on gpu */
+#define MEMCHECK_QUBIT_NUM	24	        /* available memory is checked for the state of this qubit number or more */
 #define MAX_MPS_QUBIT_NUM	2048	        /* max qubit number for MPS simulation */
+#define DEF_FUSION_QUBIT_NUM	3	        /* default max qubit number of fused gate block */
+#define MAX_FUSION_QUBIT_NUM	5	        /* max qubit number of fused gate block */
+#define DEF_CACHE_QUBIT_NUM	16	        /* low-order qubit number of cache block (2^16 amplitudes) */
+#define MAX_QEXT_NUM	39	        /* max extra qubit number of multi-qubit gate (mcx,qft,iqft,mrz) */
+#define FT_TWIDDLE_LO_BITS	10	        /* twiddle factors of qft are tabulated for 2^10 low-order steps */
+#define MARGINAL_LOCAL_QUBIT_NUM	12	/* marginal probabilities of this qubit number or less are reduced per thread */
+#define SHOT_PARALLEL_QUBIT_NUM	16	        /* shots of the circuit with mid-circuit measurements are run in parallel for this qubit number or less */
+#define SHOT_PARALLEL_CHUNK_NUM	32	        /* max number of the chunks of shots run in parallel */
+#define SIMD_CHUNK_NUM		1024	        /* max amplitude number per call of the simd kernels */
+#define PAULI_SIGN_LO_BITS	10	        /* signs of the pauli rotation are tabulated for 2^10 low-order indices */
+#define PAULI_CONTIG_LO_BITS	4	        /* pauli rotation sweeps the contiguous pairs if X,Y are not on the 4 low-order bits */
 #define DEF_QLAZYINIT		"./.qlazyinit"
 
 #define DEF_SHOTS 100
@@ -186,6 +203,8 @@ typedef enum _ErrCode {
   ERROR_QCIRC_INIT,
   ERROR_QCIRC_APPEND_GATE,
   ERROR_QCIRC_DECOMPOSE,
+  ERROR_QPLAN_INIT,
+  ERROR_QPLAN_SET_PARAMS,
   ERROR_CMEM_INIT,
   ERROR_CMEM_COPY,
   ERROR_TAGTABLE_INIT,
@@ -209,6 +228,7 @@ typedef enum _ErrCode {
   ERROR_CANT_PRINT_GATES,
   ERROR_CANT_PRINT_HELP,
   ERROR_CANT_RESET,
+  ERROR_NOT_ENOUGH_MEMORY,
 } ErrCode;
 
 typedef enum _Kind {
@@ -259,6 +279,10 @@ typedef enum _Kind {
   ROTATION_YY    = 181,		/* symbol: 'ryy'        */
   ROTATION_ZZ    = 182,		/* symbol: 'rzz'        */
   SWAP_QUBITS	 = 190,		/* symbol: 'sw'         */
+  MULTI_CONTROLLED_X = 195,	/* symbol: 'mcx'        */
+  QFT_GATE	 = 196,		/* symbol: 'qft'        */
+  IQFT_GATE	 = 197,		/* symbol: 'iqft'       */
+  MULTI_ROTATION_Z = 198,	/* symbol: 'mrz'        */
   MEASURE	 = 200,	 	/* symbol: 'm'          */
   MEASURE_X	 = 201,	 	/* symbol: 'mx'         */
   MEASURE_Y	 = 202,	 	/* symbol: 'my'         */
@@ -293,7 +317,24 @@ typedef enum _MatrixType {
   POVM  = 2,
 } MatrixType;
 
+typedef enum _SimdLevel {
+  SIMD_SCALAR = 0,
+  SIMD_AVX2   = 1,
+  SIMD_AVX512 = 2,
+} SimdLevel;
+
+#ifdef SINGLE_PRECISION  /* build of libqlz_single.so (complex64 amplitudes) */
+#ifdef USE_GPU
+#error "SINGLE_PRECISION is not supported with USE_GPU"
+#endif
+typedef float _Complex COMPLEX;
+typedef float REAL;            /* type of the real (imaginary) part of COMPLEX */
+#else
 typedef double _Complex COMPLEX;
+typedef double REAL;
+#endif
+
+typedef long long INDEX;       /* index of the amplitudes (64-bit for more than 30 qubits) */
 
 typedef struct _ParaPhase {
   double	alpha;
@@ -324,6 +365,12 @@ typedef struct _CImage {
   char**	ch;
 } CImage;
 
+typedef struct _Rng {
+  unsigned long long	seed;	/* key of the counter-based generator (see random.c) */
+  unsigned long long	stream;	/* stream id (ex: shot, thread or process) */
+  unsigned long long	count;	/* number of the random numbers generated */
+} Rng;
+
 typedef struct _GBank {
   COMPLEX PauliX[4];
   COMPLEX PauliY[4];
@@ -372,6 +419,8 @@ typedef struct _TagTable {
 typedef struct _QGate {
   Kind			kind;            /* kind of qgate */
   int			qid[2];	         /* array of qubit id */
+  int			qext_num;        /* number of extra qubits (multi-qubit gate) */
+  int*			qext;            /* extra qubit ids (mcx: control qubits, qft/iqft/mrz: qubits preceding qid[0], NULL if qext_num = 0) */
   double		para[3];         /* array of gate parameters (phases, gphase, factor) */
   int			c;               /* classical register id for storing measurement result (0 or 1) */
   int			ctrl;            /* classical register id for controlling quantum gate */
@@ -380,6 +429,15 @@ typedef struct _QGate {
   struct _QGate*        next;
 } QGate;
 
+typedef struct _QBlock {
+  int			knum;                       /* number of qubits of the block */
+  int			qid[MAX_FUSION_QUBIT_NUM];  /* qubit id (ascending order) */
+  int			gate_num;                   /* number of fused gates */
+  QGate*		qgate;                      /* the gate (gate_num = 1) */
+  QGate**		fused;                      /* the fused gates (gate_num) */
+  COMPLEX*		U;                          /* block matrix (gate_num > 1) */
+} QBlock;
+
 typedef struct _QCirc {
   int	        qubit_num;
   int	        cmem_num;
@@ -389,14 +447,41 @@ typedef struct _QCirc {
   TagTable*     tag_table;
 } QCirc;
 
+typedef struct _QPlan {
+  int		qubit_num;	/* number of qubits of the circuit */
+  int		step_num;	/* number of steps */
+  QBlock*	step;		/* steps in the order of operation: fused blocks (U is set)
+				   and multi-qubit gates (knum = 0, U = NULL) */
+  int		slot_num;	/* number of slots (steps including the tagged gates) */
+  int*		slot;		/* step ids of the slots */
+  int		param_num;	/* number of the tagged gates */
+  QGate**	param_gate;	/* tagged gates */
+  int*		param_tag;	/* tag id of each tagged gate */
+  int*		param_slot;	/* slot id of each tagged gate */
+  int		tag_num;	/* number of tags */
+  double*	phase;		/* current phases of the tags */
+  QCirc*	qcirc;		/* copy of the circuit (the gates referred to by the steps) */
+  GBank*	gbank;		/* gate bank for the matrices */
+  bool		use_single;	/* single precision (complex64) or not */
+} QPlan;
+
 typedef struct _CMem {
   int	        cmem_num;
   BYTE*	        bit_array;
 } CMem;
 
+typedef struct _Noise {
+  int		chan_num;	/* number of noise channels */
+  int*		chan_kind;	/* kind of the gates after which each channel acts (-1: all the gates) */
+  int*		kraus_num;	/* number of kraus operators of each channel */
+  double*	kraus;		/* 2x2 kraus operators of the channels (real and imaginary parts, row-major) */
+  double*	prob;		/* probability of each kraus operator (-1.0: not a mixture of unitaries) */
+  double	readout[2];	/* probabilities of reading 1 for 0 and 0 for 1 */
+} Noise;
+
 typedef struct _QState {
   int		qubit_num;	/* number of qubits */
-  int		state_num;	/* number of quantum state (dim = 2^num) */
+  INDEX		state_num;	/* number of quantum state (dim = 2^num) */
   int           buf_id;         /* official buffer id (0: buffer_0, 1: buffer_1)*/
   COMPLEX*	camp;           /* complex amplitude of the quantum state (pointer to buffer #0 or #1) */
   COMPLEX*	buffer_0;       /* complex amplitude of the quantum state (buffer #0) */
@@ -412,7 +497,11 @@ typedef struct _QState {
   bool                  d_prob_updated; /* prob_array is updated or not */
 #endif
   GBank*        gbank;
+  Rng*          rng;            /* random number generator for the measurements of this qstate */
   bool          use_gpu;
+  bool          use_single;     /* amplitudes are single precision (libqlz_single.so) or not */
+  bool          mapped;         /* buffer_0 is a memory-mapped file (see qstate_init_with_file) or not */
+  bool          adopted;        /* buffer_0 is adopted from the caller (see qstate_init_with_buffer) or not */
 } QState;
 
 typedef struct _MData {
@@ -499,17 +588,19 @@ bool	 line_join_token(char* dst, char* token[], int ini, int fin);
 bool     line_remove_space(char* str);
 bool     is_number(char* str);
 bool     is_decimal(char* str);
-bool	 binstr_from_decimal(char* binstr, int qubit_num, int decimal, int zflag);
-int      bit_permutation(int bits_in, int qnum, int qnum_part, int* qid);
-int*     bit_permutation_array(int length, int qnum, int qnum_part, int* qid);
-bool     select_bits(int* bits_out, int bits_in, int digits_out, int digits_in, int* digit_array);
-bool     is_power_of_2(int n);
+bool	 binstr_from_decimal(char* binstr, int qubit_num, INDEX decimal, int zflag);
+INDEX    bit_permutation(INDEX bits_in, int qnum, int qnum_part, int* qid);
+INDEX*   bit_permutation_array(INDEX length, int qnum, int qnum_part, int* qid);
+bool     select_bits(INDEX* bits_out, INDEX bits_in, int digits_out, int digits_in, int* digit_array);
+bool     is_power_of_2(INDEX n);
+size_t   get_available_memory(void);
 int      kind_get_qid_size(Kind kind);
 int      kind_get_para_size(Kind kind);
 bool     kind_is_measurement(Kind kind);
 bool     kind_is_reset(Kind kind);
 bool     kind_is_unitary(Kind kind);
 bool     kind_is_controlled(Kind kind);
+bool     kind_is_multi_qubit(Kind kind);
 bool     is_gpu_supported_lib(void);
 bool     is_gpu_available(void);
 
@@ -541,11 +632,15 @@ bool     gbank_get_unitary(GBank* gbank, Kind kind, double para_phase, double pa
 
 /* qstate.c */
 bool	 qstate_init(int qubit_num, void** qstate_out, bool use_gpu);
-bool	 qstate_init_with_vector(double* real, double* imag, int dim, void** qstate_out,
+bool	 qstate_init_with_vector(double* real, double* imag, INDEX dim, void** qstate_out,
 				 bool use_gpu);
+bool	 qstate_init_with_file(int qubit_num, char* fname, bool load, void** qstate_out);
+bool	 qstate_init_with_buffer(void* buffer, INDEX dim, bool adopt, void** qstate_out);
+bool	 qstate_set_seed(QState* qstate, unsigned long long seed, unsigned long long stream);
 bool     qstate_normalize(QState* qstate);
 bool	 qstate_reset(QState* qstate, int qubit_num, int* qubit_id);
 bool	 qstate_copy(QState* qstate, void** qstate_out);
+bool	 qstate_sync(QState* qstate);
 bool     qstate_get_camp(QState* qstate, int qubit_num, int* qubit_id,
 			 void** camp_out);
 bool	 qstate_print(QState* qstate, int qubit_num, int* qubit_id, bool nonzero);
@@ -553,6 +648,8 @@ bool     qstate_bloch(QState* qstate, int qid, double* theta, double* phi);
 bool     qstate_print_bloch(QState* qstate, int qid);
 bool     qstate_measure(QState* qstate, int mnum, int* qid, char* measured_char,
 			bool measure_update);
+bool	 qstate_marginal_prob(QState* qstate, int mnum, int* qid, double* prob_out);
+bool	 qstate_sample(QState* qstate, int shots, int mnum, int* qid, INDEX* mval_out);
 bool	 qstate_measure_stats(QState* qstate, int shot_num, double angle, double phase,
 			      int qubit_num, int* qubit_id, void** mdata_out);
 bool     qstate_measure_bell_stats(QState* qstate, int shot_num, int qubit_num,
@@ -567,7 +664,18 @@ bool     qstate_expect_value(QState* qstate, ObservableBase* observ, double* val
 bool     qstate_apply_matrix(QState* qstate, int qnum, int* qid,
 			     double* real, double *imag, int row, int col);
 bool     qstate_operate_qcirc(QState* qstate, CMem* cmem, QCirc* qcirc, int shots,
-			      char* mchar_shots, bool out_state);
+			      char* mchar_shots, int* mchar_count, int* mchar_num,
+			      bool out_state, int fuse_num, int cache_num, bool relabel);
+bool     qstate_operate_qcirc_noise(QState* qstate, CMem* cmem, QCirc* qcirc, int shots,
+				    char* mchar_shots, int* mchar_count, int* mchar_num,
+				    int chan_num, int* chan_kind, int* kraus_num, double* kraus,
+				    double* prob, double* readout);
+bool     qstate_operate_qcirc_batch(QState* qstate, QCirc* qcirc, int batch_num, int tag_num,
+				    char* tag_buf, double* phase, int fuse_num, int cache_num,
+				    bool relabel, void** qstate_out);
+bool     qstate_operate_qplan(QState* qstate, QPlan* qplan, int cache_num, bool relabel);
+bool     qstate_gradient(QState* qstate, QCirc* qcirc, ObservableBase* observ, int tag_num,
+			 char* tag_buf, int fuse_num, int cache_num, bool relabel, double* grad);
 void	 qstate_free(QState* qstate);
 
 /* mdata.c */
@@ -631,6 +739,11 @@ void	stabilizer_free(Stabilizer* stab);
 /* qgate.c */
 bool qgate_get_next_unitary(void** qgate_inout, GBank* gbank, int* dim, int* q0, int* q1,
 			    void** matrix_out, bool* compo);
+bool qgate_get_next_fused_blocks(void** qgate_inout, GBank* gbank, int fuse_num,
+				 int* block_num_out, void** qblock_out);
+bool qblock_set_matrix(QBlock* qblock, GBank* gbank);
+void qblock_free(QBlock* qblock, int block_num);
+void qgate_free(QGate* qgate);
 bool qgate_get_measurement_attributes(void** qgate_inout, GBank* gbank,
 				      int* mnum_out, int* qid_out, int* cid_out, bool* last_out);
 
@@ -644,8 +757,10 @@ bool qcirc_is_unitary_only(QCirc* qcirc, bool* ans);
 bool qcirc_is_measurement_only(QCirc* qcirc, bool* ans);
 bool qcirc_kind_first(QCirc* qcirc, Kind* kind);
 bool qcirc_append_gate(QCirc* qcirc, Kind kind, int* qid, double* para, int c, int ctrl, char* tag);
-bool qcirc_pop_gate(QCirc* qcirc, Kind* kind, int* qid, double* para, int* c, int* ctrl,
-		    char* tag, int* taglen);
+bool qcirc_append_mqgate(QCirc* qcirc, Kind kind, int* qid, int qext_num, int* qext,
+			 double* para, int ctrl, char* tag);
+bool qcirc_pop_gate(QCirc* qcirc, Kind* kind, int* qid, int* qext_num, int* qext,
+		    double* para, int* c, int* ctrl, char* tag, int* taglen);
 bool qcirc_decompose(QCirc* qcirc_in, void** qcirc_uonly_out, void** qcirc_mixed_out,
 		     void** qcirc_monly_out);
 bool qcirc_set_tag_phase(QCirc* qcirc, char* tag, double phase);
@@ -655,6 +770,11 @@ bool qcirc_get_tag_buf(QCirc* qcirc, char* tag_buf);
 bool qcirc_update_phases(QCirc* qcirc);
 void qcirc_free(QCirc* qcirc);
 
+/* qplan.c */
+bool qplan_init(QCirc* qcirc, int fuse_num, int tag_num, char* tag_buf, void** qplan_out);
+bool qplan_set_params(QPlan* qplan, double* phase);
+void qplan_free(QPlan* qplan);
+
 /* cmem.c */
 bool cmem_init(int cmem_num, void** cmem_out);
 bool cmem_copy(CMem* cmem_in, void** cmem_out);
@@ -671,6 +791,18 @@ double genrand_real1(void);
 double genrand_real2(void);
 double genrand_real3(void);
 double genrand_res53(void);
+void rng_init(Rng* rng, unsigned long long seed, unsigned long long stream);
+void rng_split(Rng* rng, Rng* rng_out);
+unsigned long long rng_uint64(Rng* rng);
+double rng_real1(Rng* rng);
+double rng_real2(Rng* rng);
+double rng_real3(Rng* rng);
+
+/* simd.c */
+SimdLevel simd_level(void);
+int  simd_lane_num(void);
+void simd_unitary_k(COMPLEX* a, INDEX* offset, int size, COMPLEX* U, int len);
+void simd_scale(COMPLEX* a, COMPLEX d, int len);
 
 /* tagtable.c */
 bool tagtable_init(int table_size, void** tt_out);
@@ -0,0 +1,295 @@
+/*
+ *  qplan.c
+ */
+
+#include "qlazy.h"
+
+static int _tag_index(char* tag, int tag_num, char** tags)
+{
+  int	t;
+
+  if (strlen(tag) == 0) return -1;
+  for (t=0; t<tag_num; t++) {
+    if (strcmp(tag, tags[t]) == 0) return t;
+  }
+  return -1;
+}
+
+static bool _qplan_set_matrix(QPlan* qplan, QBlock* qblock)
+/* set the matrix of the block (a single gate or the fused gates) */
+{
+  QGate*	qgate = qblock->qgate;
+  int		dim   = 0;
+
+  if (qblock->U != NULL) {
+    free(qblock->U); qblock->U = NULL;
+  }
+
+  if (qblock->gate_num == 1) {
+    if (!(gbank_get_unitary(qplan->gbank, qgate->kind, qgate->para[0], qgate->para[1],
+			    qgate->para[2], &dim, (void**)&qblock->U)))
+      ERR_RETURN(ERROR_GBANK_GET_UNITARY, false);
+  }
+  else {
+    if (!(qblock_set_matrix(qblock, qplan->gbank)))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
+
+  SUC_RETURN(true);
+}
+
+static bool _qplan_append_step(QPlan* qplan, QBlock* qblock, int* step_max)
+/* append the step (the block is moved to the plan) */
+{
+  if (qplan->step_num == *step_max) {
+    *step_max = MAX(2 * (*step_max), 16);
+    if (!(qplan->step = (QBlock*)realloc(qplan->step, sizeof(QBlock) * (*step_max))))
+      ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  }
+  qplan->step[qplan->step_num++] = *qblock;
+
+  SUC_RETURN(true);
+}
+
+static bool _qplan_set_steps(QPlan* qplan, int fuse_num)
+/* steps of the circuit (the gates are fused into the blocks if fuse_num >= 2) */
+{
+  QGate*	qgate	  = qplan->qcirc->first;
+  QBlock*	qblock	  = NULL;
+  QBlock	step;
+  int		step_max  = 0;
+  int		block_num = 0;
+  int		i;
+
+  while (qgate != NULL) {
+
+    if (kind_is_multi_qubit(qgate->kind) == true) { /* operated natively */
+      step.knum = 0;
+      step.gate_num = 1;
+      step.qgate = qgate;
+      step.fused = NULL;
+      step.U = NULL;
+      if (!(_qplan_append_step(qplan, &step, &step_max)))
+	ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+    }
+
+    else if (fuse_num >= 2) { /* fused blocks of the consecutive unitary gates */
+      if (!(qgate_get_next_fused_blocks((void**)&qgate, qplan->gbank, fuse_num, &block_num,
+					(void**)&qblock)))
+	ERR_RETURN(ERROR_QGATE_GET_NEXT_UNITARY, false);
+      for (i=0; i<block_num; i++) {
+	if ((qblock[i].gate_num == 1) && !(_qplan_set_matrix(qplan, &qblock[i])))
+	  ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+	if (!(_qplan_append_step(qplan, &qblock[i], &step_max)))
+	  ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+      }
+      free(qblock); qblock = NULL; /* the matrices and the fused gates are owned by the steps */
+    }
+
+    else { /* a block of the gate */
+      step.knum = kind_get_qid_size(qgate->kind);
+      step.qid[0] = (step.knum == 2) ? MIN(qgate->qid[0], qgate->qid[1]) : qgate->qid[0];
+      step.qid[1] = (step.knum == 2) ? MAX(qgate->qid[0], qgate->qid[1]) : -1;
+      step.gate_num = 1;
+      step.qgate = qgate;
+      step.U = NULL;
+      if (!(step.fused = (QGate**)malloc(sizeof(QGate*))))
+	ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+      step.fused[0] = qgate;
+      if (!(_qplan_set_matrix(qplan, &step)))
+	ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+      if (!(_qplan_append_step(qplan, &step, &step_max)))
+	ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+    }
+
+    qgate = qgate->next;
+  }
+
+  SUC_RETURN(true);
+}
+
+static bool _qplan_set_slots(QPlan* qplan, char** tags)
+/* slots (steps including the tagged gates) and the tagged gates */
+{
+  QBlock*	step = NULL;
+  QGate*	qgate = NULL;
+  int		gate_num;
+  int		s, k, t;
+
+  if (!(qplan->slot = (int*)malloc(sizeof(int) * (qplan->step_num + 1))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(qplan->param_gate = (QGate**)malloc(sizeof(QGate*) * (qplan->qcirc->gate_num + 1))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(qplan->param_tag = (int*)malloc(sizeof(int) * (qplan->qcirc->gate_num + 1))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(qplan->param_slot = (int*)malloc(sizeof(int) * (qplan->qcirc->gate_num + 1))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+
+  for (s=0; s<qplan->step_num; s++) {
+    step = &qplan->step[s];
+    gate_num = (step->fused == NULL) ? 1 : step->gate_num;
+    for (k=0; k<gate_num; k++) {
+      qgate = (step->fused == NULL) ? step->qgate : step->fused[k];
+      if ((t = _tag_index(qgate->tag, qplan->tag_num, tags)) < 0) continue;
+      if ((qplan->slot_num == 0) || (qplan->slot[qplan->slot_num - 1] != s)) {
+	qplan->slot[qplan->slot_num++] = s;
+      }
+      qplan->param_gate[qplan->param_num] = qgate;
+      qplan->param_tag[qplan->param_num] = t;
+      qplan->param_slot[qplan->param_num] = qplan->slot_num - 1;
+      qplan->param_num++;
+    }
+  }
+
+  SUC_RETURN(true);
+}
+
+bool qplan_init(QCirc* qcirc, int fuse_num, int tag_num, char* tag_buf, void** qplan_out)
+/*
+ * compile the unitary circuit into the plan, a flat array of the steps: the gates are
+ * fused into the blocks acting on 'fuse_num' qubits or less (a block for each gate if
+ * fuse_num < 2) and the matrices of all the blocks are computed once, so the plan is
+ * operated many times without decomposing the circuit and building the matrices.
+ * the steps including the gates tagged tags[t] (tags: 'tag_num' null-terminated strings
+ * in tag_buf) are the slots, whose matrices are only updated by qplan_set_params.
+ */
+{
+  QPlan*	qplan = NULL;
+  QGate*	qgate = NULL;
+  char**	tags  = NULL;
+  int		t;
+
+  if ((qcirc == NULL) || (qplan_out == NULL) || (fuse_num > MAX_FUSION_QUBIT_NUM) ||
+      (tag_num < 0) || ((tag_num > 0) && (tag_buf == NULL)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  /* unitary gates only */
+  for (qgate = qcirc->first; qgate != NULL; qgate = qgate->next) {
+    if ((kind_is_unitary(qgate->kind) == false) || (qgate->ctrl != -1))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
+
+  if (!(qplan = (QPlan*)malloc(sizeof(QPlan))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+
+  qplan->qubit_num = qcirc->qubit_num;
+  qplan->step_num = 0;
+  qplan->step = NULL;
+  qplan->slot_num = 0;
+  qplan->slot = NULL;
+  qplan->param_num = 0;
+  qplan->param_gate = NULL;
+  qplan->param_tag = NULL;
+  qplan->param_slot = NULL;
+  qplan->tag_num = tag_num;
+  qplan->phase = NULL;
+  qplan->qcirc = NULL;
+  qplan->gbank = NULL;
+#ifdef SINGLE_PRECISION
+  qplan->use_single = true;
+#else
+  qplan->use_single = false;
+#endif
+
+  if (!(qcirc_copy(qcirc, (void**)&qplan->qcirc)))
+    ERR_RETURN(ERROR_QCIRC_INIT, false);
+  if (!(gbank_init((void**)&qplan->gbank)))
+    ERR_RETURN(ERROR_GBANK_INIT, false);
+
+  /* tags and the current phases */
+  if (!(tags = (char**)malloc(sizeof(char*) * (tag_num + 1))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(qplan->phase = (double*)malloc(sizeof(double) * (tag_num + 1))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  for (t=0; t<tag_num; t++) {
+    tags[t] = tag_buf;
+    tag_buf += strlen(tag_buf) + 1;
+    if (!(tagtable_get_phase(qplan->qcirc->tag_table, tags[t], &qplan->phase[t])))
+      ERR_RETURN(ERROR_TAGTABLE_GET_PHASE, false);
+  }
+
+  if (!(_qplan_set_steps(qplan, fuse_num)))
+    ERR_RETURN(ERROR_QPLAN_INIT, false);
+  if (!(_qplan_set_slots(qplan, tags)))
+    ERR_RETURN(ERROR_QPLAN_INIT, false);
+
+  free(tags); tags = NULL;
+
+  *qplan_out = qplan;
+
+  SUC_RETURN(true);
+}
+
+bool qplan_set_params(QPlan* qplan, double* phase)
+/*
+ * set the phases of the tags (phase[t]: phase of the tag t), where only the matrices
+ * of the slots including the gates with the changed phases are updated
+ */
+{
+  char*		changed = NULL;
+  char*		dirty	= NULL;
+  QBlock*	step	= NULL;
+  int		p, s, t;
+
+  if ((qplan == NULL) || ((qplan->tag_num > 0) && (phase == NULL)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  if (!(changed = (char*)malloc(sizeof(char) * (qplan->tag_num + 1))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(dirty = (char*)malloc(sizeof(char) * (qplan->slot_num + 1))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+
+  for (t=0; t<qplan->tag_num; t++) {
+    changed[t] = (phase[t] != qplan->phase[t]);
+    qplan->phase[t] = phase[t];
+  }
+  for (s=0; s<qplan->slot_num; s++) dirty[s] = 0;
+
+  /* patch the phases of the tagged gates */
+  for (p=0; p<qplan->param_num; p++) {
+    t = qplan->param_tag[p];
+    if (changed[t] == 0) continue;
+    qplan->param_gate[p]->para[0] = phase[t];
+    dirty[qplan->param_slot[p]] = 1;
+  }
+
+  /* update the matrices of the slots (the multi-qubit gates refer to the phase) */
+  for (s=0; s<qplan->slot_num; s++) {
+    step = &qplan->step[qplan->slot[s]];
+    if ((dirty[s] == 0) || (step->knum == 0)) continue;
+    if (!(_qplan_set_matrix(qplan, step)))
+      ERR_RETURN(ERROR_QPLAN_SET_PARAMS, false);
+  }
+
+  free(changed); changed = NULL;
+  free(dirty); dirty = NULL;
+
+  SUC_RETURN(true);
+}
+
+void qplan_free(QPlan* qplan)
+{
+  if (qplan == NULL) return;
+
+  qblock_free(qplan->step, qplan->step_num); qplan->step = NULL;
+  if (qplan->slot != NULL) {
+    free(qplan->slot); qplan->slot = NULL;
+  }
+  if (qplan->param_gate != NULL) {
+    free(qplan->param_gate); qplan->param_gate = NULL;
+  }
+  if (qplan->param_tag != NULL) {
+    free(qplan->param_tag); qplan->param_tag = NULL;
+  }
+  if (qplan->param_slot != NULL) {
+    free(qplan->param_slot); qplan->param_slot = NULL;
+  }
+  if (qplan->phase != NULL) {
+    free(qplan->phase); qplan->phase = NULL;
+  }
+  qcirc_free(qplan->qcirc); qplan->qcirc = NULL;
+  if (qplan->gbank != NULL) {
+    free(qplan->gbank); qplan->gbank = NULL;
+  }
+  free(qplan);
+}
@@ -6,14 +6,16 @@
 #include "qlazy.h"
 
 #define METHOD_0
+#define IN_PLACE  /* operate gates in place (buffer_1 is not allocated) */
 
 static void _qstate_set_none(QState* qstate)
 {
-  int i;
+  INDEX i;
   
   for (i=0; i<qstate->state_num; i++) {
     qstate->buffer_0[i] = 0.0 + 0.0 * COMP_I;
   }
+  if (qstate->buffer_1 == NULL) return;
   for (i=0; i<qstate->state_num; i++) {
     qstate->buffer_1[i] = 0.0 + 0.0 * COMP_I;
   }
@@ -21,7 +23,7 @@ static void _qstate_set_none(QState* qstate)
 
 static void _qstate_set_0(QState* qstate)
 {
-  int i;
+  INDEX i;
   
   for (i=0; i<qstate->state_num; i++) {
     qstate->camp[i] = 0.0 + 0.0 * COMP_I;
@@ -32,7 +34,7 @@ static void _qstate_set_0(QState* qstate)
 bool qstate_normalize(QState* qstate)
 {
   double	norm = 0.0;
-  int		i;
+  INDEX		i;
   
   if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
 
@@ -112,8 +114,8 @@ static QState* _qstate_pickup(QState* qstate_in, int qubit_num, int* qubit_id)
 {
   QState*	qstate	    = NULL;
   QState*	mask_qstate = NULL;
-  int		x;
-  int		i;
+  INDEX		x;
+  INDEX		i;
 
   if (!(mask_qstate = _qstate_mask(qstate_in, qubit_num, qubit_id)))
     ERR_RETURN(ERROR_INVALID_ARGUMENT,NULL);
@@ -140,7 +142,7 @@ static QState* _qstate_pickup(QState* qstate_in, int qubit_num, int* qubit_id)
 static bool _qstate_remove_phase_factor(QState* qstate, COMPLEX* phase_factor)
 {
   COMPLEX	exp_i_phase = 1.0 + 0.0 * COMP_I;
-  int		i;
+  INDEX		i;
 
   if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
 
@@ -222,39 +224,88 @@ static bool _bloch_get_angle(COMPLEX alpha, COMPLEX beta, double* theta, double*
   SUC_RETURN(true);
 }
 
-bool _qstate_init_cpu(int qubit_num, void** qstate_out)
+static bool _qstate_init_cpu_with_buffer(int qubit_num, COMPLEX* buffer, bool mapped, void** qstate_out)
+/*
+ * qstate with the amplitude buffer (allocated if buffer is NULL, the amplitudes are not set).
+ * the given buffer is a memory-mapped file if mapped, otherwise it is adopted from the caller
+ * (both are not freed by qstate_free).
+ */
 {
   QState	*qstate = NULL;
-  int		 state_num;
+  INDEX		 state_num = (INDEX)1 << qubit_num;
 
-  if ((qubit_num < 1) || (qubit_num > MAX_QUBIT_NUM))
-    ERR_RETURN(ERROR_OUT_OF_BOUND,false);
-  
   if (!(qstate = (QState*)malloc(sizeof(QState))))
     ERR_RETURN(ERROR_CANT_ALLOC_MEMORY,false);
 
   qstate->qubit_num = qubit_num;
-  state_num = (1 << qubit_num);
   qstate->state_num = state_num;
 
   qstate->buf_id = 0;
 
-  if (!(qstate->buffer_0 = (COMPLEX*)malloc(sizeof(COMPLEX)*state_num)))
-    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY,false);
+  if (buffer != NULL) {
+    qstate->buffer_0 = buffer;
+    qstate->mapped = mapped;
+    qstate->adopted = !mapped;
+  }
+  else {
+    if (!(qstate->buffer_0 = (COMPLEX*)malloc(sizeof(COMPLEX)*state_num)))
+      ERR_RETURN(ERROR_CANT_ALLOC_MEMORY,false);
+    qstate->mapped = false;
+    qstate->adopted = false;
+  }
 
+#ifdef IN_PLACE
+  qstate->buffer_1 = NULL;
+#else
   if (!(qstate->buffer_1 = (COMPLEX*)malloc(sizeof(COMPLEX)*state_num)))
     ERR_RETURN(ERROR_CANT_ALLOC_MEMORY,false);
+#endif
 
   qstate->camp = qstate->buffer_0;
 
-  if (!(qstate->prob_array = (double*)malloc(sizeof(double) * state_num)))
-    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY,false);
+  /* prob_array is allocated when it is needed (see _qstate_update_prob_array) */
+  qstate->prob_array = NULL;
   qstate->prob_updated = false;
 
   if (!(gbank_init((void**)&(qstate->gbank))))
       ERR_RETURN(ERROR_GBANK_INIT,false);
 
+  /* seeded from the global generator (see qstate_set_seed) */
+  if (!(qstate->rng = (Rng*)malloc(sizeof(Rng))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY,false);
+  rng_init(qstate->rng, ((unsigned long long)genrand_int32() << 32) | genrand_int32(), 0);
+
   qstate->use_gpu = false;
+#ifdef SINGLE_PRECISION
+  qstate->use_single = true;
+#else
+  qstate->use_single = false;
+#endif
+
+  *qstate_out = qstate;
+  
+  SUC_RETURN(true);
+}
+
+bool _qstate_init_cpu(int qubit_num, void** qstate_out)
+{
+  QState	*qstate = NULL;
+  INDEX		 state_num;
+  size_t	 avail_mem;
+
+  if ((qubit_num < 1) || (qubit_num > MAX_QUBIT_NUM))
+    ERR_RETURN(ERROR_OUT_OF_BOUND,false);
+
+  /* the number of qubits is limited by the memory for the amplitudes */
+  state_num = (INDEX)1 << qubit_num;
+  if (qubit_num >= MEMCHECK_QUBIT_NUM) {
+    avail_mem = get_available_memory();
+    if ((avail_mem > 0) && (sizeof(COMPLEX) * (size_t)state_num > avail_mem))
+      ERR_RETURN(ERROR_NOT_ENOUGH_MEMORY,false);
+  }
+
+  if (!(_qstate_init_cpu_with_buffer(qubit_num, NULL, false, (void**)&qstate)))
+    ERR_RETURN(ERROR_QSTATE_INIT,false);
 
   _qstate_set_0(qstate);
 
@@ -263,6 +314,123 @@ bool _qstate_init_cpu(int qubit_num, void** qstate_out)
   SUC_RETURN(true);
 }
 
+bool qstate_init_with_file(int qubit_num, char* fname, bool load, void** qstate_out)
+/*
+ * initialize the qstate whose amplitudes are kept in the memory-mapped file 'fname'
+ * (raw array of 2^qubit_num COMPLEX, shared with the other processes mapping the file).
+ * if load, the amplitudes of the existing file are used as they are (qubit_num is
+ * deduced from the file size if qubit_num = 0), otherwise the file is created as |0..0>.
+ * the state larger than the memory is paged in and out by the kernel, and the gates
+ * sweep the mapping sequentially.
+ */
+{
+  QState*	qstate = NULL;
+  COMPLEX*	buffer = NULL;
+  struct stat	st;
+  size_t	size   = 0;
+  int		fd     = -1;
+
+  if ((fname == NULL) || (qubit_num < 0) || (qubit_num > MAX_QUBIT_NUM) ||
+      ((load == false) && (qubit_num < 1)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+  if (load == true) {
+    if ((fd = open(fname, O_RDWR)) < 0) ERR_RETURN(ERROR_CANT_OPEN_FILE,false);
+    if (fstat(fd, &st) != 0) {
+      close(fd);
+      ERR_RETURN(ERROR_CANT_OPEN_FILE,false);
+    }
+    size = (size_t)st.st_size;
+    if (qubit_num == 0) {
+      while ((qubit_num < MAX_QUBIT_NUM) && ((sizeof(COMPLEX) << qubit_num) < size)) qubit_num++;
+    }
+    if ((qubit_num < 1) || ((sizeof(COMPLEX) << qubit_num) != size)) {
+      close(fd);
+      ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+    }
+  }
+  else {
+    size = sizeof(COMPLEX) << qubit_num;
+    if ((fd = open(fname, O_RDWR | O_CREAT | O_TRUNC, 0644)) < 0)
+      ERR_RETURN(ERROR_CANT_OPEN_FILE,false);
+    if (posix_fallocate(fd, 0, (off_t)size) != 0) { /* zero filled (or not enough space) */
+      close(fd);
+      ERR_RETURN(ERROR_CANT_WRITE_FILE,false);
+    }
+  }
+
+  buffer = (COMPLEX*)mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+  close(fd);
+  if (buffer == MAP_FAILED) ERR_RETURN(ERROR_CANT_ALLOC_MEMORY,false);
+  madvise(buffer, size, MADV_SEQUENTIAL);
+
+  if (!(_qstate_init_cpu_with_buffer(qubit_num, buffer, true, (void**)&qstate))) {
+    munmap(buffer, size);
+    ERR_RETURN(ERROR_QSTATE_INIT,false);
+  }
+
+  /* the new file is zero filled, so only the amplitude of |0..0> is set */
+  if (load == false) qstate->camp[0] = 1.0 + 0.0 * COMP_I;
+
+  *qstate_out = qstate;
+
+  SUC_RETURN(true);
+}
+
+bool qstate_init_with_buffer(void* buffer, INDEX dim, bool adopt, void** qstate_out)
+/*
+ * initialize the qstate with the raw array of dim COMPLEX (ex: numpy.ndarray).
+ * if adopt, the array is used as the amplitudes as it is (not copied and not freed,
+ * the caller must keep it while the qstate is alive), otherwise it is copied at once.
+ */
+{
+  QState*	qstate	  = NULL;
+  int		qubit_num = 0;
+
+  if ((buffer == NULL) || (dim <= 1) || (!(is_power_of_2(dim))))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+  while (((INDEX)1 << qubit_num) < dim) qubit_num++;
+  if (qubit_num > MAX_QUBIT_NUM) ERR_RETURN(ERROR_OUT_OF_BOUND,false);
+
+  if (adopt == true) {
+    if (!(_qstate_init_cpu_with_buffer(qubit_num, (COMPLEX*)buffer, false, (void**)&qstate)))
+      ERR_RETURN(ERROR_QSTATE_INIT,false);
+  }
+  else {
+    if (!(_qstate_init_cpu_with_buffer(qubit_num, NULL, false, (void**)&qstate)))
+      ERR_RETURN(ERROR_QSTATE_INIT,false);
+    memcpy(qstate->camp, buffer, sizeof(COMPLEX) * (size_t)dim);
+  }
+
+  *qstate_out = qstate;
+
+  SUC_RETURN(true);
+}
+
+bool qstate_set_seed(QState* qstate, unsigned long long seed, unsigned long long stream)
+/* set the seed and the stream of the random number generator of the qstate */
+{
+  if ((qstate == NULL) || (qstate->rng == NULL)) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+  rng_init(qstate->rng, seed, stream);
+
+  SUC_RETURN(true);
+}
+
+bool qstate_sync(QState* qstate)
+/* write the amplitudes of the memory-mapped qstate back to the file (nothing if not mapped) */
+{
+  if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+  if (qstate->mapped == true) {
+    if (msync(qstate->buffer_0, sizeof(COMPLEX) * (size_t)qstate->state_num, MS_SYNC) != 0)
+      ERR_RETURN(ERROR_CANT_WRITE_FILE,false);
+  }
+
+  SUC_RETURN(true);
+}
+
 bool qstate_init(int qubit_num, void** qstate_out, bool use_gpu)
 {
   QState	*qstate = NULL;
@@ -290,12 +458,12 @@ bool qstate_init(int qubit_num, void** qstate_out, bool use_gpu)
   SUC_RETURN(true);
 }
 
-bool qstate_init_with_vector(double* real, double* imag, int dim, void** qstate_out, bool use_gpu)
+bool qstate_init_with_vector(double* real, double* imag, INDEX dim, void** qstate_out, bool use_gpu)
 {
   QState	*qstate	   = NULL;
-  int            state_num = dim;
+  INDEX          state_num = dim;
   int		 qubit_num;
-  int		 i;
+  INDEX		 i;
 
   if ((real == NULL) || (imag == NULL) || (dim <= 0) || (!(is_power_of_2(dim))))
     ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
@@ -329,6 +497,9 @@ static bool _qstate_copy_host_memory(QState* qstate_in, void** qstate_out)
 
   memcpy(qstate->camp, qstate_in->camp, sizeof(COMPLEX)*qstate_in->state_num);
 
+  /* the copy has the independent generator split from the original */
+  rng_split(qstate_in->rng, qstate->rng);
+
   *qstate_out = qstate;
 
   SUC_RETURN(true);
@@ -361,11 +532,11 @@ bool qstate_copy(QState* qstate_in, void** qstate_out)
 
 bool qstate_reset(QState* qstate_in, int qubit_num, int* qubit_id)
 {
-  QState*	qstate = NULL;
-  int		mask   = 0;
+  INDEX		mask   = 0;
   int           shift  = 0;
-  int           idx    = 0;
-  int		i,k;
+  INDEX         idx    = 0;
+  INDEX		i;
+  int		k;
   
   if (qstate_in == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
 
@@ -374,28 +545,26 @@ bool qstate_reset(QState* qstate_in, int qubit_num, int* qubit_id)
     ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY,false);
 #endif
 
-  /* copy to temporary qstate */
-  if (!(_qstate_copy_host_memory(qstate_in, (void**)&qstate)))
-    ERR_RETURN(ERROR_QSTATE_COPY,false);
-
   /* make mask */
-  mask = (1 << qstate_in->qubit_num) - 1;
+  mask = ((INDEX)1 << qstate_in->qubit_num) - 1;
   for (k=0; k<qubit_num; k++) {
     shift = qstate_in->qubit_num - qubit_id[k] - 1;
-    mask = mask ^ (1 << shift);
+    mask = mask ^ ((INDEX)1 << shift);
   }
 
   /* apply mask operation to qubit index (= reset |0>) */
-  for (i=0; i<qstate_in->state_num; i++) {
-    qstate_in->camp[i] = 0.0;
-  }
   if (qubit_num == qstate_in->qubit_num) {
+    for (i=0; i<qstate_in->state_num; i++) {
+      qstate_in->camp[i] = 0.0;
+    }
     qstate_in->camp[0] = 1.0;
   }
-  else {
-    for (i=0; i<qstate->state_num; i++) {
+  else { /* in place (idx <= i, and camp[idx] with idx == i is not cleared) */
+    for (i=0; i<qstate_in->state_num; i++) {
       idx = i & mask;
-      qstate_in->camp[idx] += qstate->camp[i];
+      if (idx == i) continue;
+      qstate_in->camp[idx] += qstate_in->camp[i];
+      qstate_in->camp[i] = 0.0;
     }
   }
 
@@ -403,16 +572,13 @@ bool qstate_reset(QState* qstate_in, int qubit_num, int* qubit_id)
   if (!(qstate_normalize(qstate_in)))
     ERR_RETURN(ERROR_INVALID_ARGUMENT,NULL);
 
-  qstate->prob_updated = false;
+  qstate_in->prob_updated = false;
   
 #ifdef USE_GPU
   if (!(qstate_update_device_memory(qstate_in)))
     ERR_RETURN(ERROR_QSTATE_UPDATE_DEVICE_MEMORY,false);
 #endif
   
-  /* free temporary qstate */
-  qstate_free(qstate); qstate = NULL;
-  
   SUC_RETURN(true);
 }
 
@@ -421,7 +587,7 @@ bool qstate_get_camp(QState* qstate, int qubit_num, int* qubit_id,
 {
   QState*	mask_qstate = NULL;
   double*	camp	    = NULL;
-  int		i;
+  INDEX		i;
 
   if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
 
@@ -453,7 +619,8 @@ bool qstate_print(QState* qstate_in, int qubit_num, int* qubit_id, bool nonzero)
   double	qreal,qimag,prob;
   int		prob_level = 0;
   char		state[MAX_QUBIT_NUM+1];
-  int		i,k;
+  INDEX		i;
+  int		k;
 
   /* for extracting phase factor */
 #ifdef REMOVE_PHASE_FACTOR
@@ -571,13 +738,18 @@ bool qstate_print_bloch(QState* qstate, int qid)
   SUC_RETURN(true);
 }
 
+/* index of the 'k'-th element with bit 'b' = 0 */
+#define INSERT_ZERO_BIT(k, b) ((((k) >> (b)) << ((b) + 1)) | ((k) & (((INDEX)1 << (b)) - 1)))
+
+#ifndef IN_PLACE
+
 #ifdef METHOD_0
 
 static bool _qstate_operate_unitary2(COMPLEX* camp_out, COMPLEX* camp_in, COMPLEX* U2,
-				     int qubit_num, int state_num, int n)
+				     int qubit_num, INDEX state_num, int n)
 {
   int		nn   = qubit_num - n - 1;
-  int		i;
+  INDEX		i;
   COMPLEX	u_00 = U2[IDX2(0,0)];
   COMPLEX	u_01 = U2[IDX2(0,1)];
   COMPLEX	u_10 = U2[IDX2(1,0)];
@@ -588,11 +760,11 @@ static bool _qstate_operate_unitary2(COMPLEX* camp_out, COMPLEX* camp_in, COMPLE
     if ((i >> nn) %2 == 0) {
       camp_out[i]
 	= u_00 * camp_in[i]
-	+ u_01 * camp_in[i + (1 << nn)];
+	+ u_01 * camp_in[i + ((INDEX)1 << nn)];
     }
     else {
       camp_out[i]
-	= u_10 * camp_in[i - (1 << nn)]
+	= u_10 * camp_in[i - ((INDEX)1 << nn)]
 	+ u_11 * camp_in[i];
     }
   }
@@ -601,11 +773,11 @@ static bool _qstate_operate_unitary2(COMPLEX* camp_out, COMPLEX* camp_in, COMPLE
 }
 
 static bool _qstate_operate_unitary4(COMPLEX* camp_out, COMPLEX* camp_in, COMPLEX* U4,
-				     int qubit_num, int state_num, int m, int n)
+				     int qubit_num, INDEX state_num, int m, int n)
 {
   int		mm   = qubit_num - m - 1;
   int		nn   = qubit_num - n - 1;
-  int		i;
+  INDEX		i;
   COMPLEX	u_00 = U4[IDX4(0,0)];
   COMPLEX	u_01 = U4[IDX4(0,1)];
   COMPLEX	u_02 = U4[IDX4(0,2)];
@@ -628,29 +800,29 @@ static bool _qstate_operate_unitary4(COMPLEX* camp_out, COMPLEX* camp_in, COMPLE
     if (((i >> mm) % 2 == 0) && ((i >> nn) % 2 == 0)) {
       camp_out[i]
 	= u_00 * camp_in[i]
-	+ u_01 * camp_in[i + (1 << nn)]
-	+ u_02 * camp_in[i + (1 << mm)]
-	+ u_03 * camp_in[i + (1 << nn) + (1 << mm)];
+	+ u_01 * camp_in[i + ((INDEX)1 << nn)]
+	+ u_02 * camp_in[i + ((INDEX)1 << mm)]
+	+ u_03 * camp_in[i + ((INDEX)1 << nn) + ((INDEX)1 << mm)];
     }
     else if (((i >> mm) % 2 == 0) && ((i >> nn) % 2 == 1)) {
       camp_out[i]
-	= u_10 * camp_in[i - (1 << nn)]
+	= u_10 * camp_in[i - ((INDEX)1 << nn)]
 	+ u_11 * camp_in[i]
-	+ u_12 * camp_in[i - (1 << nn) + (1 << mm)]
-	+ u_13 * camp_in[i + (1 << mm)];
+	+ u_12 * camp_in[i - ((INDEX)1 << nn) + ((INDEX)1 << mm)]
+	+ u_13 * camp_in[i + ((INDEX)1 << mm)];
     }
     else if (((i >> mm) % 2 == 1) && ((i >> nn) % 2 == 0)) {
       camp_out[i]
-	= u_20 * camp_in[i - (1 << mm)]
-	+ u_21 * camp_in[i + (1 << nn) - (1 << mm)]
+	= u_20 * camp_in[i - ((INDEX)1 << mm)]
+	+ u_21 * camp_in[i + ((INDEX)1 << nn) - ((INDEX)1 << mm)]
 	+ u_22 * camp_in[i]
-	+ u_23 * camp_in[i + (1 << nn)];
+	+ u_23 * camp_in[i + ((INDEX)1 << nn)];
     }
     else {
       camp_out[i]
-	= u_30 * camp_in[i - (1 << nn) - (1 << mm)]
-	+ u_31 * camp_in[i - (1 << mm)]
-	+ u_32 * camp_in[i - (1 << nn)]
+	= u_30 * camp_in[i - ((INDEX)1 << nn) - ((INDEX)1 << mm)]
+	+ u_31 * camp_in[i - ((INDEX)1 << mm)]
+	+ u_32 * camp_in[i - ((INDEX)1 << nn)]
 	+ u_33 * camp_in[i];
     }
   }
@@ -663,7 +835,7 @@ static bool _qstate_operate_unitary4(COMPLEX* camp_out, COMPLEX* camp_in, COMPLE
 #ifdef METHOD_1
 
 static bool _qstate_operate_unitary2(COMPLEX* camp_out, COMPLEX* camp_in, COMPLEX* U2,
-				     int qubit_num, int state_num, int n)
+				     int qubit_num, INDEX state_num, int n)
 {
   int flg[4];  // flag represent whether matrix element is zero or non-zero (0:zero, 1:non-zero)
   int nn = qubit_num - n - 1;
@@ -675,18 +847,18 @@ static bool _qstate_operate_unitary2(COMPLEX* camp_out, COMPLEX* camp_in, COMPLE
   }
   
 # pragma omp parallel for shared(camp_out)
-  for (int i=0; i<state_num; i++) {
+  for (INDEX i=0; i<state_num; i++) {
     camp_out[i] = 0.0;
     if ((i >> nn) %2 == 0) {
       int a = IDX2(0,0);
       int b = IDX2(0,1);
       if (flg[a] == 1) camp_out[i] += U2[a] * camp_in[i];
-      if (flg[b] == 1) camp_out[i] += U2[b] * camp_in[i + (1 << nn)];
+      if (flg[b] == 1) camp_out[i] += U2[b] * camp_in[i + ((INDEX)1 << nn)];
     }
     else {
       int a = IDX2(1,0);
       int b = IDX2(1,1);
-      if (flg[a] == 1) camp_out[i] += U2[a] * camp_in[i - (1 << nn)];
+      if (flg[a] == 1) camp_out[i] += U2[a] * camp_in[i - ((INDEX)1 << nn)];
       if (flg[b] == 1) camp_out[i] += U2[b] * camp_in[i];
     }
   }
@@ -695,7 +867,7 @@ static bool _qstate_operate_unitary2(COMPLEX* camp_out, COMPLEX* camp_in, COMPLE
 }
 
 static bool _qstate_operate_unitary4(COMPLEX* camp_out, COMPLEX* camp_in, COMPLEX* U4,
-				     int qubit_num, int state_num, int m, int n)
+				     int qubit_num, INDEX state_num, int m, int n)
 {
   int flg[16];  // flag represent whether matrix element is zero or non-zero (0:zero, 1:non-zero)
   int mm = qubit_num - m - 1;
@@ -708,7 +880,7 @@ static bool _qstate_operate_unitary4(COMPLEX* camp_out, COMPLEX* camp_in, COMPLE
   }
   
   # pragma omp parallel for
-  for (int i=0; i<state_num; i++) {
+  for (INDEX i=0; i<state_num; i++) {
 
     camp_out[i] = 0.0;
     if (((i >> mm) % 2 == 0) && ((i >> nn) % 2 == 0)) {
@@ -717,38 +889,38 @@ static bool _qstate_operate_unitary4(COMPLEX* camp_out, COMPLEX* camp_in, COMPLE
       int c = IDX4(0,2);
       int d = IDX4(0,3);
       if (flg[a] == 1) camp_out[i] += U4[a] * camp_in[i];
-      if (flg[b] == 1) camp_out[i] += U4[b] * camp_in[i + (1 << nn)];
-      if (flg[c] == 1) camp_out[i] += U4[c] * camp_in[i + (1 << mm)];
-      if (flg[d] == 1) camp_out[i] += U4[d] * camp_in[i + (1 << nn) + (1 << mm)];
+      if (flg[b] == 1) camp_out[i] += U4[b] * camp_in[i + ((INDEX)1 << nn)];
+      if (flg[c] == 1) camp_out[i] += U4[c] * camp_in[i + ((INDEX)1 << mm)];
+      if (flg[d] == 1) camp_out[i] += U4[d] * camp_in[i + ((INDEX)1 << nn) + ((INDEX)1 << mm)];
     }
     else if (((i >> mm) % 2 == 0) && ((i >> nn) % 2 == 1)) {
       int a = IDX4(1,0);
       int b = IDX4(1,1);
       int c = IDX4(1,2);
       int d = IDX4(1,3);
-      if (flg[a] == 1) camp_out[i] += U4[a] * camp_in[i - (1 << nn)];
+      if (flg[a] == 1) camp_out[i] += U4[a] * camp_in[i - ((INDEX)1 << nn)];
       if (flg[b] == 1) camp_out[i] += U4[b] * camp_in[i];
-      if (flg[c] == 1) camp_out[i] += U4[c] * camp_in[i - (1 << nn) + (1 << mm)];
-      if (flg[c] == 1) camp_out[i] += U4[d] * camp_in[i + (1 << mm)];
+      if (flg[c] == 1) camp_out[i] += U4[c] * camp_in[i - ((INDEX)1 << nn) + ((INDEX)1 << mm)];
+      if (flg[c] == 1) camp_out[i] += U4[d] * camp_in[i + ((INDEX)1 << mm)];
     }
     else if (((i >> mm) % 2 == 1) && ((i >> nn) % 2 == 0)) {
       int a = IDX4(2,0);
       int b = IDX4(2,1);
       int c = IDX4(2,2);
       int d = IDX4(2,3);
-      if (flg[a] == 1) camp_out[i] += U4[a] * camp_in[i - (1 << mm)];
-      if (flg[b] == 1) camp_out[i] += U4[b] * camp_in[i + (1 << nn) - (1 << mm)];
+      if (flg[a] == 1) camp_out[i] += U4[a] * camp_in[i - ((INDEX)1 << mm)];
+      if (flg[b] == 1) camp_out[i] += U4[b] * camp_in[i + ((INDEX)1 << nn) - ((INDEX)1 << mm)];
       if (flg[c] == 1) camp_out[i] += U4[c] * camp_in[i];
-      if (flg[d] == 1) camp_out[i] += U4[d] * camp_in[i + (1 << nn)];
+      if (flg[d] == 1) camp_out[i] += U4[d] * camp_in[i + ((INDEX)1 << nn)];
     }
     else {
       int a = IDX4(3,0);
       int b = IDX4(3,1);
       int c = IDX4(3,2);
       int d = IDX4(3,3);
-      if (flg[a] == 1) camp_out[i] += U4[a] * camp_in[i - (1 << nn) - (1 << mm)];
-      if (flg[b] == 1) camp_out[i] += U4[b] * camp_in[i - (1 << mm)];
-      if (flg[c] == 1) camp_out[i] += U4[c] * camp_in[i - (1 << nn)];
+      if (flg[a] == 1) camp_out[i] += U4[a] * camp_in[i - ((INDEX)1 << nn) - ((INDEX)1 << mm)];
+      if (flg[b] == 1) camp_out[i] += U4[b] * camp_in[i - ((INDEX)1 << mm)];
+      if (flg[c] == 1) camp_out[i] += U4[c] * camp_in[i - ((INDEX)1 << nn)];
       if (flg[d] == 1) camp_out[i] += U4[d] * camp_in[i];
     }
   }
@@ -761,16 +933,16 @@ static bool _qstate_operate_unitary4(COMPLEX* camp_out, COMPLEX* camp_in, COMPLE
 #ifdef METHOD_2
 
 static bool _qstate_operate_unitary2(COMPLEX* camp_out, COMPLEX* camp_in, COMPLEX* U2,
-				     int qubit_num, int state_num, int n)
+				     int qubit_num, INDEX state_num, int n)
 {
   int nn = qubit_num - n - 1;
 
 # pragma omp parallel for shared(camp_out)
-  for (int i=0; i<state_num; i++) {
+  for (INDEX i=0; i<state_num; i++) {
     int p = (i >> nn) % 2;
     int pp = p ^ 1;
     int sign = (pp << 1) - 1; // b=0 -> -1, b=1 -> +1
-    int offset = sign * (1 << nn);
+    INDEX offset = sign * ((INDEX)1 << nn);
     camp_out[i] = U2[IDX2(p,p)] * camp_in[i] + U2[IDX2(p,pp)] * camp_in[i + offset];
   }
   
@@ -778,13 +950,13 @@ static bool _qstate_operate_unitary2(COMPLEX* camp_out, COMPLEX* camp_in, COMPLE
 }
 
 static bool _qstate_operate_unitary4(COMPLEX* camp_out, COMPLEX* camp_in, COMPLEX* U4,
-				     int qubit_num, int state_num, int m, int n)
+				     int qubit_num, INDEX state_num, int m, int n)
 {
   int mm = qubit_num - m - 1;
   int nn = qubit_num - n - 1;
 
 # pragma omp parallel for shared(camp_out)
-  for (int i=0; i<state_num; i++) {
+  for (INDEX i=0; i<state_num; i++) {
 
     int p = (i >> mm) % 2;
     int pp = p ^ 1;
@@ -796,8 +968,8 @@ static bool _qstate_operate_unitary4(COMPLEX* camp_out, COMPLEX* camp_in, COMPLE
     int sign_p = (pp << 1) - 1;
     int sign_q = (qq << 1) - 1;
 
-    int off_p = sign_p * (1 << mm);
-    int off_q = sign_q * (1 << nn);
+    INDEX off_p = sign_p * ((INDEX)1 << mm);
+    INDEX off_q = sign_q * ((INDEX)1 << nn);
 
     camp_out[i]
       = U4[IDX4(l, l)] * camp_in[i]
@@ -811,1087 +983,3416 @@ static bool _qstate_operate_unitary4(COMPLEX* camp_out, COMPLEX* camp_in, COMPLE
 
 #endif
 
-static bool _qstate_operate_controlled_gate_core(COMPLEX* camp_out, COMPLEX* camp_in, COMPLEX* U,
-						 int qubit_num, int state_num, int m, int n)
+#endif
+
+#ifdef IN_PLACE
+
+static bool _qstate_operate_unitary2_in_place(COMPLEX* camp, COMPLEX* U2,
+					      int qubit_num, INDEX state_num, int n)
+{
+  int		nn   = qubit_num - n - 1;
+  INDEX		k;
+  COMPLEX	u_00 = U2[IDX2(0,0)];
+  COMPLEX	u_01 = U2[IDX2(0,1)];
+  COMPLEX	u_10 = U2[IDX2(1,0)];
+  COMPLEX	u_11 = U2[IDX2(1,1)];
+
+  if (((INDEX)1 << nn) >= simd_lane_num()) { /* vectorized over the contiguous pairs */
+    int	chunk = MIN((INDEX)1 << nn, SIMD_CHUNK_NUM);
+    INDEX	offset[2] = {0, (INDEX)1 << nn};
+#   pragma omp parallel for shared(camp)
+    for (k=0; k<(state_num >> 1) / chunk; k++) {
+      simd_unitary_k(camp + INSERT_ZERO_BIT(k * chunk, nn), offset, 2, U2, chunk);
+    }
+    SUC_RETURN(true);
+  }
+
+# pragma omp parallel for shared(camp)
+  for (k=0; k<(state_num >> 1); k++) {
+    INDEX		i0 = INSERT_ZERO_BIT(k, nn);
+    INDEX		i1 = i0 | ((INDEX)1 << nn);
+    COMPLEX	a0 = camp[i0];
+    COMPLEX	a1 = camp[i1];
+    camp[i0] = u_00 * a0 + u_01 * a1;
+    camp[i1] = u_10 * a0 + u_11 * a1;
+  }
+  
+  SUC_RETURN(true);
+}
+
+static bool _qstate_operate_unitary4_in_place(COMPLEX* camp, COMPLEX* U4,
+					      int qubit_num, INDEX state_num, int m, int n)
 {
   int		mm   = qubit_num - m - 1;
   int		nn   = qubit_num - n - 1;
-  int		i;
+  int		lo   = MIN(mm, nn);
+  int		hi   = MAX(mm, nn);
+  INDEX		k;
+
+  if (((INDEX)1 << lo) >= simd_lane_num()) { /* vectorized over the contiguous quads */
+    int	chunk = MIN((INDEX)1 << lo, SIMD_CHUNK_NUM);
+    INDEX	offset[4] = {0, (INDEX)1 << nn, (INDEX)1 << mm, ((INDEX)1 << nn) | ((INDEX)1 << mm)};
+#   pragma omp parallel for shared(camp)
+    for (k=0; k<(state_num >> 2) / chunk; k++) {
+      INDEX	i0 = INSERT_ZERO_BIT(INSERT_ZERO_BIT(k * chunk, lo), hi);
+      simd_unitary_k(camp + i0, offset, 4, U4, chunk);
+    }
+    SUC_RETURN(true);
+  }
+
+# pragma omp parallel for shared(camp)
+  for (k=0; k<(state_num >> 2); k++) {
+    INDEX		i0 = INSERT_ZERO_BIT(INSERT_ZERO_BIT(k, lo), hi);
+    INDEX		idx[4];
+    COMPLEX	a[4];
+    int		l;
+    idx[0] = i0;
+    idx[1] = i0 | ((INDEX)1 << nn);
+    idx[2] = i0 | ((INDEX)1 << mm);
+    idx[3] = i0 | ((INDEX)1 << nn) | ((INDEX)1 << mm);
+    for (l=0; l<4; l++) a[l] = camp[idx[l]];
+    for (l=0; l<4; l++) {
+      camp[idx[l]]
+	= U4[IDX4(l,0)] * a[0]
+	+ U4[IDX4(l,1)] * a[1]
+	+ U4[IDX4(l,2)] * a[2]
+	+ U4[IDX4(l,3)] * a[3];
+    }
+  }
+  
+  SUC_RETURN(true);
+}
+
+static bool _qstate_operate_controlled_gate_in_place(COMPLEX* camp, COMPLEX* U,
+						     int qubit_num, INDEX state_num, int m, int n)
+{
+  int		mm   = qubit_num - m - 1;
+  int		nn   = qubit_num - n - 1;
+  int		lo   = MIN(mm, nn);
+  int		hi   = MAX(mm, nn);
+  INDEX		k;
   COMPLEX	u_00 = U[IDX4(0,0)];
   COMPLEX	u_11 = U[IDX4(1,1)];
   COMPLEX	u_22 = U[IDX4(2,2)];
   COMPLEX	u_23 = U[IDX4(2,3)];
   COMPLEX	u_32 = U[IDX4(3,2)];
   COMPLEX	u_33 = U[IDX4(3,3)];
-
-# pragma omp parallel for shared(camp_out)
-  for (i=0; i<state_num; i++) {
-    if (((i >> mm) % 2 == 0) && ((i >> nn) % 2 == 0)) {
-      camp_out[i] = u_00 * camp_in[i];
-    }
-    else if (((i >> mm) % 2 == 0) && ((i >> nn) % 2 == 1)) {
-      camp_out[i] = u_11 * camp_in[i];
-    }
-    else if (((i >> mm) % 2 == 1) && ((i >> nn) % 2 == 0)) {
-      camp_out[i]
-	= u_22 * camp_in[i]
-	+ u_23 * camp_in[i + (1 << nn)];
+  bool		ctrl_0_id = ((u_00 == 1.0) && (u_11 == 1.0)); /* identity for control = 0 */
+
+  if ((ctrl_0_id == true) && (((INDEX)1 << lo) >= simd_lane_num())) { /* vectorized */
+    int		chunk = MIN((INDEX)1 << lo, SIMD_CHUNK_NUM);
+    INDEX		offset[2] = {0, (INDEX)1 << nn};
+    COMPLEX	U2[4] = {u_22, u_23, u_32, u_33};
+#   pragma omp parallel for shared(camp)
+    for (k=0; k<(state_num >> 2) / chunk; k++) {
+      INDEX	i2 = INSERT_ZERO_BIT(INSERT_ZERO_BIT(k * chunk, lo), hi) | ((INDEX)1 << mm);
+      simd_unitary_k(camp + i2, offset, 2, U2, chunk);
     }
-    else {
-      camp_out[i]
-	= u_32 * camp_in[i - (1 << nn)]
-	+ u_33 * camp_in[i];
+    SUC_RETURN(true);
+  }
+
+# pragma omp parallel for shared(camp)
+  for (k=0; k<(state_num >> 2); k++) {
+    INDEX		i0 = INSERT_ZERO_BIT(INSERT_ZERO_BIT(k, lo), hi);
+    INDEX		i2 = i0 | ((INDEX)1 << mm);
+    INDEX		i3 = i2 | ((INDEX)1 << nn);
+    COMPLEX	a2 = camp[i2];
+    COMPLEX	a3 = camp[i3];
+    if (ctrl_0_id == false) {
+      camp[i0] = u_00 * camp[i0];
+      camp[i0 | ((INDEX)1 << nn)] = u_11 * camp[i0 | ((INDEX)1 << nn)];
     }
+    camp[i2] = u_22 * a2 + u_23 * a3;
+    camp[i3] = u_32 * a2 + u_33 * a3;
   }
   
   SUC_RETURN(true);
 }
 
-static bool _qstate_operate_controlled_gate_cpu(QState* qstate, COMPLEX* U, int m, int n)
-{
-  if (qstate == NULL)
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+#endif
 
-  if (qstate->buf_id == 0) {
-    if (!(_qstate_operate_controlled_gate_core(qstate->buffer_1, qstate->buffer_0, U,
-					       qstate->qubit_num, qstate->state_num, m, n))) {
-      ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-    }
-    qstate->buf_id = 1;
-    qstate->camp = qstate->buffer_1;
+/* kernels of the blocks (operated on camp, so also used if not IN_PLACE) */
+
+static inline void _qstate_operate_unitary_k_core(REAL* amp, double* ur, double* ui,
+						  INDEX* offset, INDEX i0, int size)
+/* amp[i0 + offset[l]] <= sum_m (ur + i ui)[l,m] * amp[i0 + offset[m]] (real arithmetic) */
+{
+  double	ar[1 << MAX_FUSION_QUBIT_NUM];
+  double	ai[1 << MAX_FUSION_QUBIT_NUM];
+  double	re, im;
+  int		l, m;
+
+  for (l=0; l<size; l++) {
+    ar[l] = amp[2 * (i0 + offset[l])];
+    ai[l] = amp[2 * (i0 + offset[l]) + 1];
   }
-  else {
-    if (!(_qstate_operate_controlled_gate_core(qstate->buffer_0, qstate->buffer_1, U,
-					       qstate->qubit_num, qstate->state_num, m, n))) {
-      ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  for (l=0; l<size; l++) {
+    re = 0.0; im = 0.0;
+    for (m=0; m<size; m++) {
+      re += ur[l * size + m] * ar[m] - ui[l * size + m] * ai[m];
+      im += ur[l * size + m] * ai[m] + ui[l * size + m] * ar[m];
     }
-    qstate->buf_id = 0;
-    qstate->camp = qstate->buffer_0;
+    amp[2 * (i0 + offset[l])] = re;
+    amp[2 * (i0 + offset[l]) + 1] = im;
   }
-
-  SUC_RETURN(true);
 }
 
-static bool _qstate_operate_unitary_cpu(QState* qstate, COMPLEX* U, int dim, int m, int n)
+static bool _qstate_operate_unitary_k_in_place(COMPLEX* camp, COMPLEX* U, int qubit_num,
+					       INDEX state_num, int knum, int* qid)
+/* operate the dense 2^knum x 2^knum unitary U on the qubits qid[0],...,qid[knum-1] */
 {
-  if (qstate == NULL)
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-
-  if (dim == 2) {
-
-    if (qstate->buf_id == 0) {
-      if (!(_qstate_operate_unitary2(qstate->buffer_1, qstate->buffer_0, U,
-                                     qstate->qubit_num, qstate->state_num, m))) {
-      	ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-      }
-      qstate->buf_id = 1;
-      qstate->camp = qstate->buffer_1;
+  int		size = 1 << knum;
+  int		bit[MAX_FUSION_QUBIT_NUM];	   /* bit position of each qubit */
+  int		bit_sorted[MAX_FUSION_QUBIT_NUM]; /* ascending order */
+  INDEX		offset[1 << MAX_FUSION_QUBIT_NUM];
+  double	ur[1 << (2 * MAX_FUSION_QUBIT_NUM)];
+  double	ui[1 << (2 * MAX_FUSION_QUBIT_NUM)];
+  REAL*		amp  = (REAL*)camp;
+  INDEX		k;
+  int		i, j, l;
+
+  if ((knum < 1) || (knum > MAX_FUSION_QUBIT_NUM)) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  for (j=0; j<knum; j++) {
+    bit[j] = qubit_num - qid[j] - 1;
+    for (i=j; (i > 0) && (bit_sorted[i-1] > bit[j]); i--) bit_sorted[i] = bit_sorted[i-1];
+    bit_sorted[i] = bit[j];
+  }
+  for (l=0; l<size; l++) {
+    offset[l] = 0;
+    for (j=0; j<knum; j++) {
+      if ((l >> (knum - j - 1)) % 2 == 1) offset[l] |= ((INDEX)1 << bit[j]);
     }
-    else {
-      if (!(_qstate_operate_unitary2(qstate->buffer_0, qstate->buffer_1, U,
-				     qstate->qubit_num, qstate->state_num, m))) {
-      	ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-      }
-      qstate->buf_id = 0;
-      qstate->camp = qstate->buffer_0;
+  }
+
+  if (((INDEX)1 << bit_sorted[0]) >= simd_lane_num()) { /* vectorized */
+    int	chunk = MIN((INDEX)1 << bit_sorted[0], SIMD_CHUNK_NUM);
+#   pragma omp parallel for shared(camp)
+    for (k=0; k<(state_num >> knum) / chunk; k++) {
+      INDEX	i0 = k * chunk;
+      int	jj;
+      for (jj=0; jj<knum; jj++) i0 = INSERT_ZERO_BIT(i0, bit_sorted[jj]);
+      simd_unitary_k(camp + i0, offset, size, U, chunk);
     }
+    SUC_RETURN(true);
   }
 
-  else if (dim == 4) {
+  for (l=0; l<size*size; l++) {
+    ur[l] = creal(U[l]);
+    ui[l] = cimag(U[l]);
+  }
 
-    if (qstate->buf_id == 0) {
-      if (!(_qstate_operate_unitary4(qstate->buffer_1, qstate->buffer_0, U,
-				     qstate->qubit_num, qstate->state_num, m, n))) {
-	ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-      }
-      qstate->buf_id = 1;
-      qstate->camp = qstate->buffer_1;
+# pragma omp parallel for shared(amp)
+  for (k=0; k<(state_num >> knum); k++) {
+    INDEX	i0 = k;
+    int	jj;
+    for (jj=0; jj<knum; jj++) i0 = INSERT_ZERO_BIT(i0, bit_sorted[jj]);
+    /* constant size for loop unrolling */
+    switch (size) {
+    case 2:  _qstate_operate_unitary_k_core(amp, ur, ui, offset, i0, 2);  break;
+    case 4:  _qstate_operate_unitary_k_core(amp, ur, ui, offset, i0, 4);  break;
+    case 8:  _qstate_operate_unitary_k_core(amp, ur, ui, offset, i0, 8);  break;
+    case 16: _qstate_operate_unitary_k_core(amp, ur, ui, offset, i0, 16); break;
+    default: _qstate_operate_unitary_k_core(amp, ur, ui, offset, i0, size); break;
     }
-    else {
-      if (!(_qstate_operate_unitary4(qstate->buffer_0, qstate->buffer_1, U,
-				     qstate->qubit_num, qstate->state_num, m, n))) {
-	ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-      }
-      qstate->buf_id = 0;
-      qstate->camp = qstate->buffer_0;
+  }
+  
+  SUC_RETURN(true);
+}
+
+static bool _qstate_operate_diagonal_k_in_place(COMPLEX* camp, COMPLEX* U, int qubit_num,
+						INDEX state_num, int knum, int* qid)
+/* operate the diagonal 2^knum x 2^knum unitary U on the qubits qid[0],...,qid[knum-1] */
+{
+  int		size = 1 << knum;
+  int		bit[MAX_FUSION_QUBIT_NUM];
+  int		bit_min = qubit_num;
+  COMPLEX	d[1 << MAX_FUSION_QUBIT_NUM];
+  INDEX		i;
+  int		j, l;
+
+  if ((knum < 1) || (knum > MAX_FUSION_QUBIT_NUM)) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  for (j=0; j<knum; j++) {
+    bit[j] = qubit_num - qid[j] - 1;
+    bit_min = MIN(bit_min, bit[j]);
+  }
+  for (l=0; l<size; l++) d[l] = U[l * size + l];
+
+  if (((INDEX)1 << bit_min) >= simd_lane_num()) { /* vectorized over the runs with the same phase */
+    int	chunk = MIN((INDEX)1 << bit_min, SIMD_CHUNK_NUM);
+#   pragma omp parallel for shared(camp)
+    for (i=0; i<state_num; i+=chunk) {
+      int	ll = 0;
+      int	jj;
+      for (jj=0; jj<knum; jj++) ll = (ll << 1) | ((i >> bit[jj]) & 1);
+      simd_scale(camp + i, d[ll], chunk);
     }
+    SUC_RETURN(true);
   }
-  else {
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+# pragma omp parallel for shared(camp)
+  for (i=0; i<state_num; i++) {
+    int	ll = 0;
+    int	jj;
+    for (jj=0; jj<knum; jj++) ll = (ll << 1) | ((i >> bit[jj]) & 1);
+    camp[i] *= d[ll];
   }
 
   SUC_RETURN(true);
 }
 
-static bool _qstate_operate_controlled_gate(QState* qstate, COMPLEX* U, int m, int n)
+#ifdef IN_PLACE
+
+static bool _qstate_operate_diagonal2_in_place(COMPLEX* camp, COMPLEX d_0, COMPLEX d_1,
+					       int qubit_num, INDEX state_num, int n)
+/* operate diag(d_0, d_1) on the qubit n (only the half with bit = 1 if d_0 = 1) */
 {
-  if (qstate->use_gpu == false) {
-    if (!(_qstate_operate_controlled_gate_cpu(qstate, U, m, n)))
-      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+  int	nn = qubit_num - n - 1;
+  INDEX	k;
+
+  if (((INDEX)1 << nn) >= simd_lane_num()) { /* vectorized */
+    int	chunk = MIN((INDEX)1 << nn, SIMD_CHUNK_NUM);
+#   pragma omp parallel for shared(camp)
+    for (k=0; k<(state_num >> 1) / chunk; k++) {
+      INDEX	i0 = INSERT_ZERO_BIT(k * chunk, nn);
+      if (d_0 != 1.0) simd_scale(camp + i0, d_0, chunk);
+      simd_scale(camp + (i0 | ((INDEX)1 << nn)), d_1, chunk);
+    }
+    SUC_RETURN(true);
   }
 
-#ifdef USE_GPU
-  else if (qstate->use_gpu == true) {
-    if (!(qstate_operate_controlled_gate_gpu(qstate, U, m, n)))
-      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+  if (d_0 == 1.0) {
+#   pragma omp parallel for shared(camp)
+    for (k=0; k<(state_num >> 1); k++) {
+      camp[INSERT_ZERO_BIT(k, nn) | ((INDEX)1 << nn)] *= d_1;
+    }
   }
-#endif
-
   else {
-    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+#   pragma omp parallel for shared(camp)
+    for (k=0; k<(state_num >> 1); k++) {
+      INDEX	i0 = INSERT_ZERO_BIT(k, nn);
+      camp[i0] *= d_0;
+      camp[i0 | ((INDEX)1 << nn)] *= d_1;
+    }
   }
-  
+
   SUC_RETURN(true);
 }
 
-static bool _qstate_operate_unitary(QState* qstate, COMPLEX* U, int dim, int m, int n)
+static bool _qstate_operate_diagonal4_in_place(COMPLEX* camp, COMPLEX* d, int qubit_num,
+					       INDEX state_num, int m, int n)
+/* operate diag(d[0],..,d[3]) on the qubits m,n (only the quarters with d[l] != 1) */
 {
-  if (qstate->use_gpu == false) {
-    if (!(_qstate_operate_unitary_cpu(qstate, U, dim, m, n)))
-      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+  int		mm   = qubit_num - m - 1;
+  int		nn   = qubit_num - n - 1;
+  int		lo   = MIN(mm, nn);
+  int		hi   = MAX(mm, nn);
+  int		num  = 0;
+  INDEX		offset[4];
+  COMPLEX	phase[4];
+  INDEX		k;
+  int		l;
+
+  for (l=0; l<4; l++) {
+    if (d[l] == 1.0) continue;
+    offset[num] = ((INDEX)(l >> 1) << mm) | ((INDEX)(l & 1) << nn);
+    phase[num] = d[l];
+    num++;
+  }
+  if (num == 0) SUC_RETURN(true);
+
+  if (((INDEX)1 << lo) >= simd_lane_num()) { /* vectorized */
+    int	chunk = MIN((INDEX)1 << lo, SIMD_CHUNK_NUM);
+#   pragma omp parallel for shared(camp)
+    for (k=0; k<(state_num >> 2) / chunk; k++) {
+      INDEX	i0 = INSERT_ZERO_BIT(INSERT_ZERO_BIT(k * chunk, lo), hi);
+      int	ll;
+      for (ll=0; ll<num; ll++) simd_scale(camp + (i0 | offset[ll]), phase[ll], chunk);
+    }
+    SUC_RETURN(true);
   }
 
-#ifdef USE_GPU
-  else if (qstate->use_gpu == true) {
-    if (!(qstate_operate_unitary_gpu(qstate, U, dim, m, n)))
-      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+# pragma omp parallel for shared(camp)
+  for (k=0; k<(state_num >> 2); k++) {
+    INDEX	i0 = INSERT_ZERO_BIT(INSERT_ZERO_BIT(k, lo), hi);
+    int	ll;
+    for (ll=0; ll<num; ll++) camp[i0 | offset[ll]] *= phase[ll];
   }
+
+  SUC_RETURN(true);
+}
+
 #endif
 
+static bool _qstate_operate_swap_in_place(COMPLEX* camp, int qubit_num, INDEX state_num,
+					  int m, int n, int offset_0, int offset_1)
+/*
+ * swap the amplitudes of the basis 'offset_0' and 'offset_1' in every 2-qubit block on m,n
+ * (offset: bit 1 = qubit m, bit 0 = qubit n, m = n for 1-qubit gate)
+ */
+{
+  int	mm = qubit_num - m - 1;
+  int	nn = qubit_num - n - 1;
+  int	lo = MIN(mm, nn);
+  int	hi = MAX(mm, nn);
+  INDEX	i_0 = ((INDEX)(offset_0 >> 1) << mm) | ((INDEX)(offset_0 & 1) << nn);
+  INDEX	i_1 = ((INDEX)(offset_1 >> 1) << mm) | ((INDEX)(offset_1 & 1) << nn);
+  INDEX	k;
+
+  if (m == n) {
+#   pragma omp parallel for shared(camp)
+    for (k=0; k<(state_num >> 1); k++) {
+      INDEX	i0 = INSERT_ZERO_BIT(k, nn);
+      COMPLEX	a  = camp[i0];
+      camp[i0] = camp[i0 | ((INDEX)1 << nn)];
+      camp[i0 | ((INDEX)1 << nn)] = a;
+    }
+  }
   else {
-    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+#   pragma omp parallel for shared(camp)
+    for (k=0; k<(state_num >> 2); k++) {
+      INDEX	i0 = INSERT_ZERO_BIT(INSERT_ZERO_BIT(k, lo), hi);
+      COMPLEX	a  = camp[i0 | i_0];
+      camp[i0 | i_0] = camp[i0 | i_1];
+      camp[i0 | i_1] = a;
+    }
   }
-  
+
   SUC_RETURN(true);
 }
 
-static bool _qstate_transform_basis(QState* qstate, double angle, double phase, int n)
+#ifdef IN_PLACE
+
+static bool _qstate_operate_special_gate_cpu(QState* qstate, Kind kind, COMPLEX* U,
+					     int m, int n, bool* done)
+/*
+ * operate the diagonal or permutation gate with the dedicated kernel
+ * (*done = false if the kind has no dedicated kernel)
+ */
 {
-  /*
-     This function operate U+ to the qstate
-     - |p> = U |0> = cos(theta/2) |0> + exp(i phi) sin(theta/2) |1>
-     - U = Rz(PI/2 + phi) H Rz(theta) H
-     - U+ = H Rz(-theta) H Rz(-PI/2 - phi)
-   */
-  double	phs = -0.5 - phase;
-  double	ang = -angle;
-  int		qubit_id[MAX_QUBIT_NUM];
+  COMPLEX*	camp	  = qstate->camp;
+  int		qubit_num = qstate->qubit_num;
+  INDEX		state_num = qstate->state_num;
+  COMPLEX	d[4];
+  bool		ans	  = true;
+  int		l;
+
+  *done = true;
+
+  switch (kind) {
+  case PAULI_Z:
+  case PHASE_SHIFT_S:
+  case PHASE_SHIFT_S_:
+  case PHASE_SHIFT_T:
+  case PHASE_SHIFT_T_:
+  case PHASE_SHIFT:
+  case ROTATION_Z:
+    ans = _qstate_operate_diagonal2_in_place(camp, U[IDX2(0,0)], U[IDX2(1,1)],
+					     qubit_num, state_num, m);
+    break;
+  case CONTROLLED_Z:
+  case CONTROLLED_S:
+  case CONTROLLED_S_:
+  case CONTROLLED_T:
+  case CONTROLLED_T_:
+  case CONTROLLED_P:
+  case CONTROLLED_RZ:
+  case ROTATION_ZZ:
+    for (l=0; l<4; l++) d[l] = U[IDX4(l,l)];
+    ans = _qstate_operate_diagonal4_in_place(camp, d, qubit_num, state_num, m, n);
+    break;
+  case PAULI_X:
+    ans = _qstate_operate_swap_in_place(camp, qubit_num, state_num, m, m, 0, 1);
+    break;
+  case CONTROLLED_X:
+    ans = _qstate_operate_swap_in_place(camp, qubit_num, state_num, m, n, 2, 3);
+    break;
+  case SWAP_QUBITS:
+    ans = _qstate_operate_swap_in_place(camp, qubit_num, state_num, m, n, 1, 2);
+    break;
+  default:
+    *done = false;
+    break;
+  }
 
-  if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  if (ans == false) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
   
-  qubit_id[0] = n;
-  if (!(qstate_operate_qgate(qstate, ROTATION_Z, phs, 0.0, 1.0, qubit_id)))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-  if (!(qstate_operate_qgate(qstate, HADAMARD, 0.0, 0.0, 1.0, qubit_id)))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-  if (!(qstate_operate_qgate(qstate, ROTATION_Z, ang, 0.0, 1.0, qubit_id)))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-  if (!(qstate_operate_qgate(qstate, HADAMARD, 0.0, 0.0, 0.0, qubit_id)))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  SUC_RETURN(true);
+}
 
-#ifdef USE_GPU
-  if (!(qstate_update_host_memory(qstate)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
 #endif
 
-  SUC_RETURN(true);
-}
+#ifndef IN_PLACE
 
-static bool _qstate_transform_basis_inv(QState* qstate, double angle, double phase, int n)
+static bool _qstate_operate_controlled_gate_core(COMPLEX* camp_out, COMPLEX* camp_in, COMPLEX* U,
+						 int qubit_num, INDEX state_num, int m, int n)
 {
-  /* 
-     This function operate U to the qstate
-     - |p> = U |0> = cos(theta/2) |0> + exp(i phi) sin(theta/2) |1>
-     - U = Rz(PI/2 + phi) H Rz(theta) H
-     - U+ = H Rz(-theta) H Rz(-PI/2 - phi)
-   */
-  double	phs = 0.5 + phase;
-  double	ang = angle;
-  int		qubit_id[MAX_QUBIT_NUM];
+  int		mm   = qubit_num - m - 1;
+  int		nn   = qubit_num - n - 1;
+  INDEX		i;
+  COMPLEX	u_00 = U[IDX4(0,0)];
+  COMPLEX	u_11 = U[IDX4(1,1)];
+  COMPLEX	u_22 = U[IDX4(2,2)];
+  COMPLEX	u_23 = U[IDX4(2,3)];
+  COMPLEX	u_32 = U[IDX4(3,2)];
+  COMPLEX	u_33 = U[IDX4(3,3)];
 
-  if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+# pragma omp parallel for shared(camp_out)
+  for (i=0; i<state_num; i++) {
+    if (((i >> mm) % 2 == 0) && ((i >> nn) % 2 == 0)) {
+      camp_out[i] = u_00 * camp_in[i];
+    }
+    else if (((i >> mm) % 2 == 0) && ((i >> nn) % 2 == 1)) {
+      camp_out[i] = u_11 * camp_in[i];
+    }
+    else if (((i >> mm) % 2 == 1) && ((i >> nn) % 2 == 0)) {
+      camp_out[i]
+	= u_22 * camp_in[i]
+	+ u_23 * camp_in[i + ((INDEX)1 << nn)];
+    }
+    else {
+      camp_out[i]
+	= u_32 * camp_in[i - ((INDEX)1 << nn)]
+	+ u_33 * camp_in[i];
+    }
+  }
   
-  qubit_id[0] = n;
-  if (!(qstate_operate_qgate(qstate, HADAMARD, 0.0, 0.0, 1.0, qubit_id)))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-  if (!(qstate_operate_qgate(qstate, ROTATION_Z, ang, 0.0, 1.0, qubit_id)))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-  if (!(qstate_operate_qgate(qstate, HADAMARD, 0.0, 0.0, 1.0, qubit_id)))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-  if (!(qstate_operate_qgate(qstate, ROTATION_Z, phs, 0.0, 1.0, qubit_id)))
+  SUC_RETURN(true);
+}
+
+#endif
+
+static bool _qstate_operate_controlled_gate_cpu(QState* qstate, COMPLEX* U, int m, int n)
+{
+  if (qstate == NULL)
     ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
 
-#ifdef USE_GPU
-  if (!(qstate_update_host_memory(qstate)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
+#ifdef IN_PLACE
+  if (!(_qstate_operate_controlled_gate_in_place(qstate->camp, U, qstate->qubit_num,
+						 qstate->state_num, m, n))) {
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  }
+#else
+  if (qstate->buf_id == 0) {
+    if (!(_qstate_operate_controlled_gate_core(qstate->buffer_1, qstate->buffer_0, U,
+					       qstate->qubit_num, qstate->state_num, m, n))) {
+      ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+    }
+    qstate->buf_id = 1;
+    qstate->camp = qstate->buffer_1;
+  }
+  else {
+    if (!(_qstate_operate_controlled_gate_core(qstate->buffer_0, qstate->buffer_1, U,
+					       qstate->qubit_num, qstate->state_num, m, n))) {
+      ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+    }
+    qstate->buf_id = 0;
+    qstate->camp = qstate->buffer_0;
+  }
 #endif
 
   SUC_RETURN(true);
 }
 
-static bool _qstate_update_prob_array(QState* qstate)
+static bool _qstate_operate_unitary_cpu(QState* qstate, COMPLEX* U, int dim, int m, int n)
 {
-  int		i;
-  double	prob;
+  if (qstate == NULL)
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
 
-  if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+#ifdef IN_PLACE
+  if (dim == 2) {
+    if (!(_qstate_operate_unitary2_in_place(qstate->camp, U, qstate->qubit_num,
+					    qstate->state_num, m))) {
+      ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+    }
+  }
+  else if (dim == 4) {
+    if (!(_qstate_operate_unitary4_in_place(qstate->camp, U, qstate->qubit_num,
+					    qstate->state_num, m, n))) {
+      ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+    }
+  }
+  else {
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  }
+#else
+  if (dim == 2) {
 
-  for (i=0; i<qstate->state_num; i++) qstate->prob_array[i] = 0.0;
+    if (qstate->buf_id == 0) {
+      if (!(_qstate_operate_unitary2(qstate->buffer_1, qstate->buffer_0, U,
+                                     qstate->qubit_num, qstate->state_num, m))) {
+      	ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+      }
+      qstate->buf_id = 1;
+      qstate->camp = qstate->buffer_1;
+    }
+    else {
+      if (!(_qstate_operate_unitary2(qstate->buffer_0, qstate->buffer_1, U,
+				     qstate->qubit_num, qstate->state_num, m))) {
+      	ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+      }
+      qstate->buf_id = 0;
+      qstate->camp = qstate->buffer_0;
+    }
+  }
 
-  qstate->prob_array[0] = 0.0;
-  for (i=1; i<qstate->state_num; i++) {
-    prob = pow(cabs(qstate->camp[i-1]), 2.0);
-    qstate->prob_array[i] = qstate->prob_array[i-1] + prob;
+  else if (dim == 4) {
+
+    if (qstate->buf_id == 0) {
+      if (!(_qstate_operate_unitary4(qstate->buffer_1, qstate->buffer_0, U,
+				     qstate->qubit_num, qstate->state_num, m, n))) {
+	ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+      }
+      qstate->buf_id = 1;
+      qstate->camp = qstate->buffer_1;
+    }
+    else {
+      if (!(_qstate_operate_unitary4(qstate->buffer_0, qstate->buffer_1, U,
+				     qstate->qubit_num, qstate->state_num, m, n))) {
+	ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+      }
+      qstate->buf_id = 0;
+      qstate->camp = qstate->buffer_0;
+    }
+  }
+  else {
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
   }
+#endif
 
   SUC_RETURN(true);
 }
 
-static bool _qstate_get_measured_char(QState* qstate, int mnum, int* qid, char* mchar)
+static bool _qstate_operate_multi_controlled_gate_cpu(QState* qstate, COMPLEX* U,
+						     int qctrl_num, int* qctrl, int n)
+/* operate the 2x2 unitary U on the qubit n only if the control qubits are all 1 (in place) */
 {
-  double	r;
-  int           i, idx, up;
-
-  if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
-
-  if (qstate->prob_updated == false) {
-    _qstate_update_prob_array(qstate);
-    qstate->prob_updated = true;
-  }
-
-  r = genrand_real1();
-  idx = 0;
-  for (i=0; i<qstate->qubit_num; i++) {
-    up = 1 << (qstate->qubit_num - 1 - i);
-    if (r >= qstate->prob_array[idx + up]) {
-      idx = idx + up;
-    }
+  COMPLEX*	camp	  = qstate->camp;
+  int		qubit_num = qstate->qubit_num;
+  int		nn	  = qubit_num - n - 1;
+  int		bit_sorted[MAX_QEXT_NUM + 1]; /* ascending order */
+  INDEX		cmask	  = 0;
+  int		bnum	  = qctrl_num + 1;
+  INDEX		k;
+  int		i, j;
+  COMPLEX	u_00	  = U[IDX2(0,0)];
+  COMPLEX	u_01	  = U[IDX2(0,1)];
+  COMPLEX	u_10	  = U[IDX2(1,0)];
+  COMPLEX	u_11	  = U[IDX2(1,1)];
+
+  if ((qctrl_num < 1) || (qctrl_num > MAX_QEXT_NUM)) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  for (j=0; j<bnum; j++) {
+    int b = (j < qctrl_num) ? qubit_num - qctrl[j] - 1 : nn;
+    if (j < qctrl_num) cmask |= ((INDEX)1 << b);
+    for (i=j; (i > 0) && (bit_sorted[i-1] > b); i--) bit_sorted[i] = bit_sorted[i-1];
+    bit_sorted[i] = b;
   }
 
-  for (i=0; i<mnum; i++) {
-    mchar[i] = (idx >> (qstate->qubit_num - qid[i] - 1)) % 2;
+# pragma omp parallel for shared(camp)
+  for (k=0; k<(qstate->state_num >> bnum); k++) {
+    INDEX	i0 = k;
+    INDEX	i1;
+    int		jj;
+    COMPLEX	a0, a1;
+    for (jj=0; jj<bnum; jj++) i0 = INSERT_ZERO_BIT(i0, bit_sorted[jj]);
+    i0 |= cmask;
+    i1 = i0 | ((INDEX)1 << nn);
+    a0 = camp[i0];
+    a1 = camp[i1];
+    camp[i0] = u_00 * a0 + u_01 * a1;
+    camp[i1] = u_10 * a0 + u_11 * a1;
   }
 
   SUC_RETURN(true);
 }
 
-bool qstate_measure(QState* qstate, int mnum, int* qid, char* measured_char,
-		    bool measure_update)
+static bool _qstate_operate_ft_cpu(QState* qstate, int qnum, int* qid, bool inverse)
+/*
+ * operate QFT (or IQFT) on the qubits qid[0],...,qid[qnum-1] as a radix-2 FFT in place
+ * - qft: decimation in time without the bit reversal (same as 'h' and 'cp' sequence of QObject.qft)
+ * - iqft: decimation in frequency (the stages of qft in reverse order)
+ * (each stage is a single sweep of the amplitude pairs like 1-qubit gate, so the cost is O(2^n * qnum))
+ */
 {
-  int	i, x;
-  int   mval_qid = 0;
-
-  if ((qstate == NULL) || (mnum < 1) ||
-      (qid == NULL) || (measured_char == NULL))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
-    
-#ifdef USE_GPU
-  if (!(qstate_update_host_memory(qstate)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
-#endif
+  COMPLEX*	camp	  = qstate->camp;
+  int		qubit_num = qstate->qubit_num;
+  INDEX		ft_num	  = (INDEX)1 << qnum;      /* size of the transform */
+  INDEX		half_num  = ft_num >> 1;
+  int		lo_bits	  = MIN(qnum - 1, FT_TWIDDLE_LO_BITS);
+  INDEX		lo_num	  = (INDEX)1 << lo_bits;
+  INDEX		hi_num	  = half_num >> lo_bits;
+  int		chunk_num = (qubit_num + 7) >> 3;
+  INDEX*	jtab	  = NULL;  /* byte-wise table to extract the butterfly position from the index */
+  COMPLEX*	tw_lo	  = NULL;  /* twiddle factor: tw(t) = tw_hi[t >> lo_bits] * tw_lo[t & (lo_num-1)] */
+  COMPLEX*	tw_hi	  = NULL;
+  double	sign	  = (inverse == true) ? -1.0 : 1.0;
+  double	norm	  = 1.0 / sqrt(2.0);
+  INDEX		i, k;
+  int		b, s, v;
+
+  if ((qnum < 1) || (qnum > qubit_num)) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  for (i=0; i<qnum; i++) {
+    if ((qid[i] < 0) || (qid[i] >= qubit_num)) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
 
-  _qstate_get_measured_char(qstate, mnum, qid, measured_char);
+  if (!(jtab = (INDEX*)malloc(sizeof(INDEX) * (chunk_num << 8))) ||
+      !(tw_lo = (COMPLEX*)malloc(sizeof(COMPLEX) * lo_num)) ||
+      !(tw_hi = (COMPLEX*)malloc(sizeof(COMPLEX) * hi_num))) {
+    free(jtab); free(tw_lo); free(tw_hi);
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  }
+  for (i=0; i<lo_num; i++) tw_lo[i] = cexp(sign * 2.0 * M_PI * COMP_I * i / ft_num);
+  for (i=0; i<hi_num; i++) tw_hi[i] = cexp(sign * 2.0 * M_PI * COMP_I * ((double)i * lo_num) / ft_num);
 
-  /* get measured value for target qubits */
-  /* update qstate (projection and normalize) */
-  if (measure_update == true) {
-    for (i=0; i<mnum; i++) {
-      mval_qid += ((int)measured_char[i] << (mnum - 1 - i));
-    }
-    for (i=0; i<qstate->state_num; i++) {
-      if (!(select_bits(&x, i, mnum, qstate->qubit_num, qid)))
-	ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
-      if (x != mval_qid) qstate->camp[i] = 0.0;
+  /*
+   * stage s: butterflies between the amplitude pairs of the qubit qid[qnum-s-1]
+   * (twiddle factor is determined by the qubits qid[qnum-1],...,qid[qnum-s] as the s-bit integer)
+   */
+  for (i=0; i<qnum; i++) {
+    INDEX	stride;
+    int		nn;
+
+    s = (inverse == true) ? qnum - i - 1 : i;
+    stride = half_num >> s;
+    nn = qubit_num - qid[qnum - s - 1] - 1;
+
+    memset(jtab, 0, sizeof(INDEX) * (chunk_num << 8));
+    for (b=0; b<s; b++) {
+      int p = qubit_num - qid[qnum - b - 1] - 1;
+      for (v=0; v<256; v++) {
+	if ((v >> (p & 7)) & 1) jtab[((p >> 3) << 8) + v] += ((INDEX)1 << b);
+      }
     }
-    if (!(qstate_normalize(qstate))) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
-
-#ifdef USE_GPU
-    if (!(qstate_update_device_memory(qstate)))
-      ERR_RETURN(ERROR_QSTATE_UPDATE_DEVICE_MEMORY, false);
-#endif
 
-    qstate->prob_updated = false;
+# pragma omp parallel for private(b) shared(camp)
+    for (k=0; k<(qstate->state_num >> 1); k++) {
+      INDEX	i0 = INSERT_ZERO_BIT(k, nn);
+      INDEX	i1 = i0 | ((INDEX)1 << nn);
+      INDEX	t  = 0;
+      COMPLEX	w;
+      COMPLEX	u  = camp[i0];
+      COMPLEX	v  = camp[i1];
+      for (b=0; b<chunk_num; b++) t += jtab[(b << 8) + ((i0 >> (b << 3)) & 255)];
+      t *= stride;
+      w = tw_hi[t >> lo_bits] * tw_lo[t & (lo_num - 1)];
+      if (inverse == false) {
+	v *= w;
+	camp[i0] = norm * (u + v);
+	camp[i1] = norm * (u - v);
+      }
+      else {
+	camp[i0] = norm * (u + v);
+	camp[i1] = norm * (u - v) * w;
+      }
+    }
   }
 
+  free(jtab); jtab = NULL;
+  free(tw_lo); tw_lo = NULL;
+  free(tw_hi); tw_hi = NULL;
+
   SUC_RETURN(true);
 }
 
-bool qstate_measure_stats(QState* qstate, int shot_num, double angle, double phase,
-			  int qubit_num, int* qubit_id, void** mdata_out)
+static inline void _pauli_rotation_pair(REAL* a0, REAL* a1, double s0, double s1, double c,
+					double fr, double fi)
+/* (a0, a1) <= (c * a0 + s1 * f * a1, c * a1 + s0 * f * a0), f = fr + i * fi */
 {
-  int		mes_id	       = 0;
-  MData*	mdata	       = NULL;
-  bool		measure_update = false;
-  char*		measured_char  = NULL;
-  int		i, j;
+  double	a0r = a0[0];
+  double	a0i = a0[1];
+  double	a1r = a1[0];
+  double	a1i = a1[1];
+
+  a0[0] = c * a0r + s1 * (fr * a1r - fi * a1i);
+  a0[1] = c * a0i + s1 * (fr * a1i + fi * a1r);
+  a1[0] = c * a1r + s0 * (fr * a0r - fi * a0i);
+  a1[1] = c * a1i + s0 * (fr * a0i + fi * a0r);
+}
 
-  if ((qstate == NULL) ||
-      (shot_num < 1) || (qubit_num < 0) ||
-      (qubit_num > qstate->qubit_num))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+static bool _qstate_operate_pauli_rotation_cpu(QState* qstate, INDEX xmask, INDEX zmask, int ny,
+					       double theta)
+/*
+ * operate exp(-i * theta * P) in a single sweep of the amplitudes, where P is the pauli
+ * product with P|k> = i^ny * (-1)^parity(k & zmask) |k ^ xmask> (xmask: bits of X or Y,
+ * zmask: bits of Y or Z, ny: number of Y). exp(-i * theta * P) = cos(theta) - i * sin(theta) * P,
+ * so each pair of the amplitudes (k, k ^ xmask) is mixed at once (multiplied by the phase
+ * exp(-/+ i * theta) if P is diagonal) with the real arithmetic.
+ * the index is swept in the blocks of 2^lo_bits, where the sign of the block is computed once
+ * and the signs of the low-order bits are tabulated.
+ */
+{
+  REAL*		amp = (REAL*)qstate->camp;
+  REAL		sgn[1 << PAULI_SIGN_LO_BITS];
+  double	c   = cos(theta);
+  double	fr  = 0.0;  /* f = -i * sin(theta) * i^ny */
+  double	fi  = 0.0;
+  double	sxz;        /* sign of (k ^ xmask) relative to k */
+  INDEX		zc;         /* zmask without the bit hbit (for the index k with the bit hbit removed) */
+  INDEX		h, j, lo_num;
+  int		hbit = -1;  /* highest bit of xmask */
+  int		lo_bits;
+  bool		contig;
+
+  switch (ny % 4) {
+  case 0: fi = -sin(theta); break;
+  case 1: fr =  sin(theta); break;
+  case 2: fi =  sin(theta); break;
+  case 3: fr = -sin(theta); break;
+  }
+  for (h=xmask; h!=0; h>>=1) hbit++;
+
+  if (xmask == 0) { /* diagonal: multiply by c - i * sin(theta) * sign */
+    lo_bits = MIN(qstate->qubit_num, PAULI_SIGN_LO_BITS);
+    lo_num = (INDEX)1 << lo_bits;
+    for (j=0; j<lo_num; j++) sgn[j] = __builtin_parityll(j & zmask) ? -fi : fi;
+
+#   pragma omp parallel for private(j)
+    for (h=0; h<(qstate->state_num >> lo_bits); h++) {
+      REAL*	a  = amp + 2 * (h << lo_bits);
+      double	sh = __builtin_parityll((h << lo_bits) & zmask) ? -1.0 : 1.0;
+      for (j=0; j<lo_num; j++) {
+	double	si = sh * sgn[j];
+	double	ar = a[2 * j];
+	double	ai = a[2 * j + 1];
+	a[2 * j]     = c * ar - si * ai;
+	a[2 * j + 1] = c * ai + si * ar;
+      }
+    }
+  }
+  else {
+    zc = (zmask & (((INDEX)1 << hbit) - 1)) | ((zmask >> (hbit + 1)) << hbit);
+    sxz = __builtin_parityll(xmask & zmask) ? -1.0 : 1.0;
+    lo_bits = MIN(qstate->qubit_num - 1, PAULI_SIGN_LO_BITS);
+    contig = (__builtin_ctzll(xmask) >= PAULI_CONTIG_LO_BITS);
+    if (contig == true) lo_bits = MIN(lo_bits, __builtin_ctzll(xmask));
+    lo_num = (INDEX)1 << lo_bits;
+    for (j=0; j<lo_num; j++) sgn[j] = __builtin_parityll(j & zc) ? -1.0 : 1.0;
+
+    if (contig == true) { /* the pairs of the block are contiguous */
+#     pragma omp parallel for private(j)
+      for (h=0; h<(qstate->state_num >> (lo_bits + 1)); h++) {
+	INDEX	i0 = INSERT_ZERO_BIT(h << lo_bits, hbit);
+	REAL*	b0 = amp + 2 * i0;
+	REAL*	b1 = amp + 2 * (i0 ^ xmask);
+	double	sh = __builtin_parityll((h << lo_bits) & zc) ? -1.0 : 1.0;
+	for (j=0; j<lo_num; j++) {
+	  _pauli_rotation_pair(b0 + 2 * j, b1 + 2 * j, sh * sgn[j], sh * sgn[j] * sxz, c, fr, fi);
+	}
+      }
+    }
+    else {
+#     pragma omp parallel for private(j)
+      for (h=0; h<(qstate->state_num >> (lo_bits + 1)); h++) {
+	double	sh = __builtin_parityll((h << lo_bits) & zc) ? -1.0 : 1.0;
+	for (j=0; j<lo_num; j++) {
+	  INDEX	k0 = INSERT_ZERO_BIT((h << lo_bits) | j, hbit);
+	  _pauli_rotation_pair(amp + 2 * k0, amp + 2 * (k0 ^ xmask), sh * sgn[j],
+			       sh * sgn[j] * sxz, c, fr, fi);
+	}
+      }
+    }
+  }
 
-#ifdef USE_GPU
-  if (!(qstate_update_host_memory(qstate)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
-#endif
+  qstate->prob_updated = false;
 
-  /* initialize mdata */
-  if (!(mdata_init(qubit_num, shot_num, angle, phase, qubit_id,
-		   (void**)&mdata))) ERR_RETURN(ERROR_MDATA_INIT,false);
+  SUC_RETURN(true);
+}
 
-  /* change basis, if measurement axis isn't Z */
-  if ((angle != 0.0) || (phase != 0.0)) {
-    for (i=0; i<qubit_num; i++) {
-      if (!(_qstate_transform_basis(qstate, angle, phase, qubit_id[i])))
-	ERR_RETURN(ERROR_INVALID_ARGUMENT,-1);
-    }
+static bool _qstate_operate_multi_qubit_gate(QState* qstate, QGate* qgate)
+/* operate the multi-qubit gate (mcx, qft, iqft, mrz) */
+{
+  COMPLEX*	U     = NULL;
+  int		dim   = 0;
+  int		qid[MAX_QEXT_NUM + 1];
+  INDEX		zmask = 0;
+  int		i;
+
+  /* the multi-qubit gate is not supported with GPU (decomposed before) */
+  if (qstate->use_gpu == true) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  switch (qgate->kind) {
+  case MULTI_CONTROLLED_X:
+    if (!(gbank_get_unitary(qstate->gbank, PAULI_X, qgate->para[0], qgate->para[1],
+			    qgate->para[2], &dim, (void**)&U)))
+      ERR_RETURN(ERROR_GBANK_GET_UNITARY, false);
+    if (!(_qstate_operate_multi_controlled_gate_cpu(qstate, U, qgate->qext_num, qgate->qext,
+						     qgate->qid[0])))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    free(U); U = NULL;
+    break;
+  case QFT_GATE:
+  case IQFT_GATE:
+    for (i=0; i<qgate->qext_num; i++) qid[i] = qgate->qext[i];
+    qid[qgate->qext_num] = qgate->qid[0];
+    if (!(_qstate_operate_ft_cpu(qstate, qgate->qext_num + 1, qid, (qgate->kind == IQFT_GATE))))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    break;
+  case MULTI_ROTATION_Z:
+    /* exp(-i * (phase * PI / 2) * Z...Z) */
+    for (i=0; i<qgate->qext_num; i++) zmask |= ((INDEX)1 << (qstate->qubit_num - qgate->qext[i] - 1));
+    zmask |= ((INDEX)1 << (qstate->qubit_num - qgate->qid[0] - 1));
+    if (!(_qstate_operate_pauli_rotation_cpu(qstate, 0, zmask, 0,
+					     0.5 * M_PI * qgate->para[0] * qgate->para[2])))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    break;
+  default:
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
   }
 
-  /* get measurement data */
-  if (!(measured_char = (char*)malloc(sizeof(char) * qstate->qubit_num)))
-    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  SUC_RETURN(true);
+}
 
-  for (i=0; i<shot_num; i++) {
-    if (i < shot_num - 1) measure_update = false;
-    else measure_update = true;
+static bool _qstate_operate_controlled_gate(QState* qstate, COMPLEX* U, int m, int n)
+{
+  if (qstate->use_gpu == false) {
+    if (!(_qstate_operate_controlled_gate_cpu(qstate, U, m, n)))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+  }
 
-    if (!(qstate_measure(qstate, qubit_num, qubit_id, measured_char, measure_update)))
-      ERR_RETURN(ERROR_QSTATE_MEASURE, false);
+#ifdef USE_GPU
+  else if (qstate->use_gpu == true) {
+    if (!(qstate_operate_controlled_gate_gpu(qstate, U, m, n)))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+  }
+#endif
 
-    mes_id = 0;
-    for (j=0; j<qubit_num; j++) {
-      mes_id += ((int)measured_char[j] << (qubit_num - j - 1));
-    }
-    mdata->freq[mes_id]++;
+  else {
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
   }
-  mdata->last_val = mes_id;
+  
+  SUC_RETURN(true);
+}
 
-  /* change basis (inverse), if measurement axis isn't Z */
-  if ((angle != 0.0) || (phase != 0.0)) {
-    for (i=0; i<qubit_num; i++) {
-      if (!(_qstate_transform_basis_inv(qstate, angle, phase, qubit_id[i])))
-	ERR_RETURN(ERROR_INVALID_ARGUMENT,-1);
-    }
+static bool _qstate_operate_unitary(QState* qstate, COMPLEX* U, int dim, int m, int n)
+{
+  if (qstate->use_gpu == false) {
+    if (!(_qstate_operate_unitary_cpu(qstate, U, dim, m, n)))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
   }
 
 #ifdef USE_GPU
-  if (!(qstate_update_device_memory(qstate)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_DEVICE_MEMORY, false);
+  else if (qstate->use_gpu == true) {
+    if (!(qstate_operate_unitary_gpu(qstate, U, dim, m, n)))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+  }
 #endif
 
-  qstate->prob_updated = false;
-
-  free(measured_char); measured_char = NULL;
+  else {
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
   
-  *mdata_out = mdata;
   SUC_RETURN(true);
 }
 
-bool qstate_measure_bell_stats(QState* qstate, int shot_num, int qubit_num,
-			       int* qubit_id, void** mdata_out)
+static bool _qstate_operate_gate(QState* qstate, Kind kind, COMPLEX* U, int dim, int m, int n)
+/* operate the gate of the kind (dispatch to the dedicated kernel if exists) */
 {
-  MData*	mdata  = NULL;
-  
-  if ((qstate == NULL) || (shot_num < 1) || (qubit_num != 2))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  bool	done = false;
 
-  /* equivalent transform to bell-basis */
-  /* CX 0 1 */
-  if (!(qstate_operate_qgate(qstate, CONTROLLED_X, 0.0, 0.0, 1.0, qubit_id)))
+#ifdef IN_PLACE
+  if (qstate->use_gpu == false) {
+    if (!(_qstate_operate_special_gate_cpu(qstate, kind, U, m, n, &done)))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+  }
+#endif
+
+  if (done == true) {
+    SUC_RETURN(true);
+  }
+  else if (kind_is_controlled(kind) == true) {
+    if (!(_qstate_operate_controlled_gate(qstate, U, m, n)))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
+  else {
+    if (!(_qstate_operate_unitary(qstate, U, dim, m, n)))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
+
+  SUC_RETURN(true);
+}
+
+static bool _qstate_transform_basis(QState* qstate, double angle, double phase, int n)
+{
+  /*
+     This function operate U+ to the qstate
+     - |p> = U |0> = cos(theta/2) |0> + exp(i phi) sin(theta/2) |1>
+     - U = Rz(PI/2 + phi) H Rz(theta) H
+     - U+ = H Rz(-theta) H Rz(-PI/2 - phi)
+   */
+  double	phs = -0.5 - phase;
+  double	ang = -angle;
+  int		qubit_id[MAX_QUBIT_NUM];
+
+  if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  
+  qubit_id[0] = n;
+  if (!(qstate_operate_qgate(qstate, ROTATION_Z, phs, 0.0, 1.0, qubit_id)))
     ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-  /* H 0 */
   if (!(qstate_operate_qgate(qstate, HADAMARD, 0.0, 0.0, 1.0, qubit_id)))
     ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-  /* CX 0 1 */
-  if (!(qstate_operate_qgate(qstate, CONTROLLED_X, 0.0, 0.0, 1.0, qubit_id)))
+  if (!(qstate_operate_qgate(qstate, ROTATION_Z, ang, 0.0, 1.0, qubit_id)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  if (!(qstate_operate_qgate(qstate, HADAMARD, 0.0, 0.0, 0.0, qubit_id)))
     ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
 
-  /* execute Bell-mesurement */
-  if (!(qstate_measure_stats(qstate, shot_num, 0.0, 0.0, qubit_num, qubit_id, (void**)&mdata)))
-    ERR_RETURN(ERROR_QSTATE_MEASURE_STATS,false);
+#ifdef USE_GPU
+  if (!(qstate_update_host_memory(qstate)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
+#endif
 
-  /* equivalent transform to bell-basis (inverse) */
-  /* CX 0 1 */
-  if (!(qstate_operate_qgate(qstate, CONTROLLED_X, 0.0, 0.0, 1.0, qubit_id)))
+  SUC_RETURN(true);
+}
+
+static bool _qstate_transform_basis_inv(QState* qstate, double angle, double phase, int n)
+{
+  /* 
+     This function operate U to the qstate
+     - |p> = U |0> = cos(theta/2) |0> + exp(i phi) sin(theta/2) |1>
+     - U = Rz(PI/2 + phi) H Rz(theta) H
+     - U+ = H Rz(-theta) H Rz(-PI/2 - phi)
+   */
+  double	phs = 0.5 + phase;
+  double	ang = angle;
+  int		qubit_id[MAX_QUBIT_NUM];
+
+  if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  
+  qubit_id[0] = n;
+  if (!(qstate_operate_qgate(qstate, HADAMARD, 0.0, 0.0, 1.0, qubit_id)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  if (!(qstate_operate_qgate(qstate, ROTATION_Z, ang, 0.0, 1.0, qubit_id)))
     ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-  /* H 0 */
   if (!(qstate_operate_qgate(qstate, HADAMARD, 0.0, 0.0, 1.0, qubit_id)))
     ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-  /* CX 0 1 */
-  if (!(qstate_operate_qgate(qstate, CONTROLLED_X, 0.0, 0.0, 1.0, qubit_id)))
+  if (!(qstate_operate_qgate(qstate, ROTATION_Z, phs, 0.0, 1.0, qubit_id)))
     ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
 
 #ifdef USE_GPU
-  if (!(qstate_update_device_memory(qstate)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_DEVICE_MEMORY, false);
+  if (!(qstate_update_host_memory(qstate)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
 #endif
 
-  qstate->prob_updated = false;
-
-  *mdata_out = mdata;
   SUC_RETURN(true);
 }
 
-bool qstate_operate_qgate(QState* qstate, Kind kind, double phase, double gphase,
-			  double factor, int* qubit_id)
+static bool _qstate_update_prob_array(QState* qstate)
 {
-  int		q0  = qubit_id[0];
-  int		q1  = qubit_id[1];
-  int		dim = 0;
-  COMPLEX*	U   = NULL;
+  INDEX		i;
+  double	prob;
 
-  if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
 
-  if ((kind == INIT) || (kind == MEASURE) || (kind ==MEASURE_X) ||
-      (kind == MEASURE_Y) || (kind == MEASURE_Z) || (kind == MEASURE_BELL) ||
-      (kind == RESET)) {
-    SUC_RETURN(true);
+  if (qstate->prob_array == NULL) {
+    if (!(qstate->prob_array = (double*)malloc(sizeof(double) * qstate->state_num)))
+      ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
   }
 
-  if (!(gbank_get_unitary(qstate->gbank, kind, phase, gphase, factor, &dim, (void**)&U)))
-    ERR_RETURN(ERROR_GBANK_GET_UNITARY,false);
-  
-  if (kind_is_controlled(kind) == true) {
-    if (!(_qstate_operate_controlled_gate(qstate, U, q0, q1)))
-      ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  for (i=0; i<qstate->state_num; i++) qstate->prob_array[i] = 0.0;
+
+  qstate->prob_array[0] = 0.0;
+  for (i=1; i<qstate->state_num; i++) {
+    prob = pow(cabs(qstate->camp[i-1]), 2.0);
+    qstate->prob_array[i] = qstate->prob_array[i-1] + prob;
   }
-  else {
-    if (!(_qstate_operate_unitary(qstate, U, dim, q0, q1)))
-      ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+  SUC_RETURN(true);
+}
+
+static bool _qstate_get_measured_char(QState* qstate, int mnum, int* qid, char* mchar)
+{
+  double	r;
+  INDEX         idx, up;
+  int           i;
+
+  if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  if (qstate->prob_updated == false) {
+    if (!(_qstate_update_prob_array(qstate))) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    qstate->prob_updated = true;
   }
 
-  qstate->prob_updated = false;
+  r = rng_real1(qstate->rng);
+  idx = 0;
+  for (i=0; i<qstate->qubit_num; i++) {
+    up = (INDEX)1 << (qstate->qubit_num - 1 - i);
+    if (r >= qstate->prob_array[idx + up]) {
+      idx = idx + up;
+    }
+  }
+
+  for (i=0; i<mnum; i++) {
+    mchar[i] = (idx >> (qstate->qubit_num - qid[i] - 1)) % 2;
+  }
 
-  free(U); U = NULL;
   SUC_RETURN(true);
 }
 
-static bool _qstate_evolve_spro(QState* qstate, SPro* spro, double time)
+static int _cmp_for_sort(const void* p, const void* q)
 {
-  int	pre,now;
-  int	qubit_id[MAX_QUBIT_NUM];
-  
-  if ((qstate == NULL) || (spro == NULL))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  INDEX a = *(INDEX*)p;
+  INDEX b = *(INDEX*)q;
 
-  pre = -1; now = 0;
-  while (now < spro->spin_num) {
-    /* operate nothing */
-    if (spro->spin_type[now] == NONE) {
-      now++;
-      continue;
-    }
-    /* operate G: G=H (if PauliX), G=Rx(-0.5) (if PauliY), G=I (if PauliZ) */
-    if (spro->spin_type[now] == SIGMA_X) {
-      qubit_id[0] = now;
-      if (!(qstate_operate_qgate(qstate, HADAMARD, 0.0, 0.0, 1.0, qubit_id)))
-	ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  return (a > b) - (a < b);
+}
+
+static bool _qstate_sample_measured_values(QState* qstate, int shots, int mnum, int* qid,
+					   INDEX* mval_out, int* count_out, int* num_out)
+/*
+ * sample the measured values of qubits 'qid' for 'shots' shots at once.
+ * the sorted uniform random numbers are merged against the cumulative
+ * distribution of the state in one sweep (O(2^n + shots)).
+ * the distinct measured values (ascending order) and the counts are returned:
+ * mval_out[k], count_out[k] (k = 0,1,...,*num_out-1),
+ * where mval_out and count_out must have MIN(shots, state_num) elements.
+ */
+{
+  INDEX*	pair	  = NULL; /* (measured value, count) pairs */
+  int		pair_num  = 0;
+  int		cnt	  = 0;
+  int		left	  = shots;
+  INDEX		last_idx  = -1;
+  INDEX		mval	  = 0;
+  double	norm	  = 0.0;
+  double	prob_sum  = 0.0;
+  double	r	  = 0.0;  /* sorted uniform random number */
+  INDEX		i;
+  int		k, num;
+
+  if ((qstate == NULL) || (shots < 1) || (mnum < 1) || (qid == NULL) ||
+      (mval_out == NULL) || (count_out == NULL) || (num_out == NULL))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  if (!(pair = (INDEX*)malloc(sizeof(INDEX) * 2 * MIN(shots, qstate->state_num))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+
+# pragma omp parallel for reduction(+:norm)
+  for (i=0; i<qstate->state_num; i++) {
+    norm += creal(qstate->camp[i] * conj(qstate->camp[i]));
+  }
+  if (norm <= 0.0) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  /* 1st (minimum) random number of 'shots' sorted uniform random numbers */
+  r = norm * (1.0 - pow(rng_real3(qstate->rng), 1.0 / left));
+
+  for (i=0; (i<qstate->state_num) && (left > 0); i++) {
+    prob_sum += creal(qstate->camp[i] * conj(qstate->camp[i]));
+    if (prob_sum > 0.0) last_idx = i;
+    cnt = 0;
+    while ((left > 0) && (r < prob_sum)) {
+      cnt++; left--;
+      if (left > 0) r = norm - (norm - r) * pow(rng_real3(qstate->rng), 1.0 / left);
     }
-    else if (spro->spin_type[now] == SIGMA_Y) {
-      qubit_id[0] = now;
-      if (!(qstate_operate_qgate(qstate, ROTATION_X, -0.5, 0.0, 1.0, qubit_id)))
-	ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+    if (cnt > 0) {
+      if (!(select_bits(&mval, i, mnum, qstate->qubit_num, qid)))
+	ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+      pair[2 * pair_num] = mval;
+      pair[2 * pair_num + 1] = cnt;
+      pair_num++;
     }
-    else if (spro->spin_type[now] == SIGMA_Z) {
-      ;
+  }
+
+  /* remained shots (because of rounding error) */
+  if (left > 0) {
+    if (!(select_bits(&mval, last_idx, mnum, qstate->qubit_num, qid)))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    if ((pair_num > 0) && (pair[2 * (pair_num - 1)] == mval)) {
+      pair[2 * (pair_num - 1) + 1] += left;
     }
     else {
-      ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+      pair[2 * pair_num] = mval;
+      pair[2 * pair_num + 1] = left;
+      pair_num++;
     }
-    /* operate CX */
-    if (pre >= 0) {
-      if ((spro->spin_type[pre] != NONE) && (spro->spin_type[now] != NONE)) {
-	qubit_id[0] = pre;
-	qubit_id[1] = now;
-	if (!(qstate_operate_qgate(qstate, CONTROLLED_X, 0.0, 0.0, 1.0, qubit_id)))
-	  ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  }
+
+  /* merge the pairs with the same measured value */
+  qsort(pair, (size_t)pair_num, sizeof(INDEX) * 2, _cmp_for_sort);
+  num = 0;
+  for (k=0; k<pair_num; k++) {
+    if ((num > 0) && (mval_out[num - 1] == pair[2 * k])) {
+      count_out[num - 1] += (int)pair[2 * k + 1];
+    }
+    else {
+      mval_out[num] = pair[2 * k];
+      count_out[num] = (int)pair[2 * k + 1];
+      num++;
+    }
+  }
+  *num_out = num;
+
+  free(pair); pair = NULL;
+
+  SUC_RETURN(true);
+}
+
+static bool _qstate_project_measured(QState* qstate, int mnum, int* qid, INDEX mval_qid)
+/* projection to the measured value 'mval_qid' of qubits 'qid' and normalize */
+{
+  INDEX	i, x;
+
+  if ((qstate == NULL) || (mnum < 1) || (qid == NULL))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  for (i=0; i<qstate->state_num; i++) {
+    if (!(select_bits(&x, i, mnum, qstate->qubit_num, qid)))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    if (x != mval_qid) qstate->camp[i] = 0.0;
+  }
+  if (!(qstate_normalize(qstate))) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  qstate->prob_updated = false;
+
+  SUC_RETURN(true);
+}
+
+bool qstate_measure(QState* qstate, int mnum, int* qid, char* measured_char,
+		    bool measure_update)
+{
+  int	i;
+  INDEX mval_qid = 0;
+
+  if ((qstate == NULL) || (mnum < 1) ||
+      (qid == NULL) || (measured_char == NULL))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    
+#ifdef USE_GPU
+  if (!(qstate_update_host_memory(qstate)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
+#endif
+
+  _qstate_get_measured_char(qstate, mnum, qid, measured_char);
+
+  /* get measured value for target qubits */
+  /* update qstate (projection and normalize) */
+  if (measure_update == true) {
+    for (i=0; i<mnum; i++) {
+      mval_qid += ((INDEX)measured_char[i] << (mnum - 1 - i));
+    }
+    if (!(_qstate_project_measured(qstate, mnum, qid, mval_qid)))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+#ifdef USE_GPU
+    if (!(qstate_update_device_memory(qstate)))
+      ERR_RETURN(ERROR_QSTATE_UPDATE_DEVICE_MEMORY, false);
+#endif
+  }
+
+  SUC_RETURN(true);
+}
+
+static INDEX _qstate_select_bits(INDEX idx, int mnum, int* shift)
+/* value of the bits of idx at the shifts (shift[0] is the most significant bit of the value) */
+{
+  INDEX	x = 0;
+  int	k;
+
+  for (k=0; k<mnum; k++) x = (x << 1) | ((idx >> shift[k]) & 1);
+
+  return x;
+}
+
+bool qstate_marginal_prob(QState* qstate, int mnum, int* qid, double* prob_out)
+/*
+ * marginal probabilities of qubits 'qid' (the other qubits are traced out, the state is not changed).
+ * prob_out[x] is the probability of the measured value x (qid[0] is the most significant bit),
+ * where prob_out must have 2^mnum elements. the amplitudes are reduced into the thread-local
+ * arrays in parallel (if the array is small), and merged at last. otherwise the measured
+ * values are divided into the blocks of 2^MARGINAL_LOCAL_QUBIT_NUM values, and each thread
+ * sums up the probabilities of its own blocks (the inner loop is on the low-order qubits).
+ */
+{
+  int		shift[MAX_QUBIT_NUM];
+  INDEX		prob_num;
+  INDEX		rest_mask = 0; /* bits of the traced out qubits */
+  INDEX		x0;
+  double	norm	 = 0.0;
+  bool		in_order = (mnum == qstate->qubit_num);
+  INDEX		i, x;
+  int		k;
+
+  if ((qstate == NULL) || (mnum < 1) || (mnum > qstate->qubit_num) ||
+      (qid == NULL) || (prob_out == NULL))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+#ifdef USE_GPU
+  if (!(qstate_update_host_memory(qstate)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
+#endif
+
+  for (k=0; k<mnum; k++) {
+    if ((qid[k] < 0) || (qid[k] >= qstate->qubit_num)) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    shift[k] = qstate->qubit_num - 1 - qid[k];
+    if (qid[k] != k) in_order = false;
+  }
+
+  prob_num = (INDEX)1 << mnum;
+  for (x=0; x<prob_num; x++) prob_out[x] = 0.0;
+
+  if (in_order == true) { /* all of the qubits in order: no reduction */
+#   pragma omp parallel for
+    for (i=0; i<qstate->state_num; i++) {
+      prob_out[i] = creal(qstate->camp[i] * conj(qstate->camp[i]));
+    }
+  }
+  else if (mnum <= MARGINAL_LOCAL_QUBIT_NUM) {
+#   pragma omp parallel private(i, x)
+    {
+      double	prob_local[1 << MARGINAL_LOCAL_QUBIT_NUM];
+
+      for (x=0; x<prob_num; x++) prob_local[x] = 0.0;
+#     pragma omp for
+      for (i=0; i<qstate->state_num; i++) {
+	prob_local[_qstate_select_bits(i, mnum, shift)]
+	  += creal(qstate->camp[i] * conj(qstate->camp[i]));
+      }
+#     pragma omp critical
+      {
+	for (x=0; x<prob_num; x++) prob_out[x] += prob_local[x];
+      }
+    }
+  }
+  else {
+    for (k=0; k<mnum; k++) rest_mask |= (INDEX)1 << shift[k];
+    rest_mask = (qstate->state_num - 1) & ~rest_mask;
+#   pragma omp parallel for private(i, x, k)
+    for (x0=0; x0<prob_num; x0+=((INDEX)1 << MARGINAL_LOCAL_QUBIT_NUM)) {
+      INDEX	base[1 << MARGINAL_LOCAL_QUBIT_NUM];
+      double	prob_block[1 << MARGINAL_LOCAL_QUBIT_NUM];
+      INDEX	rest;
+
+      for (x=0; x<((INDEX)1 << MARGINAL_LOCAL_QUBIT_NUM); x++) {
+	base[x] = 0;
+	for (k=0; k<mnum; k++) base[x] |= (((x0 + x) >> (mnum - 1 - k)) & 1) << shift[k];
+	prob_block[x] = 0.0;
+      }
+      if ((rest_mask & 1) == 1) { /* traced out qubits are low-order: each value in turn */
+	for (x=0; x<((INDEX)1 << MARGINAL_LOCAL_QUBIT_NUM); x++) {
+	  rest = 0;
+	  do { /* all the subsets of rest_mask */
+	    i = base[x] | rest;
+	    prob_block[x] += creal(qstate->camp[i] * conj(qstate->camp[i]));
+	    rest = ((rest | ~rest_mask) + 1) & rest_mask;
+	  } while (rest != 0);
+	}
+      }
+      else { /* measured qubits are low-order: all the values of the block for each rest */
+	rest = 0;
+	do {
+	  for (x=0; x<((INDEX)1 << MARGINAL_LOCAL_QUBIT_NUM); x++) {
+	    i = base[x] | rest;
+	    prob_block[x] += creal(qstate->camp[i] * conj(qstate->camp[i]));
+	  }
+	  rest = ((rest | ~rest_mask) + 1) & rest_mask;
+	} while (rest != 0);
+      }
+      for (x=0; x<((INDEX)1 << MARGINAL_LOCAL_QUBIT_NUM); x++) prob_out[x0 + x] = prob_block[x];
+    }
+  }
+
+  for (x=0; x<prob_num; x++) norm += prob_out[x];
+  if (norm <= 0.0) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  for (x=0; x<prob_num; x++) prob_out[x] /= norm;
+
+  SUC_RETURN(true);
+}
+
+bool qstate_sample(QState* qstate, int shots, int mnum, int* qid, INDEX* mval_out)
+/*
+ * sample the measured values of qubits 'qid' for 'shots' shots (the state is not changed).
+ * mval_out[s] is the measured value of the s-th shot (qid[0] is the most significant bit),
+ * where mval_out must have 'shots' elements. the values are sampled at once in one sweep
+ * of the state (see _qstate_sample_measured_values) and shuffled into the shot order.
+ */
+{
+  INDEX*	mval  = NULL;
+  int*		count = NULL;
+  INDEX		tmp;
+  int		num   = 0;
+  int		s, j, k, c;
+
+  if ((qstate == NULL) || (shots < 1) || (mnum < 1) || (mnum > qstate->qubit_num) ||
+      (qid == NULL) || (mval_out == NULL))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+#ifdef USE_GPU
+  if (!(qstate_update_host_memory(qstate)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
+#endif
+
+  if (!(mval = (INDEX*)malloc(sizeof(INDEX) * MIN(shots, qstate->state_num))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(count = (int*)malloc(sizeof(int) * MIN(shots, qstate->state_num))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+
+  if (!(_qstate_sample_measured_values(qstate, shots, mnum, qid, mval, count, &num)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  s = 0;
+  for (k=0; k<num; k++) {
+    for (c=0; c<count[k]; c++) mval_out[s++] = mval[k];
+  }
+
+  /* shuffle (Fisher-Yates) */
+  for (s=shots-1; s>0; s--) {
+    j = (int)(rng_real2(qstate->rng) * (s + 1));
+    tmp = mval_out[s]; mval_out[s] = mval_out[j]; mval_out[j] = tmp;
+  }
+
+  free(mval); mval = NULL;
+  free(count); count = NULL;
+
+  SUC_RETURN(true);
+}
+
+bool qstate_measure_stats(QState* qstate, int shot_num, double angle, double phase,
+			  int qubit_num, int* qubit_id, void** mdata_out)
+{
+  INDEX		mes_id	       = 0;
+  MData*	mdata	       = NULL;
+  bool		measure_update = false;
+  char*		measured_char  = NULL;
+  int		i, j;
+
+  if ((qstate == NULL) ||
+      (shot_num < 1) || (qubit_num < 0) ||
+      (qubit_num > qstate->qubit_num))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+#ifdef USE_GPU
+  if (!(qstate_update_host_memory(qstate)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
+#endif
+
+  /* initialize mdata */
+  if (!(mdata_init(qubit_num, shot_num, angle, phase, qubit_id,
+		   (void**)&mdata))) ERR_RETURN(ERROR_MDATA_INIT,false);
+
+  /* change basis, if measurement axis isn't Z */
+  if ((angle != 0.0) || (phase != 0.0)) {
+    for (i=0; i<qubit_num; i++) {
+      if (!(_qstate_transform_basis(qstate, angle, phase, qubit_id[i])))
+	ERR_RETURN(ERROR_INVALID_ARGUMENT,-1);
+    }
+  }
+
+  /* get measurement data */
+  if (!(measured_char = (char*)malloc(sizeof(char) * qstate->qubit_num)))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+
+  for (i=0; i<shot_num; i++) {
+    if (i < shot_num - 1) measure_update = false;
+    else measure_update = true;
+
+    if (!(qstate_measure(qstate, qubit_num, qubit_id, measured_char, measure_update)))
+      ERR_RETURN(ERROR_QSTATE_MEASURE, false);
+
+    mes_id = 0;
+    for (j=0; j<qubit_num; j++) {
+      mes_id += ((INDEX)measured_char[j] << (qubit_num - j - 1));
+    }
+    mdata->freq[mes_id]++;
+  }
+  mdata->last_val = mes_id;
+
+  /* change basis (inverse), if measurement axis isn't Z */
+  if ((angle != 0.0) || (phase != 0.0)) {
+    for (i=0; i<qubit_num; i++) {
+      if (!(_qstate_transform_basis_inv(qstate, angle, phase, qubit_id[i])))
+	ERR_RETURN(ERROR_INVALID_ARGUMENT,-1);
+    }
+  }
+
+#ifdef USE_GPU
+  if (!(qstate_update_device_memory(qstate)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_DEVICE_MEMORY, false);
+#endif
+
+  qstate->prob_updated = false;
+
+  free(measured_char); measured_char = NULL;
+  
+  *mdata_out = mdata;
+  SUC_RETURN(true);
+}
+
+bool qstate_measure_bell_stats(QState* qstate, int shot_num, int qubit_num,
+			       int* qubit_id, void** mdata_out)
+{
+  MData*	mdata  = NULL;
+  
+  if ((qstate == NULL) || (shot_num < 1) || (qubit_num != 2))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+  /* equivalent transform to bell-basis */
+  /* CX 0 1 */
+  if (!(qstate_operate_qgate(qstate, CONTROLLED_X, 0.0, 0.0, 1.0, qubit_id)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  /* H 0 */
+  if (!(qstate_operate_qgate(qstate, HADAMARD, 0.0, 0.0, 1.0, qubit_id)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  /* CX 0 1 */
+  if (!(qstate_operate_qgate(qstate, CONTROLLED_X, 0.0, 0.0, 1.0, qubit_id)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+  /* execute Bell-mesurement */
+  if (!(qstate_measure_stats(qstate, shot_num, 0.0, 0.0, qubit_num, qubit_id, (void**)&mdata)))
+    ERR_RETURN(ERROR_QSTATE_MEASURE_STATS,false);
+
+  /* equivalent transform to bell-basis (inverse) */
+  /* CX 0 1 */
+  if (!(qstate_operate_qgate(qstate, CONTROLLED_X, 0.0, 0.0, 1.0, qubit_id)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  /* H 0 */
+  if (!(qstate_operate_qgate(qstate, HADAMARD, 0.0, 0.0, 1.0, qubit_id)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  /* CX 0 1 */
+  if (!(qstate_operate_qgate(qstate, CONTROLLED_X, 0.0, 0.0, 1.0, qubit_id)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+#ifdef USE_GPU
+  if (!(qstate_update_device_memory(qstate)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_DEVICE_MEMORY, false);
+#endif
+
+  qstate->prob_updated = false;
+
+  *mdata_out = mdata;
+  SUC_RETURN(true);
+}
+
+bool qstate_operate_qgate(QState* qstate, Kind kind, double phase, double gphase,
+			  double factor, int* qubit_id)
+{
+  int		q0  = qubit_id[0];
+  int		q1  = qubit_id[1];
+  int		dim = 0;
+  COMPLEX*	U   = NULL;
+
+  if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+  if ((kind == INIT) || (kind == MEASURE) || (kind ==MEASURE_X) ||
+      (kind == MEASURE_Y) || (kind == MEASURE_Z) || (kind == MEASURE_BELL) ||
+      (kind == RESET)) {
+    SUC_RETURN(true);
+  }
+
+  if (!(gbank_get_unitary(qstate->gbank, kind, phase, gphase, factor, &dim, (void**)&U)))
+    ERR_RETURN(ERROR_GBANK_GET_UNITARY,false);
+  
+  if (!(_qstate_operate_gate(qstate, kind, U, dim, q0, q1)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+  qstate->prob_updated = false;
+
+  free(U); U = NULL;
+  SUC_RETURN(true);
+}
+
+static bool _spro_get_mask(SPro* spro, int qubit_num, INDEX* xmask_out, INDEX* zmask_out,
+			   int* ny_out)
+/*
+ * bit masks of the pauli product P|k> = i^ny * (-1)^parity(k & zmask) |k ^ xmask>
+ * (xmask: bits of X or Y, zmask: bits of Y or Z, ny: number of Y)
+ */
+{
+  INDEX		xmask = 0;
+  INDEX		zmask = 0;
+  int		ny    = 0;
+  int		i, b;
+
+  for (i=0; i<spro->spin_num; i++) {
+    if (spro->spin_type[i] == NONE) continue;
+    if (i >= qubit_num) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    b = qubit_num - i - 1;
+    if ((spro->spin_type[i] == SIGMA_X) || (spro->spin_type[i] == SIGMA_Y)) {
+      xmask |= ((INDEX)1 << b);
+    }
+    if ((spro->spin_type[i] == SIGMA_Z) || (spro->spin_type[i] == SIGMA_Y)) {
+      zmask |= ((INDEX)1 << b);
+    }
+    if (spro->spin_type[i] == SIGMA_Y) ny++;
+  }
+
+  *xmask_out = xmask;
+  *zmask_out = zmask;
+  *ny_out = ny;
+
+  SUC_RETURN(true);
+}
+
+static bool _qstate_evolve_spro(QState* qstate, SPro* spro, double time)
+/*
+ * evolve the qstate by the pauli product term c * P of the hamiltonian for the time,
+ * exp(i * PI * time * c * P), with the native pauli rotation (a single sweep of the
+ * amplitudes instead of the basis changes, the CX ladders and the RZ gate)
+ */
+{
+  INDEX		xmask = 0;
+  INDEX		zmask = 0;
+  int		ny    = 0;
+
+  if ((qstate == NULL) || (spro == NULL))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+  if (!(_spro_get_mask(spro, qstate->qubit_num, &xmask, &zmask, &ny)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+  if (!(_qstate_operate_pauli_rotation_cpu(qstate, xmask, zmask, ny, -M_PI * time * spro->coef)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  
+  SUC_RETURN(true);
+}
+
+bool qstate_evolve(QState* qstate, ObservableBase* observ, double time, int iter)
+{
+  double	t = time / iter;
+  int		i,j;
+  
+  if ((qstate == NULL) || (observ == NULL) || (iter < 1))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+#ifdef USE_GPU
+  if (!(qstate_update_host_memory(qstate)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
+#endif
+
+  for (i=0; i<iter; i++) {
+    for (j=0; j<observ->array_num; j++) {
+      if (!(_qstate_evolve_spro(qstate, observ->spro_array[j], t)))
+	ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+    }
+  }
+
+#ifdef USE_GPU
+  if (!(qstate_update_device_memory(qstate)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_DEVICE_MEMORY, false);
+#endif
+
+  SUC_RETURN(true);
+}
+
+static bool _qstate_expect_spro(QState* qstate, SPro* spro, double* value)
+/*
+ * expectation value of the pauli product P = X^x Z^z (up to the phase i^ny, ny: number of Y)
+ * P|k> = i^ny * (-1)^popcount(k & zmask) |k ^ xmask>, so <P> is the sum over the pairs
+ * (k, k ^ xmask) of 2 * Re(conj(camp[k ^ xmask]) * camp[k] * i^ny * (-1)^popcount(k & zmask))
+ * computed in a single sweep without any copies of the state
+ */
+{
+  COMPLEX*	camp  = qstate->camp;
+  INDEX		xmask = 0;
+  INDEX		zmask = 0;
+  INDEX		k;
+  int		ny    = 0;
+  int		hbit  = -1; /* highest bit of xmask */
+  int		i, b;
+  double	sum   = 0.0;
+
+  for (i=0; i<spro->spin_num; i++) {
+    if (spro->spin_type[i] == NONE) continue;
+    if (i >= qstate->qubit_num) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    b = qstate->qubit_num - i - 1;
+    if ((spro->spin_type[i] == SIGMA_X) || (spro->spin_type[i] == SIGMA_Y)) {
+      xmask |= ((INDEX)1 << b);
+      hbit = MAX(hbit, b);
+    }
+    if ((spro->spin_type[i] == SIGMA_Z) || (spro->spin_type[i] == SIGMA_Y)) {
+      zmask |= ((INDEX)1 << b);
+    }
+    if (spro->spin_type[i] == SIGMA_Y) ny++;
+  }
+
+  if (xmask == 0) { /* diagonal */
+#   pragma omp parallel for reduction(+:sum)
+    for (k=0; k<qstate->state_num; k++) {
+      double p = (double)creal(camp[k] * conj(camp[k]));
+      sum += (__builtin_popcountll(k & zmask) & 1) ? -p : p;
+    }
+  }
+  else {
+#   pragma omp parallel for reduction(+:sum)
+    for (k=0; k<(qstate->state_num >> 1); k++) {
+      INDEX	k0 = INSERT_ZERO_BIT(k, hbit);
+      COMPLEX	c  = conj(camp[k0 ^ xmask]) * camp[k0];
+      double	v  = (ny % 2 == 0) ? (double)creal(c) : -(double)cimag(c); /* Re(i^ny * c) */
+      if ((ny / 2) % 2 == 1) v = -v;
+      sum += (__builtin_popcountll(k0 & zmask) & 1) ? -2.0 * v : 2.0 * v;
+    }
+  }
+
+  *value = spro->coef * sum;
+
+  SUC_RETURN(true);
+}
+
+bool qstate_inner_product(QState* qstate_0, QState* qstate_1,
+			  double* real, double* imag)
+{
+  COMPLEX	out = 0.0 + 0.0 * COMP_I;
+  INDEX		i;
+
+  if ((qstate_0 == NULL) || (qstate_1 == NULL) ||
+      (qstate_0->qubit_num != qstate_1->qubit_num) ||
+      (qstate_0->state_num != qstate_1->state_num))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  
+#ifdef USE_GPU
+  if (!(qstate_update_host_memory(qstate_0)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY,false);
+  if (!(qstate_update_host_memory(qstate_1)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY,false);
+#endif
+
+  for (i=0; i<qstate_0->state_num; i++) {
+    out = out + conj(qstate_0->camp[i]) * qstate_1->camp[i];
+  }
+  *real = creal(out);
+  *imag = cimag(out);
+
+  SUC_RETURN(true);
+}
+
+bool qstate_tensor_product(QState* qstate_0, QState* qstate_1, void** qstate_out)
+{
+  int		qubit_num;
+  QState*	qstate = NULL;
+  INDEX		i,j;
+
+  if ((qstate_0 == NULL) || (qstate_1 == NULL))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  if (qstate_0->use_gpu != qstate_1->use_gpu)
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+#ifdef USE_GPU
+  if (!(qstate_update_host_memory(qstate_0)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
+  if (!(qstate_update_host_memory(qstate_1)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
+#endif
+
+  qubit_num = qstate_0->qubit_num + qstate_1->qubit_num;
+  if (!(qstate_init(qubit_num, (void**)&qstate, qstate_0->use_gpu)))
+    ERR_RETURN(ERROR_QSTATE_INIT, false);
+
+  INDEX cnt = 0;
+  for (i=0; i<qstate_0->state_num; i++) {
+    for (j=0; j<qstate_1->state_num; j++) {
+      qstate->camp[cnt++] = qstate_0->camp[i] * qstate_1->camp[j];
+    }
+  }
+
+#ifdef USE_GPU
+  if (!(qstate_update_device_memory(qstate)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_DEVICE_MEMORY, false);
+#endif
+
+  *qstate_out = qstate;
+
+  SUC_RETURN(true);
+}
+
+bool qstate_expect_value(QState* qstate, ObservableBase* observ, double* value)
+/* expectation value of the observable (sum of the pauli products, see _qstate_expect_spro) */
+{
+  double	val = 0.0;
+  double	sum = 0.0;
+  int		i;
+
+  if ((qstate == NULL) || (observ == NULL))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+#ifdef USE_GPU
+  if (!(qstate_update_host_memory(qstate)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
+#endif
+
+  for (i=0; i<observ->array_num; i++) {
+    if (!(_qstate_expect_spro(qstate, observ->spro_array[i], &val)))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+    sum += val;
+  }
+
+  *value = sum;
+
+  SUC_RETURN(true);
+}
+
+bool qstate_apply_matrix(QState* qstate, int qnum_part, int* qid,
+			 double* real, double *imag, int row, int col)
+{
+  QState*	qstate_tmp = NULL;
+  INDEX*	index	   = NULL;
+  INDEX*	inv_index  = NULL;
+  COMPLEX	coef	   = 0.0 + 0.0 * COMP_I;
+  int		shift	   = 0;
+  int           N	   = 0;
+  INDEX		ii,iii,jj,jjj;
+  INDEX         i,n;
+  int           k;
+
+  if ((qstate == NULL) || (real == NULL) || (imag == NULL) ||
+      (qstate->state_num < row) || (1<<qnum_part != row) || (row != col))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+#ifdef USE_GPU
+  if (!(qstate_update_host_memory(qstate)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY,false);
+#endif
+
+  if (!(_qstate_copy_host_memory(qstate, (void**)&qstate_tmp)))
+    ERR_RETURN(ERROR_QSTATE_COPY,false);
+
+  index = bit_permutation_array(qstate->state_num, qstate->qubit_num, qnum_part, qid);
+
+  if (!(inv_index = (INDEX*)malloc(sizeof(INDEX)*qstate->state_num)))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY,false);
+  for (n=0; n<qstate->state_num; n++) inv_index[index[n]] = n; 
+
+  shift = qstate->qubit_num-qnum_part;
+  N = 1<<(qstate->qubit_num-shift);
+  
+  for (i=0; i<qstate->state_num; i++) {
+    qstate->camp[i] = 0.0 + 0.0 * COMP_I;
+    ii = index[i]>>shift;
+    iii = index[i]%((INDEX)1 << shift);
+
+    for (k=0; k<N; k++) {
+      INDEX j = inv_index[((INDEX)k<<shift)+iii];
+      jj = index[j]>>shift;
+      jjj = index[j]%((INDEX)1 << shift);
+      coef = real[ii*col+jj] + 1.0 * COMP_I * imag[ii*col+jj];
+      qstate->camp[i] += (coef * qstate_tmp->camp[j]);
+    }
+  }
+
+#ifdef USE_GPU
+  if (!(qstate_update_device_memory(qstate)))
+    ERR_RETURN(ERROR_QSTATE_UPDATE_DEVICE_MEMORY,false);
+#endif
+
+  free(index); index = NULL;
+  free(inv_index); inv_index = NULL;
+  qstate_free(qstate_tmp); qstate_tmp = NULL;
+
+  qstate->prob_updated = false;
+
+  SUC_RETURN(true);
+}
+
+static bool _is_diagonal(COMPLEX* U, int dim)
+{
+  int	i, j;
+
+  for (i=0; i<dim; i++) {
+    for (j=0; j<dim; j++) {
+      if ((i != j) && (U[i * dim + j] != 0.0)) return false;
+    }
+  }
+  return true;
+}
+
+static bool _qstate_operate_qblock(QState* qstate, QBlock* qblock, int* qmap)
+/* operate the block (U must be set) on the qubits qmap[qid] of the qstate */
+{
+  QGate*	qgate = qblock->qgate;
+  int		qid[MAX_FUSION_QUBIT_NUM];
+  int		j;
+
+  if (qblock->gate_num == 1) {
+    if (!(_qstate_operate_gate(qstate, qgate->kind, qblock->U, 1 << kind_get_qid_size(qgate->kind),
+			       qmap[qgate->qid[0]], (qgate->qid[1] < 0) ? -1 : qmap[qgate->qid[1]])))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    SUC_RETURN(true);
+  }
+
+  for (j=0; j<qblock->knum; j++) qid[j] = qmap[qblock->qid[j]];
+  if (_is_diagonal(qblock->U, 1 << qblock->knum) == true) {
+    if (!(_qstate_operate_diagonal_k_in_place(qstate->camp, qblock->U, qstate->qubit_num,
+					      qstate->state_num, qblock->knum, qid)))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
+  else {
+    if (!(_qstate_operate_unitary_k_in_place(qstate->camp, qblock->U, qstate->qubit_num,
+					     qstate->state_num, qblock->knum, qid)))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
+
+  SUC_RETURN(true);
+}
+
+static bool _qstate_swap_bits(QState* qstate, int* pos, int* who, int b_0, int b_1)
+/* swap the qubits at the bit positions b_0 and b_1 (pos: qubit -> bit, who: bit -> qubit) */
+{
+  int	q_0 = who[b_0];
+  int	q_1 = who[b_1];
+
+  if (b_0 == b_1) SUC_RETURN(true);
+
+  if (!(_qstate_operate_swap_in_place(qstate->camp, qstate->qubit_num, qstate->state_num,
+				      qstate->qubit_num - b_0 - 1, qstate->qubit_num - b_1 - 1,
+				      1, 2)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  who[b_0] = q_1; pos[q_1] = b_0;
+  who[b_1] = q_0; pos[q_0] = b_1;
+
+  SUC_RETURN(true);
+}
+
+static bool _qstate_operate_qblocks_cached(QState* qstate, QBlock* qblock, int block_num,
+					   int cache_num, bool relabel)
+/*
+ * operate the blocks, where the runs of consecutive blocks acting on the low-order
+ * 'cache_num' bits only are operated chunk by chunk of 2^cache_num amplitudes, so that
+ * a run sweeps the state vector once (not once per block).
+ * if relabel, the qubits of a run on the high-order bits are swapped to the low-order bits
+ * beforehand when the swaps are cheaper than the sweeps saved (restored at the end).
+ */
+{
+  int		qubit_num = qstate->qubit_num;
+  int		pos[MAX_QUBIT_NUM];  /* bit position of each qubit */
+  int		who[MAX_QUBIT_NUM];  /* qubit at each bit position */
+  int		qmap[MAX_QUBIT_NUM];
+  char		in_run[MAX_QUBIT_NUM];
+  int		head, tail, run_qnum, high_num, add, q, b, i, j;
+  INDEX		c;
+  bool		low, ans;
+
+  for (q=0; q<qubit_num; q++) {
+    pos[q] = qubit_num - q - 1;
+    who[pos[q]] = q;
+  }
+
+  head = 0;
+  while (head < block_num) {
+
+    /* longest run from the head acting on 'cache_num' qubits or less */
+    for (q=0; q<qubit_num; q++) in_run[q] = 0;
+    run_qnum = 0;
+    high_num = 0;
+    for (tail=head; tail<block_num; tail++) {
+      for (j=0, add=0; j<qblock[tail].knum; j++) if (in_run[qblock[tail].qid[j]] == 0) add++;
+      if (run_qnum + add > cache_num) break;
+      for (j=0; j<qblock[tail].knum; j++) {
+	q = qblock[tail].qid[j];
+	if (in_run[q] == 1) continue;
+	in_run[q] = 1;
+	run_qnum++;
+	if (pos[q] >= cache_num) high_num++;
+      }
+    }
+
+    /* relabel the high-order qubits of the run to the free low-order bits (highest first,
+       where the strides are long enough for the vectorized kernels) */
+    if ((high_num > 0) && (relabel == true) && (4 * high_num < tail - head)) {
+      for (q=0, b=cache_num-1; q<qubit_num; q++) {
+	if ((in_run[q] == 0) || (pos[q] < cache_num)) continue;
+	while (in_run[who[b]] == 1) b--;
+	if (!(_qstate_swap_bits(qstate, pos, who, pos[q], b)))
+	  ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+      }
+      high_num = 0;
+    }
+
+    /* otherwise the leading blocks on the low-order bits only */
+    if (high_num > 0) {
+      for (tail=head; tail<block_num; tail++) {
+	for (j=0, low=true; j<qblock[tail].knum; j++) {
+	  if (pos[qblock[tail].qid[j]] >= cache_num) low = false;
+	}
+	if (low == false) break;
+      }
+    }
+
+    if (tail - head >= 2) { /* chunk by chunk */
+      for (q=0; q<qubit_num; q++) qmap[q] = cache_num - pos[q] - 1;
+      ans = true;
+#     pragma omp parallel for private(i) shared(ans)
+      for (c=0; c<(qstate->state_num >> cache_num); c++) {
+	QState	chunk = *qstate;
+	chunk.camp = qstate->camp + (c << cache_num);
+	chunk.qubit_num = cache_num;
+	chunk.state_num = (INDEX)1 << cache_num;
+	for (i=head; i<tail; i++) {
+	  if (!(_qstate_operate_qblock(&chunk, &qblock[i], qmap))) ans = false;
+	}
+      }
+      if (ans == false) ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+    }
+    else { /* the whole state vector */
+      if (tail == head) tail++;
+      for (q=0; q<qubit_num; q++) qmap[q] = qubit_num - pos[q] - 1;
+      for (i=head; i<tail; i++) {
+	if (!(_qstate_operate_qblock(qstate, &qblock[i], qmap)))
+	  ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+      }
+    }
+    head = tail;
+  }
+
+  /* restore the order of the qubits */
+  for (b=0; b<qubit_num; b++) {
+    if (!(_qstate_swap_bits(qstate, pos, who, b, pos[qubit_num - b - 1])))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+  }
+
+  SUC_RETURN(true);
+}
+
+static bool _qstate_operate_qblocks(QState* qstate, QBlock* qblock, int block_num,
+				    int cache_num, bool relabel)
+/*
+ * operate the blocks (U must be set)
+ * (cache blocking if 0 < cache_num < qubit_num, see _qstate_operate_qblocks_cached)
+ */
+{
+  int		qmap[MAX_QUBIT_NUM];
+  int		i, q;
+
+  if ((cache_num > 0) && (cache_num < qstate->qubit_num)) {
+    if (!(_qstate_operate_qblocks_cached(qstate, qblock, block_num, cache_num, relabel)))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+  }
+  else {
+    for (q=0; q<qstate->qubit_num; q++) qmap[q] = q;
+    for (i=0; i<block_num; i++) {
+      if (!(_qstate_operate_qblock(qstate, &qblock[i], qmap)))
+	ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+    }
+  }
+
+  SUC_RETURN(true);
+}
+
+#ifdef IN_PLACE
+
+static bool _qstate_operate_fused_unitary(QState* qstate, QGate** qgate_inout, int fuse_num,
+					  int cache_num, bool relabel)
+/*
+ * operate the fused blocks of the consecutive unitary gates starting from '*qgate_inout'
+ */
+{
+  QBlock*	qblock	  = NULL;
+  QGate*	qgate	  = NULL;
+  int		block_num = 0;
+  int		dim	  = 0;
+  int		i;
+
+  if (!(qgate_get_next_fused_blocks((void**)qgate_inout, qstate->gbank, fuse_num, &block_num,
+				    (void**)&qblock)))
+    ERR_RETURN(ERROR_QGATE_GET_NEXT_UNITARY, false);
+
+  /* matrices of the blocks of single gate */
+  for (i=0; i<block_num; i++) {
+    if (qblock[i].gate_num != 1) continue;
+    qgate = qblock[i].qgate;
+    if (!(gbank_get_unitary(qstate->gbank, qgate->kind, qgate->para[0], qgate->para[1],
+			    qgate->para[2], &dim, (void**)&qblock[i].U)))
+      ERR_RETURN(ERROR_GBANK_GET_UNITARY, false);
+  }
+
+  if (!(_qstate_operate_qblocks(qstate, qblock, block_num, cache_num, relabel)))
+    ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+  qblock_free(qblock, block_num); qblock = NULL;
+
+  SUC_RETURN(true);
+}
+
+#endif
+
+static bool _qstate_operate_next_unitary(QState* qstate, QGate** qgate_inout, int fuse_num,
+					 int cache_num, bool relabel)
+/*
+ * operate the unitary gates (composite if possible) starting from '*qgate_inout'
+ * (fuse the gates acting on 'fuse_num' qubits or less into a block if fuse_num >= 2,
+ *  and operate the blocks cache-blocked by 'cache_num' low-order qubits if cache_num > 0)
+ */
+{
+  int		dim   = 0;
+  int           q0    = -1;
+  int           q1    = -1;
+  COMPLEX*	U     = NULL;
+  bool          compo = false;  /* U is composite or not */
+
+  if (kind_is_multi_qubit((*qgate_inout)->kind) == true) {
+    if (!(_qstate_operate_multi_qubit_gate(qstate, *qgate_inout)))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+    SUC_RETURN(true);
+  }
+
+#ifdef IN_PLACE
+  if ((fuse_num >= 2) && (qstate->use_gpu == false)) {
+    if (!(_qstate_operate_fused_unitary(qstate, qgate_inout, fuse_num, cache_num, relabel)))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+    SUC_RETURN(true);
+  }
+#endif
+
+  if (!(qgate_get_next_unitary((void**)qgate_inout, qstate->gbank, &dim, &q0, &q1, (void**)&U, &compo))) {
+    ERR_RETURN(ERROR_QGATE_GET_NEXT_UNITARY, false);
+  }
+
+  /* operate unitary matrix */
+  if (compo == false) {
+    if (!(_qstate_operate_gate(qstate, (*qgate_inout)->kind, U, dim, q0, q1))) {
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    }
+  }
+  else {
+    if (!(_qstate_operate_unitary(qstate, U, dim, q0, q1))) {
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    }
+  }
+  free(U); U = NULL;
+
+  SUC_RETURN(true);
+}
+
+static bool _qstate_operate_qcirc_cpu(QState* qstate, CMem* cmem, QCirc* qcirc,
+				      bool measure_update, int fuse_num, int cache_num, bool relabel)
+/* one shot execution */
+{
+  QGate*        qgate = NULL;   /* quantum gate in quantum circuit */
+  int		mnum  = 0;
+  int*		qid   = NULL;
+  int*		cid   = NULL;
+  bool		last  = false;
+  char*		measured_char = NULL;
+  int i;
+
+  /* error check */
+  if ((qstate == NULL || qcirc == NULL) ||
+      (qstate->qubit_num < qcirc->qubit_num) ||
+      (cmem != NULL && cmem->cmem_num < qcirc->cmem_num))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+  /* malloc */
+  if (cmem != NULL) {
+    if (!(cid = (int*)malloc(sizeof(int) * cmem->cmem_num)))
+      ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+
+    if (!(measured_char = (char*)malloc(sizeof(int) * cmem->cmem_num)))
+      ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  }
+  if (!(qid = (int*)malloc(sizeof(int) * qstate->qubit_num)))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+
+  /* execute quantum circuit */
+  qgate = qcirc->first;
+  while (qgate != NULL) {
+
+    if ((qgate->ctrl == -1) ||
+	((qgate->ctrl != -1) && (cmem->bit_array[qgate->ctrl] == 1))) {
+
+      /* unitary gate */
+      if (kind_is_unitary(qgate->kind) == true) {
+	if (!(_qstate_operate_next_unitary(qstate, &qgate, fuse_num, cache_num, relabel)))
+	  ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+	qgate = qgate->next;
+      }
+      /* reset */
+      else if (kind_is_reset(qgate->kind) == true) {
+	if (!(qstate_reset(qstate, 1, qgate->qid)))
+	  ERR_RETURN(ERROR_CANT_RESET, false);
+	qgate = qgate->next;
+      }
+      /* measurement */
+      else if (kind_is_measurement(qgate->kind) == true) {
+
+	if (!(qgate_get_measurement_attributes((void**)&qgate, qstate->gbank, &mnum, qid, cid, &last))) {
+	  ERR_RETURN(ERROR_QGATE_GET_NEXT_UNITARY, false);
+	}
+	if (!(qstate_measure(qstate, mnum, qid, measured_char, measure_update)))
+	  ERR_RETURN(ERROR_QSTATE_MEASURE, false);
+	for (i=0; i<mnum; i++) {
+	  cmem->bit_array[cid[i]] = measured_char[i];
+	}
+	qgate = qgate->next;
+      }
+      else {
+	ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+      }
+    }
+    else {
+      qgate = qgate->next;
+    }
+  }
+
+  /* free */
+  if (cmem != NULL) {
+    free(cid); cid = NULL;
+    free(measured_char); measured_char = NULL;
+  }
+  free(qid); qid = NULL;
+
+  qstate->prob_updated = false;
+
+  SUC_RETURN(true);
+}
+
+static bool _qstate_operate_qcirc_branch_cpu(QState* qstate, CMem* cmem, QGate* qgate_start,
+					     int shots, char* mchar_shots, int* mchar_count,
+					     int* mchar_num, int fuse_num, int cache_num, bool relabel)
+/*
+ * shot-branching execution of the gates from 'qgate_start' for 'shots' shots.
+ * at each measurement the outcomes of all the shots are sampled at once and
+ * the shots are distributed to the branches (one branch per distinct outcome),
+ * so the gates between measurements are operated once per branch, not once per shot.
+ * each branch adds one row of classical memory and its count of shots
+ * (mchar_shots[row * cmem_num + j], mchar_count[row], row = *mchar_num ...).
+ * the nested branches hold one copy of the qstate each, so if the memory is not enough
+ * for the copy of a branch and one more, the shots of the branch are operated one by one
+ * on a single copy (one row per shot).
+ * the qstate and cmem are updated to the branch of one sampled shot.
+ */
+{
+  QGate*        qgate	      = qgate_start;
+  QState*	qstate_branch = NULL;
+  CMem*		cmem_branch   = NULL;
+  int		mnum	      = 0;
+  int*		qid	      = NULL;
+  int*		cid	      = NULL;
+  bool		last	      = false;
+  INDEX*	mval	      = NULL; /* distinct measured values */
+  int*		count	      = NULL; /* number of shots for each measured value */
+  int		num	      = 0;
+  int		self	      = 0;    /* branch to which this qstate goes */
+  int		branch_shots  = 0;    /* number of shots operated on a copy at once */
+  size_t	avail_mem     = 0;
+  size_t	state_size    = 0;
+  int		r, i, k, s;
+
+  if ((qstate == NULL) || (shots < 1) || (mchar_count == NULL) || (mchar_num == NULL))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  /* malloc */
+  if (cmem != NULL) {
+    if (!(cid = (int*)malloc(sizeof(int) * cmem->cmem_num)))
+      ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  }
+  if (!(qid = (int*)malloc(sizeof(int) * qstate->qubit_num)))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(mval = (INDEX*)malloc(sizeof(INDEX) * MIN(shots, qstate->state_num))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(count = (int*)malloc(sizeof(int) * MIN(shots, qstate->state_num))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+
+  /* execute quantum circuit */
+  while (qgate != NULL) {
+
+    if ((qgate->ctrl != -1) && (cmem->bit_array[qgate->ctrl] != 1)) {
+      qgate = qgate->next;
+      continue;
+    }
+
+    /* unitary gate */
+    if (kind_is_unitary(qgate->kind) == true) {
+      if (!(_qstate_operate_next_unitary(qstate, &qgate, fuse_num, cache_num, relabel)))
+	ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+    }
+    /* reset */
+    else if (kind_is_reset(qgate->kind) == true) {
+      if (!(qstate_reset(qstate, 1, qgate->qid)))
+	ERR_RETURN(ERROR_CANT_RESET, false);
+    }
+    /* measurement */
+    else if (kind_is_measurement(qgate->kind) == true) {
+
+      if (!(qgate_get_measurement_attributes((void**)&qgate, qstate->gbank, &mnum, qid, cid, &last))) {
+	ERR_RETURN(ERROR_QGATE_GET_NEXT_UNITARY, false);
+      }
+
+      /* sample the measured values of all the shots */
+      if (!(_qstate_sample_measured_values(qstate, shots, mnum, qid, mval, count, &num)))
+	ERR_RETURN(ERROR_QSTATE_MEASURE, false);
+
+      /* select the branch of this qstate (with probability count[k] / shots) */
+      r = (int)(rng_real2(qstate->rng) * shots);
+      for (self=0; self<num-1; self++) {
+	if (r < count[self]) break;
+	r -= count[self];
+      }
+
+      /* other branches (operate the rest of the circuit on the copies) */
+      for (k=0; k<num; k++) {
+	if (k == self) continue;
+
+	if (last == true) { /* no gates after the measurement -> store the classical memory only */
+	  memcpy(&mchar_shots[*mchar_num * cmem->cmem_num], cmem->bit_array,
+		 sizeof(char) * cmem->cmem_num);
+	  for (i=0; i<mnum; i++) {
+	    mchar_shots[*mchar_num * cmem->cmem_num + cid[i]] = (mval[k] >> (mnum - 1 - i)) % 2;
+	  }
+	  mchar_count[*mchar_num] = count[k];
+	  (*mchar_num)++;
+	  continue;
+	}
+
+	/* one by one if the memory is not enough for the nested branches */
+	branch_shots = count[k];
+	if (qstate->qubit_num >= MEMCHECK_QUBIT_NUM) {
+	  avail_mem = get_available_memory();
+	  state_size = sizeof(COMPLEX) * (size_t)qstate->state_num;
+	  if ((avail_mem > 0) && (state_size > avail_mem))
+	    ERR_RETURN(ERROR_NOT_ENOUGH_MEMORY, false);
+	  if ((avail_mem > 0) && (2 * state_size > avail_mem)) branch_shots = 1;
+	}
+
+	for (s=0; s<count[k]; s+=branch_shots) {
+	  if (!(qstate_copy(qstate, (void**)&qstate_branch)))
+	    ERR_RETURN(ERROR_QSTATE_COPY, false);
+	  if (!(cmem_copy(cmem, (void**)&cmem_branch)))
+	    ERR_RETURN(ERROR_CMEM_COPY, false);
+
+	  if (!(_qstate_project_measured(qstate_branch, mnum, qid, mval[k])))
+	    ERR_RETURN(ERROR_QSTATE_MEASURE, false);
+	  for (i=0; i<mnum; i++) {
+	    cmem_branch->bit_array[cid[i]] = (mval[k] >> (mnum - 1 - i)) % 2;
+	  }
+
+	  /* a single shot never branches (no more copies) */
+	  if (!(_qstate_operate_qcirc_branch_cpu(qstate_branch, cmem_branch, qgate->next,
+						 branch_shots, mchar_shots, mchar_count, mchar_num,
+						 fuse_num, cache_num, relabel)))
+	    ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+
+	  qstate_free(qstate_branch); qstate_branch = NULL;
+	  cmem_free(cmem_branch); cmem_branch = NULL;
+	}
+      }
+
+      /* this branch */
+      if (!(_qstate_project_measured(qstate, mnum, qid, mval[self])))
+	ERR_RETURN(ERROR_QSTATE_MEASURE, false);
+      for (i=0; i<mnum; i++) {
+	cmem->bit_array[cid[i]] = (mval[self] >> (mnum - 1 - i)) % 2;
+      }
+      shots = count[self];
+    }
+    else {
+      ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+    }
+
+    qgate = qgate->next;
+  }
+
+  /* store the classical memory and the number of shots of this branch */
+  if (cmem != NULL) {
+    memcpy(&mchar_shots[*mchar_num * cmem->cmem_num], cmem->bit_array,
+	   sizeof(char) * cmem->cmem_num);
+  }
+  mchar_count[*mchar_num] = shots;
+  (*mchar_num)++;
+
+  /* free */
+  if (cmem != NULL) {
+    free(cid); cid = NULL;
+  }
+  free(qid); qid = NULL;
+  free(mval); mval = NULL;
+  free(count); count = NULL;
+
+  qstate->prob_updated = false;
+
+  SUC_RETURN(true);
+}
+
+static bool _qstate_operate_qcirc_shot_parallel_cpu(QState* qstate, CMem* cmem, QGate* qgate_start,
+						    int shots, char* mchar_shots, int* mchar_count,
+						    int* mchar_num, int fuse_num, int cache_num,
+						    bool relabel)
+/*
+ * shot-parallel execution of the gates from 'qgate_start' for 'shots' shots.
+ * the shots are divided into SHOT_PARALLEL_CHUNK_NUM chunks (or less) and each chunk is
+ * executed by shot-branching (see _qstate_operate_qcirc_branch_cpu) on its own pair of
+ * qstate and cmem in parallel. the chunk c draws the random numbers from the stream c
+ * of the key drawn from qstate->rng, so the result doesn't depend on the thread number
+ * (the chunks are executed one by one on a single thread).
+ * the rows of the chunks are stored in the chunk order (rows are not merged).
+ * the qstate and cmem are updated to the branch of one sampled shot (of the chunk 0).
+ */
+{
+  QState**	qstate_chunk = NULL;
+  CMem**	cmem_chunk   = NULL;
+  int*		row_start    = NULL; /* first row of each chunk */
+  int*		row_num	     = NULL; /* number of rows of each chunk */
+  int		chunk_num    = MIN(shots, SHOT_PARALLEL_CHUNK_NUM);
+  int		cmem_num     = (cmem == NULL) ? 0 : cmem->cmem_num;
+  unsigned long long key     = 0;
+  Rng		rng_self;
+  bool		ok	     = true;
+  int		c, row;
+
+  if ((qstate == NULL) || (shots < 1) || (mchar_count == NULL) || (mchar_num == NULL))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  /* malloc */
+  if (!(qstate_chunk = (QState**)calloc(chunk_num, sizeof(QState*))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(cmem_chunk = (CMem**)calloc(chunk_num, sizeof(CMem*))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(row_start = (int*)malloc(sizeof(int) * chunk_num)))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(row_num = (int*)malloc(sizeof(int) * chunk_num)))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+
+  /* private qstate and cmem of each chunk (the chunk 0 operates on the original ones) */
+  key = rng_uint64(qstate->rng);
+  qstate_chunk[0] = qstate;
+  cmem_chunk[0] = cmem;
+  for (c=1; c<chunk_num; c++) {
+    if (!(qstate_copy(qstate, (void**)&qstate_chunk[c])))
+      ERR_RETURN(ERROR_QSTATE_COPY, false);
+    rng_init(qstate_chunk[c]->rng, key, c);
+    if ((cmem != NULL) && !(cmem_copy(cmem, (void**)&cmem_chunk[c])))
+      ERR_RETURN(ERROR_CMEM_COPY, false);
+  }
+  rng_self = *(qstate->rng);
+  rng_init(qstate->rng, key, 0);
+
+  /* each chunk has the rows as many as its shots at most */
+  row = 0;
+  for (c=0; c<chunk_num; c++) {
+    row_start[c] = row;
+    row_num[c] = 0;
+    row += shots / chunk_num + ((c < shots % chunk_num) ? 1 : 0);
+  }
+
+# pragma omp parallel for schedule(dynamic, 1)
+  for (c=0; c<chunk_num; c++) {
+    if (!(_qstate_operate_qcirc_branch_cpu(qstate_chunk[c], cmem_chunk[c], qgate_start,
+					   shots / chunk_num + ((c < shots % chunk_num) ? 1 : 0),
+					   &mchar_shots[row_start[c] * cmem_num],
+					   &mchar_count[row_start[c]], &row_num[c], fuse_num,
+					   cache_num, relabel))) {
+#     pragma omp atomic write
+      ok = false;
+    }
+  }
+  if (ok == false) ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+
+  /* gather the rows of the chunks */
+  row = 0;
+  for (c=0; c<chunk_num; c++) {
+    memmove(&mchar_shots[row * cmem_num], &mchar_shots[row_start[c] * cmem_num],
+	    sizeof(char) * row_num[c] * cmem_num);
+    memmove(&mchar_count[row], &mchar_count[row_start[c]], sizeof(int) * row_num[c]);
+    row += row_num[c];
+  }
+  *mchar_num = row;
+
+  /* free */
+  *(qstate->rng) = rng_self;
+  for (c=1; c<chunk_num; c++) {
+    qstate_free(qstate_chunk[c]); qstate_chunk[c] = NULL;
+    cmem_free(cmem_chunk[c]); cmem_chunk[c] = NULL;
+  }
+  free(qstate_chunk); qstate_chunk = NULL;
+  free(cmem_chunk); cmem_chunk = NULL;
+  free(row_start); row_start = NULL;
+  free(row_num); row_num = NULL;
+
+  SUC_RETURN(true);
+}
+
+bool qstate_operate_qcirc(QState* qstate, CMem* cmem, QCirc* qcirc, int shots, char* mchar_shots,
+			  int* mchar_count, int* mchar_num, bool out_state, int fuse_num,
+			  int cache_num, bool relabel)
+/*
+ * shots times execution
+ * the consecutive unitary gates acting on 'fuse_num' qubits or less are fused into
+ * a block (no fusion if fuse_num < 2, see qgate_get_next_fused_blocks)
+ * the runs of the blocks acting on the low-order 'cache_num' qubits are operated
+ * chunk by chunk of 2^cache_num amplitudes (no cache blocking if cache_num = 0),
+ * where the qubits are relabelled to the low-order ones if relabel is true
+ * the measured classical memories are stored as the distinct rows and the counts:
+ * mchar_shots[row * cmem_num + j], mchar_count[row] (row = 0,1,...,*mchar_num-1),
+ * where mchar_shots and mchar_count must have shots * cmem_num, shots elements.
+ * the shots of the circuit with mid-circuit measurements are run in parallel threads
+ * if the qubit number is SHOT_PARALLEL_QUBIT_NUM or less (see _qstate_operate_qcirc_shot_parallel_cpu).
+ */
+{
+  int		i, j, k;
+  QCirc*	qcirc_uonly    = NULL;
+  QCirc*	qcirc_mixed    = NULL;
+  QCirc*	qcirc_monly    = NULL;
+#ifdef USE_GPU
+  QState*	qstate_tmp     = NULL;
+#endif
+  bool		measure_update = true;
+  QGate*        qgate	       = NULL;
+  int		mnum	       = 0;
+  int*		qid	       = NULL;
+  int*		cid	       = NULL;
+  bool		last	       = false;
+  INDEX*	mval	       = NULL;
+  int		num	       = 0;
+  int		r	       = 0;
+
+  if ((qstate == NULL) || (qcirc == NULL) || (mchar_num == NULL) ||
+      (fuse_num > MAX_FUSION_QUBIT_NUM) ||
+      ((cache_num != 0) && (cache_num < MAX_FUSION_QUBIT_NUM)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+
+  *mchar_num = 0;
+
+  if (!(qcirc_decompose(qcirc, (void**)&qcirc_uonly, (void**)&qcirc_mixed, (void**)&qcirc_monly)))
+    ERR_RETURN(ERROR_QCIRC_DECOMPOSE, false);
+  
+  if (qstate->use_gpu == false) {
+
+    if (qcirc_uonly != NULL) { /* unitary only */
+      measure_update = true; /* not efficient because of including no measurements */
+      if (!(_qstate_operate_qcirc_cpu(qstate, cmem, qcirc_uonly, measure_update, fuse_num,
+				      cache_num, relabel)))
+	ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+      qcirc_free(qcirc_uonly); qcirc_uonly = NULL;
+    }
+    
+    if ((qcirc_mixed != NULL) && (qstate->qubit_num <= SHOT_PARALLEL_QUBIT_NUM) && (shots > 1)) {
+      /* shot-parallel: the state is too small for the parallel gate operations */
+      if (!(_qstate_operate_qcirc_shot_parallel_cpu(qstate, cmem, qcirc_mixed->first, shots,
+						    mchar_shots, mchar_count, mchar_num, fuse_num,
+						    cache_num, relabel)))
+	ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+      qcirc_free(qcirc_mixed); qcirc_mixed = NULL;
+    }
+
+    else if (qcirc_mixed != NULL) { /* unitary and non-unitary mixed */
+      /* shot-branching: the shots share the state until the measured values differ */
+      if (!(_qstate_operate_qcirc_branch_cpu(qstate, cmem, qcirc_mixed->first, shots,
+					     mchar_shots, mchar_count, mchar_num, fuse_num,
+					     cache_num, relabel)))
+	ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+      qcirc_free(qcirc_mixed); qcirc_mixed = NULL;
+    }
+    
+    else if (qcirc_monly != NULL) { /* measurement only */
+
+      if (!(cid = (int*)malloc(sizeof(int) * cmem->cmem_num)))
+	ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+      if (!(qid = (int*)malloc(sizeof(int) * qstate->qubit_num)))
+	ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+      if (!(mval = (INDEX*)malloc(sizeof(INDEX) * MIN(shots, qstate->state_num))))
+	ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+
+      qgate = qcirc_monly->first;
+      if (!(qgate_get_measurement_attributes((void**)&qgate, qstate->gbank, &mnum, qid, cid, &last))) {
+	ERR_RETURN(ERROR_QGATE_GET_NEXT_UNITARY, false);
+      }
+
+      /* shots times measurements at once (qstate is not updated) */
+      if (!(_qstate_sample_measured_values(qstate, shots, mnum, qid, mval, mchar_count, &num)))
+	ERR_RETURN(ERROR_QSTATE_MEASURE, false);
+      for (k=0; k<num; k++) {
+	for (j=0; j<cmem->cmem_num; j++) {
+	  mchar_shots[k * cmem->cmem_num + j] = cmem->bit_array[j];
+	}
+	for (i=0; i<mnum; i++) {
+	  mchar_shots[k * cmem->cmem_num + cid[i]] = (mval[k] >> (mnum - 1 - i)) % 2;
+	}
+      }
+      *mchar_num = num;
+
+      /* classical memory of one sampled shot */
+      r = (int)(rng_real2(qstate->rng) * shots);
+      for (k=0; k<num-1; k++) {
+	if (r < mchar_count[k]) break;
+	r -= mchar_count[k];
+      }
+      memcpy(cmem->bit_array, &mchar_shots[k * cmem->cmem_num], sizeof(char) * cmem->cmem_num);
+
+      free(cid); cid = NULL;
+      free(qid); qid = NULL;
+      free(mval); mval = NULL;
+
+      qcirc_free(qcirc_monly); qcirc_monly = NULL;
+    }
+  }
+
+#ifdef USE_GPU
+  else if (qstate->use_gpu == true) {
+
+    if (qcirc_uonly != NULL) { /* unitary only */
+      measure_update = true; /* not efficient because of including no measurements */
+      if (!(qstate_operate_qcirc_gpu(qstate, cmem, qcirc_uonly, measure_update)))
+	ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+      qcirc_free(qcirc_uonly); qcirc_uonly = NULL;
+    }
+
+    if (qcirc_mixed != NULL) { /* unitary and non-unitary mixed */
+      measure_update = true;
+      for (i=0; i<shots-1; i++) {
+	if (!(qstate_copy(qstate, (void**)&qstate_tmp)))
+	  ERR_RETURN(ERROR_QSTATE_COPY, false);
+	if (!(qstate_operate_qcirc_gpu(qstate_tmp, cmem, qcirc_mixed, measure_update)))
+	  ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+	for (j=0; j<cmem->cmem_num; j++) {
+	  mchar_shots[i * cmem->cmem_num + j] = cmem->bit_array[j];
+	}
+	qstate_free(qstate_tmp); qstate_tmp = NULL;
       }
-    }
-    pre = now; now++;
-  }
-  
-  /* operate Rz(-2.0*t) */
-  now = spro->spin_num-1;
-  qubit_id[0] = now;
-  if (!(qstate_operate_qgate(qstate, ROTATION_Z, -2.0*time, 0.0, 1.0, qubit_id)))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-
-  pre = now; now--;
-  while (pre >= 0) {
-    /* operate nothing */
-    if ((now >= 0) && (spro->spin_type[now] == NONE)) {
-      now--;
-      if (now >= 0) continue;
-    }
-    /* operate CX */
-    if (now >= 0) {
-      if ((spro->spin_type[pre] != NONE) && (spro->spin_type[now] != NONE)) {
-	qubit_id[0] = now;
-	qubit_id[1] = pre;
-	if (!(qstate_operate_qgate(qstate, CONTROLLED_X, 0.0, 0.0, 1.0, qubit_id)))
-	  ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+      if (!(qstate_operate_qcirc_gpu(qstate, cmem, qcirc_mixed, measure_update)))
+	ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+      for (j=0; j<cmem->cmem_num; j++) {
+	mchar_shots[(shots - 1) * cmem->cmem_num + j] = cmem->bit_array[j];
       }
+      for (i=0; i<shots; i++) mchar_count[i] = 1;
+      *mchar_num = shots;
+      qcirc_free(qcirc_mixed); qcirc_mixed = NULL;
     }
-    /* operate G+: G+=H (if PauliX), G+=Rx(+0.5) (if PauliY), G+=I (if PauliZ) */
-    if (spro->spin_type[pre] == SIGMA_X) {
-      qubit_id[0] = pre;
-      if (!(qstate_operate_qgate(qstate, HADAMARD, 0.0, 0.0, 1.0, qubit_id)))
-	ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-    }
-    else if (spro->spin_type[pre] == SIGMA_Y) {
-      qubit_id[0] = pre;
-      if (!(qstate_operate_qgate(qstate, ROTATION_X, 0.5, 0.0, 1.0, qubit_id)))
-	ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-    }
-    else if (spro->spin_type[pre] == SIGMA_Z) {
-      ;
-    }
-    else if (spro->spin_type[pre] == NONE) {
-      ;
-    }
-    else {
-      ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+
+    else if (qcirc_monly != NULL) { /* measurement only */
+      /* shots times meaurements */
+      if (!(qstate_operate_measure_gpu(qstate, cmem, qcirc_monly, shots, mchar_shots, out_state)))
+	ERR_RETURN(ERROR_QSTATE_OPERATE_MEASURE, false);
+      for (i=0; i<shots; i++) mchar_count[i] = 1;
+      *mchar_num = shots;
+      qcirc_free(qcirc_monly); qcirc_monly = NULL;
     }
-    pre = now; now--;
   }
-  
+#endif
+
+  else {
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
+    
+  qstate->prob_updated = false;
+
   SUC_RETURN(true);
 }
 
-bool qstate_evolve(QState* qstate, ObservableBase* observ, double time, int iter)
+static bool _qstate_reduced_densop_1q(QState* qstate, int q, COMPLEX* rho)
+/* reduced density operator of the qubit q (rho[i * 2 + j] = <i|rho|j>) */
 {
-  double	t = time / iter;
-  int		i,j;
-  
-  if ((qstate == NULL) || (observ == NULL) || (iter < 1))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-
-  for (i=0; i<iter; i++) {
-    for (j=0; j<observ->array_num; j++) {
-      if (!(_qstate_evolve_spro(qstate, observ->spro_array[j], t)))
-	ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-    }
+  int		nn    = qstate->qubit_num - q - 1;
+  double	r00   = 0.0;
+  double	r11   = 0.0;
+  double	re01  = 0.0;
+  double	im01  = 0.0;
+  INDEX		k;
+
+# pragma omp parallel for reduction(+:r00,r11,re01,im01)
+  for (k=0; k<(qstate->state_num >> 1); k++) {
+    INDEX	i0 = INSERT_ZERO_BIT(k, nn);
+    INDEX	i1 = i0 | ((INDEX)1 << nn);
+    COMPLEX	a0 = qstate->camp[i0];
+    COMPLEX	a1 = qstate->camp[i1];
+    COMPLEX	c  = a0 * conj(a1);
+    r00 += creal(a0 * conj(a0));
+    r11 += creal(a1 * conj(a1));
+    re01 += creal(c);
+    im01 += cimag(c);
   }
+  rho[0] = r00;
+  rho[1] = re01 + im01 * COMP_I;
+  rho[2] = re01 - im01 * COMP_I;
+  rho[3] = r11;
 
   SUC_RETURN(true);
 }
 
-static bool _qstate_add(QState* qstate, QState* qstate_add)
+static bool _qstate_operate_channel(QState* qstate, int q, Noise* noise, int chan, int start)
+/*
+ * operate the noise channel 'chan' on the qubit q (one kraus operator sampled).
+ * the kraus operators of the channel are noise->kraus[(start + k) * 8 ...].
+ * a mixture of unitaries is sampled by the probabilities without the quantum state,
+ * otherwise by the probabilities <psi|K^dag K|psi> from the reduced density operator.
+ */
 {
-  int i;
-
-  if ((qstate == NULL) || (qstate_add == NULL))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-
-  if (qstate->state_num != qstate_add->state_num)
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-
-  for (i=0; i<qstate->state_num; i++) {
-    qstate->camp[i] = qstate->camp[i] + qstate_add->camp[i];
+  int		num  = noise->kraus_num[chan];
+  double*	K    = NULL;
+  COMPLEX	U[4];
+  COMPLEX	rho[4];
+  double	p    = 0.0;
+  double	p_k  = 0.0;
+  double	r    = rng_real2(qstate->rng);
+  int		kk   = -1;   /* sampled operator */
+  int		i, j, l, k;
+
+  if (noise->prob[start] >= 0.0) { /* mixture of unitaries */
+    for (k=0; k<num-1; k++) {
+      if (r < noise->prob[start + k]) break;
+      r -= noise->prob[start + k];
+    }
+    p = 1.0;
+  }
+  else {
+    if (!(_qstate_reduced_densop_1q(qstate, q, rho)))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+    for (k=0; k<num; k++) {
+      K = &noise->kraus[(start + k) * 8];
+      p_k = 0.0;
+      for (i=0; i<2; i++) {
+	for (j=0; j<2; j++) {
+	  for (l=0; l<2; l++) { /* (K rho K^dag)_ii */
+	    p_k += creal((K[(i*2+j)*2] + K[(i*2+j)*2+1] * COMP_I) * rho[j*2+l] *
+			 (K[(i*2+l)*2] - K[(i*2+l)*2+1] * COMP_I));
+	  }
+	}
+      }
+      if (p_k <= 0.0) continue; /* never sampled */
+      kk = k;
+      p = p_k;
+      if (r < p_k) break;
+      r -= p_k;
+    }
+    if (kk < 0) ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+    k = kk;
   }
 
-  qstate->prob_updated = false;
+  /* the identity (up to the phase) is skipped */
+  K = &noise->kraus[(start + k) * 8];
+  if ((fabs(K[2]) < MIN_DOUBLE) && (fabs(K[3]) < MIN_DOUBLE) &&
+      (fabs(K[4]) < MIN_DOUBLE) && (fabs(K[5]) < MIN_DOUBLE) &&
+      (fabs(K[0] - K[6]) < MIN_DOUBLE) && (fabs(K[1] - K[7]) < MIN_DOUBLE) &&
+      (fabs(K[0] * K[0] + K[1] * K[1] - p) < MIN_DOUBLE))
+    SUC_RETURN(true);
+
+  for (i=0; i<4; i++) U[i] = (K[i*2] + K[i*2+1] * COMP_I) / sqrt(p);
+  if (!(_qstate_operate_unitary(qstate, U, 2, q, -1)))
+    ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
 
   SUC_RETURN(true);
 }
 
-static bool _qstate_mul(QState* qstate, double mul)
+static bool _qstate_operate_noise(QState* qstate, QGate* qgate, Noise* noise)
+/* operate the noise channels of the gate kind on each qubit of the gate */
 {
-  int i;
-  
-  if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-
-  for (i=0; i<qstate->state_num; i++) {
-    qstate->camp[i] = mul * qstate->camp[i];
+  int		qid[MAX_QEXT_NUM + 2];
+  int		qnum  = 0;
+  int		start = 0;
+  int		chan, i;
+
+  qid[qnum++] = qgate->qid[0];
+  if (qgate->qid[1] >= 0) qid[qnum++] = qgate->qid[1];
+  for (i=0; i<qgate->qext_num; i++) qid[qnum++] = qgate->qext[i];
+
+  for (chan=0; chan<noise->chan_num; chan++) {
+    if ((noise->chan_kind[chan] == -1) || (noise->chan_kind[chan] == (int)qgate->kind)) {
+      for (i=0; i<qnum; i++) {
+	if (!(_qstate_operate_channel(qstate, qid[i], noise, chan, start)))
+	  ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+      }
+    }
+    start += noise->kraus_num[chan];
   }
 
-  qstate->prob_updated = false;
-
   SUC_RETURN(true);
 }
 
-static QState* _qstate_apply_spro(QState* qstate, SPro* spro)
+static bool _qstate_operate_qcirc_trajectory_cpu(QState* qstate, CMem* cmem, QCirc* qcirc,
+						 Noise* noise)
+/*
+ * one shot execution with the noise (one quantum trajectory).
+ * the gates are operated one by one (not fused), and each gate is followed by
+ * the noise channels of its kind, and the measured values are flipped by the readout error.
+ */
 {
-  QState*	qstate_ob = NULL;
-  int		qubit_id[MAX_QUBIT_NUM];
+  QGate*        qgate	      = NULL;
+  COMPLEX*	U	      = NULL;
+  int		dim	      = 0;
+  int		mnum	      = 0;
+  int*		qid	      = NULL;
+  int*		cid	      = NULL;
+  bool		last	      = false;
+  char*		measured_char = NULL;
   int		i;
 
-  if ((qstate == NULL) || (spro == NULL))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT, NULL);
+  /* malloc */
+  if (cmem != NULL) {
+    if (!(cid = (int*)malloc(sizeof(int) * cmem->cmem_num)))
+      ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+    if (!(measured_char = (char*)malloc(sizeof(char) * qstate->qubit_num)))
+      ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  }
+  if (!(qid = (int*)malloc(sizeof(int) * qstate->qubit_num)))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
 
-  if (!(qstate_copy(qstate, (void**)&qstate_ob)))
-    ERR_RETURN(ERROR_QSTATE_COPY, NULL);
+  /* execute quantum circuit */
+  qgate = qcirc->first;
+  while (qgate != NULL) {
 
-  for (i=0; i<spro->spin_num; i++) {
-    qubit_id[0] = i;
-    if (spro->spin_type[i] == NONE) {
-      ;
-    }
-    else if (spro->spin_type[i] == SIGMA_X) {
-      if (!(qstate_operate_qgate(qstate_ob, PAULI_X, 0.0, 0.0, 1.0, qubit_id))) {
-	qstate_free(qstate_ob); qstate_ob = NULL;
-	ERR_RETURN(ERROR_INVALID_ARGUMENT,NULL);
-      }
+    if ((qgate->ctrl != -1) && (cmem->bit_array[qgate->ctrl] != 1)) {
+      qgate = qgate->next;
+      continue;
     }
-    else if (spro->spin_type[i] == SIGMA_Y) {
-      if (!(qstate_operate_qgate(qstate_ob, PAULI_Y, 0.0, 0.0, 1.0, qubit_id))) {
-	qstate_free(qstate_ob); qstate_ob = NULL;
-	ERR_RETURN(ERROR_INVALID_ARGUMENT,NULL);
+
+    /* unitary gate */
+    if (kind_is_unitary(qgate->kind) == true) {
+      if (kind_is_multi_qubit(qgate->kind) == true) {
+	if (!(_qstate_operate_multi_qubit_gate(qstate, qgate)))
+	  ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+      }
+      else {
+	if (!(gbank_get_unitary(qstate->gbank, qgate->kind, qgate->para[0], qgate->para[1],
+				qgate->para[2], &dim, (void**)&U)))
+	  ERR_RETURN(ERROR_GBANK_GET_UNITARY, false);
+	if (!(_qstate_operate_gate(qstate, qgate->kind, U, dim, qgate->qid[0], qgate->qid[1])))
+	  ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+	free(U); U = NULL;
       }
+      if (!(_qstate_operate_noise(qstate, qgate, noise)))
+	ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+    }
+    /* reset */
+    else if (kind_is_reset(qgate->kind) == true) {
+      if (!(qstate_reset(qstate, 1, qgate->qid)))
+	ERR_RETURN(ERROR_CANT_RESET, false);
+      if (!(_qstate_operate_noise(qstate, qgate, noise)))
+	ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
     }
-    else if (spro->spin_type[i] == SIGMA_Z) {
-      if (!(qstate_operate_qgate(qstate_ob, PAULI_Z, 0.0, 0.0, 1.0, qubit_id))) {
-	qstate_free(qstate_ob); qstate_ob = NULL;
-	ERR_RETURN(ERROR_INVALID_ARGUMENT,NULL);
+    /* measurement */
+    else if (kind_is_measurement(qgate->kind) == true) {
+      if (!(qgate_get_measurement_attributes((void**)&qgate, qstate->gbank, &mnum, qid, cid, &last)))
+	ERR_RETURN(ERROR_QGATE_GET_NEXT_UNITARY, false);
+      if (!(qstate_measure(qstate, mnum, qid, measured_char, true)))
+	ERR_RETURN(ERROR_QSTATE_MEASURE, false);
+      for (i=0; i<mnum; i++) {
+	if (rng_real2(qstate->rng) < noise->readout[(int)measured_char[i]])
+	  cmem->bit_array[cid[i]] = 1 - measured_char[i];
+	else
+	  cmem->bit_array[cid[i]] = measured_char[i];
       }
     }
     else {
-      qstate_free(qstate_ob); qstate_ob = NULL;
-      ERR_RETURN(ERROR_INVALID_ARGUMENT,NULL);
+      ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
     }
-  }
 
-#ifdef USE_GPU
-  if (!(qstate_update_host_memory(qstate_ob)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, NULL);
-#endif
+    qgate = qgate->next;
+  }
 
-  if (!(_qstate_mul(qstate_ob, spro->coef))) {
-    qstate_free(qstate_ob); qstate_ob = NULL;
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,NULL);
+  /* free */
+  if (cmem != NULL) {
+    free(cid); cid = NULL;
+    free(measured_char); measured_char = NULL;
   }
-  
+  free(qid); qid = NULL;
+
+  qstate->prob_updated = false;
 
-  SUC_RETURN(qstate_ob);
+  SUC_RETURN(true);
 }
 
-static QState* _qstate_apply_observable(QState* qstate, ObservableBase* observ)
+bool qstate_operate_qcirc_noise(QState* qstate, CMem* cmem, QCirc* qcirc, int shots,
+				char* mchar_shots, int* mchar_count, int* mchar_num,
+				int chan_num, int* chan_kind, int* kraus_num, double* kraus,
+				double* prob, double* readout)
+/*
+ * shots times quantum-trajectory execution of the circuit with the noise channels.
+ * the noise channel 'chan' acts on each qubit of the gates of the kind chan_kind[chan]
+ * (all the gates if -1) after the gate, where one of its kraus_num[chan] operators
+ * (2x2, kraus[k * 8 + (i * 2 + j) * 2 + 0/1] = real/imaginary part of K_k[i][j]) is sampled.
+ * prob[k] are the probabilities of the operators if the channel is a mixture of unitaries
+ * (K_k / sqrt(prob[k]) are unitary), or -1.0 otherwise.
+ * readout[0], readout[1] are the probabilities of reading 1 for 0 and 0 for 1.
+ * the shots are divided into SHOT_PARALLEL_CHUNK_NUM chunks (or less) operated on their
+ * own qstate and cmem, which are run in parallel if the qubit number is
+ * SHOT_PARALLEL_QUBIT_NUM or less (the chunk c draws the random numbers from the stream c
+ * of the key drawn from qstate->rng, so the result doesn't depend on the thread number).
+ * the classical memory of each shot is stored as a row (mchar_num = shots, mchar_count = 1),
+ * and the qstate and cmem are updated to the last trajectory of the chunk 0.
+ */
 {
-  QState*	qstate_ob  = NULL;
-  QState*	qstate_tmp = NULL;
-  int		i;
+  Noise		noise;
+  QState**	qstate_chunk = NULL;
+  CMem**	cmem_chunk   = NULL;
+  int		chunk_num    = 0;
+  int		cmem_num     = (cmem == NULL) ? 0 : cmem->cmem_num;
+  unsigned long long key     = 0;
+  bool		ok	     = true;
+  int		c;
+
+  if ((qstate == NULL) || (qcirc == NULL) || (shots < 1) || (mchar_num == NULL) ||
+      (qstate->use_gpu == true) || (qstate->qubit_num < qcirc->qubit_num) ||
+      ((cmem != NULL) && (cmem->cmem_num < qcirc->cmem_num)) ||
+      ((chan_num > 0) && ((chan_kind == NULL) || (kraus_num == NULL) ||
+			  (kraus == NULL) || (prob == NULL))) || (readout == NULL))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
 
-  if (qstate == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT, NULL);
-  
-  for (i=0; i<observ->array_num; i++) {
-    if (!(qstate_tmp = _qstate_apply_spro(qstate, observ->spro_array[i])))
-      ERR_RETURN(ERROR_INVALID_ARGUMENT, NULL);
-    if (qstate_ob == NULL) {
-      if (!(qstate_init(qstate_tmp->qubit_num, (void**)&qstate_ob, qstate->use_gpu)))
-	ERR_RETURN(ERROR_QSTATE_INIT, NULL);
-      _qstate_set_none(qstate_ob);
-    }
-    if (!(_qstate_add(qstate_ob, qstate_tmp)))
-      ERR_RETURN(ERROR_INVALID_ARGUMENT, NULL);
+  noise.chan_num = chan_num;
+  noise.chan_kind = chan_kind;
+  noise.kraus_num = kraus_num;
+  noise.kraus = kraus;
+  noise.prob = prob;
+  noise.readout[0] = readout[0];
+  noise.readout[1] = readout[1];
 
-    qstate_free(qstate_tmp);
-    qstate_tmp = NULL;
-  }
+  chunk_num = MIN(shots, SHOT_PARALLEL_CHUNK_NUM);
+  if (!(qstate_chunk = (QState**)calloc(chunk_num, sizeof(QState*))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (!(cmem_chunk = (CMem**)calloc(chunk_num, sizeof(CMem*))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
 
-#ifdef USE_GPU
-  if (!(qstate_update_device_memory(qstate_ob)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_DEVICE_MEMORY, NULL);
-#endif
+  key = rng_uint64(qstate->rng);
 
-  SUC_RETURN(qstate_ob);
-}
+# pragma omp parallel for schedule(dynamic, 1) if (qstate->qubit_num <= SHOT_PARALLEL_QUBIT_NUM)
+  for (c=0; c<chunk_num; c++) {
+    int		s_start = c * (shots / chunk_num) + MIN(c, shots % chunk_num);
+    int		s_end	= s_start + shots / chunk_num + ((c < shots % chunk_num) ? 1 : 0);
+    int		s;
 
-bool qstate_inner_product(QState* qstate_0, QState* qstate_1,
-			  double* real, double* imag)
-{
-  COMPLEX	out = 0.0 + 0.0 * COMP_I;
-  int		i;
+    if (!(qstate_init(qstate->qubit_num, (void**)&qstate_chunk[c], false)) ||
+	((cmem != NULL) && !(cmem_copy(cmem, (void**)&cmem_chunk[c])))) {
+#     pragma omp atomic write
+      ok = false;
+      continue;
+    }
+    rng_init(qstate_chunk[c]->rng, key, c);
 
-  if ((qstate_0 == NULL) || (qstate_1 == NULL) ||
-      (qstate_0->qubit_num != qstate_1->qubit_num) ||
-      (qstate_0->state_num != qstate_1->state_num))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-  
-#ifdef USE_GPU
-  if (!(qstate_update_host_memory(qstate_0)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY,false);
-  if (!(qstate_update_host_memory(qstate_1)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY,false);
-#endif
+    for (s=s_start; s<s_end; s++) {
+      memcpy(qstate_chunk[c]->camp, qstate->camp, sizeof(COMPLEX) * qstate->state_num);
+      qstate_chunk[c]->prob_updated = false;
+      if (cmem != NULL) memcpy(cmem_chunk[c]->bit_array, cmem->bit_array, sizeof(BYTE) * cmem_num);
 
-  for (i=0; i<qstate_0->state_num; i++) {
-    out = out + conj(qstate_0->camp[i]) * qstate_1->camp[i];
+      if (!(_qstate_operate_qcirc_trajectory_cpu(qstate_chunk[c], cmem_chunk[c], qcirc, &noise))) {
+#       pragma omp atomic write
+	ok = false;
+	break;
+      }
+      if (cmem != NULL) memcpy(&mchar_shots[s * cmem_num], cmem_chunk[c]->bit_array, sizeof(char) * cmem_num);
+      mchar_count[s] = 1;
+    }
+
+    /* the state of the chunk 0 is kept for the output */
+    if ((c > 0) && (qstate_chunk[c] != NULL)) {
+      qstate_free(qstate_chunk[c]); qstate_chunk[c] = NULL;
+      cmem_free(cmem_chunk[c]); cmem_chunk[c] = NULL;
+    }
   }
-  *real = creal(out);
-  *imag = cimag(out);
+
+  if (ok == true) {
+    memcpy(qstate->camp, qstate_chunk[0]->camp, sizeof(COMPLEX) * qstate->state_num);
+    if (cmem != NULL) memcpy(cmem->bit_array, cmem_chunk[0]->bit_array, sizeof(BYTE) * cmem_num);
+    *mchar_num = shots;
+  }
+
+  /* free */
+  for (c=0; c<chunk_num; c++) {
+    if (qstate_chunk[c] != NULL) qstate_free(qstate_chunk[c]);
+    qstate_chunk[c] = NULL;
+    cmem_free(cmem_chunk[c]); cmem_chunk[c] = NULL;
+  }
+  free(qstate_chunk); qstate_chunk = NULL;
+  free(cmem_chunk); cmem_chunk = NULL;
+
+  if (ok == false) ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
+
+  qstate->prob_updated = false;
 
   SUC_RETURN(true);
 }
 
-bool qstate_tensor_product(QState* qstate_0, QState* qstate_1, void** qstate_out)
+static int _tag_index(char* tag, int tag_num, char** tags)
 {
-  int		qubit_num;
-  QState*	qstate = NULL;
-  int		i,j;
+  int	t;
 
-  if ((qstate_0 == NULL) || (qstate_1 == NULL))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  if (strlen(tag) == 0) return -1;
+  for (t=0; t<tag_num; t++) {
+    if (strcmp(tag, tags[t]) == 0) return t;
+  }
+  return -1;
+}
 
-  if (qstate_0->use_gpu != qstate_1->use_gpu)
+bool qstate_operate_qcirc_batch(QState* qstate, QCirc* qcirc, int batch_num, int tag_num,
+				char* tag_buf, double* phase, int fuse_num, int cache_num,
+				bool relabel, void** qstate_out)
+/*
+ * operate the unitary circuit on the batch of 'batch_num' copies of the qstate, where
+ * the phase of the gates with the tag tags[t] is phase[b * tag_num + t] for the member b
+ * (tags: 'tag_num' null-terminated strings in tag_buf), and store the members to
+ * qstate_out[b] (b = 0,..,batch_num-1).
+ * the circuit is walked once for the batch: the gates are fused into the blocks once,
+ * the matrices of the blocks without the tagged gates are shared by all the members,
+ * and only the blocks with the tagged gates have the matrices for each member.
+ * the blocks are operated member by member (in parallel if the state fits in the
+ * cache block), so that a member stays in the cache through the blocks.
+ */
+{
+  QState**	member	  = (QState**)qstate_out;
+  QBlock*	qblock	  = NULL;
+  QBlock*	qblock_b  = NULL;
+  COMPLEX**	U_tagged  = NULL; /* U_tagged[i * batch_num + b]: matrix of the block i of the member b */
+  QGate*	qgate	  = NULL;
+  char**	tags	  = NULL;
+  size_t	avail_mem;
+  int		block_num = 0;
+  int		dim	  = 0;
+  int		fuse	  = MAX(fuse_num, 2); /* at least the gates on the same qubits are fused */
+  int		b, i, k, t;
+  bool		parallel, ans;
+
+  if ((qstate == NULL) || (qcirc == NULL) || (qstate_out == NULL) || (batch_num < 1) ||
+      (tag_num < 0) || ((tag_num > 0) && ((tag_buf == NULL) || (phase == NULL))) ||
+      (qstate->use_gpu == true) || (qstate->qubit_num < qcirc->qubit_num) ||
+      (fuse_num > MAX_FUSION_QUBIT_NUM) ||
+      ((cache_num != 0) && (cache_num < MAX_FUSION_QUBIT_NUM)))
     ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
 
-#ifdef USE_GPU
-  if (!(qstate_update_host_memory(qstate_0)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
-  if (!(qstate_update_host_memory(qstate_1)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
-#endif
+  /* unitary gates only */
+  for (qgate = qcirc->first; qgate != NULL; qgate = qgate->next) {
+    if ((kind_is_unitary(qgate->kind) == false) || (qgate->ctrl != -1))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
 
-  qubit_num = qstate_0->qubit_num + qstate_1->qubit_num;
-  if (!(qstate_init(qubit_num, (void**)&qstate, qstate_0->use_gpu)))
-    ERR_RETURN(ERROR_QSTATE_INIT, false);
+  if (!(tags = (char**)malloc(sizeof(char*) * (tag_num + 1))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  for (t=0; t<tag_num; t++) {
+    tags[t] = tag_buf;
+    tag_buf += strlen(tag_buf) + 1;
+  }
 
-  int cnt = 0;
-  for (i=0; i<qstate_0->state_num; i++) {
-    for (j=0; j<qstate_1->state_num; j++) {
-      qstate->camp[cnt++] = qstate_0->camp[i] * qstate_1->camp[j];
-    }
+  /* members (copies of the qstate) */
+  avail_mem = get_available_memory();
+  if ((avail_mem > 0) && (sizeof(COMPLEX) * (size_t)qstate->state_num * batch_num > avail_mem))
+    ERR_RETURN(ERROR_NOT_ENOUGH_MEMORY, false);
+  for (b=0; b<batch_num; b++) {
+    if (!(_qstate_copy_host_memory(qstate, (void**)&member[b])))
+      ERR_RETURN(ERROR_QSTATE_COPY, false);
   }
+  parallel = (cache_num == 0) || (qstate->qubit_num <= cache_num);
 
-#ifdef USE_GPU
-  if (!(qstate_update_device_memory(qstate)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_DEVICE_MEMORY, false);
-#endif
+  qgate = qcirc->first;
+  while (qgate != NULL) {
 
-  *qstate_out = qstate;
+    /* multi-qubit gate (the phase is set for each member if tagged, and restored) */
+    if (kind_is_multi_qubit(qgate->kind) == true) {
+      t = _tag_index(qgate->tag, tag_num, tags);
+      for (b=0; b<batch_num; b++) {
+	if (t >= 0) qgate->para[0] = phase[b * tag_num + t];
+	if (!(_qstate_operate_multi_qubit_gate(member[b], qgate)))
+	  ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+      }
+      if ((t >= 0) && !(tagtable_get_phase(qcirc->tag_table, qgate->tag, &(qgate->para[0]))))
+	ERR_RETURN(ERROR_TAGTABLE_GET_PHASE, false);
+      qgate = qgate->next;
+      continue;
+    }
 
-  SUC_RETURN(true);
-}
+    /* fused blocks of the consecutive unitary gates */
+    if (!(qgate_get_next_fused_blocks((void**)&qgate, qstate->gbank, fuse, &block_num,
+				      (void**)&qblock)))
+      ERR_RETURN(ERROR_QGATE_GET_NEXT_UNITARY, false);
+    if (!(U_tagged = (COMPLEX**)malloc(sizeof(COMPLEX*) * block_num * batch_num)))
+      ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
 
-bool qstate_expect_value(QState* qstate, ObservableBase* observ, double* value)
-{
-  QState*	qstate_ob = NULL;
-  double	real	  = 0.0;
-  double	imag	  = 0.0;
+    for (i=0; i<block_num; i++) {
+      for (b=0; b<batch_num; b++) U_tagged[i * batch_num + b] = NULL;
 
-  if ((qstate == NULL) || (observ == NULL))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+      for (k=0; k<qblock[i].gate_num; k++) {
+	if (_tag_index(qblock[i].fused[k]->tag, tag_num, tags) >= 0) break;
+      }
+      if (k == qblock[i].gate_num) { /* shared by all the members */
+	if ((qblock[i].gate_num == 1) &&
+	    !(gbank_get_unitary(qstate->gbank, qblock[i].qgate->kind, qblock[i].qgate->para[0],
+				qblock[i].qgate->para[1], qblock[i].qgate->para[2], &dim,
+				(void**)&qblock[i].U)))
+	  ERR_RETURN(ERROR_GBANK_GET_UNITARY, false);
+	continue;
+      }
 
-#ifdef USE_GPU
-  if (!(qstate_update_host_memory(qstate)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
-#endif
-  
-  if (!(qstate_ob = _qstate_apply_observable(qstate, observ)))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
-      
-#ifdef USE_GPU
-  if (!(qstate_update_host_memory(qstate_ob)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY, false);
-#endif
+      /* for each member (the phases are set to the gates, and restored from the tag table) */
+      for (b=0; b<batch_num; b++) {
+	QBlock	qblock_tmp = qblock[i];
+	for (k=0; k<qblock[i].gate_num; k++) {
+	  t = _tag_index(qblock[i].fused[k]->tag, tag_num, tags);
+	  if (t >= 0) qblock[i].fused[k]->para[0] = phase[b * tag_num + t];
+	}
+	qblock_tmp.U = NULL;
+	if (!(qblock_set_matrix(&qblock_tmp, qstate->gbank)))
+	  ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+	U_tagged[i * batch_num + b] = qblock_tmp.U;
+      }
+      for (k=0; k<qblock[i].gate_num; k++) {
+	if (_tag_index(qblock[i].fused[k]->tag, tag_num, tags) < 0) continue;
+	if (!(tagtable_get_phase(qcirc->tag_table, qblock[i].fused[k]->tag,
+				 &(qblock[i].fused[k]->para[0]))))
+	  ERR_RETURN(ERROR_TAGTABLE_GET_PHASE, false);
+      }
+    }
 
-  if (!(qstate_inner_product(qstate, qstate_ob, &real, &imag)))
-    ERR_RETURN(ERROR_QSTATE_INNER_PRODUCT,false);
-  
-  if (fabs(imag) > MIN_DOUBLE) ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+    /* operate the blocks member by member */
+    ans = true;
+#   pragma omp parallel for private(i, qblock_b) shared(ans) if (parallel)
+    for (b=0; b<batch_num; b++) {
+      if (!(qblock_b = (QBlock*)malloc(sizeof(QBlock) * block_num))) {
+	ans = false;
+	continue;
+      }
+      memcpy(qblock_b, qblock, sizeof(QBlock) * block_num);
+      for (i=0; i<block_num; i++) {
+	if (U_tagged[i * batch_num + b] != NULL) qblock_b[i].U = U_tagged[i * batch_num + b];
+      }
+      if (!(_qstate_operate_qblocks(member[b], qblock_b, block_num, cache_num, relabel)))
+	ans = false;
+      free(qblock_b);
+    }
+    if (ans == false) ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+
+    for (i=0; i<block_num * batch_num; i++) free(U_tagged[i]);
+    free(U_tagged); U_tagged = NULL;
+    qblock_free(qblock, block_num); qblock = NULL;
 
-  qstate_free(qstate_ob);
-  qstate_ob = NULL;
+    qgate = qgate->next;
+  }
 
-  *value = real;
+  for (b=0; b<batch_num; b++) member[b]->prob_updated = false;
+  free(tags); tags = NULL;
 
   SUC_RETURN(true);
 }
 
-bool qstate_apply_matrix(QState* qstate, int qnum_part, int* qid,
-			 double* real, double *imag, int row, int col)
+bool qstate_operate_qplan(QState* qstate, QPlan* qplan, int cache_num, bool relabel)
+/*
+ * operate the compiled plan of the unitary circuit (see qplan_init), where the runs of
+ * the blocks are operated with the matrices of the plan (cache-blocked by 'cache_num'
+ * low-order qubits, see qstate_operate_qcirc) and the multi-qubit gates natively
+ */
 {
-  QState*	qstate_tmp = NULL;
-  int*		index	   = NULL;
-  int*		inv_index  = NULL;
-  COMPLEX	coef	   = 0.0 + 0.0 * COMP_I;
-  int		shift	   = 0;
-  int           N	   = 0;
-  int		ii,iii,jj,jjj;
-  int           i,k,n;
+  int		i, j;
 
-  if ((qstate == NULL) || (real == NULL) || (imag == NULL) ||
-      (qstate->state_num < row) || (1<<qnum_part != row) || (row != col))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  if ((qstate == NULL) || (qplan == NULL) || (qstate->use_gpu == true) ||
+      (qstate->use_single != qplan->use_single) || (qstate->qubit_num < qplan->qubit_num) ||
+      ((cache_num != 0) && (cache_num < MAX_FUSION_QUBIT_NUM)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
 
-#ifdef USE_GPU
-  if (!(qstate_update_host_memory(qstate)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_HOST_MEMORY,false);
-#endif
+  i = 0;
+  while (i < qplan->step_num) {
+    if (qplan->step[i].knum == 0) {
+      if (!(_qstate_operate_multi_qubit_gate(qstate, qplan->step[i].qgate)))
+	ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+      i++;
+      continue;
+    }
+    for (j=i; (j < qplan->step_num) && (qplan->step[j].knum > 0); j++);
+    if (!(_qstate_operate_qblocks(qstate, &qplan->step[i], j - i, cache_num, relabel)))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+    i = j;
+  }
 
-  if (!(_qstate_copy_host_memory(qstate, (void**)&qstate_tmp)))
-    ERR_RETURN(ERROR_QSTATE_COPY,false);
+  qstate->prob_updated = false;
 
-  index = bit_permutation_array(qstate->state_num, qstate->qubit_num, qnum_part, qid);
+  SUC_RETURN(true);
+}
 
-  if (!(inv_index = (int*)malloc(sizeof(int)*qstate->state_num)))
-    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY,false);
-  for (n=0; n<qstate->state_num; n++) inv_index[index[n]] = n; 
+static bool _qstate_operate_circuit_gate(QState* qstate, QGate* qgate, bool adjoint)
+/* operate the unitary gate of the circuit (or the adjoint of the gate) */
+{
+  QGate		qgate_adj;
+  COMPLEX*	U   = NULL;
+  COMPLEX	u;
+  int		dim = 0;
+  int		i, j;
 
-  shift = qstate->qubit_num-qnum_part;
-  N = 1<<(qstate->qubit_num-shift);
-  
-  for (i=0; i<qstate->state_num; i++) {
-    qstate->camp[i] = 0.0 + 0.0 * COMP_I;
-    ii = index[i]>>shift;
-    iii = index[i]%(1<<shift);
+  if (qgate->kind == IDENTITY) SUC_RETURN(true);
 
-    for (k=0; k<N; k++) {
-      int j = inv_index[(k<<shift)+iii];
-      jj = index[j]>>shift;
-      jjj = index[j]%(1<<shift);
-      coef = real[ii*col+jj] + 1.0 * COMP_I * imag[ii*col+jj];
-      qstate->camp[i] += (coef * qstate_tmp->camp[j]);
+  if (kind_is_multi_qubit(qgate->kind) == true) {
+    qgate_adj = *qgate;
+    if (adjoint == true) { /* mcx is self-adjoint */
+      if (qgate->kind == QFT_GATE) qgate_adj.kind = IQFT_GATE;
+      else if (qgate->kind == IQFT_GATE) qgate_adj.kind = QFT_GATE;
+      else if (qgate->kind == MULTI_ROTATION_Z) qgate_adj.para[0] = -qgate->para[0];
     }
+    if (!(_qstate_operate_multi_qubit_gate(qstate, &qgate_adj)))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+    SUC_RETURN(true);
   }
 
-#ifdef USE_GPU
-  if (!(qstate_update_device_memory(qstate)))
-    ERR_RETURN(ERROR_QSTATE_UPDATE_DEVICE_MEMORY,false);
-#endif
-
-  free(index); index = NULL;
-  free(inv_index); inv_index = NULL;
-  qstate_free(qstate_tmp); qstate_tmp = NULL;
+  if (!(gbank_get_unitary(qstate->gbank, qgate->kind, qgate->para[0], qgate->para[1],
+			  qgate->para[2], &dim, (void**)&U)))
+    ERR_RETURN(ERROR_GBANK_GET_UNITARY, false);
+
+  /* conjugate transpose (the diagonal, controlled or permutation form is kept) */
+  if (adjoint == true) {
+    for (i=0; i<dim; i++) {
+      U[i * dim + i] = conj(U[i * dim + i]);
+      for (j=i+1; j<dim; j++) {
+	u = U[i * dim + j];
+	U[i * dim + j] = conj(U[j * dim + i]);
+	U[j * dim + i] = conj(u);
+      }
+    }
+  }
 
+  if (!(_qstate_operate_gate(qstate, qgate->kind, U, dim, qgate->qid[0], qgate->qid[1])))
+    ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
   qstate->prob_updated = false;
 
+  free(U); U = NULL;
   SUC_RETURN(true);
 }
 
-static bool _qstate_operate_qcirc_cpu(QState* qstate, CMem* cmem, QCirc* qcirc,
-				      bool measure_update)
-/* one shot execution */
+static bool _qgate_get_derivative(QGate* qgate, GBank* gbank, int* dim_out, void** matrix_out)
+/*
+ * derivative of the matrix of the 1-parameter gate by the phase (para[0]),
+ * dU = a/2 * (U(phase + d) - U(phase - d)) with a * d = PI / 2, which is exact for the
+ * matrix elements of the form A * cos(a * phase) + B * sin(a * phase) + C
+ * (a = PI * factor for p and cp, and a = PI * factor / 2 for the rotations)
+ */
 {
-  QGate*        qgate = NULL;   /* quantum gate in quantum circuit */
-  int		dim   = 0;
-  int           q0    = -1;
-  int           q1    = -1;
-  COMPLEX*	U     = NULL;
-  bool          compo = false;  /* U is composite or not */
-  int		mnum  = 0;
-  int*		qid   = NULL;
-  int*		cid   = NULL;
-  bool		last  = false;
-  char*		measured_char = NULL;
-  int i;
-
-  /* error check */
-  if ((qstate == NULL || qcirc == NULL) ||
-      (qstate->qubit_num < qcirc->qubit_num) ||
-      (cmem != NULL && cmem->cmem_num < qcirc->cmem_num))
-    ERR_RETURN(ERROR_INVALID_ARGUMENT,false);
+  COMPLEX*	U_p = NULL;
+  COMPLEX*	U_m = NULL;
+  double	a, d;
+  int		dim = 0;
+  int		i;
 
-  /* malloc */
-  if (cmem != NULL) {
-    if (!(cid = (int*)malloc(sizeof(int) * cmem->cmem_num)))
-      ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  switch (qgate->kind) {
+  case PHASE_SHIFT:
+  case CONTROLLED_P:
+    a = M_PI * qgate->para[2];
+    break;
+  case ROTATION_X:
+  case ROTATION_Y:
+  case ROTATION_Z:
+  case CONTROLLED_RX:
+  case CONTROLLED_RY:
+  case CONTROLLED_RZ:
+  case ROTATION_XX:
+  case ROTATION_YY:
+  case ROTATION_ZZ:
+    a = 0.5 * M_PI * qgate->para[2];
+    break;
+  default:
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
 
-    if (!(measured_char = (char*)malloc(sizeof(int) * cmem->cmem_num)))
-      ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  if (a == 0.0) { /* independent of the phase */
+    *dim_out = 0;
+    *matrix_out = NULL;
+    SUC_RETURN(true);
   }
-  if (!(qid = (int*)malloc(sizeof(int) * qstate->qubit_num)))
-    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  d = 0.5 * M_PI / a;
 
-  /* execute quantum circuit */
-  qgate = qcirc->first;
-  while (qgate != NULL) {
+  if (!(gbank_get_unitary(gbank, qgate->kind, qgate->para[0] + d, qgate->para[1],
+			  qgate->para[2], &dim, (void**)&U_p)))
+    ERR_RETURN(ERROR_GBANK_GET_UNITARY, false);
+  if (!(gbank_get_unitary(gbank, qgate->kind, qgate->para[0] - d, qgate->para[1],
+			  qgate->para[2], &dim, (void**)&U_m)))
+    ERR_RETURN(ERROR_GBANK_GET_UNITARY, false);
 
-    if ((qgate->ctrl == -1) ||
-	((qgate->ctrl != -1) && (cmem->bit_array[qgate->ctrl] == 1))) {
+  for (i=0; i<dim*dim; i++) U_p[i] = 0.5 * a * (U_p[i] - U_m[i]);
+  free(U_m); U_m = NULL;
 
-      /* unitary gate */
-      if (kind_is_unitary(qgate->kind) == true) {
+  *dim_out = dim;
+  *matrix_out = U_p;
 
-	if (!(qgate_get_next_unitary((void**)&qgate, qstate->gbank, &dim, &q0, &q1, (void**)&U, &compo))) {
-	  ERR_RETURN(ERROR_QGATE_GET_NEXT_UNITARY, false);
-	}
+  SUC_RETURN(true);
+}
 
-	/* operate unitary matrix */
-	if (compo == false && kind_is_controlled(qgate->kind) == true) {
-	  if (!(_qstate_operate_controlled_gate(qstate, U, q0, q1))) {
-	    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
-	  }
-	}
-	else {
-	  if (!(_qstate_operate_unitary(qstate, U, dim, q0, q1))) {
-	    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
-	  }
-	}
-	free(U); U = NULL;
-	
-	qgate = qgate->next;
-      }
-      /* reset */
-      else if (kind_is_reset(qgate->kind) == true) {
-	if (!(qstate_reset(qstate, 1, qgate->qid)))
-	  ERR_RETURN(ERROR_CANT_RESET, false);
-	qgate = qgate->next;
-      }
-      /* measurement */
-      else if (kind_is_measurement(qgate->kind) == true) {
+static bool _qstate_sandwich(QState* bra, QState* ket, COMPLEX* M, int dim, int m, int n,
+			     double* real, double* imag)
+/* <bra|M|ket> for the matrix M on the qubit m (dim = 2) or the qubits m, n (dim = 4) */
+{
+  COMPLEX*	a  = ket->camp;
+  COMPLEX*	b  = bra->camp;
+  int		mm = bra->qubit_num - m - 1;
+  int		nn = bra->qubit_num - n - 1;
+  int		lo = MIN(mm, nn);
+  int		hi = MAX(mm, nn);
+  double	sr = 0.0;
+  double	si = 0.0;
+  INDEX		k;
 
-	if (!(qgate_get_measurement_attributes((void**)&qgate, qstate->gbank, &mnum, qid, cid, &last))) {
-	  ERR_RETURN(ERROR_QGATE_GET_NEXT_UNITARY, false);
-	}
-	if (!(qstate_measure(qstate, mnum, qid, measured_char, measure_update)))
-	  ERR_RETURN(ERROR_QSTATE_MEASURE, false);
-	for (i=0; i<mnum; i++) {
-	  cmem->bit_array[cid[i]] = measured_char[i];
-	}
-	qgate = qgate->next;
-      }
-      else {
-	ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
-      }
+  if (dim == 2) {
+#   pragma omp parallel for reduction(+:sr,si)
+    for (k=0; k<(bra->state_num >> 1); k++) {
+      INDEX	i0 = INSERT_ZERO_BIT(k, mm);
+      INDEX	i1 = i0 | ((INDEX)1 << mm);
+      COMPLEX	c  = conj(b[i0]) * (M[IDX2(0,0)] * a[i0] + M[IDX2(0,1)] * a[i1])
+	+ conj(b[i1]) * (M[IDX2(1,0)] * a[i0] + M[IDX2(1,1)] * a[i1]);
+      sr += (double)creal(c);
+      si += (double)cimag(c);
     }
-    else {
-      qgate = qgate->next;
+  }
+  else if (dim == 4) {
+#   pragma omp parallel for reduction(+:sr,si)
+    for (k=0; k<(bra->state_num >> 2); k++) {
+      INDEX	i0 = INSERT_ZERO_BIT(INSERT_ZERO_BIT(k, lo), hi);
+      INDEX	idx[4];
+      COMPLEX	c = 0.0;
+      int	l;
+      idx[0] = i0;
+      idx[1] = i0 | ((INDEX)1 << nn);
+      idx[2] = i0 | ((INDEX)1 << mm);
+      idx[3] = i0 | ((INDEX)1 << nn) | ((INDEX)1 << mm);
+      for (l=0; l<4; l++) {
+	c += conj(b[idx[l]]) * (M[IDX4(l,0)] * a[idx[0]] + M[IDX4(l,1)] * a[idx[1]]
+				+ M[IDX4(l,2)] * a[idx[2]] + M[IDX4(l,3)] * a[idx[3]]);
+      }
+      sr += (double)creal(c);
+      si += (double)cimag(c);
     }
   }
-
-  /* free */
-  if (cmem != NULL) {
-    free(cid); cid = NULL;
-    free(measured_char); measured_char = NULL;
+  else {
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
   }
-  free(qid); qid = NULL;
 
-  qstate->prob_updated = false;
+  *real = sr;
+  *imag = si;
 
   SUC_RETURN(true);
 }
 
-bool qstate_operate_qcirc(QState* qstate, CMem* cmem, QCirc* qcirc, int shots, char* mchar_shots,
-			  bool out_state)
-/* shots times execution */
+static bool _qstate_sandwich_z(QState* bra, QState* ket, INDEX zmask, double* real, double* imag)
+/* <bra|Z...Z|ket> for the pauli Z product on the bits of zmask */
 {
-  int		i, j, k;
-  QCirc*	qcirc_uonly    = NULL;
-  QCirc*	qcirc_mixed    = NULL;
-  QCirc*	qcirc_monly    = NULL;
-  QState*	qstate_tmp     = NULL;
-  bool		measure_update = true;
-  QGate*        qgate	       = NULL;
-  int		mnum	       = 0;
-  int*		qid	       = NULL;
-  int*		cid	       = NULL;
-  bool		last	       = false;
-  char*		measured_char  = NULL;
+  COMPLEX*	a  = ket->camp;
+  COMPLEX*	b  = bra->camp;
+  double	sr = 0.0;
+  double	si = 0.0;
+  INDEX		k;
+
+# pragma omp parallel for reduction(+:sr,si)
+  for (k=0; k<bra->state_num; k++) {
+    COMPLEX	c = conj(b[k]) * a[k];
+    if (__builtin_parityll(k & zmask)) c = -c;
+    sr += (double)creal(c);
+    si += (double)cimag(c);
+  }
 
-  if (!(qcirc_decompose(qcirc, (void**)&qcirc_uonly, (void**)&qcirc_mixed, (void**)&qcirc_monly)))
-    ERR_RETURN(ERROR_QCIRC_DECOMPOSE, false);
-  
-  if (qstate->use_gpu == false) {
+  *real = sr;
+  *imag = si;
 
-    if (qcirc_uonly != NULL) { /* unitary only */
-      measure_update = true; /* not efficient because of including no measurements */
-      if (!(_qstate_operate_qcirc_cpu(qstate, cmem, qcirc_uonly, measure_update)))
-	ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
-      qcirc_free(qcirc_uonly); qcirc_uonly = NULL;
+  SUC_RETURN(true);
+}
+
+static bool _qstate_apply_observable(QState* qstate, ObservableBase* observ, QState* qstate_out)
+/*
+ * qstate_out <= O|qstate> for the observable O = sum_j c_j * P_j, where each pauli product
+ * is added in a single sweep, P|k> = i^ny * (-1)^parity(k & zmask) |k ^ xmask>
+ */
+{
+  COMPLEX*	a = qstate->camp;
+  COMPLEX*	o = qstate_out->camp;
+  COMPLEX	f;
+  INDEX		xmask, zmask, k;
+  int		ny, j;
+
+  for (k=0; k<qstate_out->state_num; k++) o[k] = 0.0;
+
+  for (j=0; j<observ->array_num; j++) {
+    if (!(_spro_get_mask(observ->spro_array[j], qstate->qubit_num, &xmask, &zmask, &ny)))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+    f = observ->spro_array[j]->coef;
+    switch (ny % 4) {
+    case 1: f *= COMP_I; break;
+    case 2: f *= -1.0; break;
+    case 3: f *= -COMP_I; break;
     }
-    
-    if (qcirc_mixed != NULL) { /* unitary and non-unitary mixed */
-      measure_update = true;
-      for (i=0; i<shots-1; i++) {
-	if (!(qstate_copy(qstate, (void**)&qstate_tmp)))
-	  ERR_RETURN(ERROR_QSTATE_COPY, false);
-	if (!(_qstate_operate_qcirc_cpu(qstate_tmp, cmem, qcirc_mixed, measure_update)))
-	  ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
-	for (j=0; j<cmem->cmem_num; j++) {
-	  mchar_shots[i * cmem->cmem_num + j] = cmem->bit_array[j];
-	}
-	qstate_free(qstate_tmp); qstate_tmp = NULL;
-      }
-      if (!(_qstate_operate_qcirc_cpu(qstate, cmem, qcirc_mixed, measure_update)))
-	ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
-      for (j=0; j<cmem->cmem_num; j++) {
-	mchar_shots[(shots - 1) * cmem->cmem_num + j] = cmem->bit_array[j];
-      }
-      qcirc_free(qcirc_mixed); qcirc_mixed = NULL;
+#   pragma omp parallel for
+    for (k=0; k<qstate->state_num; k++) { /* k -> k ^ xmask is one to one */
+      o[k ^ xmask] += __builtin_parityll(k & zmask) ? -f * a[k] : f * a[k];
     }
-    
-    else if (qcirc_monly != NULL) { /* measurement only */
+  }
 
-      if (!(measured_char = (char*)malloc(sizeof(char) * qstate->qubit_num)))
-	ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
-      if (!(cid = (int*)malloc(sizeof(int) * cmem->cmem_num)))
-	ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
-      if (!(qid = (int*)malloc(sizeof(int) * qstate->qubit_num)))
-	ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  qstate_out->prob_updated = false;
 
-      qgate = qcirc_monly->first;
-      if (!(qgate_get_measurement_attributes((void**)&qgate, qstate->gbank, &mnum, qid, cid, &last))) {
-	ERR_RETURN(ERROR_QGATE_GET_NEXT_UNITARY, false);
-      }
+  SUC_RETURN(true);
+}
 
-      measure_update = false;
-      for (i=0; i<shots; i++) {
-	if (out_state == false || i < shots - 1) measure_update = false;
-	else measure_update = false;
+bool qstate_gradient(QState* qstate, QCirc* qcirc, ObservableBase* observ, int tag_num,
+		     char* tag_buf, int fuse_num, int cache_num, bool relabel, double* grad)
+/*
+ * gradient of the expectation value <O> = <psi|O|psi> (|psi> = U_N...U_1|qstate>) by the
+ * phases of the tags (tags: 'tag_num' null-terminated strings in tag_buf), stored to
+ * grad[t] (t = 0,..,tag_num-1), with the adjoint method:
+ * after the forward pass, |psi> and |lambda> = O|psi> are walked back through the gates,
+ * |psi> <= U_i^+ |psi> and |lambda> <= U_i^+ |lambda>, and the tagged gate adds
+ * 2 * Re(<lambda|dU_i|psi>) (|psi> before the gate, |lambda> after the gate) to the gradient.
+ * only the two states are held in addition to the qstate. the forward pass is operated with
+ * the fused blocks (fuse_num, cache_num, relabel: see qstate_operate_qcirc), and the backward
+ * pass gate by gate.
+ */
+{
+  QState*	psi	= NULL;
+  QState*	lambda	= NULL;
+  QGate*	qgate	= NULL;
+  COMPLEX*	dU	= NULL;
+  char**	tags	= NULL;
+  size_t	avail_mem;
+  INDEX		zmask;
+  double	re, im;
+  int		dim	= 0;
+  int		i, t;
+
+  if ((qstate == NULL) || (qcirc == NULL) || (observ == NULL) || (tag_num < 0) ||
+      ((tag_num > 0) && ((tag_buf == NULL) || (grad == NULL))) ||
+      (qstate->use_gpu == true) || (qstate->qubit_num < qcirc->qubit_num) ||
+      (fuse_num > MAX_FUSION_QUBIT_NUM) ||
+      ((cache_num != 0) && (cache_num < MAX_FUSION_QUBIT_NUM)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
 
-	if (!(qstate_measure(qstate, mnum, qid, measured_char, measure_update)))
-	  ERR_RETURN(ERROR_QSTATE_MEASURE, false);
-	for (k=0; k<mnum; k++) {
-	  cmem->bit_array[cid[k]] = measured_char[k];
-	}
-	for (j=0; j<cmem->cmem_num; j++) {
-	  mchar_shots[i * cmem->cmem_num + j] = cmem->bit_array[j];
-	}
-      }
+  /* unitary gates only */
+  for (qgate = qcirc->first; qgate != NULL; qgate = qgate->next) {
+    if ((kind_is_unitary(qgate->kind) == false) || (qgate->ctrl != -1))
+      ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+  }
 
-      free(cid); cid = NULL;
-      free(measured_char); measured_char = NULL;
-      free(qid); qid = NULL;
+  if (!(tags = (char**)malloc(sizeof(char*) * (tag_num + 1))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  for (t=0; t<tag_num; t++) {
+    tags[t] = tag_buf;
+    tag_buf += strlen(tag_buf) + 1;
+    grad[t] = 0.0;
+  }
 
-      qcirc_free(qcirc_monly); qcirc_monly = NULL;
-    }
+  avail_mem = get_available_memory();
+  if ((avail_mem > 0) && (sizeof(COMPLEX) * (size_t)qstate->state_num * 2 > avail_mem))
+    ERR_RETURN(ERROR_NOT_ENOUGH_MEMORY, false);
+
+  /* forward */
+  if (!(_qstate_copy_host_memory(qstate, (void**)&psi)))
+    ERR_RETURN(ERROR_QSTATE_COPY, false);
+  qgate = qcirc->first;
+  while (qgate != NULL) {
+    if (!(_qstate_operate_next_unitary(psi, &qgate, fuse_num, cache_num, relabel)))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+    qgate = qgate->next;
   }
+  psi->prob_updated = false;
 
-#ifdef USE_GPU
-  else if (qstate->use_gpu == true) {
+  /* backward */
+  if (!(_qstate_copy_host_memory(psi, (void**)&lambda)))
+    ERR_RETURN(ERROR_QSTATE_COPY, false);
+  if (!(_qstate_apply_observable(psi, observ, lambda)))
+    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
 
-    if (qcirc_uonly != NULL) { /* unitary only */
-      measure_update = true; /* not efficient because of including no measurements */
-      if (!(qstate_operate_qcirc_gpu(qstate, cmem, qcirc_uonly, measure_update)))
-	ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
-      qcirc_free(qcirc_uonly); qcirc_uonly = NULL;
+  for (qgate = qcirc->last; qgate != NULL; qgate = qgate->prev) {
+    t = _tag_index(qgate->tag, tag_num, tags);
+
+    /* mrz: dU = -i * (PI * factor / 2) * Z...Z * U, with |psi> after the gate */
+    if ((t >= 0) && (qgate->kind == MULTI_ROTATION_Z)) {
+      zmask = (INDEX)1 << (psi->qubit_num - qgate->qid[0] - 1);
+      for (i=0; i<qgate->qext_num; i++) zmask |= (INDEX)1 << (psi->qubit_num - qgate->qext[i] - 1);
+      if (!(_qstate_sandwich_z(lambda, psi, zmask, &re, &im)))
+	ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+      grad[t] += M_PI * qgate->para[2] * im;
     }
 
-    if (qcirc_mixed != NULL) { /* unitary and non-unitary mixed */
-      measure_update = true;
-      for (i=0; i<shots-1; i++) {
-	if (!(qstate_copy(qstate, (void**)&qstate_tmp)))
-	  ERR_RETURN(ERROR_QSTATE_COPY, false);
-	if (!(qstate_operate_qcirc_gpu(qstate_tmp, cmem, qcirc_mixed, measure_update)))
-	  ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
-	for (j=0; j<cmem->cmem_num; j++) {
-	  mchar_shots[i * cmem->cmem_num + j] = cmem->bit_array[j];
-	}
-	qstate_free(qstate_tmp); qstate_tmp = NULL;
-      }
-      if (!(qstate_operate_qcirc_gpu(qstate, cmem, qcirc_mixed, measure_update)))
-	ERR_RETURN(ERROR_QSTATE_OPERATE_QCIRC, false);
-      for (j=0; j<cmem->cmem_num; j++) {
-	mchar_shots[(shots - 1) * cmem->cmem_num + j] = cmem->bit_array[j];
+    if (!(_qstate_operate_circuit_gate(psi, qgate, true)))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
+
+    if ((t >= 0) && (qgate->kind != MULTI_ROTATION_Z)) {
+      if (!(_qgate_get_derivative(qgate, qstate->gbank, &dim, (void**)&dU)))
+	ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+      if (dU != NULL) {
+	if (!(_qstate_sandwich(lambda, psi, dU, dim, qgate->qid[0], qgate->qid[1], &re, &im)))
+	  ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
+	grad[t] += 2.0 * re;
+	free(dU); dU = NULL;
       }
-      qcirc_free(qcirc_mixed); qcirc_mixed = NULL;
     }
 
-    else if (qcirc_monly != NULL) { /* measurement only */
-      /* shots times meaurements */
-      if (!(qstate_operate_measure_gpu(qstate, cmem, qcirc_monly, shots, mchar_shots, out_state)))
-	ERR_RETURN(ERROR_QSTATE_OPERATE_MEASURE, false);
-      qcirc_free(qcirc_monly); qcirc_monly = NULL;
-    }
+    if (!(_qstate_operate_circuit_gate(lambda, qgate, true)))
+      ERR_RETURN(ERROR_QSTATE_OPERATE_UNITARY, false);
   }
-#endif
 
-  else {
-    ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
-  }
-    
-  qstate->prob_updated = false;
+  qstate_free(psi); psi = NULL;
+  qstate_free(lambda); lambda = NULL;
+  free(tags); tags = NULL;
 
   SUC_RETURN(true);
 }
@@ -1900,15 +4401,28 @@ static void _qstate_free_cpu(QState* qstate)
 {
   if (qstate == NULL) return;
   
+  if ((qstate->buffer_0 != NULL) && (qstate->mapped == true)) {
+    munmap(qstate->buffer_0, sizeof(COMPLEX) * (size_t)qstate->state_num);
+    qstate->buffer_0 = NULL;
+  }
+  if ((qstate->buffer_0 != NULL) && (qstate->adopted == true)) {
+    qstate->buffer_0 = NULL; /* owned by the caller */
+  }
   if (qstate->buffer_0 != NULL) {
     free(qstate->buffer_0); qstate->buffer_0 = NULL;
   }
   if (qstate->buffer_1 != NULL) {
     free(qstate->buffer_1); qstate->buffer_1 = NULL;
   }
+  if (qstate->prob_array != NULL) {
+    free(qstate->prob_array); qstate->prob_array = NULL;
+  }
   if (qstate->gbank != NULL) {
     free(qstate->gbank); qstate->gbank = NULL;
   }
+  if (qstate->rng != NULL) {
+    free(qstate->rng); qstate->rng = NULL;
+  }
   free(qstate);
 }
 
@@ -320,7 +320,7 @@ static bool _qstate_get_measured_char_gpu(QState* qstate, int mnum, int* qid, ch
     _qstate_update_prob_array_gpu(qstate);
   }
 
-  r = genrand_real1();
+  r = rng_real1(qstate->rng);
   idx = 0;
   for (i=0; i<qstate->qubit_num; i++) {
     up = 1 << (qstate->qubit_num - 1 - i);
@@ -340,7 +340,7 @@ static bool _qstate_measure_gpu(QState* qstate, int mnum, int* qid,
 				char* measured_char, bool measure_update)
 /* execute one shot measurement and update qstate according to measure_update flag */
 {
-  int			i, x;
+  INDEX			i, x;
   int			mval_qid     = 0;
 
   if (measure_update == true) { /* measure and update qstate */
@@ -586,7 +586,7 @@ bool qstate_init_gpu(int qubit_num, void** qstate_out)
   dim3			 grid ((state_num + block.x - 1) / block.x, 1, 1);
   cuDoubleComplex	 h_buf;
 
-  if ((qubit_num < 1) || (qubit_num > MAX_QUBIT_NUM))
+  if ((qubit_num < 1) || (qubit_num > MAX_GPU_QUBIT_NUM))
     ERR_RETURN(ERROR_OUT_OF_BOUND,false);
   
   if (!(qstate = (QState*)malloc(sizeof(QState))))
@@ -595,6 +595,9 @@ bool qstate_init_gpu(int qubit_num, void** qstate_out)
   qstate->qubit_num = qubit_num;
   qstate->state_num = state_num;
   qstate->use_gpu = true;
+  qstate->use_single = false;
+  qstate->mapped = false;
+  qstate->adopted = false;
 
   /* allocate host memory */
   qstate->buf_id = 0;
@@ -628,6 +631,11 @@ bool qstate_init_gpu(int qubit_num, void** qstate_out)
   if (!(gbank_init((void**)&(qstate->gbank))))
       ERR_RETURN(ERROR_GBANK_INIT,false);
 
+  /* seeded from the global generator (see qstate_set_seed) */
+  if (!(qstate->rng = (Rng*)malloc(sizeof(Rng))))
+    ERR_RETURN(ERROR_CANT_ALLOC_MEMORY, false);
+  rng_init(qstate->rng, ((unsigned long long)genrand_int32() << 32) | genrand_int32(), 0);
+
   *qstate_out = qstate;
   
   SUC_RETURN(true);
@@ -698,6 +706,9 @@ void qstate_free_gpu(QState* qstate)
   if (qstate->gbank != NULL) {
     free(qstate->gbank); qstate->gbank = NULL;
   }
+  if (qstate->rng != NULL) {
+    free(qstate->rng); qstate->rng = NULL;
+  }
 
   checkCudaErrors(cudaFree(qstate->d_buffer_0)); qstate->d_buffer_0 = NULL;
   checkCudaErrors(cudaFree(qstate->d_buffer_1)); qstate->d_buffer_1 = NULL;
@@ -57,13 +57,17 @@
 #define UPPER_MASK 0x80000000UL /* most significant w-r bits */
 #define LOWER_MASK 0x7fffffffUL /* least significant r bits */
 
+#include <pthread.h>
 #include "qlazy.h"
 
 static unsigned long mt[MT_N]; /* the array for the state vector  */
 static int mti=MT_N+1; /* mti==MT_N+1 means mt[MT_N] is not initialized */
 
+/* lock of the global generator (called from the threads of the jobs, see Backend.submit) */
+static pthread_mutex_t genrand_mutex = PTHREAD_MUTEX_INITIALIZER;
+
 /* initializes mt[MT_N] with a seed */
-void init_genrand(unsigned long s)
+static void _init_genrand(unsigned long s)
 {
     mt[0]= s & 0xffffffffUL;
     for (mti=1; mti<MT_N; mti++) {
@@ -78,6 +82,13 @@ void init_genrand(unsigned long s)
     }
 }
 
+void init_genrand(unsigned long s)
+{
+  pthread_mutex_lock(&genrand_mutex);
+  _init_genrand(s);
+  pthread_mutex_unlock(&genrand_mutex);
+}
+
 /* initialize by an array with array-length */
 /* init_key is the array for initializing keys */
 /* key_length is its length */
@@ -85,7 +96,8 @@ void init_genrand(unsigned long s)
 void init_by_array(unsigned long init_key[], int key_length)
 {
     int i, j, k;
-    init_genrand(19650218UL);
+    pthread_mutex_lock(&genrand_mutex);
+    _init_genrand(19650218UL);
     i=1; j=0;
     k = (MT_N>key_length ? MT_N : key_length);
     for (; k; k--) {
@@ -105,10 +117,11 @@ void init_by_array(unsigned long init_key[], int key_length)
     }
 
     mt[0] = 0x80000000UL; /* MSB is 1; assuring non-zero initial array */ 
+    pthread_mutex_unlock(&genrand_mutex);
 }
 
 /* generates a random number on [0,0xffffffff]-interval */
-unsigned long genrand_int32(void)
+static unsigned long _genrand_int32(void)
 {
     unsigned long y;
     static unsigned long mag01[2]={0x0UL, MATRIX_A};
@@ -118,7 +131,7 @@ unsigned long genrand_int32(void)
         int kk;
 
         if (mti == MT_N+1)   /* if init_genrand() has not been called, */
-            init_genrand(5489UL); /* a default initial seed is used */
+            _init_genrand(5489UL); /* a default initial seed is used */
 
         for (kk=0;kk<MT_N-MT_M;kk++) {
             y = (mt[kk]&UPPER_MASK)|(mt[kk+1]&LOWER_MASK);
@@ -145,6 +158,17 @@ unsigned long genrand_int32(void)
     return y;
 }
 
+unsigned long genrand_int32(void)
+{
+    unsigned long y;
+
+    pthread_mutex_lock(&genrand_mutex);
+    y = _genrand_int32();
+    pthread_mutex_unlock(&genrand_mutex);
+
+    return y;
+}
+
 /* generates a random number on [0,0x7fffffff]-interval */
 long genrand_int31(void)
 {
@@ -179,3 +203,85 @@ double genrand_res53(void)
     return(a*67108864.0+b)*(1.0/9007199254740992.0); 
 } 
 /* These real versions are due to Isaku Wada, 2002/01/09 added */
+
+/*
+ * counter-based random number generator (Philox4x32-10)
+ *
+ * J. K. Salmon, M. A. Moraes, R. O. Dror, D. E. Shaw,
+ * "Parallel random numbers: as easy as 1, 2, 3", SC11 (2011).
+ *
+ * the n-th random number of a stream is the function of (seed, stream, n) only,
+ * so that each qstate owns its generator (see qstate->rng), and the streams
+ * are split deterministically for the threads or processes (see rng_split).
+ */
+
+#define PHILOX_M0 0xD2511F53U
+#define PHILOX_M1 0xCD9E8D57U
+#define PHILOX_W0 0x9E3779B9U
+#define PHILOX_W1 0xBB67AE85U
+#define PHILOX_ROUND_NUM 10
+
+static unsigned long long _philox4x32(unsigned long long seed, unsigned long long stream,
+				      unsigned long long count)
+/* 64-bit random number of the block (count, stream) with the key (seed) */
+{
+  unsigned int		c0 = (unsigned int)count;
+  unsigned int		c1 = (unsigned int)(count >> 32);
+  unsigned int		c2 = (unsigned int)stream;
+  unsigned int		c3 = (unsigned int)(stream >> 32);
+  unsigned int		k0 = (unsigned int)seed;
+  unsigned int		k1 = (unsigned int)(seed >> 32);
+  unsigned long long	p0, p1;
+  int			r;
+
+  for (r=0; r<PHILOX_ROUND_NUM; r++) {
+    if (r > 0) {
+      k0 += PHILOX_W0;
+      k1 += PHILOX_W1;
+    }
+    p0 = (unsigned long long)PHILOX_M0 * c0;
+    p1 = (unsigned long long)PHILOX_M1 * c2;
+    c0 = (unsigned int)(p1 >> 32) ^ c1 ^ k0;
+    c1 = (unsigned int)p1;
+    c2 = (unsigned int)(p0 >> 32) ^ c3 ^ k1;
+    c3 = (unsigned int)p0;
+  }
+
+  return ((unsigned long long)c1 << 32) | c0;
+}
+
+void rng_init(Rng* rng, unsigned long long seed, unsigned long long stream)
+{
+  rng->seed = seed;
+  rng->stream = stream;
+  rng->count = 0;
+}
+
+void rng_split(Rng* rng, Rng* rng_out)
+/* new generator whose seed is the next random number of rng (the stream of rng_out is 0) */
+{
+  rng_init(rng_out, rng_uint64(rng), 0);
+}
+
+unsigned long long rng_uint64(Rng* rng)
+{
+  return _philox4x32(rng->seed, rng->stream, rng->count++);
+}
+
+/* generates a random number on [0,1]-real-interval (53-bit resolution) */
+double rng_real1(Rng* rng)
+{
+  return (double)(rng_uint64(rng) >> 11) * (1.0/9007199254740991.0);
+}
+
+/* generates a random number on [0,1)-real-interval (53-bit resolution) */
+double rng_real2(Rng* rng)
+{
+  return (double)(rng_uint64(rng) >> 11) * (1.0/9007199254740992.0);
+}
+
+/* generates a random number on (0,1)-real-interval (52-bit resolution) */
+double rng_real3(Rng* rng)
+{
+  return ((double)(rng_uint64(rng) >> 12) + 0.5) * (1.0/4503599627370496.0);
+}
@@ -0,0 +1,264 @@
+/*
+ *  simd.c
+ *
+ *  vectorized kernels of the state vector simulation (AVX2, AVX-512).
+ *  the instruction set is selected at library load by the cpu features
+ *  (environment variable QLAZY_SIMD=scalar|avx2|avx512 limits it),
+ *  and the scalar loops are used if no vector unit is available.
+ */
+
+#include "qlazy.h"
+
+#if defined(__x86_64__) && defined(__GNUC__)
+#define SIMD_X86
+#include <immintrin.h>
+#endif
+
+static SimdLevel Level = SIMD_SCALAR;
+static int	 Lane  = 1;	/* number of amplitudes in a vector register */
+
+/*
+ *  scalar kernels
+ */
+
+static void _unitary_k_scalar(COMPLEX* a, INDEX* offset, int size, COMPLEX* U, int len)
+{
+  COMPLEX	b[1 << MAX_FUSION_QUBIT_NUM];
+  int		j, l, m;
+
+  for (j=0; j<len; j++) {
+    for (m=0; m<size; m++) b[m] = a[offset[m] + j];
+    for (l=0; l<size; l++) {
+      COMPLEX	c = 0.0;
+      for (m=0; m<size; m++) c += U[l * size + m] * b[m];
+      a[offset[l] + j] = c;
+    }
+  }
+}
+
+static void _scale_scalar(COMPLEX* a, COMPLEX d, int len)
+{
+  int	j;
+
+  for (j=0; j<len; j++) a[j] *= d;
+}
+
+#ifdef SIMD_X86
+
+/*
+ *  vector kernels
+ *
+ *  complex amplitudes are interleaved (re,im,re,im,...) in a vector register.
+ *  u * a = re(u) * (re(a),im(a)) + im(u) * (-im(a),re(a)), so the product is
+ *  computed with fused multiply-add of 'a' and 'a' with swapped (re,im) pairs,
+ *  and the sign of the second term is applied once at the end.
+ */
+
+#ifdef SINGLE_PRECISION
+
+#define VEC_256			__m256
+#define LANE_256		4
+#define LOAD_256(p)		_mm256_loadu_ps((REAL*)(p))
+#define STORE_256(p, v)		_mm256_storeu_ps((REAL*)(p), (v))
+#define SET1_256(x)		_mm256_set1_ps(x)
+#define ZERO_256()		_mm256_setzero_ps()
+#define MUL_256(a, b)		_mm256_mul_ps((a), (b))
+#define FMA_256(a, b, c)	_mm256_fmadd_ps((a), (b), (c))
+#define SWAP_256(v)		_mm256_permute_ps((v), 0xb1)
+#define SIGN_256()		_mm256_set_ps(1,-1,1,-1,1,-1,1,-1)
+
+#define VEC_512			__m512
+#define LANE_512		8
+#define LOAD_512(p)		_mm512_loadu_ps((REAL*)(p))
+#define STORE_512(p, v)		_mm512_storeu_ps((REAL*)(p), (v))
+#define SET1_512(x)		_mm512_set1_ps(x)
+#define ZERO_512()		_mm512_setzero_ps()
+#define MUL_512(a, b)		_mm512_mul_ps((a), (b))
+#define FMA_512(a, b, c)	_mm512_fmadd_ps((a), (b), (c))
+#define SWAP_512(v)		_mm512_permute_ps((v), 0xb1)
+#define SIGN_512()		_mm512_set_ps(1,-1,1,-1,1,-1,1,-1,1,-1,1,-1,1,-1,1,-1)
+
+#else
+
+#define VEC_256			__m256d
+#define LANE_256		2
+#define LOAD_256(p)		_mm256_loadu_pd((REAL*)(p))
+#define STORE_256(p, v)		_mm256_storeu_pd((REAL*)(p), (v))
+#define SET1_256(x)		_mm256_set1_pd(x)
+#define ZERO_256()		_mm256_setzero_pd()
+#define MUL_256(a, b)		_mm256_mul_pd((a), (b))
+#define FMA_256(a, b, c)	_mm256_fmadd_pd((a), (b), (c))
+#define SWAP_256(v)		_mm256_permute_pd((v), 0x5)
+#define SIGN_256()		_mm256_set_pd(1,-1,1,-1)
+
+#define VEC_512			__m512d
+#define LANE_512		4
+#define LOAD_512(p)		_mm512_loadu_pd((REAL*)(p))
+#define STORE_512(p, v)		_mm512_storeu_pd((REAL*)(p), (v))
+#define SET1_512(x)		_mm512_set1_pd(x)
+#define ZERO_512()		_mm512_setzero_pd()
+#define MUL_512(a, b)		_mm512_mul_pd((a), (b))
+#define FMA_512(a, b, c)	_mm512_fmadd_pd((a), (b), (c))
+#define SWAP_512(v)		_mm512_permute_pd((v), 0x55)
+#define SIGN_512()		_mm512_set_pd(1,-1,1,-1,1,-1,1,-1)
+
+#endif
+
+/* a[offset[l] + j] <= sum_m U[l,m] * a[offset[m] + j] (j = 0,..,len-1, step = lane) */
+#define UNITARY_K_BODY(W, SIZE)						\
+  {									\
+    VEC_##W	b[1 << MAX_FUSION_QUBIT_NUM];				\
+    VEC_##W	c[1 << MAX_FUSION_QUBIT_NUM];				\
+    VEC_##W	sign = SIGN_##W();					\
+    int		j, l, m;						\
+    for (j=0; j + LANE_##W <= len; j += LANE_##W) {			\
+      for (m=0; m<(SIZE); m++) {					\
+	b[m] = LOAD_##W(a + offset[m] + j);				\
+	c[m] = SWAP_##W(b[m]);						\
+      }									\
+      for (l=0; l<(SIZE); l++) {					\
+	VEC_##W	re = ZERO_##W();					\
+	VEC_##W	im = ZERO_##W();					\
+	for (m=0; m<(SIZE); m++) {					\
+	  re = FMA_##W(b[m], SET1_##W(ur[l * (SIZE) + m]), re);		\
+	  im = FMA_##W(c[m], SET1_##W(ui[l * (SIZE) + m]), im);		\
+	}								\
+	STORE_##W(a + offset[l] + j, FMA_##W(im, sign, re));		\
+      }									\
+    }									\
+    if (j < len) {							\
+      INDEX	off[1 << MAX_FUSION_QUBIT_NUM];				\
+      for (m=0; m<(SIZE); m++) off[m] = offset[m] + j;			\
+      _unitary_k_scalar(a, off, (SIZE), U, len - j);			\
+    }									\
+  }
+
+/* a[j] <= d * a[j] (j = 0,..,len-1, step = lane) */
+#define SCALE_BODY(W)							\
+  {									\
+    VEC_##W	dr = SET1_##W(creal(d));				\
+    VEC_##W	di = MUL_##W(SET1_##W(cimag(d)), SIGN_##W());		\
+    int		j;							\
+    for (j=0; j + LANE_##W <= len; j += LANE_##W) {			\
+      VEC_##W	b = LOAD_##W(a + j);					\
+      STORE_##W(a + j, FMA_##W(SWAP_##W(b), di, MUL_##W(b, dr)));	\
+    }									\
+    if (j < len) _scale_scalar(a + j, d, len - j);			\
+  }
+
+__attribute__((target("avx2,fma")))
+static inline void _unitary_k_avx2_core(COMPLEX* a, INDEX* offset, int size, COMPLEX* U,
+					REAL* ur, REAL* ui, int len)
+UNITARY_K_BODY(256, size)
+
+__attribute__((target("avx2,fma")))
+static void _unitary_k_avx2(COMPLEX* a, INDEX* offset, int size, COMPLEX* U,
+			    REAL* ur, REAL* ui, int len)
+{
+  /* constant size for loop unrolling */
+  switch (size) {
+  case 2:  _unitary_k_avx2_core(a, offset, 2, U, ur, ui, len);  break;
+  case 4:  _unitary_k_avx2_core(a, offset, 4, U, ur, ui, len);  break;
+  case 8:  _unitary_k_avx2_core(a, offset, 8, U, ur, ui, len);  break;
+  default: _unitary_k_avx2_core(a, offset, size, U, ur, ui, len); break;
+  }
+}
+
+__attribute__((target("avx2,fma")))
+static void _scale_avx2(COMPLEX* a, COMPLEX d, int len)
+SCALE_BODY(256)
+
+__attribute__((target("avx512f")))
+static inline void _unitary_k_avx512_core(COMPLEX* a, INDEX* offset, int size, COMPLEX* U,
+					  REAL* ur, REAL* ui, int len)
+UNITARY_K_BODY(512, size)
+
+__attribute__((target("avx512f")))
+static void _unitary_k_avx512(COMPLEX* a, INDEX* offset, int size, COMPLEX* U,
+			      REAL* ur, REAL* ui, int len)
+{
+  /* constant size for loop unrolling */
+  switch (size) {
+  case 2:  _unitary_k_avx512_core(a, offset, 2, U, ur, ui, len);  break;
+  case 4:  _unitary_k_avx512_core(a, offset, 4, U, ur, ui, len);  break;
+  case 8:  _unitary_k_avx512_core(a, offset, 8, U, ur, ui, len);  break;
+  default: _unitary_k_avx512_core(a, offset, size, U, ur, ui, len); break;
+  }
+}
+
+__attribute__((target("avx512f")))
+static void _scale_avx512(COMPLEX* a, COMPLEX d, int len)
+SCALE_BODY(512)
+
+#endif
+
+/*
+ *  dispatch
+ */
+
+__attribute__((constructor))
+static void _simd_init(void)
+{
+#ifdef SIMD_X86
+  char*		env = getenv("QLAZY_SIMD");
+  SimdLevel	limit = SIMD_AVX512;
+
+  if (env != NULL) {
+    if (strcmp(env, "scalar") == 0) limit = SIMD_SCALAR;
+    else if (strcmp(env, "avx2") == 0) limit = SIMD_AVX2;
+  }
+
+  __builtin_cpu_init();
+  if ((limit >= SIMD_AVX512) && __builtin_cpu_supports("avx512f")) {
+    Level = SIMD_AVX512;
+    Lane = LANE_512;
+  }
+  else if ((limit >= SIMD_AVX2) && __builtin_cpu_supports("avx2")
+	   && __builtin_cpu_supports("fma")) {
+    Level = SIMD_AVX2;
+    Lane = LANE_256;
+  }
+#endif
+}
+
+SimdLevel simd_level(void)
+{
+  return Level;
+}
+
+int simd_lane_num(void)
+{
+  return Lane;
+}
+
+void simd_unitary_k(COMPLEX* a, INDEX* offset, int size, COMPLEX* U, int len)
+/* operate the size x size matrix U on the amplitudes a[offset[l] + j] (l = 0,..,size-1)
+   for j = 0,..,len-1 (each offset[l] + j must be disjoint) */
+{
+#ifdef SIMD_X86
+  REAL	ur[1 << (2 * MAX_FUSION_QUBIT_NUM)];
+  REAL	ui[1 << (2 * MAX_FUSION_QUBIT_NUM)];
+  int	l;
+
+  if (Level != SIMD_SCALAR) {
+    for (l=0; l<size*size; l++) {
+      ur[l] = creal(U[l]);
+      ui[l] = cimag(U[l]);
+    }
+    if (Level == SIMD_AVX512) _unitary_k_avx512(a, offset, size, U, ur, ui, len);
+    else _unitary_k_avx2(a, offset, size, U, ur, ui, len);
+    return;
+  }
+#endif
+  _unitary_k_scalar(a, offset, size, U, len);
+}
+
+void simd_scale(COMPLEX* a, COMPLEX d, int len)
+/* multiply the amplitudes a[j] (j = 0,..,len-1) by d */
+{
+#ifdef SIMD_X86
+  if (Level == SIMD_AVX512) { _scale_avx512(a, d, len); return; }
+  if (Level == SIMD_AVX2) { _scale_avx2(a, d, len); return; }
+#endif
+  _scale_scalar(a, d, len);
+}
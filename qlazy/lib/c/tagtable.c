@@ -136,14 +136,15 @@ bool tagtable_get_tags(TagTable* tt, void** tag_array_out, int* tag_num, int* ta
 
   if (tt == NULL) ERR_RETURN(ERROR_INVALID_ARGUMENT, false);
   
-  if (!(tag_array = (char**)malloc(sizeof(char*) * tt->data_num)))
+  /* one more element, so that tag_array[0] is the buffer even if no tags */
+  if (!(tag_array = (char**)malloc(sizeof(char*) * (tt->data_num + 1))))
     ERR_RETURN(ERROR_CANT_ALLOC_MEMORY,NULL);
 
-  if (!(buff = (char*)malloc(sizeof(char) * TAG_STRLEN * tt->data_num)))
+  if (!(buff = (char*)malloc(sizeof(char) * TAG_STRLEN * (tt->data_num + 1))))
     ERR_RETURN(ERROR_CANT_ALLOC_MEMORY,NULL);
 
   k_pos = 0;
-  for (i=0; i<tt->data_num; i++) {
+  for (i=0; i<=tt->data_num; i++) {
     tag_array[i] = &buff[k_pos];
     k_pos += TAG_STRLEN;
   }
@@ -22,6 +22,9 @@ def densop_init(qstate=None, prob=None):
     if prob is None:
         prob = []
 
+    # density operator is double precision (single precision states are converted)
+    qstate = [QState(vector=qs.get_amp()) if qs.use_single is True else qs for qs in qstate]
+
     num = len(qstate)
 
     densop = None
@@ -4,7 +4,7 @@
 import numpy as np
 from collections import Counter
 
-from qlazy.util import get_qgate_qubit_num, is_measurement_gate, is_reset_gate
+from qlazy.util import get_qgate_qubit_num, is_measurement_gate, is_reset_gate, bits_to_values
 import qlazy.config as cfg
 
 def mps_operate_qcirc(mps, cmem, qcirc, shots, cid):
@@ -28,7 +28,7 @@ def mps_operate_qcirc(mps, cmem, qcirc, shots, cid):
     
     # non-unitary part
     if qcirc_non_unitary.kind_first() is None: # non-unitary part includes no gates
-        frequency = None
+        counts = None
     
     elif qcirc_non_unitary.all_gates_measurement() is True: # non-unitary part includes measurements only
         q_list = []
@@ -44,18 +44,15 @@ def mps_operate_qcirc(mps, cmem, qcirc, shots, cid):
                 c_list.append(c)
 
         md = mps.m(qid=q_list, shots=shots)
-        frequency = Counter()
-        for k, v in md.frequency.items():
-            m_list = list(map(int, list(k)))
-            b_list = [0] * cmem.cmem_num
-            for i, q in enumerate(q_list):
-                b_list[c_list[i]] = m_list[i]
-            b_list = [b_list[c] for c in cid]
-            bits = "".join(map(str, b_list))
-            frequency[bits] = v
+        bits = np.zeros((len(md.frequency), cmem.cmem_num), dtype=np.uint8)
+        for n, k in enumerate(md.frequency):
+            bits[n, c_list] = list(map(int, list(k)))
+        counts = {}
+        for mval, v in zip(bits_to_values(bits[:, cid]), md.frequency.values()):
+            counts[mval] = counts.get(mval, 0) + v
 
     else:
-        frequency = Counter()
+        bits = np.zeros((shots, cmem.cmem_num), dtype=np.uint8)
         for n in range(shots):
             qc_tmp = qcirc_non_unitary.clone()
             if n == shots - 1:
@@ -83,8 +80,8 @@ def mps_operate_qcirc(mps, cmem, qcirc, shots, cid):
                     else:
                         raise ValueError("invalid gate description: {}".format(kind, qid, para, c, ctrl))
 
-            b_list = [b_list[c] for c in cid]
-            bits = "".join(map(str, b_list))
-            frequency[bits] += 1
+            bits[n] = b_list
+
+        counts = dict(Counter(bits_to_values(bits[:, cid])))
         
-    return frequency
+    return counts
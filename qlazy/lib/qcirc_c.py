@@ -114,6 +114,40 @@ def qcirc_append_gate(qcirc, kind, qid, para, c, ctrl, tag):
     if ret is False:
         raise ValueError("can't append quantum gate.")
 
+def qcirc_append_mqgate(qcirc, kind, qid, para, ctrl, tag):
+    """ append multi-qubit gate (mcx: [control, ... , control, target], qft/iqft/mrz: qubit id list) to the QCirc objects """
+
+    if para is None:
+        para = [0.0, 0.0, 1.0]  # [phase, gphase, factor]
+    if ctrl is None:
+        ctrl = -1
+    if tag is None:
+        tag = ""
+
+    if len(qid) < 1 or len(qid) > cfg.MAX_QEXT_NUM + 1:
+        raise ValueError("number of qubits must be 1 to {}.".format(cfg.MAX_QEXT_NUM + 1))
+    qext = qid[:-1]
+    qext_num = len(qext)
+    para_num = len(para)
+    IntArray = ctypes.c_int * 2
+    ExtArray = ctypes.c_int * cfg.MAX_QEXT_NUM
+    DoubleArray = ctypes.c_double * para_num
+    c_qid = IntArray(qid[-1], -1)
+    c_qext = ExtArray(*qext)
+    c_para = DoubleArray(*para)
+    c_tag = tag.encode('utf-8')
+
+    lib.qcirc_append_mqgate.restype = ctypes.c_bool
+    lib.qcirc_append_mqgate.argtypes = [ctypes.POINTER(QCirc), ctypes.c_int, IntArray,
+                                        ctypes.c_int, ExtArray, DoubleArray, ctypes.c_int,
+                                        ctypes.c_char_p]
+    ret = lib.qcirc_append_mqgate(ctypes.byref(qcirc), ctypes.c_int(kind), c_qid,
+                                  ctypes.c_int(qext_num), c_qext, c_para,
+                                  ctypes.c_int(ctrl), c_tag)
+
+    if ret is False:
+        raise ValueError("can't append quantum gate.")
+
 def qcirc_kind_first(qc):
     """ get 1st gate kind of the quantum circuit """
 
@@ -142,6 +176,10 @@ def qcirc_pop_gate(qc):
     qid = [0] * 2
     IntArray = ctypes.c_int * 2
     c_qid = IntArray(*qid)
+    qext_num = 0
+    c_qext_num = ctypes.c_int(qext_num)
+    ExtArray = ctypes.c_int * cfg.MAX_QEXT_NUM
+    c_qext = ExtArray()
     para = [0.0] * 3
     DoubleArray = ctypes.c_double * 3
     c_para = DoubleArray(*para)
@@ -157,11 +195,13 @@ def qcirc_pop_gate(qc):
     lib.qcirc_pop_gate.restype = ctypes.c_bool
     lib.qcirc_pop_gate.argtypes = [ctypes.POINTER(QCirc), ctypes.POINTER(ctypes.c_int),
                                    ctypes.POINTER(ctypes.c_int),
+                                   ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int),
                                    ctypes.POINTER(ctypes.c_double),
                                    ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int),
                                    ctypes.c_char_p, ctypes.POINTER(ctypes.c_int)]
 
-    ret = lib.qcirc_pop_gate(ctypes.byref(qc), ctypes.byref(c_kind), c_qid, c_para,
+    ret = lib.qcirc_pop_gate(ctypes.byref(qc), ctypes.byref(c_kind), c_qid,
+                             ctypes.byref(c_qext_num), c_qext, c_para,
                              ctypes.byref(c_c), ctypes.byref(c_ctrl), c_tag, ctypes.byref(c_taglen))
 
     if ret is False:
@@ -169,6 +209,10 @@ def qcirc_pop_gate(qc):
 
     kind = c_kind.value
     qid = [c_qid[i] for i in range(2)]
+    qext_num = c_qext_num.value
+    if kind in (cfg.MULTI_CONTROLLED_X, cfg.QFT_GATE, cfg.IQFT_GATE,
+                cfg.MULTI_ROTATION_Z):  # multi-qubit gate
+        qid = [c_qext[i] for i in range(qext_num)] + [qid[0]]
     para = [c_para[i] for i in range(3)]
     c = c_c.value
     ctrl = c_ctrl.value
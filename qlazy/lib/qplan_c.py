@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+""" wrapper functions for QPlan """
+import ctypes
+import numpy as np
+
+import qlazy.config as cfg
+from qlazy.QCirc import QCirc
+from qlazy.QPlan import QPlan
+from qlazy.lib.qstate_c import get_lib
+
+def qplan_lib(qplan):
+    """ get the library for the QPlan object """
+
+    return get_lib('single' if qplan.use_single is True else 'double')
+
+def qplan_init(qcirc, fusion_qubit_num=None, tags=None, precision='double'):
+    """ initialize QPlan object (compile the quantum circuit) """
+
+    qlib = get_lib(precision)
+
+    if fusion_qubit_num is None:
+        fusion_qubit_num = cfg.DEF_FUSION_QUBIT_NUM
+    if fusion_qubit_num < 0 or fusion_qubit_num > cfg.MAX_FUSION_QUBIT_NUM:
+        raise ValueError("fusion_qubit_num must be 0 or more and {0:d} or less.".format(cfg.MAX_FUSION_QUBIT_NUM))
+
+    tags = tags or []
+    tag_buf = b''.join([tag.encode('utf-8') + b'\x00' for tag in tags])
+
+    qplan = None
+    c_qplan = ctypes.c_void_p(qplan)
+
+    qlib.qplan_init.restype = ctypes.c_bool
+    qlib.qplan_init.argtypes = [ctypes.POINTER(QCirc), ctypes.c_int, ctypes.c_int,
+                                ctypes.c_char_p, ctypes.POINTER(ctypes.c_void_p)]
+    ret = qlib.qplan_init(ctypes.byref(qcirc), ctypes.c_int(fusion_qubit_num),
+                          ctypes.c_int(len(tags)), tag_buf, c_qplan)
+
+    if ret is False:
+        raise ValueError("can't compile the quantum circuit.")
+
+    return c_qplan
+
+def qplan_set_params(qplan, phase):
+    """ set the phases of the tags """
+
+    qlib = qplan_lib(qplan)
+
+    phase = np.ascontiguousarray(phase, dtype=np.float64)
+
+    qlib.qplan_set_params.restype = ctypes.c_bool
+    qlib.qplan_set_params.argtypes = [ctypes.POINTER(QPlan), ctypes.POINTER(ctypes.c_double)]
+    ret = qlib.qplan_set_params(ctypes.byref(qplan),
+                                phase.ctypes.data_as(ctypes.POINTER(ctypes.c_double)))
+
+    if ret is False:
+        raise ValueError("can't set the parameters of the plan.")
+
+def qplan_free(qplan):
+    """ free memory of the QPlan object """
+
+    qlib = qplan_lib(qplan)
+
+    qlib.qplan_free.argtypes = [ctypes.POINTER(QPlan)]
+    qlib.qplan_free(ctypes.byref(qplan))
@@ -3,11 +3,10 @@
 import ctypes
 from ctypes.util import find_library
 import pathlib
-from collections import Counter
 import numpy as np
 
 import qlazy.config as cfg
-from qlazy.util import get_lib_ext, qstate_check_args
+from qlazy.util import get_lib_ext, qstate_check_args, bits_to_values
 from qlazy.QState import QState
 from qlazy.MData import MData
 from qlazy.ObservableBase import ObservableBase
@@ -16,58 +15,199 @@ from qlazy.CMem import CMem
 
 lib = ctypes.CDLL(str(pathlib.Path(__file__).with_name('libqlz.'+get_lib_ext())))
 libc = ctypes.CDLL(find_library("c"), mode=ctypes.RTLD_GLOBAL)
-
-def qstate_init(qubit_num=None, seed=None, use_gpu=False):
+try:  # single precision build of libqlz (not built with GPU)
+    lib_single = ctypes.CDLL(str(pathlib.Path(__file__).with_name('libqlz_single.'+get_lib_ext())))
+except OSError:
+    lib_single = None
+
+def get_lib(precision='double'):
+    """ get the library for the precision of the amplitudes ('double' or 'single') """
+
+    if precision == 'double':
+        return lib
+    if precision == 'single':
+        if lib_single is None:
+            raise ValueError("single precision is not supported (libqlz_single is not built).")
+        return lib_single
+    raise ValueError("precision must be 'double' or 'single'.")
+
+def qstate_lib(*qstates):
+    """ get the library for the QState objects (the precision must be the same) """
+
+    if len(set(qs.use_single for qs in qstates)) > 1:
+        raise ValueError("precision of the quantum states must be the same.")
+    if qstates[0].use_single is True:
+        return lib_single
+    return lib
+
+def qstate_check_memory(qubit_num, precision='double'):
+    """ check the available memory for the quantum state vector """
+
+    if qubit_num < cfg.MEMCHECK_QUBIT_NUM:
+        return
+
+    lib.get_available_memory.restype = ctypes.c_size_t
+    lib.get_available_memory.argtypes = []
+    avail = lib.get_available_memory()
+
+    itemsize = 8 if precision == 'single' else 16
+    need = (1 << qubit_num) * itemsize
+    if avail > 0 and need > avail:
+        raise MemoryError("quantum state of {0:d} qubits requires {1:.1f} GiB, "
+                          "but only {2:.1f} GiB is available."
+                          .format(qubit_num, need / 2**30, avail / 2**30))
+
+def qstate_init(qubit_num=None, seed=None, use_gpu=False, precision='double'):
     """ initialize QState object """
 
-    lib.init_genrand(ctypes.c_int(seed))
+    qlib = get_lib(precision)
+    if use_gpu is True and qlib is not lib:
+        raise ValueError("single precision is not supported with GPU.")
+
+    if use_gpu is False:
+        qstate_check_memory(qubit_num, precision)
 
     qstate = None
     c_qstate = ctypes.c_void_p(qstate)
 
-    lib.qstate_init.restype = ctypes.c_bool
-    lib.qstate_init.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_void_p), ctypes.c_bool]
-    ret = lib.qstate_init(ctypes.c_int(qubit_num), c_qstate, ctypes.c_bool(use_gpu))
+    qlib.qstate_init.restype = ctypes.c_bool
+    qlib.qstate_init.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_void_p), ctypes.c_bool]
+    ret = qlib.qstate_init(ctypes.c_int(qubit_num), c_qstate, ctypes.c_bool(use_gpu))
 
     if ret is False:
         raise ValueError("can't initialize QState object.")
 
+    qstate_set_seed(c_qstate, seed, qlib=qlib)
+
     return c_qstate
 
-def qstate_init_with_vector(vector=None, seed=None, use_gpu=False):
+def qstate_init_with_vector(vector=None, seed=None, use_gpu=False, precision='double'):
     """ initialize QState object with vector """
 
-    libc.srand(ctypes.c_int(seed))
+    qlib = get_lib(precision)
+    if use_gpu is True and qlib is not lib:
+        raise ValueError("single precision is not supported with GPU.")
 
     qstate = None
     c_qstate = ctypes.c_void_p(qstate)
 
+    vector = np.asarray(vector, dtype=np.complex128).ravel()
     dim = len(vector)
-    vec_real = [0.0 for _ in range(dim)]
-    vec_imag = [0.0 for _ in range(dim)]
-    for i in range(dim):
-        vec_real[i] = vector[i].real
-        vec_imag[i] = vector[i].imag
-
-    DoubleArray = ctypes.c_double * dim
-    c_vec_real = DoubleArray(*vec_real)
-    c_vec_imag = DoubleArray(*vec_imag)
-
-    lib.qstate_init_with_vector.restype = ctypes.c_bool
-    lib.qstate_init_with_vector.argtypes = [DoubleArray, DoubleArray, ctypes.c_int,
-                                            ctypes.POINTER(ctypes.c_void_p), ctypes.c_bool]
-    ret = lib.qstate_init_with_vector(c_vec_real, c_vec_imag, ctypes.c_int(dim),
-                                      c_qstate, ctypes.c_bool(use_gpu))
+    vec_real = np.ascontiguousarray(vector.real)
+    vec_imag = np.ascontiguousarray(vector.imag)
+
+    DoublePtr = ctypes.POINTER(ctypes.c_double)
+    qlib.qstate_init_with_vector.restype = ctypes.c_bool
+    qlib.qstate_init_with_vector.argtypes = [DoublePtr, DoublePtr, ctypes.c_longlong,
+                                             ctypes.POINTER(ctypes.c_void_p), ctypes.c_bool]
+    ret = qlib.qstate_init_with_vector(vec_real.ctypes.data_as(DoublePtr),
+                                       vec_imag.ctypes.data_as(DoublePtr),
+                                       ctypes.c_longlong(dim), c_qstate, ctypes.c_bool(use_gpu))
 
     if ret is False:
         raise ValueError("can't initialize QState object.")
 
+    qstate_set_seed(c_qstate, seed, qlib=qlib)
+
+    return c_qstate
+
+def qstate_init_with_file(qubit_num=0, fname=None, seed=None, precision='double'):
+    """ initialize QState object on the memory-mapped file """
+
+    qlib = get_lib(precision)
+
+    qstate = None
+    c_qstate = ctypes.c_void_p(qstate)
+
+    load = (qubit_num == 0)
+    qlib.qstate_init_with_file.restype = ctypes.c_bool
+    qlib.qstate_init_with_file.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_bool,
+                                           ctypes.POINTER(ctypes.c_void_p)]
+    ret = qlib.qstate_init_with_file(ctypes.c_int(qubit_num), fname.encode('utf-8'),
+                                     ctypes.c_bool(load), c_qstate)
+
+    if ret is False:
+        raise ValueError("can't initialize QState object with the file '{}'.".format(fname))
+
+    qstate_set_seed(c_qstate, seed, qlib=qlib)
+
     return c_qstate
 
+def qstate_init_with_buffer(array=None, adopt=False, seed=None, precision='double'):
+    """ initialize QState object with the contiguous numpy array (adopted or copied) """
+
+    qlib = get_lib(precision)
+    if adopt is False:
+        qstate_check_memory(int(array.size).bit_length() - 1, precision)
+
+    qstate = None
+    c_qstate = ctypes.c_void_p(qstate)
+
+    qlib.qstate_init_with_buffer.restype = ctypes.c_bool
+    qlib.qstate_init_with_buffer.argtypes = [ctypes.c_void_p, ctypes.c_longlong, ctypes.c_bool,
+                                             ctypes.POINTER(ctypes.c_void_p)]
+    ret = qlib.qstate_init_with_buffer(ctypes.c_void_p(array.ctypes.data),
+                                       ctypes.c_longlong(array.size), ctypes.c_bool(adopt),
+                                       c_qstate)
+
+    if ret is False:
+        raise ValueError("can't initialize QState object with the array.")
+
+    qstate_set_seed(c_qstate, seed, qlib=qlib)
+
+    return c_qstate
+
+def qstate_set_seed(qs, seed, stream=0, qlib=None):
+    """ set the seed and the stream of the random number generator of QState object """
+
+    if qlib is None:
+        qlib = qstate_lib(qs)
+    if isinstance(qs, QState):
+        qs = ctypes.c_void_p(ctypes.addressof(qs))
+
+    qlib.qstate_set_seed.restype = ctypes.c_bool
+    qlib.qstate_set_seed.argtypes = [ctypes.c_void_p, ctypes.c_ulonglong, ctypes.c_ulonglong]
+    ret = qlib.qstate_set_seed(qs, ctypes.c_ulonglong(seed), ctypes.c_ulonglong(stream))
+
+    if ret is False:
+        raise ValueError("can't set the seed of QState object.")
+
+def qstate_amp_view(qs, writable=False):
+    """ numpy array aliasing the elements of the quantum state vector (not copied) """
+
+    if qs.use_gpu is True:
+        raise ValueError("view of the quantum state vector is not supported with GPU.")
+
+    ctype = ctypes.c_float if qs.use_single is True else ctypes.c_double
+    dtype = np.complex64 if qs.use_single is True else np.complex128
+
+    buf = (ctype * (2 * qs.state_num)).from_address(qs.camp)
+    buf.qstate = qs  # keep the quantum state alive while the view is alive
+    out = np.frombuffer(buf, dtype=dtype)
+    if writable is True:
+        qs.prob_updated = False
+    else:
+        out.flags.writeable = False
+
+    return out
+
+def qstate_sync(qs):
+    """ write the quantum state vector back to the backing file """
+
+    qlib = qstate_lib(qs)
+
+    qlib.qstate_sync.restype = ctypes.c_bool
+    qlib.qstate_sync.argtypes = [ctypes.POINTER(QState)]
+    ret = qlib.qstate_sync(ctypes.byref(qs))
+
+    if ret is False:
+        raise ValueError("can't write the quantum state vector to the backing file.")
 
 def qstate_reset(qs, qid=None):
     """ reset quantum state vector """
 
+    qlib = qstate_lib(qs)
+
     if qid is None or qid == []:
         qid = list(range(qs.qubit_num))
 
@@ -82,9 +222,9 @@ def qstate_reset(qs, qid=None):
         IntArray = ctypes.c_int * qubit_num
         qid_array = IntArray(*qubit_id)
 
-        lib.qstate_reset.restype = ctypes.c_bool
-        lib.qstate_reset.argtypes = [ctypes.POINTER(QState), ctypes.c_int, IntArray]
-        ret = lib.qstate_reset(ctypes.byref(qs), ctypes.c_int(qubit_num), qid_array)
+        qlib.qstate_reset.restype = ctypes.c_bool
+        qlib.qstate_reset.argtypes = [ctypes.POINTER(QState), ctypes.c_int, IntArray]
+        ret = qlib.qstate_reset(ctypes.byref(qs), ctypes.c_int(qubit_num), qid_array)
 
         if ret is False:
             raise ValueError("can't reset quantum state vector.")
@@ -96,6 +236,8 @@ def qstate_reset(qs, qid=None):
 def qstate_print(qs, qid=None, nonzero=False):
     """ print quantum state vector """
 
+    qlib = qstate_lib(qs)
+
     if qid is None or qid == []:
         qid = list(range(qs.qubit_num))
 
@@ -110,10 +252,10 @@ def qstate_print(qs, qid=None, nonzero=False):
         IntArray = ctypes.c_int * qubit_num
         qid_array = IntArray(*qubit_id)
 
-        lib.qstate_print.restype = ctypes.c_bool
-        lib.qstate_print.argtypes = [ctypes.POINTER(QState), ctypes.c_int, IntArray, ctypes.c_bool]
-        ret = lib.qstate_print(ctypes.byref(qs), ctypes.c_int(qubit_num),
-                               qid_array, ctypes.c_bool(nonzero))
+        qlib.qstate_print.restype = ctypes.c_bool
+        qlib.qstate_print.argtypes = [ctypes.POINTER(QState), ctypes.c_int, IntArray, ctypes.c_bool]
+        ret = qlib.qstate_print(ctypes.byref(qs), ctypes.c_int(qubit_num),
+                                qid_array, ctypes.c_bool(nonzero))
 
         if ret is False:
             raise ValueError("can't print quantum state vector.")
@@ -125,14 +267,16 @@ def qstate_print(qs, qid=None, nonzero=False):
 def qstate_copy(qs):
     """ copy the quantum state vector """
 
+    qlib = qstate_lib(qs)
+
     try:
         qstate = None
         c_qstate = ctypes.c_void_p(qstate)
 
-        lib.qstate_copy.restype = ctypes.c_bool
-        lib.qstate_copy.argtypes = [ctypes.POINTER(QState),
-                                    ctypes.POINTER(ctypes.c_void_p)]
-        ret = lib.qstate_copy(ctypes.byref(qs), c_qstate)
+        qlib.qstate_copy.restype = ctypes.c_bool
+        qlib.qstate_copy.argtypes = [ctypes.POINTER(QState),
+                                     ctypes.POINTER(ctypes.c_void_p)]
+        ret = qlib.qstate_copy(ctypes.byref(qs), c_qstate)
 
         if ret is False:
             raise ValueError("can't copy quantum state vector.")
@@ -146,6 +290,8 @@ def qstate_copy(qs):
 def qstate_bloch(qs, q=0):
     """ get bloch angle from quantum state vector """
 
+    qlib = qstate_lib(qs)
+
     # error check
     qstate_check_args(qs, kind=cfg.BLOCH, qid=[q])
 
@@ -155,12 +301,12 @@ def qstate_bloch(qs, q=0):
         c_theta = ctypes.c_double(theta)
         c_phi = ctypes.c_double(phi)
 
-        lib.qstate_bloch.restype = ctypes.c_bool
-        lib.qstate_bloch.argtypes = [ctypes.POINTER(QState), ctypes.c_int,
-                                     ctypes.POINTER(ctypes.c_double),
-                                     ctypes.POINTER(ctypes.c_double)]
-        ret = lib.qstate_bloch(ctypes.byref(qs), ctypes.c_int(q),
-                               ctypes.byref(c_theta), ctypes.byref(c_phi))
+        qlib.qstate_bloch.restype = ctypes.c_bool
+        qlib.qstate_bloch.argtypes = [ctypes.POINTER(QState), ctypes.c_int,
+                                      ctypes.POINTER(ctypes.c_double),
+                                      ctypes.POINTER(ctypes.c_double)]
+        ret = qlib.qstate_bloch(ctypes.byref(qs), ctypes.c_int(q),
+                                ctypes.byref(c_theta), ctypes.byref(c_phi))
 
         if ret is False:
             raise ValueError("can't get bloch angle.")
@@ -177,19 +323,21 @@ def qstate_bloch(qs, q=0):
 def qstate_inner_product(qs_0, qs_1):
     """ get inner product of 2 quantum state vectors """
 
+    qlib = qstate_lib(qs_0, qs_1)
+
     try:
         real = 0.0
         imag = 0.0
         c_real = ctypes.c_double(real)
         c_imag = ctypes.c_double(imag)
 
-        lib.qstate_inner_product.restype = ctypes.c_bool
-        lib.qstate_inner_product.argtypes = [ctypes.POINTER(QState),
-                                             ctypes.POINTER(QState),
-                                             ctypes.POINTER(ctypes.c_double),
-                                             ctypes.POINTER(ctypes.c_double)]
-        ret = lib.qstate_inner_product(ctypes.byref(qs_0), ctypes.byref(qs_1),
-                                       ctypes.byref(c_real), ctypes.byref(c_imag))
+        qlib.qstate_inner_product.restype = ctypes.c_bool
+        qlib.qstate_inner_product.argtypes = [ctypes.POINTER(QState),
+                                              ctypes.POINTER(QState),
+                                              ctypes.POINTER(ctypes.c_double),
+                                              ctypes.POINTER(ctypes.c_double)]
+        ret = qlib.qstate_inner_product(ctypes.byref(qs_0), ctypes.byref(qs_1),
+                                        ctypes.byref(c_real), ctypes.byref(c_imag))
 
         if ret is False:
             raise ValueError("can't get inner product of 2 quantum state vectors.")
@@ -206,6 +354,8 @@ def qstate_inner_product(qs_0, qs_1):
 def qstate_get_camp(qs, qid=None):
     """ get elements of the quantum state vector """
 
+    qlib = qstate_lib(qs)
+
     if qid is None or qid == []:
         qid = list(range(qs.qubit_num))
 
@@ -218,6 +368,14 @@ def qstate_get_camp(qs, qid=None):
         if q < 0:
             raise IndexError("out of range.")
 
+    # all of the qubits in order: copied from the elements at once (without picking up)
+    if qs.use_gpu is False and list(qid) == list(range(qs.qubit_num)):
+        out = np.array(qstate_amp_view(qs), dtype=np.complex128)
+        norm = np.linalg.norm(out)
+        if norm > 0.0:
+            out /= norm
+        return out
+
     try:
         qubit_num = len(qid)
         qubit_id = [0 for _ in range(qubit_num)]
@@ -228,11 +386,11 @@ def qstate_get_camp(qs, qid=None):
 
         camp = None
         c_camp = ctypes.c_void_p(camp)
-        lib.qstate_get_camp.restype = ctypes.c_bool
-        lib.qstate_get_camp.argtypes = [ctypes.POINTER(QState), ctypes.c_int, IntArray,
-                                        ctypes.POINTER(ctypes.c_void_p)]
-        ret = lib.qstate_get_camp(ctypes.byref(qs), ctypes.c_int(qubit_num),
-                                  qid_array, c_camp)
+        qlib.qstate_get_camp.restype = ctypes.c_bool
+        qlib.qstate_get_camp.argtypes = [ctypes.POINTER(QState), ctypes.c_int, IntArray,
+                                         ctypes.POINTER(ctypes.c_void_p)]
+        ret = qlib.qstate_get_camp(ctypes.byref(qs), ctypes.c_int(qubit_num),
+                                   qid_array, c_camp)
 
         if ret is False:
             raise ValueError("can't get element of the quantum state vector.")
@@ -240,9 +398,7 @@ def qstate_get_camp(qs, qid=None):
         o = ctypes.cast(c_camp.value, ctypes.POINTER(ctypes.c_double))
 
         state_num = (1 << len(qid))
-        out = [0] * state_num
-        for i in range(state_num):
-            out[i] = complex(o[2*i], o[2*i+1])
+        out = np.ctypeslib.as_array(o, shape=(2 * state_num,)).view(np.complex128).copy()
 
         libc.free.argtypes = [ctypes.POINTER(ctypes.c_double)]
         libc.free(o)
@@ -250,22 +406,24 @@ def qstate_get_camp(qs, qid=None):
     except Exception:
         raise ValueError("can't get element of the quantum state vector.")
 
-    return np.array(out)
+    return out
 
 
 def qstate_tensor_product(qs, qstate):
     """ get tensor product of 2 quantum state vectors """
 
+    qlib = qstate_lib(qs, qstate)
+
     try:
         qstate_out = None
         c_qstate_out = ctypes.c_void_p(qstate_out)
 
-        lib.qstate_tensor_product.restype = ctypes.c_bool
-        lib.qstate_tensor_product.argtypes = [ctypes.POINTER(QState),
-                                              ctypes.POINTER(QState),
-                                              ctypes.POINTER(ctypes.c_void_p)]
-        ret = lib.qstate_tensor_product(ctypes.byref(qs), ctypes.byref(qstate),
-                                        c_qstate_out)
+        qlib.qstate_tensor_product.restype = ctypes.c_bool
+        qlib.qstate_tensor_product.argtypes = [ctypes.POINTER(QState),
+                                               ctypes.POINTER(QState),
+                                               ctypes.POINTER(ctypes.c_void_p)]
+        ret = qlib.qstate_tensor_product(ctypes.byref(qs), ctypes.byref(qstate),
+                                         c_qstate_out)
 
         if ret is False:
             raise ValueError("can't get tensor product of the 2 quantum state vectors.")
@@ -279,6 +437,8 @@ def qstate_tensor_product(qs, qstate):
 def qstate_evolve(qs, observable=None, time=0.0, iteration=0):
     """ time evolution of the quantum state vectors """
 
+    qlib = qstate_lib(qs)
+
     if iteration < 1:
         raise ValueError("iteration must be positive integer.")
 
@@ -286,11 +446,11 @@ def qstate_evolve(qs, observable=None, time=0.0, iteration=0):
         raise ValueError("observable must be set.")
 
     try:
-        lib.qstate_evolve.restype = ctypes.c_bool
-        lib.qstate_evolve.argtypes = [ctypes.POINTER(QState), ctypes.POINTER(ObservableBase),
-                                      ctypes.c_double, ctypes.c_int]
-        ret = lib.qstate_evolve(ctypes.byref(qs), ctypes.byref(observable),
-                                ctypes.c_double(time), ctypes.c_int(iteration))
+        qlib.qstate_evolve.restype = ctypes.c_bool
+        qlib.qstate_evolve.argtypes = [ctypes.POINTER(QState), ctypes.POINTER(ObservableBase),
+                                       ctypes.c_double, ctypes.c_int]
+        ret = qlib.qstate_evolve(ctypes.byref(qs), ctypes.byref(observable),
+                                 ctypes.c_double(time), ctypes.c_int(iteration))
 
         if ret is False:
             raise ValueError("can't get the quantum state vectors after time evolution.")
@@ -303,19 +463,21 @@ def qstate_expect_value(qs, observable=None):
     """ get expectation value of the observable
         under the quantum state vector """
 
+    qlib = qstate_lib(qs)
+
     if observable is None:
         raise ValueError("observable must be set.")
 
     try:
         val = 0.0
         c_val = ctypes.c_double(val)
-        lib.qstate_expect_value.restype = ctypes.c_bool
-        lib.qstate_expect_value.argtypes = [ctypes.POINTER(QState),
-                                            ctypes.POINTER(ObservableBase),
-                                            ctypes.POINTER(ctypes.c_double)]
-        ret = lib.qstate_expect_value(ctypes.byref(qs),
-                                      ctypes.byref(observable),
-                                      ctypes.byref(c_val))
+        qlib.qstate_expect_value.restype = ctypes.c_bool
+        qlib.qstate_expect_value.argtypes = [ctypes.POINTER(QState),
+                                             ctypes.POINTER(ObservableBase),
+                                             ctypes.POINTER(ctypes.c_double)]
+        ret = qlib.qstate_expect_value(ctypes.byref(qs),
+                                       ctypes.byref(observable),
+                                       ctypes.byref(c_val))
 
         if ret is False:
             raise ValueError("can't get expect value of the observable"
@@ -335,6 +497,8 @@ def qstate_expect_value(qs, observable=None):
 def qstate_apply_matrix(qs, matrix=None, qid=None):
     """ apply matrix to the quantum state """
 
+    qlib = qstate_lib(qs)
+
     if matrix is None:
         raise ValueError("matrix must be set.")
 
@@ -368,15 +532,15 @@ def qstate_apply_matrix(qs, matrix=None, qid=None):
         c_mat_real = DoubleArray(*mat_real)
         c_mat_imag = DoubleArray(*mat_imag)
 
-        lib.qstate_apply_matrix.restype = ctypes.c_bool
-        lib.qstate_apply_matrix.argtypes = [ctypes.POINTER(QState),
-                                            ctypes.c_int, IntArray,
-                                            DoubleArray, DoubleArray,
-                                            ctypes.c_int, ctypes.c_int]
-        ret = lib.qstate_apply_matrix(ctypes.byref(qs),
-                                      ctypes.c_int(qubit_num), qid_array,
-                                      c_mat_real, c_mat_imag,
-                                      ctypes.c_int(row), ctypes.c_int(col))
+        qlib.qstate_apply_matrix.restype = ctypes.c_bool
+        qlib.qstate_apply_matrix.argtypes = [ctypes.POINTER(QState),
+                                             ctypes.c_int, IntArray,
+                                             DoubleArray, DoubleArray,
+                                             ctypes.c_int, ctypes.c_int]
+        ret = qlib.qstate_apply_matrix(ctypes.byref(qs),
+                                       ctypes.c_int(qubit_num), qid_array,
+                                       c_mat_real, c_mat_imag,
+                                       ctypes.c_int(row), ctypes.c_int(col))
 
         if ret is False:
             raise ValueError("can't apply the matrix to the quantum state vector.")
@@ -389,6 +553,8 @@ def qstate_operate_qgate(qs, kind=None, qid=None, phase=cfg.DEF_PHASE,
                          gphase=cfg.DEF_GPHASE, factor=cfg.DEF_FACTOR):
     """ operate quantum gate to the quantum state """
 
+    qlib = qstate_lib(qs)
+
     # error check
     qstate_check_args(qs, kind=kind, qid=qid)
 
@@ -398,13 +564,13 @@ def qstate_operate_qgate(qs, kind=None, qid=None, phase=cfg.DEF_PHASE,
     IntArray = ctypes.c_int * 2
     qid_array = IntArray(*qubit_id)
 
-    lib.qstate_operate_qgate.restype = ctypes.c_bool
-    lib.qstate_operate_qgate.argtypes = [ctypes.POINTER(QState), ctypes.c_int,
-                                         ctypes.c_double, ctypes.c_double,
-                                         ctypes.c_double, IntArray]
-    ret = lib.qstate_operate_qgate(ctypes.byref(qs), ctypes.c_int(kind),
-                                   ctypes.c_double(phase), ctypes.c_double(gphase),
-                                   ctypes.c_double(factor), qid_array)
+    qlib.qstate_operate_qgate.restype = ctypes.c_bool
+    qlib.qstate_operate_qgate.argtypes = [ctypes.POINTER(QState), ctypes.c_int,
+                                          ctypes.c_double, ctypes.c_double,
+                                          ctypes.c_double, IntArray]
+    ret = qlib.qstate_operate_qgate(ctypes.byref(qs), ctypes.c_int(kind),
+                                    ctypes.c_double(phase), ctypes.c_double(gphase),
+                                    ctypes.c_double(factor), qid_array)
 
     if ret is False:
         raise ValueError("can't operate quantum gate to the quantum state vector.")
@@ -412,6 +578,8 @@ def qstate_operate_qgate(qs, kind=None, qid=None, phase=cfg.DEF_PHASE,
 def qstate_measure(qs, qid=None):
     """ measurement of the qubits """
 
+    qlib = qstate_lib(qs)
+
     # qnum, mnum
     qnum = qs.qubit_num
     if qid is None or qid == []:
@@ -435,11 +603,11 @@ def qstate_measure(qs, qid=None):
     CharArray = ctypes.c_char * qnum
     mchar_array = CharArray(*mchar_bytes)
     
-    lib.qstate_measure.restype = ctypes.c_bool
-    lib.qstate_measure.argtypes = [ctypes.POINTER(QState), ctypes.c_int,
-                                   IntArray, ctypes.c_char_p, ctypes.c_bool]
-    ret = lib.qstate_measure(ctypes.byref(qs), ctypes.c_int(mnum),
-                             qid_array, mchar_array, True)
+    qlib.qstate_measure.restype = ctypes.c_bool
+    qlib.qstate_measure.argtypes = [ctypes.POINTER(QState), ctypes.c_int,
+                                    IntArray, ctypes.c_char_p, ctypes.c_bool]
+    ret = qlib.qstate_measure(ctypes.byref(qs), ctypes.c_int(mnum),
+                              qid_array, mchar_array, True)
 
     if ret is False:
         raise ValueError("can't measure the qubits.")
@@ -449,9 +617,66 @@ def qstate_measure(qs, qid=None):
 
     return measured_str
 
+def qstate_marginal_prob(qs, qid=None):
+    """ marginal probabilities of the qubits """
+
+    qlib = qstate_lib(qs)
+
+    if qid is None or qid == []:
+        qid = list(range(qs.qubit_num))
+
+    qstate_check_args(qs, kind=cfg.MEASURE, qid=qid)
+
+    mnum = len(qid)
+    IntArray = ctypes.c_int * mnum
+    qid_array = IntArray(*qid)
+    prob = np.zeros(1 << mnum, dtype=np.float64)
+
+    DoublePtr = ctypes.POINTER(ctypes.c_double)
+    qlib.qstate_marginal_prob.restype = ctypes.c_bool
+    qlib.qstate_marginal_prob.argtypes = [ctypes.POINTER(QState), ctypes.c_int, IntArray, DoublePtr]
+    ret = qlib.qstate_marginal_prob(ctypes.byref(qs), ctypes.c_int(mnum), qid_array,
+                                    prob.ctypes.data_as(DoublePtr))
+
+    if ret is False:
+        raise ValueError("can't get the marginal probabilities.")
+
+    return prob
+
+def qstate_sample(qs, qid=None, shots=cfg.DEF_SHOTS):
+    """ sample the measured values of the qubits (the state is not changed) """
+
+    qlib = qstate_lib(qs)
+
+    if qid is None or qid == []:
+        qid = list(range(qs.qubit_num))
+
+    qstate_check_args(qs, kind=cfg.MEASURE, qid=qid)
+    if not isinstance(shots, int) or shots < 1:
+        raise ValueError("shots must be positive integer.")
+
+    mnum = len(qid)
+    IntArray = ctypes.c_int * mnum
+    qid_array = IntArray(*qid)
+    mval = np.zeros(shots, dtype=np.int64)
+
+    LongLongPtr = ctypes.POINTER(ctypes.c_longlong)
+    qlib.qstate_sample.restype = ctypes.c_bool
+    qlib.qstate_sample.argtypes = [ctypes.POINTER(QState), ctypes.c_int, ctypes.c_int, IntArray,
+                                   LongLongPtr]
+    ret = qlib.qstate_sample(ctypes.byref(qs), ctypes.c_int(shots), ctypes.c_int(mnum), qid_array,
+                             mval.ctypes.data_as(LongLongPtr))
+
+    if ret is False:
+        raise ValueError("can't sample the measured values.")
+
+    return mval
+
 def qstate_measure_stats(qs, qid=None, shots=cfg.DEF_SHOTS, angle=0.0, phase=0.0):
     """ measurement of the qubits and get stats """
 
+    qlib = qstate_lib(qs)
+
     if qid is None or qid == []:
         qid = list(range(qs.qubit_num))
 
@@ -469,14 +694,14 @@ def qstate_measure_stats(qs, qid=None, shots=cfg.DEF_SHOTS, angle=0.0, phase=0.0
     mdata = None
     c_mdata = ctypes.c_void_p(mdata)
 
-    lib.qstate_measure_stats.restype = ctypes.c_bool
-    lib.qstate_measure_stats.argtypes = [ctypes.POINTER(QState), ctypes.c_int,
-                                         ctypes.c_double, ctypes.c_double,
-                                         ctypes.c_int, IntArray,
-                                         ctypes.POINTER(ctypes.c_void_p)]
-    ret = lib.qstate_measure_stats(ctypes.byref(qs), ctypes.c_int(shots),
-                                   ctypes.c_double(angle), ctypes.c_double(phase),
-                                   ctypes.c_int(qubit_num), qid_array, c_mdata)
+    qlib.qstate_measure_stats.restype = ctypes.c_bool
+    qlib.qstate_measure_stats.argtypes = [ctypes.POINTER(QState), ctypes.c_int,
+                                          ctypes.c_double, ctypes.c_double,
+                                          ctypes.c_int, IntArray,
+                                          ctypes.POINTER(ctypes.c_void_p)]
+    ret = qlib.qstate_measure_stats(ctypes.byref(qs), ctypes.c_int(shots),
+                                    ctypes.c_double(angle), ctypes.c_double(phase),
+                                    ctypes.c_int(qubit_num), qid_array, c_mdata)
 
     if ret is False:
         raise ValueError("can't measure the qubits.")
@@ -488,6 +713,8 @@ def qstate_measure_stats(qs, qid=None, shots=cfg.DEF_SHOTS, angle=0.0, phase=0.0
 def qstate_measure_bell_stats(qs, qid=None, shots=cfg.DEF_SHOTS):
     """ bell measurement of the qubits and get stats """
 
+    qlib = qstate_lib(qs)
+
     if qid is None or qid == []:
         qid = list(range(2))
 
@@ -505,12 +732,12 @@ def qstate_measure_bell_stats(qs, qid=None, shots=cfg.DEF_SHOTS):
     mdata = None
     c_mdata = ctypes.c_void_p(mdata)
 
-    lib.qstate_measure_bell_stats.restype = ctypes.c_bool
-    lib.qstate_measure_bell_stats.argtypes = [ctypes.POINTER(QState), ctypes.c_int,
-                                              ctypes.c_int, IntArray,
-                                              ctypes.POINTER(ctypes.c_void_p)]
-    ret = lib.qstate_measure_bell_stats(ctypes.byref(qs), ctypes.c_int(shots),
-                                        ctypes.c_int(qubit_num), qid_array, c_mdata)
+    qlib.qstate_measure_bell_stats.restype = ctypes.c_bool
+    qlib.qstate_measure_bell_stats.argtypes = [ctypes.POINTER(QState), ctypes.c_int,
+                                               ctypes.c_int, IntArray,
+                                               ctypes.POINTER(ctypes.c_void_p)]
+    ret = qlib.qstate_measure_bell_stats(ctypes.byref(qs), ctypes.c_int(shots),
+                                         ctypes.c_int(qubit_num), qid_array, c_mdata)
 
     if ret is False:
         raise ValueError("can't measure the qubits.")
@@ -519,46 +746,218 @@ def qstate_measure_bell_stats(qs, qid=None, shots=cfg.DEF_SHOTS):
 
     return out.contents
 
-def qstate_operate_qcirc(qstate, cmem, qcirc, shots, cid, out_state):
+def qstate_operate_qcirc(qstate, cmem, qcirc, shots, cid, out_state,
+                         fusion_qubit_num=cfg.DEF_FUSION_QUBIT_NUM,
+                         cache_qubit_num=cfg.DEF_CACHE_QUBIT_NUM, relabel=True):
     """ operate quantum circuit """
 
+    qlib = qstate_lib(qstate)
+
+    if fusion_qubit_num < 0 or fusion_qubit_num > cfg.MAX_FUSION_QUBIT_NUM:
+        raise ValueError("fusion_qubit_num must be 0 or more and {0:d} or less.".format(cfg.MAX_FUSION_QUBIT_NUM))
+
+    if cache_qubit_num != 0 and cache_qubit_num < cfg.MAX_FUSION_QUBIT_NUM:
+        raise ValueError("cache_qubit_num must be 0 or {0:d} or more.".format(cfg.MAX_FUSION_QUBIT_NUM))
+
     if cmem is not None:
         cmem_num = cmem.cmem_num
     else:
         cmem_num = 0
 
     buf_size = cmem_num * shots
-    mchar_array = bytearray([0x00 for _ in range(buf_size)])
     CharArray = ctypes.c_char * buf_size
-    mchar_shots = CharArray(*mchar_array)
-
-    lib.qstate_operate_qcirc.restype = ctypes.c_bool
-    lib.qstate_operate_qcirc.argtypes = [ctypes.POINTER(QState),
-                                         ctypes.POINTER(CMem), ctypes.POINTER(QCirc),
-                                         ctypes.c_int, CharArray, ctypes.c_bool]
+    mchar_shots = CharArray()
+    IntArray = ctypes.c_int * shots
+    mchar_count = IntArray()
+    mchar_num = ctypes.c_int(0)
+
+    qlib.qstate_operate_qcirc.restype = ctypes.c_bool
+    qlib.qstate_operate_qcirc.argtypes = [ctypes.POINTER(QState),
+                                          ctypes.POINTER(CMem), ctypes.POINTER(QCirc),
+                                          ctypes.c_int, CharArray, IntArray,
+                                          ctypes.POINTER(ctypes.c_int), ctypes.c_bool,
+                                          ctypes.c_int, ctypes.c_int, ctypes.c_bool]
 
     if cmem is not None:
-        ret = lib.qstate_operate_qcirc(ctypes.byref(qstate),
-                                       ctypes.byref(cmem), ctypes.byref(qcirc),
-                                       ctypes.c_int(shots), mchar_shots, ctypes.c_bool(out_state))
-        frequency = Counter()
-        for i in range(0, len(mchar_shots), cmem_num):
-            cmem_list = mchar_shots[i:i+cmem_num]
-            cmem_list_part = [cmem_list[c] for c in cid]
-            mchar = "".join(map(str, cmem_list_part))
-            frequency[mchar] += 1
+        ret = qlib.qstate_operate_qcirc(ctypes.byref(qstate),
+                                        ctypes.byref(cmem), ctypes.byref(qcirc),
+                                        ctypes.c_int(shots), mchar_shots, mchar_count,
+                                        ctypes.byref(mchar_num), ctypes.c_bool(out_state),
+                                        ctypes.c_int(fusion_qubit_num),
+                                        ctypes.c_int(cache_qubit_num), ctypes.c_bool(relabel))
+        if ret is False:
+            raise ValueError("can't operate the quantum circuit.")
+
+        # distinct classical memories (rows) and the counts
+        num = mchar_num.value
+        rows = np.frombuffer(mchar_shots, dtype=np.uint8, count=num*cmem_num).reshape(num, cmem_num)
+        counts = {}
+        for mval, cnt in zip(bits_to_values(rows[:, cid]), mchar_count[:num]):
+            counts[mval] = counts.get(mval, 0) + cnt
 
     else: # unitary only
         c_cmem = ctypes.POINTER(CMem)()
-        ret = lib.qstate_operate_qcirc(ctypes.byref(qstate), c_cmem, ctypes.byref(qcirc),
-                                       ctypes.c_int(shots), mchar_shots, ctypes.c_bool(out_state))
+        ret = qlib.qstate_operate_qcirc(ctypes.byref(qstate), c_cmem, ctypes.byref(qcirc),
+                                        ctypes.c_int(shots), mchar_shots, mchar_count,
+                                        ctypes.byref(mchar_num), ctypes.c_bool(out_state),
+                                        ctypes.c_int(fusion_qubit_num),
+                                        ctypes.c_int(cache_qubit_num), ctypes.c_bool(relabel))
+        if ret is False:
+            raise ValueError("can't operate the quantum circuit.")
 
-        frequency = None
+        counts = None
 
-    return frequency
+    return counts
+
+def qstate_operate_qcirc_noise(qstate, cmem, qcirc, shots, cid, noise_model):
+    """ operate quantum circuit with the noise model (quantum trajectories) """
+
+    qlib = qstate_lib(qstate)
+
+    if cmem is not None:
+        cmem_num = cmem.cmem_num
+        c_cmem = ctypes.byref(cmem)
+    else:
+        cmem_num = 0
+        c_cmem = ctypes.POINTER(CMem)()
+
+    chan_kind, kraus_num, kraus, prob = noise_model.kraus_arrays()
+    readout = np.array(noise_model.readout, dtype=np.float64)
+
+    CharArray = ctypes.c_char * (cmem_num * shots)
+    mchar_shots = CharArray()
+    IntArray = ctypes.c_int * shots
+    mchar_count = IntArray()
+    mchar_num = ctypes.c_int(0)
+
+    qlib.qstate_operate_qcirc_noise.restype = ctypes.c_bool
+    qlib.qstate_operate_qcirc_noise.argtypes = [ctypes.POINTER(QState),
+                                                ctypes.POINTER(CMem), ctypes.POINTER(QCirc),
+                                                ctypes.c_int, CharArray, IntArray,
+                                                ctypes.POINTER(ctypes.c_int), ctypes.c_int,
+                                                ctypes.POINTER(ctypes.c_int),
+                                                ctypes.POINTER(ctypes.c_int),
+                                                ctypes.POINTER(ctypes.c_double),
+                                                ctypes.POINTER(ctypes.c_double),
+                                                ctypes.POINTER(ctypes.c_double)]
+    ret = qlib.qstate_operate_qcirc_noise(ctypes.byref(qstate), c_cmem, ctypes.byref(qcirc),
+                                          ctypes.c_int(shots), mchar_shots, mchar_count,
+                                          ctypes.byref(mchar_num), ctypes.c_int(len(chan_kind)),
+                                          chan_kind.ctypes.data_as(ctypes.POINTER(ctypes.c_int)),
+                                          kraus_num.ctypes.data_as(ctypes.POINTER(ctypes.c_int)),
+                                          kraus.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+                                          prob.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+                                          readout.ctypes.data_as(ctypes.POINTER(ctypes.c_double)))
+    if ret is False:
+        raise ValueError("can't operate the quantum circuit with the noise model.")
+
+    if cmem is None:
+        return None
+
+    num = mchar_num.value
+    rows = np.frombuffer(mchar_shots, dtype=np.uint8, count=num*cmem_num).reshape(num, cmem_num)
+    mvals, cnts = np.unique(bits_to_values(rows[:, cid]), return_counts=True)
+
+    return {int(mval): int(cnt) for mval, cnt in zip(mvals, cnts)}
+
+def qstate_operate_qcirc_batch(qstate, qcirc, tags, phase,
+                               fusion_qubit_num=cfg.DEF_FUSION_QUBIT_NUM,
+                               cache_qubit_num=cfg.DEF_CACHE_QUBIT_NUM, relabel=True):
+    """ operate unitary quantum circuit on the batch of the quantum states """
+
+    qlib = qstate_lib(qstate)
+
+    if fusion_qubit_num < 0 or fusion_qubit_num > cfg.MAX_FUSION_QUBIT_NUM:
+        raise ValueError("fusion_qubit_num must be 0 or more and {0:d} or less.".format(cfg.MAX_FUSION_QUBIT_NUM))
+
+    if cache_qubit_num != 0 and cache_qubit_num < cfg.MAX_FUSION_QUBIT_NUM:
+        raise ValueError("cache_qubit_num must be 0 or {0:d} or more.".format(cfg.MAX_FUSION_QUBIT_NUM))
+
+    phase = np.ascontiguousarray(phase, dtype=np.float64)
+    batch_num = phase.shape[0]
+    tag_num = len(tags)
+
+    tag_buf = b''.join([tag.encode('utf-8') + b'\x00' for tag in tags])
+    qstate_out = (ctypes.c_void_p * batch_num)()
+
+    qlib.qstate_operate_qcirc_batch.restype = ctypes.c_bool
+    qlib.qstate_operate_qcirc_batch.argtypes = [ctypes.POINTER(QState), ctypes.POINTER(QCirc),
+                                                ctypes.c_int, ctypes.c_int, ctypes.c_char_p,
+                                                ctypes.POINTER(ctypes.c_double),
+                                                ctypes.c_int, ctypes.c_int, ctypes.c_bool,
+                                                ctypes.c_void_p * batch_num]
+    ret = qlib.qstate_operate_qcirc_batch(ctypes.byref(qstate), ctypes.byref(qcirc),
+                                          ctypes.c_int(batch_num), ctypes.c_int(tag_num),
+                                          tag_buf,
+                                          phase.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+                                          ctypes.c_int(fusion_qubit_num),
+                                          ctypes.c_int(cache_qubit_num), ctypes.c_bool(relabel),
+                                          qstate_out)
+
+    if ret is False:
+        raise ValueError("can't operate the quantum circuit on the batch.")
+
+    qstates = [ctypes.cast(obj, ctypes.POINTER(qstate.__class__)).contents for obj in qstate_out]
+
+    return qstates
+
+def qstate_operate_qplan(qstate, qplan, cache_qubit_num=cfg.DEF_CACHE_QUBIT_NUM, relabel=True):
+    """ operate the compiled plan of the unitary quantum circuit """
+
+    qlib = qstate_lib(qstate)
+
+    if qstate.use_single != qplan.use_single:
+        raise ValueError("precision of the plan must be the same as the quantum state.")
+
+    if cache_qubit_num != 0 and cache_qubit_num < cfg.MAX_FUSION_QUBIT_NUM:
+        raise ValueError("cache_qubit_num must be 0 or {0:d} or more.".format(cfg.MAX_FUSION_QUBIT_NUM))
+
+    qlib.qstate_operate_qplan.restype = ctypes.c_bool
+    qlib.qstate_operate_qplan.argtypes = [ctypes.POINTER(QState), ctypes.c_void_p,
+                                          ctypes.c_int, ctypes.c_bool]
+    ret = qlib.qstate_operate_qplan(ctypes.byref(qstate), ctypes.addressof(qplan),
+                                    ctypes.c_int(cache_qubit_num), ctypes.c_bool(relabel))
+
+    if ret is False:
+        raise ValueError("can't operate the plan of the quantum circuit.")
+
+def qstate_gradient(qstate, qcirc, observable, tags,
+                    fusion_qubit_num=cfg.DEF_FUSION_QUBIT_NUM,
+                    cache_qubit_num=cfg.DEF_CACHE_QUBIT_NUM, relabel=True):
+    """ gradient of the expectation value by the phases of the tags (adjoint method) """
+
+    qlib = qstate_lib(qstate)
+
+    if fusion_qubit_num < 0 or fusion_qubit_num > cfg.MAX_FUSION_QUBIT_NUM:
+        raise ValueError("fusion_qubit_num must be 0 or more and {0:d} or less.".format(cfg.MAX_FUSION_QUBIT_NUM))
+
+    if cache_qubit_num != 0 and cache_qubit_num < cfg.MAX_FUSION_QUBIT_NUM:
+        raise ValueError("cache_qubit_num must be 0 or {0:d} or more.".format(cfg.MAX_FUSION_QUBIT_NUM))
+
+    tag_num = len(tags)
+    tag_buf = b''.join([tag.encode('utf-8') + b'\x00' for tag in tags])
+    grad = np.zeros(tag_num, dtype=np.float64)
+
+    qlib.qstate_gradient.restype = ctypes.c_bool
+    qlib.qstate_gradient.argtypes = [ctypes.POINTER(QState), ctypes.POINTER(QCirc),
+                                     ctypes.POINTER(ObservableBase), ctypes.c_int,
+                                     ctypes.c_char_p, ctypes.c_int, ctypes.c_int, ctypes.c_bool,
+                                     ctypes.POINTER(ctypes.c_double)]
+    ret = qlib.qstate_gradient(ctypes.byref(qstate), ctypes.byref(qcirc),
+                               ctypes.byref(observable), ctypes.c_int(tag_num), tag_buf,
+                               ctypes.c_int(fusion_qubit_num), ctypes.c_int(cache_qubit_num),
+                               ctypes.c_bool(relabel),
+                               grad.ctypes.data_as(ctypes.POINTER(ctypes.c_double)))
+
+    if ret is False:
+        raise ValueError("can't get the gradient of the expectation value.")
+
+    return grad
 
 def qstate_free(qs):
     """ free memory of the QState object """
 
-    lib.qstate_free.argtypes = [ctypes.POINTER(QState)]
-    lib.qstate_free(ctypes.byref(qs))
+    qlib = qstate_lib(qs)
+
+    qlib.qstate_free.argtypes = [ctypes.POINTER(QState)]
+    qlib.qstate_free(ctypes.byref(qs))
@@ -1,24 +1,21 @@
 # -*- coding: utf-8 -*-
 """ wrapper functions for QState """
 import ctypes
-from ctypes.util import find_library
 from collections import Counter
 import pathlib
+import numpy as np
 
 import qlazy.config as cfg
-from qlazy.util import get_lib_ext
+from qlazy.util import get_lib_ext, bits_to_values
 from qlazy.Stabilizer import Stabilizer
 from qlazy.QCirc import QCirc
 from qlazy.CMem import CMem
 
 lib = ctypes.CDLL(str(pathlib.Path(__file__).with_name('libqlz.'+get_lib_ext())))
-libc = ctypes.CDLL(find_library("c"), mode=ctypes.RTLD_GLOBAL)
 
 def stabilizer_init(gene_num=None, qubit_num=None, seed=None):
     """ initialize Stabilizer object """
 
-    libc.srand(ctypes.c_int(seed))
-
     stab = None
     c_stab = ctypes.c_void_p(stab)
 
@@ -182,7 +179,7 @@ def stabilizer_operate_qcirc(sb, cmem, qcirc, shots, cid):
     if cmem is not None:
 
         cmem_num = cmem.cmem_num
-        frequency = Counter()
+        bits = np.zeros((shots, cmem_num), dtype=np.uint8)
         for n in range(shots):
 
             if n < shots - 1:
@@ -199,12 +196,11 @@ def stabilizer_operate_qcirc(sb, cmem, qcirc, shots, cid):
             if ret is False:
                 raise ValueError("can't operate quantum circuit to the Stabilizer object.")
 
-            cmem_list = [bit_array.contents[i] for i in range(cmem_num)]
-            mval = "".join(map(str, [cmem_list[c] for c in cid]))
+            bits[n] = np.frombuffer(bit_array.contents, dtype=np.uint8)
 
-            frequency[mval] += 1
+        counts = dict(Counter(bits_to_values(bits[:, cid])))
 
-        return frequency
+        return counts
 
     c_cmem = ctypes.POINTER(CMem)()
     ret = lib.stabilizer_operate_qcirc(ctypes.byref(sb), c_cmem, ctypes.byref(qcirc))
@@ -122,7 +122,8 @@ def get_qgate_qubit_num(kind=None):
     """ get qubit number for the quantum gate """
 
     if kind in (cfg.SHOW, cfg.MEASURE, cfg.MEASURE_X, cfg.MEASURE_Y,
-                cfg.MEASURE_Z, cfg.RESET):  # 0 if any number
+                cfg.MEASURE_Z, cfg.RESET, cfg.MULTI_CONTROLLED_X, cfg.QFT_GATE,
+                cfg.IQFT_GATE, cfg.MULTI_ROTATION_Z):  # 0 if any number
         return 0
     if ((kind in (cfg.BLOCH, cfg.PAULI_X, cfg.PAULI_Y, cfg.PAULI_Z, cfg.ROOT_PAULI_X,
                   cfg.ROOT_PAULI_X_, cfg.HADAMARD, cfg.PHASE_SHIFT_S, cfg.PHASE_SHIFT_S_,
@@ -150,12 +151,12 @@ def get_qgate_param_num(kind=None):
                  cfg.PHASE_SHIFT_T_, cfg.CONTROLLED_X, cfg.CONTROLLED_Y, cfg.CONTROLLED_Z,
                  cfg.CONTROLLED_XR, cfg.CONTROLLED_XR_, cfg.CONTROLLED_H,
                  cfg.CONTROLLED_S, cfg.CONTROLLED_S_, cfg.CONTROLLED_T, cfg.CONTROLLED_T_,
-                 cfg.SWAP_QUBITS)):
+                 cfg.SWAP_QUBITS, cfg.MULTI_CONTROLLED_X, cfg.QFT_GATE, cfg.IQFT_GATE)):
         return 0
     if (kind in (cfg.PHASE_SHIFT, cfg.ROTATION_X, cfg.ROTATION_Y, cfg.ROTATION_Z,
                  cfg.ROTATION_U1, cfg.CONTROLLED_P, cfg.CONTROLLED_RX, cfg.CONTROLLED_RY,
                  cfg.CONTROLLED_RZ, cfg.CONTROLLED_U1,
-                 cfg.ROTATION_XX, cfg.ROTATION_YY, cfg.ROTATION_ZZ)):
+                 cfg.ROTATION_XX, cfg.ROTATION_YY, cfg.ROTATION_ZZ, cfg.MULTI_ROTATION_Z)):
         return 1
     if kind in (cfg.ROTATION_U2, cfg.CONTROLLED_U2):
         return 2
@@ -175,7 +176,9 @@ def is_unitary_gate(kind=None):
                      cfg.CONTROLLED_H, cfg.CONTROLLED_S, cfg.CONTROLLED_S_,
                      cfg.CONTROLLED_T, cfg.CONTROLLED_T_, cfg.SWAP_QUBITS, cfg.CONTROLLED_P,
                      cfg.CONTROLLED_RX, cfg.CONTROLLED_RY, cfg.CONTROLLED_RZ,
-                     cfg.ROTATION_XX, cfg.ROTATION_YY, cfg.ROTATION_ZZ))
+                     cfg.ROTATION_XX, cfg.ROTATION_YY, cfg.ROTATION_ZZ,
+                     cfg.MULTI_CONTROLLED_X, cfg.QFT_GATE, cfg.IQFT_GATE,
+                     cfg.MULTI_ROTATION_Z))
 
 def is_clifford_gate(kind):
     """ is the gate clifford? """
@@ -216,6 +219,24 @@ def reverse_bit_order(vec_in):
 
     return vec_out
 
+def bits_to_values(bits):
+    """ measured values of the rows of bits (the 1st column is the most significant bit) """
+
+    bits = np.asarray(bits, dtype=np.uint8)
+    if bits.ndim != 2:
+        raise ValueError("bits must be 2-dimensional array.")
+
+    row_num, digits = bits.shape
+    if digits == 0:
+        return [0] * row_num
+    if digits < 64:
+        weight = np.left_shift(np.uint64(1), np.arange(digits - 1, -1, -1, dtype=np.uint64))
+        return (bits.astype(np.uint64) @ weight).tolist()
+
+    packed = np.packbits(bits, axis=1)
+    pad = packed.shape[1] * 8 - digits
+    return [int.from_bytes(row.tobytes(), byteorder='big') >> pad for row in packed]
+
 def read_config_ini(config_ini_path=None):
     """ read config.ini file """
 
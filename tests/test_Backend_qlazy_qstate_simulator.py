@@ -3,8 +3,11 @@ import unittest
 import math
 import numpy as np
 import sys
+import asyncio
+import ctypes
+import ctypes.util
 
-from qlazy import QCirc, Backend, PauliProduct, QState
+from qlazy import QCirc, Backend, PauliProduct, QState, DensOp, NoiseModel
 from qlazy.Observable import X,Y,Z
 
 EPS = 1.0e-6
@@ -719,6 +722,140 @@ class TestBackend_operate_qlazy_qstate_simulator(unittest.TestCase):
         ans = equal_vectors(actual, expect)
         self.assertEqual(ans,True)
 
+#
+# gate fusion
+#
+
+class TestBackend_fusion_qstate_simulator(unittest.TestCase):
+    """ test 'Backend' : gate fusion
+    """
+
+    def test_fusion_random_gates(self):
+        """test 'fusion_qubit_num' (random gates)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc.generate_random_gates(qubit_num=6, gate_num=200, phase=(0.0, 0.25, 0.5),
+                                         prob={'h':3, 'x':2, 'rz':3, 'cx':5, 'crz':2, 'cz':1,
+                                               't':1})
+        qc += QCirc().sw(5,1).rzz(4,0, phase=0.3).crx(3,2, phase=0.2).cx(5,0).h(1)
+        expect = bk.run(qcirc=qc, out_state=True, fusion_qubit_num=0).qstate
+        for k in [2, 3, 4, 5]:
+            actual = bk.run(qcirc=qc, out_state=True, fusion_qubit_num=k).qstate
+            self.assertEqual(equal_qstates(expect, actual), True)
+
+    def test_fusion_diagonal_permutation(self):
+        """test 'fusion_qubit_num' (diagonal and permutation gates)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc_ini = QCirc.generate_random_gates(qubit_num=4, gate_num=50, phase=(0.1, 0.3),
+                                             prob={'h':3, 'rx':3, 'cx':3})
+        qs_ini = bk.run(qcirc=qc_ini, out_state=True).qstate
+        ph = 0.3
+        e = lambda x: np.exp(1.j * np.pi * x)
+        I = np.eye(2)
+        P0 = np.diag([1.0, 0.0])
+        P1 = np.diag([0.0, 1.0])
+        X = np.array([[0.0, 1.0], [1.0, 0.0]])
+        def ctrl(U):
+            return np.kron(P0, I) + np.kron(P1, U)
+        gates = [
+            ('z', (2,), np.diag([1.0, -1.0])),
+            ('s', (0,), np.diag([1.0, 1.j])),
+            ('t_dg', (3,), np.diag([1.0, e(-0.25)])),
+            ('p', (1,), np.diag([1.0, e(ph)])),
+            ('rz', (2,), np.diag([e(-ph/2), e(ph/2)])),
+            ('cz', (3,0), ctrl(np.diag([1.0, -1.0]))),
+            ('cs', (0,2), ctrl(np.diag([1.0, 1.j]))),
+            ('cp', (2,1), ctrl(np.diag([1.0, e(ph)]))),
+            ('crz', (1,3), ctrl(np.diag([e(-ph/2), e(ph/2)]))),
+            ('rzz', (3,1), np.diag([e(-ph/2), e(ph/2), e(ph/2), e(-ph/2)])),
+            ('x', (1,), X),
+            ('cx', (3,2), ctrl(X)),
+            ('sw', (2,0), np.array([[1,0,0,0],[0,0,1,0],[0,1,0,0],[0,0,0,1]], dtype=complex)),
+        ]
+        qc = QCirc()
+        qs_expect = qs_ini.clone()
+        for name, qid, mat in gates:
+            if name in ('p', 'rz', 'cp', 'crz', 'rzz'):
+                getattr(qc, name)(*qid, phase=ph)
+            else:
+                getattr(qc, name)(*qid)
+            qs_expect.apply(matrix=mat, qid=list(qid))
+        for k in [0, 3]:
+            qs_actual = bk.run(init=qs_ini, qcirc=qc, out_state=True, fusion_qubit_num=k).qstate
+            self.assertEqual(equal_qstates(qs_expect, qs_actual), True)
+
+    def test_fusion_with_measurement(self):
+        """test 'fusion_qubit_num' (with mid-circuit measurement)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = (QCirc().h(0).cx(0,1).rz(1, phase=0.3).cx(1,2).measure(qid=[0], cid=[0])
+              .h(2).cx(2,1).x(0, ctrl=0).measure(qid=[0,1,2], cid=[0,1,2]))
+        freq_0 = bk.run(qcirc=qc, shots=100, fusion_qubit_num=0).frequency
+        freq_3 = bk.run(qcirc=qc, shots=100, fusion_qubit_num=3).frequency
+        self.assertEqual(sum(freq_0.values()), 100)
+        self.assertEqual(sum(freq_3.values()), 100)
+        self.assertEqual(set(freq_3.keys()) <= {'000', '011', '001', '010'}, True)
+
+    def test_fusion_too_large(self):
+        """test 'fusion_qubit_num' (over the max)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc().h(0).cx(0,1)
+        with self.assertRaises(ValueError):
+            bk.run(qcirc=qc, fusion_qubit_num=6)
+
+    def test_fusion_negative(self):
+        """test 'fusion_qubit_num' (negative)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc().h(0).cx(0,1)
+        with self.assertRaises(ValueError):
+            bk.run(qcirc=qc, fusion_qubit_num=-1)
+        with self.assertRaises(ValueError):
+            qc.compile(fusion_qubit_num=-1)
+
+#
+# cache blocking
+#
+
+class TestBackend_cache_blocking_qstate_simulator(unittest.TestCase):
+    """ test 'Backend' : cache blocking
+    """
+
+    def test_cache_blocking_random_gates(self):
+        """test 'cache_qubit_num' (random gates, with and without relabelling)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc.generate_random_gates(qubit_num=9, gate_num=300, phase=(0.0, 0.25, 0.5),
+                                         prob={'h':3, 'x':1, 'rz':3, 'cx':5, 'crz':2, 'cz':1,
+                                               't':1})
+        qc += QCirc().sw(8,1).rzz(7,0, phase=0.3).crx(3,2, phase=0.2).cx(5,0).h(1)
+        expect = bk.run(qcirc=qc, out_state=True, cache_qubit_num=0).qstate
+        for k in [5, 6, 8]:
+            for relabel in [True, False]:
+                actual = bk.run(qcirc=qc, out_state=True, cache_qubit_num=k,
+                                relabel=relabel).qstate
+                self.assertEqual(equal_qstates(expect, actual), True)
+
+    def test_cache_blocking_with_measurement(self):
+        """test 'cache_qubit_num' (with mid-circuit measurement)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = (QCirc().h(0).cx(0,1).rx(7, phase=0.3).measure(qid=[0], cid=[0])
+              .cx(0,6).h(6).rz(3, phase=0.2).measure(qid=[1,6], cid=[1,2]))
+        freq = bk.run(qcirc=qc, shots=100, cache_qubit_num=5).frequency
+        self.assertEqual(sum(freq.values()), 100)
+        self.assertEqual(set(freq.keys()) <= {'000', '001', '110', '111'}, True)
+
+    def test_cache_blocking_too_small(self):
+        """test 'cache_qubit_num' (under the min)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc().h(0).cx(0,1)
+        with self.assertRaises(ValueError):
+            bk.run(qcirc=qc, cache_qubit_num=4)
+
 #
 # measurement
 #
@@ -813,6 +950,74 @@ class TestBackend_measure_qstate_simulator(unittest.TestCase):
         self.assertEqual(freq['00'], 10)
         self.assertEqual(cid, [0,1])
 
+    def test_measure_mesurement_only_many_shots(self):
+        """test 'measure' (measurement only, many shots sampled at once)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc().h(0).rx(1, phase=0.3).cx(1,2).measure(qid=[0,1,2], cid=[0,1,2])
+        res = bk.run(qcirc=qc, shots=100000)
+        freq = res.frequency
+        prob = 0.5 * np.sin(0.15 * np.pi)**2
+        self.assertEqual(sum(freq.values()), 100000)
+        self.assertEqual(set(freq.keys()), {'000', '100', '011', '111'})
+        self.assertEqual(abs(freq['011'] / 100000 - prob) < 0.01, True)
+        self.assertEqual(abs(freq['100'] / 100000 - (0.5 - prob)) < 0.01, True)
+
+    def test_measure_branching_frequency(self):
+        """test 'measure' (shots branched at mid-circuit measurements)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc().h(0).h(1).measure(qid=[0], cid=[0]).x(2, ctrl=0).h(1).measure(qid=[1,2], cid=[1,2])
+        res = bk.run(qcirc=qc, shots=1000)
+        freq = res.frequency
+        self.assertEqual(sum(freq.values()), 1000)
+        self.assertEqual(set(freq.keys()) <= {'000', '101'}, True)
+        self.assertEqual(abs(freq['000'] - 500) < 100, True)
+
+    def test_measure_branching_out_state(self):
+        """test 'measure' (output state of a branch consistent with cmem)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc().h(0).cx(0,1).measure(qid=[0], cid=[0]).x(2, ctrl=0).measure(qid=[1], cid=[1])
+        res = bk.run(qcirc=qc, shots=100, out_state=True)
+        freq = res.frequency
+        bits = list(res.cmem.bits)
+        idx = bits[0] * 4 + bits[1] * 2 + bits[0]
+        self.assertEqual(freq['00'] + freq['11'], 100)
+        self.assertEqual(bits[0], bits[1])
+        self.assertEqual(abs(abs(res.qstate.amp[idx]) - 1.0) < EPS, True)
+
+    def test_measure_teleportation_many_shots(self):
+        """test 'measure' (feed-forward circuit, shots run in parallel threads)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc().ry(0, phase=0.3).h(1).cx(1,2).cx(0,1).h(0).measure(qid=[0,1], cid=[0,1])
+        qc.x(2, ctrl=1).z(2, ctrl=0).measure(qid=[2], cid=[2])
+        res = bk.run(qcirc=qc, shots=20000, seed=123)
+        freq = res.frequency
+        prob = np.sin(0.15 * np.pi)**2
+        self.assertEqual(sum(freq.values()), 20000)
+        self.assertEqual(abs(sum(v for k, v in freq.items() if k[2] == '1') / 20000 - prob) < 0.02, True)
+        self.assertEqual(bk.run(qcirc=qc, shots=20000, seed=123).frequency, freq)
+
+    @unittest.skipIf(ctypes.util.find_library('gomp') is None, "libgomp is not found")
+    def test_measure_teleportation_many_shots_thread_num(self):
+        """test 'measure' (feed-forward circuit, same counts for any thread number)
+        """
+        gomp = ctypes.CDLL(ctypes.util.find_library('gomp'))
+        thread_num = gomp.omp_get_max_threads()
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc().ry(0, phase=0.3).h(1).cx(1,2).cx(0,1).h(0).measure(qid=[0,1], cid=[0,1])
+        qc.x(2, ctrl=1).z(2, ctrl=0).measure(qid=[2], cid=[2])
+        try:
+            gomp.omp_set_num_threads(1)
+            freq_1 = bk.run(qcirc=qc, shots=5000, seed=123).frequency
+            gomp.omp_set_num_threads(4)
+            freq_4 = bk.run(qcirc=qc, shots=5000, seed=123).frequency
+        finally:
+            gomp.omp_set_num_threads(thread_num)
+        self.assertEqual(freq_1, freq_4)
+
 #
 # reset
 #
@@ -954,6 +1159,255 @@ class TestBackend_init_option_qstate_simulator(unittest.TestCase):
 # inheritance
 #
 
+class TestBackend_precision_option_qstate_simulator(unittest.TestCase):
+    """ test 'Backend' : precision option
+    """
+
+    def test_precision_option_run(self):
+        """test 'precision run'
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc().h(0).cx(0,1).crx(1,2, phase=0.3).rz(2, phase=0.4).measure(qid=[0,1], cid=[0,1])
+        res_actual = bk.run(qcirc=qc, shots=100, out_state=True, precision='single')
+        self.assertEqual(res_actual.qstate.precision, 'single')
+        self.assertEqual(sum(res_actual.frequency.values()), 100)
+        self.assertEqual(set(res_actual.frequency.keys()) <= {'00', '11'}, True)
+        qc_u = QCirc().h(0).cx(0,1).crx(1,2, phase=0.3).rz(2, phase=0.4)
+        qs_expect = bk.run(qcirc=qc_u, out_state=True).qstate
+        qs_actual = bk.run(qcirc=qc_u, out_state=True, precision='single').qstate
+        self.assertEqual(np.allclose(qs_expect.get_amp(), qs_actual.get_amp(), atol=EPS), True)
+
+class TestBackend_seed_option_qstate_simulator(unittest.TestCase):
+    """ test 'Backend' : seed option
+    """
+
+    def test_seed_option_run(self):
+        """test 'seed run' (reproducible with mid-circuit measurement)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = (QCirc().h(0).h(1).cx(1,2).measure(qid=[0], cid=[0]).h(0).x(2, ctrl=0)
+              .measure(qid=[0,1,2], cid=[0,1,2]))
+        res_0 = bk.run(qcirc=qc, shots=500, seed=11)
+        res_1 = bk.run(qcirc=qc, shots=500, seed=11)
+        self.assertEqual(res_0.frequency, res_1.frequency)
+        self.assertEqual(sum(res_0.frequency.values()), 500)
+
+class TestBackend_noise_model_qstate_simulator(unittest.TestCase):
+    """ test 'Backend' : noise model (quantum trajectories)
+    """
+
+    def test_noise_model_channel(self):
+        """test 'noise model' (frequency compared with DensOp)
+        """
+        nm = NoiseModel().add_channel('amp_dump', prob=0.2, gates=['h', 'cx'])
+        nm.add_channel('depolarize', prob=0.1, gates=['rx'])
+        bk = Backend(product='qlazy', device='qstate_simulator', noise_model=nm)
+        qc = QCirc().h(0).rx(1, phase=0.3).cx(0,1).measure(qid=[0,1], cid=[0,1])
+        res = bk.run(qcirc=qc, shots=20000, seed=5)
+        de = DensOp(qubit_num=2)
+        de.h(0).amp_dump(0, prob=0.2).rx(1, phase=0.3).depolarize(1, prob=0.1)
+        de.cx(0,1).amp_dump(0, prob=0.2).amp_dump(1, prob=0.2)
+        prob = np.diag(de.get_elm()).real
+        freq = res.frequency
+        self.assertEqual(sum(freq.values()), 20000)
+        for i, mstr in enumerate(['00', '01', '10', '11']):
+            self.assertEqual(abs(freq[mstr] / 20000 - prob[i]) < 0.02, True)
+
+    def test_noise_model_readout_error(self):
+        """test 'noise model' (readout error, reproducible with seed)
+        """
+        nm = NoiseModel().set_readout_error(prob_0to1=0.1, prob_1to0=0.2)
+        bk = Backend(product='qlazy', device='qstate_simulator', noise_model=nm)
+        qc = QCirc().x(0).measure(qid=[0,1], cid=[0,1])
+        res = bk.run(qcirc=qc, shots=10000, seed=3)
+        freq = res.frequency
+        self.assertEqual(abs(freq['10'] / 10000 - 0.72) < 0.02, True)
+        self.assertEqual(abs(freq['00'] / 10000 - 0.18) < 0.02, True)
+        self.assertEqual(bk.run(qcirc=qc, shots=10000, seed=3).frequency, freq)
+
+    def test_noise_model_not_supported(self):
+        """test 'noise model' (not supported)
+        """
+        nm = NoiseModel().add_channel('bit_flip', prob=0.1)
+        with self.assertRaises(ValueError):
+            Backend(product='qlazy', device='stabilizer_simulator', noise_model=nm)
+        with self.assertRaises(ValueError):
+            NoiseModel().add_channel('bit_flip', prob=0.1, gates=['ry'])
+        bk = Backend(product='qlazy', device='qstate_simulator', noise_model=nm)
+        with self.assertRaises(ValueError):
+            bk.gradient(qcirc=QCirc().rz(0, tag='foo'), observable=Z(0))
+
+class TestBackend_submit_qstate_simulator(unittest.TestCase):
+    """ test 'Backend' : submit, run_async
+    """
+
+    def test_submit_thread(self):
+        """test 'submit' (thread pool, same as run with the seed)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator').set_pool('thread', max_workers=4)
+        qc = QCirc().h(0).cx(0,1).measure(qid=[0], cid=[0]).x(2, ctrl=0).measure(qid=[0,1,2], cid=[0,1,2])
+        futures = [bk.submit(qcirc=qc, shots=100, seed=s) for s in range(8)]
+        for s, future in enumerate(futures):
+            res = future.result()
+            self.assertEqual(res.frequency, bk.run(qcirc=qc, shots=100, seed=s).frequency)
+            self.assertEqual(res.elapsed_time >= 0.0, True)
+        bk.shutdown()
+
+    def test_submit_process(self):
+        """test 'submit' (process pool)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator').set_pool('process', max_workers=2)
+        qc = QCirc().h(0).cx(0,1).mcx(qid=[0,1,2]).measure(qid=[0,1,2], cid=[0,1,2])
+        res = bk.submit(qcirc=qc, shots=100, seed=5).result()
+        self.assertEqual(res.frequency, bk.run(qcirc=qc, shots=100, seed=5).frequency)
+        with self.assertRaises(ValueError):
+            bk.submit(qcirc=qc, shots=100, out_state=True)
+        bk.shutdown()
+
+    def test_run_async(self):
+        """test 'run_async'
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc().h(0).cx(0,1).measure(qid=[0,1], cid=[0,1])
+        async def run_all():
+            return await asyncio.gather(*[bk.run_async(qcirc=qc, shots=100) for _ in range(4)])
+        for res in asyncio.run(run_all()):
+            self.assertEqual(sum(res.frequency.values()), 100)
+            self.assertEqual(set(res.frequency.keys()) <= {'00', '11'}, True)
+        bk.shutdown()
+
+class TestBackend_run_many_qstate_simulator(unittest.TestCase):
+    """ test 'Backend' : run_many
+    """
+
+    def test_run_many(self):
+        """test 'run_many' (same as run for each circuit)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        circuits = [QCirc().h(0).rx(1, phase=0.1*i).cx(0,1).measure(qid=[0,1], cid=[0,1])
+                    for i in range(10)]
+        freqs = [None] * len(circuits)
+        for i, res in bk.run_many(circuits=circuits, shots=100, workers=2, chunk_size=3, seed=7):
+            freqs[i] = res.frequency
+            self.assertEqual(res.backend, bk)
+        for i, (qc, freq) in enumerate(zip(circuits, freqs)):
+            self.assertEqual(freq, bk.run(qcirc=qc, shots=100, seed=7, stream=i).frequency)
+        circuits = [QCirc().h(0).h(1).measure(qid=[0,1], cid=[0,1])] * 4
+        freqs = [res.frequency for _, res in bk.run_many(circuits=circuits, shots=100, seed=7)]
+        self.assertEqual(len(set(tuple(sorted(f.items())) for f in freqs)), 4)
+
+    def test_run_many_out_state(self):
+        """test 'run_many' (out_state is not supported)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        with self.assertRaises(ValueError):
+            bk.run_many(circuits=[QCirc().h(0)], out_state=True)
+        with self.assertRaises(TypeError):
+            bk.run_many(circuits=QCirc().h(0))
+
+class TestBackend_run_batch_qstate_simulator(unittest.TestCase):
+    """ test 'Backend' : run_batch
+    """
+
+    def test_run_batch_out_state(self):
+        """test 'run_batch' (quantum states for each parameter set)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = (QCirc().h(0).cx(0,1).rx(2, tag='a').crz(1,3, tag='b').h(3).ry(1, tag='a')
+              .cx(2,3).qft([0,1,2]).mrz([1,3,0], tag='b').rz(3, tag='c').t(0).cx(3,0))
+        params = [{'a': 0.1, 'b': 0.2, 'c': 0.3}, {'a': 0.4, 'b': 0.5}, {'c': 0.7}]
+        for kwargs in [{}, {'fusion_qubit_num': 0}, {'precision': 'single'}]:
+            results = bk.run_batch(qcirc=qc, params=params, out_state=True, **kwargs)
+            self.assertEqual(len(results), len(params))
+            for p, result in zip(params, results):
+                qc_expect = qc.clone()
+                qc_expect.set_params(p)
+                expect = bk.run(qcirc=qc_expect, out_state=True, **kwargs).qstate
+                self.assertEqual(equal_qstates(expect, result.qstate), True)
+        self.assertEqual(qc.get_params(), {'a': 0.0, 'b': 0.0, 'c': 0.0})
+
+    def test_run_batch_expect(self):
+        """test 'run_batch' (expectation values for each parameter set)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc().h(0).rz(0, tag='foo').h(0)
+        params = [{'foo': 0.0}, {'foo': 0.5}, {'foo': 1.0}]
+        actual = bk.run_batch(qcirc=qc, params=params, observable=Z(0))
+        self.assertEqual(np.allclose(actual, [1.0, 0.0, -1.0]), True)
+
+    def test_run_batch_measurement(self):
+        """test 'run_batch' (with measurement and init)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qs = QState(qubit_num=2).x(1)
+        qc = QCirc().ry(0, tag='foo').measure(qid=[0,1], cid=[0,1])
+        results = bk.run_batch(qcirc=qc, params=[{'foo': 0.0}, {'foo': 1.0}], shots=10, init=qs)
+        self.assertEqual(results[0].frequency['01'], 10)
+        self.assertEqual(results[1].frequency['11'], 10)
+
+    def test_run_batch_seed(self):
+        """test 'run_batch' (reproducible for the seed, member i on the stream i)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc().h(0).ry(1, tag='foo').cx(0,2).measure(qid=[0,1,2], cid=[0,1,2])
+        params = [{'foo': 0.3}, {'foo': 0.3}, {'foo': 0.6}]
+        results = bk.run_batch(qcirc=qc, params=params, shots=100, seed=1)
+        freqs = [res.frequency for res in bk.run_batch(qcirc=qc, params=params, shots=100, seed=1)]
+        self.assertEqual([res.frequency for res in results], freqs)
+        self.assertNotEqual(freqs[0], freqs[1])
+        for i, p in enumerate(params):
+            qc_p = qc.clone()
+            qc_p.set_params(p)
+            self.assertEqual(bk.run(qcirc=qc_p, shots=100, seed=1, stream=i).frequency, freqs[i])
+
+class TestBackend_gradient_qstate_simulator(unittest.TestCase):
+    """ test 'Backend' : gradient
+    """
+
+    def test_gradient_simple(self):
+        """test 'gradient' (d<Z>/dphase = -PI * sin(PI * phase))
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc().h(0).rz(0, tag='foo').h(0)
+        qc.set_params({'foo': 0.5})
+        grad = bk.gradient(qcirc=qc, observable=Z(0))
+        self.assertEqual(list(grad), ['foo'])
+        self.assertAlmostEqual(grad['foo'], -np.pi, delta=EPS)
+
+    def test_gradient_finite_difference(self):
+        """test 'gradient' (compared with the central finite difference of 'expect')
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = (QCirc().h(0).h(1).h(2).x(3).rx(0, tag='a').ry(1, tag='b').rz(2, tag='c')
+              .p(3, tag='d').crx(0,1, tag='e').cry(1,2, tag='f').crz(2,3, tag='g')
+              .cp(3,0, tag='h').rxx(0,2, tag='i').ryy(1,3, tag='j').rzz(0,3, tag='k')
+              .mrz([0,1,3], tag='l').cx(0,2).t(1).s(3).mcx([0,1,2]).qft([0,1,2]).sw(1,3)
+              .rx(1, tag='a', fac=2.0).rz(0, tag='b', fac=-0.5).iqft([1,2,3]))
+        ob = 0.7*Z(0)*X(1) + 1.3*Y(2)*Y(3) - 0.4*X(0)*Y(1)*Z(3) + 0.2*Z(2)
+        params = dict(zip('abcdefghijkl', np.linspace(-0.9, 0.8, 12)))
+        qc.set_params(params)
+        init = QState(qubit_num=5).h(4).cx(4,0)
+        grad = bk.gradient(qcirc=qc, observable=ob, init=init)
+        self.assertEqual(sorted(grad), sorted(params))
+        h = 1.0e-5
+        for tag in params:
+            qc_p = qc.clone()
+            qc_p.set_params({tag: params[tag] + h})
+            qc_m = qc.clone()
+            qc_m.set_params({tag: params[tag] - h})
+            expect = (bk.expect(qcirc=qc_p, observable=ob, precise=True, init=init).real
+                      - bk.expect(qcirc=qc_m, observable=ob, precise=True, init=init).real) / (2.0 * h)
+            self.assertAlmostEqual(grad[tag], expect, delta=EPS)
+        self.assertEqual(qc.get_params(), params)
+
+    def test_gradient_non_unitary(self):
+        """test 'gradient' (error for the circuit with measurement)
+        """
+        bk = Backend(product='qlazy', device='qstate_simulator')
+        qc = QCirc().ry(0, tag='foo').measure(qid=[0], cid=[0])
+        with self.assertRaises(ValueError):
+            bk.gradient(qcirc=qc, observable=Z(0))
+
 class TestBackend_inheritance_qstate_simulator(unittest.TestCase):
     """ test 'Backend' : inheritance (qlazy_qstate_simulator)
     """
@@ -640,6 +640,50 @@ class TestQCirc_n_qubit(unittest.TestCase):
         ans = equal_vectors(actual, expect)
         self.assertEqual(ans,True)
 
+    def test_mcx_native_vs_expand(self):
+        """test 'mcx' gate (native kernel vs expanded sequence)
+        """
+        bk = Backend()
+        qc_init = QCirc.generate_random_gates(qubit_num=6, gate_num=50, phase=(0.1, 0.3),
+                                              prob={'h':3, 'rx':2, 'rz':2, 'cx':3, 't':1})
+        qc = qc_init.clone().mcx([4,0,2,1]).mcx([5,3,0]).mcx([1,5])
+        qs_native = bk.run(qcirc=qc, out_state=True).qstate
+        qs_expand = bk.run(qcirc=qc.expand_multi_qubit_gates(), out_state=True).qstate
+        ans = equal_vectors(qs_native.amp, qs_expand.amp)
+        self.assertEqual(ans,True)
+
+    def test_mcx_gate_kind(self):
+        """test 'mcx' gate (kept as one gate in QCirc)
+        """
+        qc = QCirc().h(0).mcx([3,0,2,1])
+        self.assertEqual(qc.gate_num, 2)
+        self.assertEqual(qc.kind_list(), [HADAMARD, MULTI_CONTROLLED_X])
+        self.assertEqual(qc.clone().is_equal(qc), True)
+        self.assertEqual(QCirc().h(0).mcx([3,0,1,2]).is_equal(qc), False)
+        self.assertEqual(qc.expand_multi_qubit_gates().gate_num > 2, True)
+        qc.pop_gate()
+        (kind, qid, para, c, ctrl, tag) = qc.pop_gate()
+        self.assertEqual(kind, MULTI_CONTROLLED_X)
+        self.assertEqual(qid, [3,0,2,1])
+
+    def test_mcx_invalid_qid(self):
+        """test 'mcx' gate (invalid qubit id)
+        """
+        with self.assertRaises(ValueError):
+            QCirc().mcx([0,0,1])
+        with self.assertRaises(ValueError):
+            QCirc().mcx([0,1,1])
+
+    def test_mcx_add_control(self):
+        """test 'mcx' gate (add control qubit)
+        """
+        bk = Backend()
+        qc_U = QCirc().mcx([0,1,2]).add_control(qctrl=3)
+        qc = QCirc().x(0).x(1).x(3) + qc_U
+        qs = bk.run(qcirc=qc, out_state=True).qstate
+        self.assertEqual(qc_U.kind_list(), [MULTI_CONTROLLED_X])
+        self.assertEqual(abs(qs.amp[15]) > 1.0 - EPS, True)
+
 #
 # import OpenQASM
 #
@@ -1649,6 +1693,169 @@ class TestQCirc_qft(unittest.TestCase):
         ans = equal_or_not(qs_expect, qs_actual)
         self.assertEqual(ans,True)
 
+    def test_qft_native_vs_expand(self):
+        """test 'qft' (native gate vs expanded sequence)
+        """
+        bk = Backend()
+        qc_base = QCirc.generate_random_gates(qubit_num=5, gate_num=30,
+                                              phase=(0.125, 0.25, 0.5),
+                                              prob={'h':7, 'cx':5, 'rx':3, 'crz':3})
+        qc = qc_base.clone().qft([3,0,4]).iqft([1,2,3,4])
+        qs_native = bk.run(qcirc=qc, out_state=True).qstate
+        qs_expand = bk.run(qcirc=qc.expand_multi_qubit_gates(), out_state=True).qstate
+        ans = equal_or_not(qs_native, qs_expand)
+        self.assertEqual(ans,True)
+
+    def test_qft_add_control(self):
+        """test 'qft' (add control qubit, controlled unitary of the native gate)
+        """
+        bk = Backend()
+
+        def unitary(qc, qubit_num):
+            vecs = []
+            for i in range(2**qubit_num):
+                vec = np.zeros(2**qubit_num, dtype=np.complex128)
+                vec[i] = 1.0
+                qs = bk.run(qcirc=qc, init=QState(vector=vec), out_state=True).qstate
+                vecs.append(qs.get_amp())
+            return np.array(vecs).T
+
+        for qid in ([0,1], [2,0,1], [1,3,0,2]):
+            for qc in (QCirc().qft(qid), QCirc().iqft(qid)):
+                n = len(qid)
+                U = unitary(qc, n)
+                U_ctrl = unitary(qc.add_control(qctrl=n), n + 1)
+                expect = np.zeros((2**(n+1), 2**(n+1)), dtype=np.complex128)
+                expect[0::2, 0::2] = np.eye(2**n) # control qubit n is the lowest bit
+                expect[1::2, 1::2] = U
+                gphase = U_ctrl[0, 0] / abs(U_ctrl[0, 0])
+                self.assertEqual(np.allclose(U_ctrl, gphase * expect, atol=EPS), True)
+
+    def test_qft_gate_kind(self):
+        """test 'qft' (kept as one gate in QCirc)
+        """
+        qc = QCirc().qft([2,0,1]).iqft([1])
+        self.assertEqual(qc.gate_num, 2)
+        self.assertEqual(qc.qubit_num, 3)
+        self.assertEqual(qc.kind_list(), [QFT_GATE, IQFT_GATE])
+        (kind, qid, para, c, ctrl, tag) = qc.pop_gate()
+        self.assertEqual(kind, QFT_GATE)
+        self.assertEqual(qid, [2,0,1])
+        with self.assertRaises(ValueError):
+            QCirc().qft([0,1,0])
+
+class TestQCirc_mrz(unittest.TestCase):
+    """ test 'QCirc' : mrz, rpp
+    """
+
+    def test_mrz_native_vs_expand(self):
+        """test 'mrz' (native gate vs expanded sequence, with parameter)
+        """
+        bk = Backend()
+        qc_base = QCirc.generate_random_gates(qubit_num=5, gate_num=30, phase=(0.1, 0.3),
+                                              prob={'h':3, 'rx':2, 'cx':3, 't':1})
+        qc = qc_base.clone().mrz([3,0,4], phase=0.3).mrz([2,4,1,0,3], tag='a')
+        for a in (0.25, -0.7):
+            qc.set_params({'a':a})
+            qs_native = bk.run(qcirc=qc, out_state=True).qstate
+            qs_expand = bk.run(qcirc=qc.expand_multi_qubit_gates(), out_state=True).qstate
+            ans = equal_or_not(qs_native, qs_expand)
+            self.assertEqual(ans,True)
+
+    def test_mrz_gate_kind(self):
+        """test 'mrz' (kept as one gate in QCirc)
+        """
+        qc = QCirc().mrz([2,0,1], phase=0.5, tag='a')
+        self.assertEqual(qc.gate_num, 1)
+        self.assertEqual(qc.qubit_num, 3)
+        self.assertEqual(qc.kind_list(), [MULTI_ROTATION_Z])
+        self.assertEqual(qc.get_params(), {'a':0.5})
+        (kind, qid, para, c, ctrl, tag) = qc.pop_gate()
+        self.assertEqual(kind, MULTI_ROTATION_Z)
+        self.assertEqual(qid, [2,0,1])
+        self.assertEqual(tag, 'a')
+
+    def test_rpp(self):
+        """test 'rpp' (basis changes and native 'mrz' gate)
+        """
+        bk = Backend()
+        pp = PauliProduct('XYZ', [0,3,1])
+        qc = QCirc().h(0).h(2).rpp(pp, phase=0.3)
+        self.assertEqual(qc.kind_list().count(MULTI_ROTATION_Z), 1)
+        qs_actual = bk.run(qcirc=qc, out_state=True).qstate
+        qs_expect = bk.run(qcirc=qc.expand_multi_qubit_gates(), out_state=True).qstate
+        ans = equal_or_not(qs_expect, qs_actual)
+        self.assertEqual(ans,True)
+
+class TestQCirc_compile(unittest.TestCase):
+    """ test 'QCirc' : compile
+    """
+
+    def test_compile_vs_operate_qcirc(self):
+        """test 'compile' (plan vs circuit, with fusion or not)
+        """
+        qc = QCirc.generate_random_gates(qubit_num=6, gate_num=50, phase=(0.1, 0.3),
+                                         prob={'h':3, 'rx':2, 'cx':3, 't':1})
+        qc.ccx(0, 3, 5).rz(2, tag='a').cp(0, 4, tag='b').mrz([5,1,3], tag='c').crx(3, 1, tag='a').h(5)
+        params = {'a':0.25, 'b':-0.7, 'c':1.3}
+        qc.set_params(params)
+        qs_expect = QState(qubit_num=6).operate_qcirc(qc)
+        for fusion_qubit_num in (0, 3):
+            qplan = qc.compile(fusion_qubit_num=fusion_qubit_num)
+            qplan.set_params(params)
+            qs_actual = QState(qubit_num=6).operate_qcirc(qplan)
+            ans = equal_or_not(qs_expect, qs_actual)
+            self.assertEqual(ans,True)
+
+    def test_compile_set_params(self):
+        """test 'compile' (set_params and get_params)
+        """
+        qc = QCirc().h(0).cx(0,1).ry(1, tag='a').rz(0, tag='b').cx(1,2).rx(2, tag='a')
+        qplan = qc.compile()
+        self.assertEqual(qplan.get_params(), {'a':0.0, 'b':0.0})
+        for params in ({'a':0.3, 'b':-0.5}, {'b':0.8}, {'a':-1.1}):
+            qc.set_params(params)
+            qplan.set_params(params)
+            self.assertEqual(qplan.get_params(), qc.get_params())
+            qs_expect = QState(qubit_num=3).operate_qcirc(qc)
+            qs_actual = QState(qubit_num=3).operate_qcirc(qplan)
+            ans = equal_or_not(qs_expect, qs_actual)
+            self.assertEqual(ans,True)
+        with self.assertRaises(ValueError):
+            qplan.set_params({'c':0.1})
+
+    def test_compile_single_precision(self):
+        """test 'compile' (single precision)
+        """
+        qc = QCirc().h(0).h(1).h(2).rzz(0, 2, tag='a').cx(2,1).ry(1, tag='b')
+        qc.set_params({'a':0.4, 'b':0.2})
+        qplan = qc.compile(precision='single')
+        self.assertEqual(qplan.precision, 'single')
+        qs_expect = QState(qubit_num=3, precision='single').operate_qcirc(qc)
+        qs_actual = QState(qubit_num=3, precision='single').operate_qcirc(qplan)
+        ans = equal_or_not(qs_expect, qs_actual)
+        self.assertEqual(ans,True)
+
+    def test_compile_backend(self):
+        """test 'compile' (run and expect with the backend)
+        """
+        bk = Backend()
+        qc = QCirc().h(0).cx(0,1).rx(1, tag='a').ry(0, tag='b')
+        qc.set_params({'a':0.3, 'b':0.6})
+        qplan = qc.compile()
+        qplan.set_params({'a':0.3, 'b':0.6})
+        qs_expect = bk.run(qcirc=qc, out_state=True).qstate
+        qs_actual = bk.run(qcirc=qplan, out_state=True).qstate
+        ans = equal_or_not(qs_expect, qs_actual)
+        self.assertEqual(ans,True)
+
+    def test_compile_non_unitary(self):
+        """test 'compile' (non-unitary circuit)
+        """
+        qc = QCirc().h(0).cx(0,1).measure(qid=[0], cid=[0])
+        with self.assertRaises(ValueError):
+            qc.compile()
+
 #
 # inheritance
 #
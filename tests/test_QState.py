@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 import unittest
 import math
+import os
+import sys
+import subprocess
+import tempfile
 import numpy as np
 from scipy.stats import unitary_group
 from qlazy import QState, Observable, PauliProduct, QCirc, Backend
 from qlazy.Observable import X, Y, Z
+from qlazy.QObject import QObject
 
 EPS = 1.0e-6
 
@@ -1079,6 +1084,28 @@ class TestQState_expect(unittest.TestCase):
         ans = equal_values(actual, expect)
         self.assertEqual(ans, True)
 
+    def test_expect_19(self):
+        """test 'expect_19' (random state, compared with the matrix)
+        """
+        qs = random_qstate(4)
+        ob = 0.5 * X(0) * Y(2) - 1.5 * Y(1) * Y(3) * Z(0) + 2.0 * Z(2) * X(3) + Y(0) * X(1) * Y(2) * Z(3) - 0.7
+        sx = np.array([[0, 1], [1, 0]])
+        sy = np.array([[0, -1j], [1j, 0]])
+        sz = np.array([[1, 0], [0, -1]])
+        def op(*ms):
+            mat = np.eye(1)
+            for m in ms:
+                mat = np.kron(mat, m)
+            return mat
+        I = np.eye(2)
+        mat = (0.5 * op(sx, I, sy, I) - 1.5 * op(sz, sy, I, sy) + 2.0 * op(I, I, sz, sx)
+               + op(sy, sx, sy, sz) - 0.7 * op(I, I, I, I))
+        vec = qs.get_amp()
+        actual = qs.expect(observable=ob)
+        expect = np.vdot(vec, mat @ vec)
+        ans = equal_values(actual, expect)
+        self.assertEqual(ans, True)
+
 class TestQState_evolv(unittest.TestCase):
     """ test 'QState' : 'evolve'
     """
@@ -1107,6 +1134,30 @@ class TestQState_evolv(unittest.TestCase):
         ans = equal_values(actual, expect)
         self.assertEqual(ans,True)
 
+    def test_evolve_weighted(self):
+        """test 'evolve' (weighted terms with Y, compared with the matrix)
+        """
+        qs = random_qstate(4)
+        hm = 0.5 * X(0) * Y(2) - 1.5 * Y(1) * Y(3) * Z(0) + 2.0 * Z(2) * X(3)
+        sx = np.array([[0, 1], [1, 0]])
+        sy = np.array([[0, -1j], [1j, 0]])
+        sz = np.array([[1, 0], [0, -1]])
+        def op(*ms):
+            mat = np.eye(1)
+            for m in ms:
+                mat = np.kron(mat, m)
+            return mat
+        I = np.eye(2)
+        terms = [(0.5, op(sx, I, sy, I)), (-1.5, op(sz, sy, I, sy)), (2.0, op(I, I, sz, sx))]
+        vec = qs.get_amp()
+        t = 0.2 / 3
+        for _ in range(3):
+            for c, mat in terms:  # exp(i * PI * c * t * P) = cos(PI*c*t) + i * sin(PI*c*t) * P
+                vec = np.cos(np.pi * c * t) * vec + 1.j * np.sin(np.pi * c * t) * (mat @ vec)
+        qs.evolve(observable=hm, time=0.2, iteration=3)
+        ans = equal_vectors(qs.get_amp(), vec)
+        self.assertEqual(ans, True)
+
 class TestQState_apply(unittest.TestCase):
     """ test 'QState' : 'apply'
     """
@@ -1185,6 +1236,86 @@ class TestQState_measure(unittest.TestCase):
         self.assertEqual(md.frq[0], 10)
         self.assertEqual(md.frq[1], 0)
 
+class TestQState_marginal_prob(unittest.TestCase):
+    """ test 'QState' : marginal_prob, sample
+    """
+
+    def test_marginal_prob(self):
+        """test 'marginal_prob'
+        """
+        qs = QState(vector=VECTOR_16)
+        prob_all = np.abs(np.array(VECTOR_16))**2
+        prob_all = prob_all.reshape(2,2,2,2) / prob_all.sum()
+        expect = prob_all.sum(axis=(1,3)).T.reshape(4)  # qid = [2,0]
+        actual = qs.marginal_prob(qid=[2,0])
+        self.assertEqual(np.allclose(actual, expect, atol=EPS), True)
+        actual = qs.marginal_prob()
+        self.assertEqual(np.allclose(actual, prob_all.reshape(16), atol=EPS), True)
+        ans = equal_qstates(qs, QState(vector=VECTOR_16))
+        self.assertEqual(ans,True)
+        with self.assertRaises(IndexError):
+            qs.marginal_prob(qid=[0,0])
+
+    def test_marginal_prob_many_qubits(self):
+        """test 'marginal_prob' (more qubits than the thread-local arrays)
+        """
+        qs = QState(qubit_num=16, seed=123)
+        for q in range(16):
+            qs.ry(q, phase=0.1*q).cx(q, (q+5)%16)
+        prob_all = np.abs(qs.get_amp())**2
+        for qid in ([15, 3, 0, 9, 1, 12, 7, 2, 11, 4, 14, 6, 10],
+                    [8, 3, 0, 9, 1, 12, 7, 2, 11, 4, 5, 6, 10]):
+            expect = prob_all.reshape([2]*16).transpose(qid + [q for q in range(16) if q not in qid])
+            expect = expect.reshape(1 << len(qid), -1).sum(axis=1)
+            actual = qs.marginal_prob(qid=qid)
+            self.assertEqual(np.allclose(actual, expect, atol=EPS), True)
+
+    def test_get_prob(self):
+        """test 'get_prob' (all of the qubits)
+        """
+        qs = QState(qubit_num=3).h(0).cx(0,2)
+        self.assertEqual(qs.get_prob().keys(), {'000', '101'})
+        self.assertEqual(equal_values(qs.get_prob()['101'], 0.5), True)
+
+    def test_sample(self):
+        """test 'sample' (the state is not changed)
+        """
+        qs = QState(qubit_num=3).h(0).cx(0,2).x(1)
+        mval = qs.sample(qid=[2,1], shots=1000)
+        self.assertEqual(len(mval), 1000)
+        self.assertEqual(set(mval.tolist()) <= {1, 3}, True)
+        self.assertEqual(200 < np.count_nonzero(mval == 3) < 800, True)
+        ans = equal_qstates(qs, QState(qubit_num=3).h(0).cx(0,2).x(1))
+        self.assertEqual(ans,True)
+
+class TestQState_seed(unittest.TestCase):
+    """ test 'QState' : seed of the random number generator
+    """
+
+    def test_seed_reproducible(self):
+        """test 'seed' (same measured values for the same seed, regardless of the other states)
+        """
+        qs_0 = QState(qubit_num=4, seed=123).h(0).h(1).h(3)
+        mval_0 = qs_0.sample(shots=50)
+        qs_1 = QState(qubit_num=4, seed=123).h(0).h(1).h(3)
+        qs_other = QState(qubit_num=4, seed=456).h(0).h(2)
+        qs_other.sample(shots=30)
+        mval_1 = qs_1.sample(shots=50)
+        self.assertEqual(mval_0.tolist(), mval_1.tolist())
+        self.assertEqual(qs_0.clone().sample(shots=20).tolist(),
+                         qs_1.clone().sample(shots=20).tolist())
+
+    def test_set_seed_stream(self):
+        """test 'set_seed' (independent streams of the same seed)
+        """
+        qs = QState(qubit_num=5).h(0).h(1).h(2).h(3).h(4)
+        mval_0 = qs.set_seed(7, stream=0).sample(shots=40).tolist()
+        mval_1 = qs.set_seed(7, stream=1).sample(shots=40).tolist()
+        self.assertNotEqual(mval_0, mval_1)
+        self.assertEqual(qs.set_seed(7, stream=1).sample(shots=40).tolist(), mval_1)
+        with self.assertRaises(ValueError):
+            qs.set_seed(-1)
+
 class TestQState_schmidt_decocmp(unittest.TestCase):
     """ test 'QState' : 'schmidt_decomp'
     """
@@ -1343,7 +1474,275 @@ class TestQState_qft(unittest.TestCase):
         qs_actual.iqft(list(range(qubit_num))).h(0).h(1).h(2).h(3)
         ans = equal_qstates(qs_expect, qs_actual)
         self.assertEqual(ans,True)
+
+    def test_qft_4(self):
+        """test 'qft_4' (native transform vs 'h' and 'cp' gates on the qubit subset)
+        """
+        qubit_num = 5
+        for qid in ([3,0,4], [1,2], [4,3,2,1,0]):
+            qs_expect = random_qstate(qubit_num)
+            qs_actual = qs_expect.clone()
+            qs_actual.qft(qid)
+            QObject.qft(qs_expect, qid)
+            ans = equal_qstates(qs_expect, qs_actual)
+            self.assertEqual(ans,True)
+
+            qs_actual.iqft(qid)
+            QObject.iqft(qs_expect, qid)
+            ans = equal_qstates(qs_expect, qs_actual)
+            self.assertEqual(ans,True)
         
+class TestQState_rpp(unittest.TestCase):
+    """ test 'QState' : mrz, rpp
+    """
+
+    def test_mrz(self):
+        """test 'mrz' (native gate vs 'cx' ladder and 'rz' gate)
+        """
+        for qid in ([3,0,4], [1], [4,3,2,1,0]):
+            qs_expect = random_qstate(5)
+            qs_actual = qs_expect.clone()
+            qs_actual.mrz(qid, phase=0.3)
+            QObject.mrz(qs_expect, qid, phase=0.3)
+            ans = equal_qstates(qs_expect, qs_actual)
+            self.assertEqual(ans,True)
+
+    def test_rpp(self):
+        """test 'rpp' (compared with the matrix)
+        """
+        qs = random_qstate(3)
+        vec = qs.get_amp()
+        qs.rpp(PauliProduct('XYZ', [2,0,1], factor=-1.+0.j), phase=0.4)
+        sx = np.array([[0, 1], [1, 0]])
+        sy = np.array([[0, -1j], [1j, 0]])
+        sz = np.array([[1, 0], [0, -1]])
+        mat = -np.kron(np.kron(sy, sz), sx)
+        vec = np.cos(0.2 * np.pi) * vec - 1.j * np.sin(0.2 * np.pi) * (mat @ vec)
+        ans = equal_vectors(qs.get_amp(), vec)
+        self.assertEqual(ans,True)
+
+class TestQState_precision(unittest.TestCase):
+    """ test 'QState' : precision
+    """
+
+    def test_precision_1(self):
+        """test 'precision_1' (single vs double precision)
+        """
+        qs_expect = QState(qubit_num=4)
+        qs_actual = QState(qubit_num=4, precision='single')
+        self.assertEqual(qs_expect.precision, 'double')
+        self.assertEqual(qs_actual.precision, 'single')
+        for qs in (qs_expect, qs_actual):
+            qs.h(0).cx(0,1).rx(2, phase=0.3).crz(1,3, phase=0.7).t(3).cp(2,0, phase=0.1).ry(0, phase=0.2)
+        ans = np.allclose(qs_expect.get_amp(), qs_actual.get_amp(), atol=EPS)
+        self.assertEqual(ans,True)
+
+    def test_precision_2(self):
+        """test 'precision_2' (clone, partial and measure keep single precision)
+        """
+        qs = QState(qubit_num=3, precision='single').h(0).cx(0,1).x(2)
+        self.assertEqual(qs.clone().precision, 'single')
+        self.assertEqual(qs.partial(qid=[0,1]).precision, 'single')
+        md = qs.m(qid=[0,1,2], shots=100)
+        self.assertEqual(md.frequency['001'] + md.frequency['111'], 100)
+
+    def test_precision_3(self):
+        """test 'precision_3' (states with different precision can not be mixed)
+        """
+        qs_0 = QState(qubit_num=2)
+        qs_1 = QState(qubit_num=2, precision='single')
+        with self.assertRaises(ValueError):
+            qs_0.inpro(qs_1)
+        with self.assertRaises(ValueError):
+            QState(qubit_num=2, precision='half')
+
+class TestQState_qubit_position(unittest.TestCase):
+    """ test 'QState' : gates on every qubit position (vectorized and scalar kernels)
+    """
+
+    def test_qubit_position_1(self):
+        """test 'qubit_position_1' (1-qubit gates vs matrix)
+        """
+        qubit_num = 7
+        H = np.array([[1.0, 1.0], [1.0, -1.0]]) / SQRT_2
+        T = np.array([[1.0, 0.0], [0.0, np.exp(0.25j * np.pi)]])
+        for q in range(qubit_num):
+            qs_expect = random_qstate(qubit_num)
+            qs_actual = qs_expect.clone()
+            qs_expect.apply(matrix=H, qid=[q]).apply(matrix=T, qid=[q])
+            qs_actual.h(q).t(q)
+            ans = equal_qstates(qs_expect, qs_actual)
+            self.assertEqual(ans,True)
+
+    def test_qubit_position_2(self):
+        """test 'qubit_position_2' (2-qubit gates vs matrix)
+        """
+        qubit_num = 7
+        CY = np.array([[1,0,0,0],[0,1,0,0],[0,0,0,-1j],[0,0,1j,0]])
+        CP = np.diag([1.0, 1.0, 1.0, np.exp(0.3j * np.pi)])
+        for q0, q1 in ((0,6), (6,0), (2,3), (5,4), (1,6), (6,5)):
+            qs_expect = random_qstate(qubit_num)
+            qs_actual = qs_expect.clone()
+            qs_expect.apply(matrix=CY, qid=[q0,q1]).apply(matrix=CP, qid=[q0,q1])
+            qs_actual.cy(q0,q1).cp(q0,q1, phase=0.3)
+            ans = equal_qstates(qs_expect, qs_actual)
+            self.assertEqual(ans,True)
+
+    def test_simd_vs_scalar(self):
+        """test 'simd_vs_scalar' (same amplitudes for QLAZY_SIMD=scalar, avx2 and the default)
+        """
+        script = """if True:
+            import sys
+            import numpy as np
+            from qlazy import QCirc, Backend
+            rng = np.random.default_rng(123)
+            qc = QCirc()
+            for _ in range(200):
+                q0, q1 = (int(q) for q in rng.choice(10, size=2, replace=False))
+                g = rng.integers(5)
+                phase = float(rng.random())
+                if g == 0: qc.h(q0)
+                elif g == 1: qc.rx(q0, phase=phase)
+                elif g == 2: qc.t(q0).ry(q0, phase=phase)
+                elif g == 3: qc.cx(q0, q1)
+                else: qc.crz(q0, q1, phase=phase)
+            qs = Backend().run(qcirc=qc, out_state=True, precision=sys.argv[2]).qstate
+            np.save(sys.argv[1], qs.get_amp())
+        """
+        for precision, eps in (('double', 1.0e-12), ('single', 1.0e-5)):
+            amps = []
+            with tempfile.TemporaryDirectory() as tmpdir:
+                for level in ('scalar', 'avx2', None):
+                    env = dict(os.environ)
+                    env.pop('QLAZY_SIMD', None)
+                    if level is not None:
+                        env['QLAZY_SIMD'] = level
+                    fname = os.path.join(tmpdir, '{}.npy'.format(level))
+                    subprocess.run([sys.executable, '-c', script, fname, precision],
+                                   env=env, check=True)
+                    amps.append(np.load(fname))
+            for amp in amps[1:]:
+                self.assertEqual(np.allclose(amp, amps[0], rtol=0.0, atol=eps), True)
+
+class TestQState_qubit_limit(unittest.TestCase):
+    """ test 'QState' : limit of the qubit number
+    """
+
+    def test_qubit_limit_1(self):
+        """test 'qubit_limit_1' (more than 30 qubits is limited by the memory)
+        """
+        with self.assertRaises(MemoryError):
+            QState(qubit_num=40)
+        with self.assertRaises(ValueError):
+            QState(qubit_num=41)
+
+    def test_qubit_limit_2(self):
+        """test 'qubit_limit_2' (state_num and amplitudes)
+        """
+        qs = QState(qubit_num=20).h(19).cx(19,0)
+        self.assertEqual(qs.state_num, 2**20)
+        amp = qs.get_amp()
+        self.assertEqual(abs(amp[0] - SQRT_2 / 2) < EPS, True)
+        self.assertEqual(abs(amp[2**19 + 1] - SQRT_2 / 2) < EPS, True)
+
+class TestQState_backing(unittest.TestCase):
+    """ test 'QState' : memory-mapped backing file
+    """
+
+    def test_backing_1(self):
+        """test 'backing_1' (gates on the file, and the file is the raw vector)
+        """
+        qc = QCirc().h(0).cx(0,1).rx(2, phase=0.3).crz(1,3, phase=0.7).t(3).cp(2,0, phase=0.1)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'state.bin')
+            qs_expect = QState(qubit_num=4).operate_qcirc(qc)
+            qs_actual = QState(qubit_num=4, backing=fname)
+            self.assertEqual(qs_actual.mapped, True)
+            qs_actual.operate_qcirc(qc).sync()
+            ans = equal_qstates(qs_expect, qs_actual)
+            self.assertEqual(ans,True)
+            vec = np.fromfile(fname, dtype=np.complex128)
+            ans = np.allclose(vec, qs_expect.get_amp(), atol=EPS)
+            self.assertEqual(ans,True)
+            del qs_actual
+
+    def test_backing_2(self):
+        """test 'backing_2' (resume from the file)
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'state.bin')
+            qs = QState(qubit_num=3, backing=fname).h(0).cx(0,1)
+            del qs
+            qs_actual = QState(backing=fname).cx(1,2)
+            qs_expect = QState(qubit_num=3).h(0).cx(0,1).cx(1,2)
+            self.assertEqual(qs_actual.qubit_num, 3)
+            ans = equal_qstates(qs_expect, qs_actual)
+            self.assertEqual(ans,True)
+            self.assertEqual(qs_actual.clone().mapped, False)
+            del qs_actual
+            with self.assertRaises(ValueError):
+                QState(backing=os.path.join(tmpdir, 'none.bin'))
+
+class TestQState_numpy(unittest.TestCase):
+    """ test 'QState' : numpy view and from_numpy
+    """
+
+    def test_get_amp_view(self):
+        """test 'get_amp' (view follows the gates, read-only by default)
+        """
+        qs = QState(qubit_num=3).h(0)
+        vec = qs.get_amp(view=True)
+        self.assertEqual(vec.dtype, np.complex128)
+        self.assertEqual(vec.flags.writeable, False)
+        qs.cx(0,2)
+        ans = np.allclose(vec, QState(qubit_num=3).h(0).cx(0,2).get_amp(), atol=EPS)
+        self.assertEqual(ans,True)
+        with self.assertRaises(ValueError):
+            vec[0] = 0.0
+        with self.assertRaises(ValueError):
+            qs.get_amp(qid=[1,0], view=True)
+
+    def test_get_amp_view_writable(self):
+        """test 'get_amp' (writable view)
+        """
+        qs = QState(qubit_num=2, precision='single')
+        vec = qs.get_amp(view=True, writable=True)
+        self.assertEqual(vec.dtype, np.complex64)
+        vec[0] = 0.0
+        vec[3] = 1.0
+        self.assertEqual(qs.m().last, '11')
+
+    def test_from_numpy_copy(self):
+        """test 'from_numpy' (copied)
+        """
+        vec = np.array(VECTOR_16)
+        qs = QState.from_numpy(vec)
+        self.assertEqual(qs.qubit_num, 4)
+        self.assertEqual(qs.adopted, False)
+        qs.h(1)
+        ans = equal_qstates(qs, QState(vector=VECTOR_16).h(1))
+        self.assertEqual(ans,True)
+        self.assertEqual(np.allclose(vec, VECTOR_16), True)
+        self.assertEqual(QState.from_numpy(vec.astype(np.complex64)).precision, 'single')
+        with self.assertRaises(ValueError):
+            QState.from_numpy(np.zeros(3, dtype=np.complex128))
+
+    def test_from_numpy_adopt(self):
+        """test 'from_numpy' (adopted without copying)
+        """
+        vec = np.array(VECTOR_16)
+        qs = QState.from_numpy(vec, copy=False)
+        self.assertEqual(qs.adopted, True)
+        qs.h(1).cx(0,3)
+        ans = np.allclose(vec, QState(vector=VECTOR_16).h(1).cx(0,3).get_amp(), atol=EPS)
+        self.assertEqual(ans,True)
+        del qs
+        self.assertEqual(len(vec), 16)
+        with self.assertRaises(ValueError):
+            QState.from_numpy(np.array(VECTOR_16)[::2], copy=False)
+        with self.assertRaises(ValueError):
+            QState.from_numpy(np.zeros(4, dtype=np.float64), copy=False)
+
 class TestQState_inheritance(unittest.TestCase):
     """ test 'QState' : inheritance
     """
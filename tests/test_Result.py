@@ -109,6 +109,21 @@ class TestResult_setter_getter(unittest.TestCase):
         self.assertEqual(type(result.elapsed_time), float)
         self.assertEqual(result.info, None)
             
+    def test_counts(self):
+        """test 'counts' (integer keys, and frequency built from it)
+        """
+        bk = Backend()
+        qc = QCirc().x(0).h(2).measure(qid=[0,1,2], cid=[0,1,2])
+        result = bk.run(qcirc=qc, shots=100, cid=[2,0])
+        self.assertEqual(set(result.counts.keys()) <= {1, 3}, True)
+        self.assertEqual(sum(result.counts.values()), 100)
+        self.assertEqual(result.frequency,
+                         Counter({'{:02b}'.format(k): v for k, v in result.counts.items()}))
+        result = Result()
+        result.cid = [0,1,2]
+        result.frequency = Counter({'101': 3, '010': 7})
+        self.assertEqual(result.counts, {5: 3, 2: 7})
+
 class TestResult_save_load(unittest.TestCase):
     """ test 'Result' : 'setter, getter'
     """